@@ -1,15 +1,28 @@
 from flask import Blueprint, jsonify, request
 import os
 import re
-from datetime import datetime, timedelta
+import threading
+from bisect import bisect_left
+import time
+from datetime import date, datetime, timedelta
 import pytz
-from pg_compat import get_db_connection, table_exists as pg_table_exists
+from pg_compat import column_exists, table_exists as pg_table_exists
+from request_db import get_request_connection
 
 bp = Blueprint('admin_stats', __name__)
 
+# Índice precompilado del catálogo de precios/costos (ver get_profit_catalog_index).
+# Cada cambio de precio o costo incrementa profit_catalog_version; cada
+# PROFIT_CATALOG_CHECK_SECONDS los demás workers leen ese contador (una fila) y
+# reconstruyen el índice solo si cambió.
+PROFIT_CATALOG_CHECK_SECONDS = max(float(os.environ.get('PROFIT_CATALOG_CHECK_SECONDS', '5')), 0.0)
+_profit_catalog_cache = {'index': None, 'checked_at': 0.0, 'stale': True}
+_profit_catalog_lock = threading.Lock()
+
 
 def get_conn():
-    return get_db_connection()
+    # Dentro de un request todas las consultas comparten la conexión del request
+    return get_request_connection()
 
 
 def table_exists(conn, table_name: str) -> bool:
@@ -217,6 +230,15 @@ def _infer_dashboard_item_name(package_name, dynamic_game_names):
     return 'Otros'
 
 
+_PROFIT_TOLERANCE = 0.011
+_PRICE_TABLE_SPECS = (
+    ('precios_freefire_id', 'freefire_id', 'Free Fire'),
+    ('precios_freefire_global', 'freefire_global', 'Free Fire'),
+    ('precios_paquetes', 'freefire_latam', 'Free Fire LATAM'),
+    ('precios_bloodstriker', 'bloodstriker', 'Blood Striker'),
+)
+
+
 def _load_dashboard_profit_catalog(conn):
     cost_map = _load_cost_map(conn)
     catalog = {}
@@ -237,13 +259,7 @@ def _load_dashboard_profit_catalog(conn):
             'package_id': package_id,
         })
 
-    table_specs = [
-        ('precios_freefire_id', 'freefire_id', 'Free Fire'),
-        ('precios_freefire_global', 'freefire_global', 'Free Fire'),
-        ('precios_paquetes', 'freefire_latam', 'Free Fire LATAM'),
-        ('precios_bloodstriker', 'bloodstriker', 'Blood Striker'),
-    ]
-    for table_name, game_key, item_name in table_specs:
+    for table_name, game_key, item_name in _PRICE_TABLE_SPECS:
         if not table_exists(conn, table_name):
             continue
         try:
@@ -274,54 +290,6 @@ def _load_dashboard_profit_catalog(conn):
     return catalog
 
 
-def _resolve_dashboard_profit_unit(catalog, item_name, package_name, sale_unit):
-    candidates = catalog.get((str(item_name or '').strip(), str(package_name or '').strip()), [])
-    if not candidates:
-        return None
-
-    try:
-        sale_unit = float(sale_unit or 0.0)
-    except Exception:
-        sale_unit = 0.0
-
-    exact_match = None
-    nearest_match = None
-    nearest_delta = None
-    for candidate in candidates:
-        delta = abs(float(candidate.get('sale_price') or 0.0) - sale_unit)
-        if delta <= 0.011:
-            exact_match = candidate
-            break
-        if nearest_delta is None or delta < nearest_delta:
-            nearest_match = candidate
-            nearest_delta = delta
-
-    chosen = exact_match or nearest_match
-    if not chosen:
-        return None
-    return float(chosen.get('profit_unit') or 0.0)
-
-
-def _resolve_dashboard_profit_amount(catalog, item_name, package_name, sale_total, quantity):
-    try:
-        quantity = max(1, int(quantity or 1))
-    except Exception:
-        quantity = 1
-
-    try:
-        sale_total = float(sale_total or 0.0)
-    except Exception:
-        sale_total = 0.0
-
-    sale_unit = round(sale_total / quantity, 6) if quantity else sale_total
-    profit_unit = _resolve_dashboard_profit_unit(catalog, item_name, package_name, sale_unit)
-    if profit_unit is None:
-        return None, 0.0
-
-    profit_total = round(float(profit_unit) * quantity, 6)
-    return float(profit_unit), profit_total
-
-
 def _is_dashboard_business_sale_for_admin(row):
     try:
         saldo_antes = float(row['saldo_antes'] or 0.0)
@@ -350,74 +318,424 @@ def _should_exclude_history_row_profit(row, admin_ids, admin_emails):
     return True
 
 
-def _load_dashboard_sales_rows(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
-    if not table_exists(conn, 'historial_compras'):
-        return []
-
+def _local_day_bounds(start_utc: str, end_utc: str, tz_name: str):
     tz = pytz.timezone(tz_name)
     start_dt = _parse_utc_datetime(start_utc)
     end_dt = _parse_utc_datetime(end_utc)
     if start_dt is None or end_dt is None:
+        return None, None
+    return start_dt.astimezone(tz).date().isoformat(), end_dt.astimezone(tz).date().isoformat()
+
+
+_SALES_ROWS_SQL = '''
+    SELECT h.usuario_id, h.monto, h.fecha, h.paquete_nombre, h.pin,
+           h.saldo_antes, h.saldo_despues, u.correo, u.sin_ganancia,
+           h.local_day{extra}
+    FROM historial_compras h
+    LEFT JOIN usuarios u ON u.id = h.usuario_id
+    WHERE h.tipo_evento = 'compra'
+      AND h.local_day >= ?
+      AND h.local_day < ?
+    ORDER BY h.fecha
+'''
+_ATTRIBUTION_COLUMNS = ', h.ganancia, h.ganancia_item, h.ganancia_paquete, h.ganancia_cantidad'
+
+
+def _load_sales_rows_for_days(conn, start_day: str, end_day: str):
+    if not table_exists(conn, 'historial_compras'):
         return []
+    # Base sin la migración de ganancia por venta: todo se resuelve por texto
+    extra = _ATTRIBUTION_COLUMNS if column_exists(conn, 'historial_compras', 'ganancia_item') else ''
+    return conn.execute(_SALES_ROWS_SQL.format(extra=extra), (start_day, end_day)).fetchall()
 
-    start_day = start_dt.astimezone(tz).date().isoformat()
-    end_day = end_dt.astimezone(tz).date().isoformat()
 
-    return conn.execute(
-        '''
-        SELECT h.usuario_id, h.monto, h.fecha, h.paquete_nombre, h.pin,
-               h.saldo_antes, h.saldo_despues, u.correo, u.sin_ganancia,
-               DATE(h.fecha, '-4 hours') AS local_day
-        FROM historial_compras h
-        LEFT JOIN usuarios u ON u.id = h.usuario_id
-        WHERE h.tipo_evento = 'compra'
-          AND DATE(h.fecha, '-4 hours') >= ?
-          AND DATE(h.fecha, '-4 hours') < ?
-        ORDER BY h.fecha
-        ''',
-        (start_day, end_day)
+def _load_dashboard_sales_rows(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
+    start_day, end_day = _local_day_bounds(start_utc, end_utc, tz_name)
+    if start_day is None:
+        return []
+    return _load_sales_rows_for_days(conn, start_day, end_day)
+
+
+class ProfitCatalogIndex:
+    """Catálogo compilado: candidatos ordenados por precio de venta y búsqueda por bisección.
+
+    Para cada (item, paquete) gana el primer candidato (en orden de carga) cuyo precio esté a
+    menos de _PROFIT_TOLERANCE de la venta; si ninguno, el de precio más cercano. Las
+    resoluciones repetidas de (paquete, precio unitario) se memoizan.
+    """
+
+    def __init__(self, catalog, dynamic_game_names, version=None):
+        self.catalog = catalog
+        self.dynamic_game_names = list(dynamic_game_names or [])
+        self.version = version
+        self._index = {}
+        for key, candidates in catalog.items():
+            ordered = sorted(
+                (float(candidate.get('sale_price') or 0.0), order, float(candidate.get('profit_unit') or 0.0))
+                for order, candidate in enumerate(candidates)
+            )
+            self._index[key] = ([price for price, _, _ in ordered], [(order, profit) for _, order, profit in ordered])
+        self._package_memo = {}
+        self._unit_memo = {}
+
+    def __bool__(self):
+        return bool(self._index)
+
+    def classify(self, package_name):
+        """(item, paquete normalizado) de un nombre de paquete del historial."""
+        raw_name = str(package_name or '')
+        cached = self._package_memo.get(raw_name)
+        if cached is None:
+            item_name = _infer_dashboard_item_name(raw_name, self.dynamic_game_names)
+            cached = (item_name, _normalize_dashboard_package_name(raw_name, item_name))
+            self._package_memo[raw_name] = cached
+        return cached
+
+    def profit_unit(self, item_name, package_name, sale_unit):
+        try:
+            sale_unit = float(sale_unit or 0.0)
+        except Exception:
+            sale_unit = 0.0
+        memo_key = (str(item_name or '').strip(), str(package_name or '').strip(), sale_unit)
+        try:
+            return self._unit_memo[memo_key]
+        except KeyError:
+            pass
+        entry = self._index.get(memo_key[:2])
+        result = self._bisect(entry[0], entry[1], sale_unit) if entry else None
+        self._unit_memo[memo_key] = result
+        return result
+
+    @staticmethod
+    def _bisect(prices, entries, sale_unit):
+        pos = bisect_left(prices, sale_unit)
+        # Coincidencias dentro de la tolerancia: gana el primer candidato en orden de carga
+        matches = []
+        i = pos - 1
+        while i >= 0 and abs(prices[i] - sale_unit) <= _PROFIT_TOLERANCE:
+            matches.append(entries[i])
+            i -= 1
+        i = pos
+        while i < len(prices) and abs(prices[i] - sale_unit) <= _PROFIT_TOLERANCE:
+            matches.append(entries[i])
+            i += 1
+        if matches:
+            return min(matches)[1]
+        # Sin coincidencia: el precio más cercano (a cada lado, el grupo de precios iguales)
+        nearest = []
+        for i in (pos - 1, pos):
+            if 0 <= i < len(prices):
+                lo = bisect_left(prices, prices[i])
+                hi = lo
+                while hi < len(prices) and prices[hi] == prices[i]:
+                    hi += 1
+                delta = abs(prices[i] - sale_unit)
+                nearest.extend((delta, order, profit) for order, profit in entries[lo:hi])
+        if not nearest:
+            return None
+        return min(nearest)[2]
+
+    def profit_amount(self, item_name, package_name, sale_total, quantity):
+        """(ganancia unitaria | None, ganancia total) de una venta de `quantity` unidades."""
+        try:
+            quantity = max(1, int(quantity or 1))
+        except Exception:
+            quantity = 1
+        try:
+            sale_total = float(sale_total or 0.0)
+        except Exception:
+            sale_total = 0.0
+        sale_unit = round(sale_total / quantity, 6) if quantity else sale_total
+        profit_unit = self.profit_unit(item_name, package_name, sale_unit)
+        if profit_unit is None:
+            return None, 0.0
+        return float(profit_unit), round(float(profit_unit) * quantity, 6)
+
+
+def _profit_catalog_version(conn):
+    """Contador global de versión del catálogo (None si la tabla no existe todavía)."""
+    try:
+        row = conn.execute('SELECT version FROM profit_catalog_version WHERE id = 1').fetchone()
+    except Exception:
+        return None
+    return int(row['version']) if row else None
+
+
+def get_profit_catalog_index(conn):
+    """Índice del catálogo compartido por el proceso; se reconstruye solo si cambió su versión."""
+    now = time.monotonic()
+    with _profit_catalog_lock:
+        index = _profit_catalog_cache['index']
+        stale = _profit_catalog_cache['stale']
+        if index is not None and not stale and now - _profit_catalog_cache['checked_at'] < PROFIT_CATALOG_CHECK_SECONDS:
+            return index
+    version = _profit_catalog_version(conn)
+    if index is None or stale or version != index.version:
+        index = ProfitCatalogIndex(_load_dashboard_profit_catalog(conn), _load_dynamic_game_names(conn), version)
+    with _profit_catalog_lock:
+        _profit_catalog_cache.update(index=index, checked_at=now, stale=False)
+    return index
+
+
+def invalidate_profit_catalog(conn=None):
+    """Llamar tras cambiar precios o costos: incrementa la versión global y descarta el índice local."""
+    with _profit_catalog_lock:
+        _profit_catalog_cache['stale'] = True
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_conn()
+        conn.execute('UPDATE profit_catalog_version SET version = version + 1 WHERE id = 1')
+        conn.commit()
+    except Exception:
+        pass
+    finally:
+        if own_conn and conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class _AttributionContext:
+    """Exclusiones y catálogo, cargados solo si alguna fila necesita resolverse por texto."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._loaded = False
+
+    def load(self):
+        if not self._loaded:
+            admin_ids, admin_emails = get_admin_exclusions()
+            self.admin_ids = set(admin_ids)
+            self.admin_emails = {str(email).strip().lower() for email in admin_emails if str(email).strip()}
+            self.index = get_profit_catalog_index(self._conn)
+            self._loaded = True
+        return self
+
+
+def _resolve_sale_attribution(row, ctx):
+    """Atribuye una venta: {'item', 'package', 'quantity', 'profit'} (profit None = sin ganancia).
+
+    Devuelve None si la fila no tiene nombre de paquete.
+    """
+    package_name = str(row['paquete_nombre'] or '').strip()
+    if not package_name:
+        return None
+    ctx = ctx.load()
+    quantity = max(1, _extract_dashboard_quantity(package_name, row['pin']))
+    item_name, normalized_package = ctx.index.classify(package_name)
+    profit = None
+    if not _should_exclude_history_row_profit(row, ctx.admin_ids, ctx.admin_emails):
+        profit_unit, profit_total = ctx.index.profit_amount(
+            item_name, normalized_package, abs(float(row['monto'] or 0.0)), quantity,
+        )
+        if profit_unit is not None:
+            profit = profit_total
+    return {'item': item_name, 'package': normalized_package, 'quantity': quantity, 'profit': profit}
+
+
+def _row_attribution(row, ctx):
+    """Usa la atribución guardada al registrar la venta; las filas antiguas se resuelven por texto."""
+    keys = row.keys() if hasattr(row, 'keys') else ()
+    if 'ganancia_item' in keys and row['ganancia_item'] is not None:
+        profit = row['ganancia']
+        return {
+            'item': row['ganancia_item'],
+            'package': row['ganancia_paquete'] or '',
+            'quantity': int(row['ganancia_cantidad'] or 1),
+            'profit': None if profit is None else float(profit),
+        }
+    return _resolve_sale_attribution(row, ctx)
+
+
+def attribute_sale_profit(conn, usuario_id, paquete_nombre, pin, monto, saldo_antes=0, saldo_despues=0, user=None):
+    """Resuelve la ganancia de una venta en el momento de la compra (ver insert_historial_compra).
+
+    `user` (fila con correo y sin_ganancia) evita releer el usuario.
+    """
+    if user is None:
+        user = conn.execute('SELECT correo, sin_ganancia FROM usuarios WHERE id = ?', (usuario_id,)).fetchone()
+    row = {
+        'usuario_id': usuario_id,
+        'correo': user['correo'] if user else '',
+        'sin_ganancia': user['sin_ganancia'] if user else False,
+        'paquete_nombre': paquete_nombre,
+        'pin': pin,
+        'monto': monto,
+        'saldo_antes': saldo_antes,
+        'saldo_despues': saldo_despues,
+    }
+    return _resolve_sale_attribution(row, _AttributionContext(conn))
+
+
+def insert_historial_compra(conn, usuario_id, monto, paquete_nombre, pin='', tipo_evento='compra',
+                            duracion_segundos=None, saldo_antes=0, saldo_despues=0, user=None):
+    """INSERT en historial_compras; las compras llevan su ganancia ya atribuida.
+
+    Sin las columnas de ganancia (base que aún no corrió la migración) se
+    inserta la fila sin atribución y se resuelve por texto al leerla.
+    """
+    attribution = None
+    if tipo_evento == 'compra' and column_exists(conn, 'historial_compras', 'ganancia_item'):
+        try:
+            attribution = attribute_sale_profit(conn, usuario_id, paquete_nombre, pin, monto, saldo_antes, saldo_despues,
+                                                user=user)
+        except Exception:
+            attribution = None
+    if attribution is None:
+        conn.execute('''
+            INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues))
+        return None
+    conn.execute('''
+        INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues,
+                                       ganancia, ganancia_item, ganancia_paquete, ganancia_cantidad)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues,
+          attribution['profit'], attribution['item'], attribution['package'], attribution['quantity']))
+    return attribution
+
+
+def init_profit_rollup_tables(cursor):
+    """Columnas de ganancia por venta y rollup diario inmutable. Llamar desde las migraciones de app.py."""
+    for column, col_type in (('ganancia', 'REAL'), ('ganancia_item', 'TEXT'),
+                             ('ganancia_paquete', 'TEXT'), ('ganancia_cantidad', 'INTEGER')):
+        try:
+            cursor.execute(f'ALTER TABLE historial_compras ADD COLUMN {column} {col_type}')
+        except Exception:
+            pass
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_rollup_diario (
+            day TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            package_name TEXT NOT NULL,
+            ventas INTEGER NOT NULL DEFAULT 0,
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            profit_total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, item_name, package_name)
+        )
+    ''')
+    # Versión del catálogo de precios/costos, compartida entre workers (ver invalidate_profit_catalog)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_catalog_version (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT INTO profit_catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+    # Días ya consolidados (un día sin ventas también queda cerrado)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_rollup_dias (
+            day TEXT PRIMARY KEY,
+            folded_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _iter_days(start_day: str, end_day: str):
+    current = date.fromisoformat(start_day)
+    end = date.fromisoformat(end_day)
+    while current < end:
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+
+def _load_folded_days(conn, start_day: str, end_day: str):
+    rows = conn.execute(
+        'SELECT day FROM profit_rollup_dias WHERE day >= ? AND day < ?', (start_day, end_day)
     ).fetchall()
+    return {str(row['day']) for row in rows}
 
 
-def compute_dashboard_profit_by_day(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
-    if not table_exists(conn, 'historial_compras') or not table_exists(conn, 'usuarios') or not table_exists(conn, 'precios_compra'):
+def fold_closed_profit_days(conn, start_day: str, end_day: str, tz_name: str = 'America/Caracas'):
+    """Consolida en profit_rollup_diario los días cerrados de [start_day, end_day) aún sin consolidar.
+
+    Un día consolidado no se vuelve a leer de historial_compras (que además se purga).
+    Devuelve la lista de días consolidados en esta llamada.
+    """
+    if not table_exists(conn, 'profit_rollup_dias'):
+        return []
+    today_local = datetime.now(pytz.timezone(tz_name)).date().isoformat()
+    end_day = min(end_day, today_local)
+    if start_day >= end_day:
         return []
 
-    admin_ids, admin_emails = get_admin_exclusions()
-    admin_ids = set(admin_ids)
-    admin_emails = {str(email).strip().lower() for email in admin_emails if str(email).strip()}
-    dynamic_game_names = _load_dynamic_game_names(conn)
-    profit_catalog = _load_dashboard_profit_catalog(conn)
-    rows = _load_dashboard_sales_rows(conn, start_utc, end_utc, tz_name)
+    folded = _load_folded_days(conn, start_day, end_day)
+    pending = [day for day in _iter_days(start_day, end_day) if day not in folded]
+    if not pending:
+        return []
 
-    profit_by_day = {}
-    for row in rows:
+    pending_set = set(pending)
+    ctx = _AttributionContext(conn)
+    rollup = {}
+    last_day = (date.fromisoformat(pending[-1]) + timedelta(days=1)).isoformat()
+    for row in _load_sales_rows_for_days(conn, pending[0], last_day):
+        day = str(row['local_day'] or '').strip()
+        if day not in pending_set:
+            continue
         try:
-            if _should_exclude_history_row_profit(row, admin_ids, admin_emails):
-                continue
+            attribution = _row_attribution(row, ctx)
+        except Exception:
+            continue
+        if not attribution or attribution['profit'] is None:
+            continue
+        entry = rollup.setdefault((day, attribution['item'], attribution['package']), [0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += attribution['quantity']
+        entry[2] += attribution['profit']
 
-            package_name = str(row['paquete_nombre'] or '').strip()
-            if not package_name:
-                continue
+    cur = conn.cursor()
+    for (day, item_name, package_name), (ventas, cantidad, profit_total) in rollup.items():
+        cur.execute(
+            '''
+            INSERT INTO profit_rollup_diario (day, item_name, package_name, ventas, cantidad, profit_total)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (day, item_name, package_name) DO NOTHING
+            ''',
+            (day, item_name, package_name, ventas, cantidad, round(profit_total, 6))
+        )
+    for day in pending:
+        cur.execute('INSERT INTO profit_rollup_dias (day) VALUES (?) ON CONFLICT (day) DO NOTHING', (day,))
+    conn.commit()
+    return pending
 
-            quantity = max(1, _extract_dashboard_quantity(package_name, row['pin']))
-            item_name = _infer_dashboard_item_name(package_name, dynamic_game_names)
-            normalized_package = _normalize_dashboard_package_name(package_name, item_name)
+
+def compute_dashboard_profit_by_day(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
+    if not table_exists(conn, 'historial_compras') or not table_exists(conn, 'usuarios') or not table_exists(conn, 'precios_compra'):
+        return []
+    start_day, end_day = _local_day_bounds(start_utc, end_utc, tz_name)
+    if start_day is None:
+        return []
+
+    profit_by_day = {}
+    folded = set()
+    live_start = start_day
+    if table_exists(conn, 'profit_rollup_dias'):
+        # Días consolidados por la limpieza diaria: números precomputados. El resto
+        # (el día en curso y lo aún no consolidado) se agrega en vivo, sin escribir.
+        folded = _load_folded_days(conn, start_day, end_day)
+        for row in conn.execute(
+            '''
+            SELECT day, SUM(profit_total) AS profit FROM profit_rollup_diario
+            WHERE day >= ? AND day < ? GROUP BY day
+            ''',
+            (start_day, end_day)
+        ).fetchall():
+            profit_by_day[str(row['day'])] = float(row['profit'] or 0.0)
+        live_start = next((day for day in _iter_days(start_day, end_day) if day not in folded), end_day)
+
+    ctx = _AttributionContext(conn)
+    for row in (_load_sales_rows_for_days(conn, live_start, end_day) if live_start < end_day else []):
+        try:
             local_day = str(row['local_day'] or '').strip()
-            if not local_day:
+            if not local_day or local_day in folded:
                 continue
-
-            profit_unit, profit_total = _resolve_dashboard_profit_amount(
-                profit_catalog,
-                item_name,
-                normalized_package,
-                abs(float(row['monto'] or 0.0)),
-                quantity,
-            )
-            if profit_unit is None:
+            attribution = _row_attribution(row, ctx)
+            if not attribution or attribution['profit'] is None:
                 continue
-
-            profit_by_day[local_day] = profit_by_day.get(local_day, 0.0) + profit_total
+            profit_by_day[local_day] = profit_by_day.get(local_day, 0.0) + attribution['profit']
         except Exception:
             continue
 
@@ -437,13 +755,15 @@ def _load_profit_daily_aggregate_rows(conn, start_day: str, end_day: str):
     return [dict(row) for row in rows]
 
 
-def sync_closed_dashboard_profit_days(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
+def sync_closed_dashboard_profit_days(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas',
+                                      dashboard_rows=None):
     if not table_exists(conn, 'profit_daily_aggregate'):
         return []
 
     tz = pytz.timezone(tz_name)
     today_local = datetime.now(tz).date().isoformat()
-    dashboard_rows = compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name)
+    if dashboard_rows is None:
+        dashboard_rows = compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name)
     closed_days = [
         item for item in dashboard_rows
         if str(item.get('day') or '').strip() and str(item.get('day')) < today_local
@@ -451,18 +771,20 @@ def sync_closed_dashboard_profit_days(conn, start_utc: str, end_utc: str, tz_nam
     if not closed_days:
         return []
 
+    # Una sola lectura de los agregados existentes; solo se escriben los días que cambiaron
+    existing = {
+        str(row['day']): round(float(row['profit'] or 0.0), 6)
+        for row in _load_profit_daily_aggregate_rows(
+            conn, str(closed_days[0]['day']), (date.fromisoformat(str(closed_days[-1]['day'])) + timedelta(days=1)).isoformat()
+        )
+    }
     cur = conn.cursor()
     changed = False
     for item in closed_days:
         day = str(item.get('day') or '').strip()
         total = round(float(item.get('profit') or 0.0), 6)
-        existing = cur.execute(
-            "SELECT profit_total FROM profit_daily_aggregate WHERE day = ?",
-            (day,)
-        ).fetchone()
-        if existing:
-            existing_total = round(float(existing['profit_total'] if hasattr(existing, 'keys') else existing[0]) or 0.0, 6)
-            if abs(existing_total - total) > 0.000001:
+        if day in existing:
+            if abs(existing[day] - total) > 0.000001:
                 cur.execute(
                     "UPDATE profit_daily_aggregate SET profit_total = ?, updated_at = datetime('now') WHERE day = ?",
                     (total, day)
@@ -490,15 +812,15 @@ def compute_admin_profit_by_day(conn, start_utc: str, end_utc: str, tz_name: str
     start_day = start_dt.astimezone(tz).date().isoformat()
     end_day = end_dt.astimezone(tz).date().isoformat()
 
+    dashboard_rows = compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name)
     aggregate_rows = []
     if table_exists(conn, 'profit_daily_aggregate'):
         try:
-            sync_closed_dashboard_profit_days(conn, start_utc, end_utc, tz_name)
+            sync_closed_dashboard_profit_days(conn, start_utc, end_utc, tz_name, dashboard_rows=dashboard_rows)
         except Exception:
             pass
         aggregate_rows = _load_profit_daily_aggregate_rows(conn, start_day, end_day)
 
-    dashboard_rows = compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name)
     today_local = datetime.now(tz).date().isoformat()
     aggregate_days = {
         str(item.get('day') or '').strip()
@@ -782,11 +1104,12 @@ def compute_profit_ledger_base_by_day(conn, start_utc: str, end_utc: str, tz_nam
 def compute_profit_ledger_by_day(conn, start_utc: str, end_utc: str, tz_name: str = 'America/Caracas'):
     tz = pytz.timezone(tz_name)
     base_rows = compute_profit_ledger_base_by_day(conn, start_utc, end_utc, tz_name)
+    dashboard_rows = compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name)
 
     aggregate_rows = []
     if table_exists(conn, 'profit_daily_aggregate'):
         try:
-            sync_closed_dashboard_profit_days(conn, start_utc, end_utc, tz_name)
+            sync_closed_dashboard_profit_days(conn, start_utc, end_utc, tz_name, dashboard_rows=dashboard_rows)
         except Exception:
             pass
 
@@ -799,7 +1122,7 @@ def compute_profit_ledger_by_day(conn, start_utc: str, end_utc: str, tz_name: st
 
     dashboard_today = []
     today_local = datetime.now(tz).date().isoformat()
-    for item in compute_dashboard_profit_by_day(conn, start_utc, end_utc, tz_name):
+    for item in dashboard_rows:
         day = str(item.get('day') or '').strip()
         if day == today_local:
             dashboard_today.append(item)
@@ -1539,6 +1862,7 @@ def profit_packages_config():
                     )
             conn.commit()
             conn.close()
+            invalidate_profit_catalog()
             return jsonify({'ok': True})
         except Exception as e:
             try:
@@ -0,0 +1,52 @@
+"""
+Escritura atómica de agregados
+==============================
+Los contadores por día/mes (profit_daily_aggregate, ventas_semanales,
+monthly_user_spending) se actualizaban con SELECT y luego UPDATE o INSERT:
+dos o tres viajes a la base por compra y, con dos compras simultáneas, un
+incremento perdido (o dos INSERT para la misma clave). `increment_aggregate`
+lo hace en una sola sentencia:
+
+    INSERT ... ON CONFLICT (claves) DO UPDATE SET x = tabla.x + EXCLUDED.x
+
+La tabla necesita una PRIMARY KEY o UNIQUE exactamente sobre `keys`.
+Funciona igual en PostgreSQL y en SQLite (>= 3.24) a través de pg_compat.
+"""
+
+import re
+
+_IDENT_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _check_identifiers(*names):
+    for name in names:
+        if not _IDENT_RE.match(name):
+            raise ValueError(f'Identificador SQL inválido: {name!r}')
+
+
+def increment_aggregate(conn, table, keys, increments, insert_values=None, touch=None):
+    """Suma `increments` a la fila de `keys` (creándola si no existe) en una sentencia.
+
+    Args:
+        conn: conexión de la compra; no hace commit.
+        table: tabla del agregado.
+        keys: {columna: valor} de la clave única.
+        increments: {columna: delta} que se suman a la fila existente.
+        insert_values: {columna: valor} que solo se escriben al crear la fila.
+        touch: (columna, expresión SQL) que se actualiza en cada escritura,
+            p. ej. ('updated_at', "datetime('now')").
+    """
+    insert_values = insert_values or {}
+    columns = list(keys) + list(increments) + list(insert_values)
+    _check_identifiers(table, *columns, *([touch[0]] if touch else []))
+    params = list(keys.values()) + list(increments.values()) + list(insert_values.values())
+
+    updates = [f'{col} = {table}.{col} + EXCLUDED.{col}' for col in increments]
+    if touch:
+        updates.append(f'{touch[0]} = {touch[1]}')
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) '
+        f'VALUES ({", ".join("?" for _ in columns)}) '
+        f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {", ".join(updates)}'
+    )
+    return conn.execute(sql, tuple(params))
@@ -6,8 +6,9 @@ consultar productos y ejecutar recargas usando el saldo de un usuario asignado.
 
 Endpoints:
   GET  /api/v1/products          → Catálogo de juegos + paquetes activos
-  POST /api/v1/recharge          → Crear orden de recarga
+  POST /api/v1/recharge          → Crear orden de recarga ({"async": true} → 202 + ejecución en background)
   GET  /api/v1/orders/<order_id> → Consultar estado de una orden
+  POST /api/v1/orders/status     → Estado de varias órdenes en una sola consulta (ids, external ids o cursor since)
   GET  /api/v1/balance           → Consultar saldo de la cuenta
 
 Admin (sesión):
@@ -19,16 +20,19 @@ Admin (sesión):
 """
 
 import functools
+import hashlib
 import json
 import logging
 import os
 import secrets
 import threading
 import time as time_module
+from datetime import datetime, timedelta
 
 import requests as req_lib
 from flask import Blueprint, jsonify, request, session, flash, redirect
 from csrf_utils import csrf_protect
+from admin_stats import insert_historial_compra
 from request_security import consume_rate_limit, get_request_client_ip
 
 logger = logging.getLogger(__name__)
@@ -39,6 +43,19 @@ WHITELABEL_AUTH_FAILURE_LIMIT = max(int(os.environ.get('WHITELABEL_AUTH_FAILURE_
 WHITELABEL_AUTH_FAILURE_WINDOW_SECONDS = max(int(os.environ.get('WHITELABEL_AUTH_FAILURE_WINDOW_SECONDS', '300')), 1)
 WHITELABEL_RECHARGE_RATE_LIMIT_REQUESTS = max(int(os.environ.get('WHITELABEL_RECHARGE_RATE_LIMIT_REQUESTS', '120')), 1)
 WHITELABEL_RECHARGE_RATE_LIMIT_WINDOW_SECONDS = max(int(os.environ.get('WHITELABEL_RECHARGE_RATE_LIMIT_WINDOW_SECONDS', '60')), 1)
+# Modo asíncrono (opt-in): la orden queda en una cola persistente y se responde 202;
+# con la cola llena se responde 503 (nunca se cae a modo síncrono).
+WHITELABEL_ASYNC_WORKERS = max(int(os.environ.get('WHITELABEL_ASYNC_WORKERS', '4')), 1)
+WHITELABEL_ASYNC_MAX_PENDING = max(int(os.environ.get('WHITELABEL_ASYNC_MAX_PENDING', '32')), 0)
+WHITELABEL_ASYNC_LEASE_SECONDS = max(int(os.environ.get('WHITELABEL_ASYNC_LEASE_SECONDS', '600')), 60)
+WHITELABEL_ASYNC_POLL_SECONDS = max(float(os.environ.get('WHITELABEL_ASYNC_POLL_SECONDS', '2')), 0.2)
+WHITELABEL_ASYNC_RETRY_AFTER_SECONDS = 10
+WHITELABEL_BULK_STATUS_MAX = max(int(os.environ.get('WHITELABEL_BULK_STATUS_MAX', '200')), 1)
+# fecha_actualizacion se fija al escribir, no al confirmar: una transacción lenta
+# puede aparecer con una fecha ya pasada por el cursor. Al quedar al día, el
+# cursor `since` retrocede esta ventana y la vuelve a leer.
+WHITELABEL_BULK_STATUS_OVERLAP_SECONDS = max(int(os.environ.get('WHITELABEL_BULK_STATUS_OVERLAP_SECONDS', '30')), 0)
+WHITELABEL_API_KEY_CACHE_TTL_SECONDS = max(float(os.environ.get('WHITELABEL_API_KEY_CACHE_TTL_SECONDS', '30')), 0)
 
 # ---------------------------------------------------------------------------
 # Helpers – DB connection (importados de pg_compat igual que el resto del app)
@@ -226,6 +243,241 @@ def _order_payload(row):
     }
 
 
+# ---------------------------------------------------------------------------
+# Cola persistente para /api/v1/recharge asíncrono
+# ---------------------------------------------------------------------------
+# Una orden aceptada con 202 queda en api_orders con async_estado='pendiente' y
+# los argumentos de la recarga en async_job; la ejecuta un pool de hilos por
+# proceso que la reclama con lease (como la cola FF ID). Si un proceso muere,
+# otro reclama sus órdenes al arrancar o en el siguiente sondeo: las que nunca
+# empezaron se ejecutan; las que quedaron a medias (lease vencido) se
+# reembolsan sin volver a llamar al proveedor, para no recargar dos veces.
+# Mientras la orden corre, el worker renueva el lease cada tercio de
+# WHITELABEL_ASYNC_LEASE_SECONDS; solo vence si el proceso murió. Aun así, el
+# cierre (completada/fallida) va condicionado a estado = 'procesando' y solo
+# quien lo gana reembolsa o registra historial.
+
+_async_workers = []
+_async_workers_pid = None
+_async_workers_lock = threading.Lock()
+_async_wakeup = threading.Event()
+
+
+def _wants_async_recharge(data):
+    """El cliente pide modo asíncrono con {"async": true} o el header Prefer: respond-async."""
+    if str(data.get('async', '')).strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    prefer = (request.headers.get('Prefer') or '').lower()
+    return 'respond-async' in prefer
+
+
+def _async_queue_full(conn):
+    """Cupo global (todos los procesos): órdenes en cola + en ejecución."""
+    row = conn.execute(
+        "SELECT COUNT(*) AS total FROM api_orders WHERE async_estado IN ('pendiente', 'ejecutando')"
+    ).fetchone()
+    return int(row['total'] or 0) >= WHITELABEL_ASYNC_WORKERS + WHITELABEL_ASYNC_MAX_PENDING
+
+
+def _finalize_external_order(usuario_id, endpoint_key, external_order_id, order_id):
+    if not external_order_id:
+        return
+    try:
+        conn_done = _get_conn()
+        row_done = conn_done.execute('SELECT * FROM api_orders WHERE id = ?', (order_id,)).fetchone()
+        _finalize_idempotent_order(conn_done, usuario_id, endpoint_key, external_order_id, row_done)
+        conn_done.commit()
+        conn_done.close()
+    except Exception:
+        pass
+
+
+def claim_async_order(*, now=None):
+    """Reclama la orden asíncrona más antigua (pendiente o con lease vencido)."""
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        candidates = conn.execute('''
+            SELECT id FROM api_orders
+            WHERE async_estado = 'pendiente'
+               OR (async_estado = 'ejecutando' AND async_lease < ?)
+            ORDER BY id
+            LIMIT 5
+        ''', (now,)).fetchall()
+        for cand in candidates:
+            cur = conn.execute('''
+                UPDATE api_orders
+                SET async_estado = 'ejecutando', async_lease = ?, async_intentos = async_intentos + 1
+                WHERE id = ?
+                  AND (async_estado = 'pendiente' OR (async_estado = 'ejecutando' AND async_lease < ?))
+            ''', (now + WHITELABEL_ASYNC_LEASE_SECONDS, cand['id'], now))
+            if cur.rowcount == 1:
+                conn.commit()
+                row = conn.execute('SELECT * FROM api_orders WHERE id = ?', (cand['id'],)).fetchone()
+                return dict(row) if row else None
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def renew_async_lease(order_id, attempt, *, now=None):
+    """Extiende el lease de una orden en ejecución; False si otro worker ya la reclamó."""
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        cur = conn.execute('''
+            UPDATE api_orders SET async_lease = ?
+            WHERE id = ? AND async_estado = 'ejecutando' AND async_intentos = ?
+        ''', (now + WHITELABEL_ASYNC_LEASE_SECONDS, order_id, attempt))
+        conn.commit()
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def _async_lease_keeper(order_id, attempt, stop):
+    while not stop.wait(WHITELABEL_ASYNC_LEASE_SECONDS / 3):
+        try:
+            if not renew_async_lease(order_id, attempt):
+                logger.error(f'[WL API] order={order_id} perdió el lease de la cola asíncrona')
+                return
+        except Exception as e:
+            logger.warning(f'[WL API] No se pudo renovar el lease order={order_id}: {e}')
+
+
+def _finish_async_order(order_id, attempt):
+    conn = _get_conn()
+    try:
+        conn.execute(
+            "UPDATE api_orders SET async_estado = 'terminado', async_lease = 0 WHERE id = ? AND async_intentos = ?",
+            (order_id, attempt)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _load_order_account(account_id):
+    conn = _get_conn()
+    try:
+        row = conn.execute('SELECT * FROM webservice_accounts WHERE id = ?', (account_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else {'id': account_id, 'nombre': '', 'webhook_url': ''}
+
+
+def _refund_interrupted_order(order, account):
+    """Cierra como fallida (con reembolso) una orden cuya ejecución quedó a medias."""
+    conn = _get_conn()
+    try:
+        cur = conn.execute('''
+            UPDATE api_orders
+            SET estado = 'fallida', error_msg = ?, fecha_completada = CURRENT_TIMESTAMP,
+                fecha_actualizacion = CURRENT_TIMESTAMP
+            WHERE id = ? AND estado = 'procesando'
+        ''', ('Ejecución interrumpida por reinicio del servidor; saldo reembolsado', order['id']))
+        if cur.rowcount == 1:
+            conn.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (order['precio'], order['usuario_id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logger.warning(f'[WL API] order={order["id"]} interrumpida a medias: reembolsada sin reintentar')
+    if account.get('webhook_url'):
+        _send_webhook_async(order['id'], account['webhook_url'])
+
+
+def _run_async_order(order):
+    """Ejecuta una orden reclamada de la cola. El resultado llega por webhook o /api/v1/orders/<id>."""
+    order_id = order['id']
+    attempt = int(order.get('async_intentos') or 1)
+    job = json.loads(order.get('async_job') or '{}')
+    stop_keeper = threading.Event()
+    threading.Thread(target=_async_lease_keeper, args=(order_id, attempt, stop_keeper), daemon=True,
+                     name=f'wl-async-lease-{order_id}').start()
+    try:
+        account = _load_order_account(order['account_id'])
+        if order['estado'] == 'procesando':
+            if attempt > 1:
+                _refund_interrupted_order(order, account)
+            else:
+                _process_recharge_order(
+                    order_id, job['game_type'], job['package_id'], job['player_id'], job.get('player_id2', ''),
+                    job['precio'], job.get('gp_package_id'), job.get('gp_product_id'), order['usuario_id'], account,
+                    provider_meta=job.get('provider_meta') or {}, game_name=job.get('game_name', ''),
+                    pkg_name=job.get('pkg_name', ''),
+                )
+        # Si estado ya no es 'procesando', el proceso anterior terminó la recarga
+        # y murió antes de cerrar la cola: solo falta lo de abajo.
+        _finalize_external_order(order['usuario_id'], job.get('endpoint_key', ''),
+                                 job.get('external_order_id', ''), order_id)
+    finally:
+        stop_keeper.set()
+        _finish_async_order(order_id, attempt)
+
+
+def _async_worker_loop():
+    while True:
+        order = None
+        try:
+            order = claim_async_order()
+        except Exception as e:
+            logger.error(f'[WL API] Error reclamando orden asíncrona: {e}')
+
+        if not order:
+            _async_wakeup.wait(WHITELABEL_ASYNC_POLL_SECONDS)
+            _async_wakeup.clear()
+            continue
+
+        try:
+            _run_async_order(order)
+        except Exception as e:
+            logger.error(f'[WL API] Error en ejecución asíncrona order={order.get("id")}: {e}')
+
+
+def _has_async_backlog():
+    try:
+        conn = _get_conn()
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM api_orders WHERE async_estado IN ('pendiente', 'ejecutando') LIMIT 1"
+            ).fetchone()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f'[WL API] No se pudo revisar la cola asíncrona: {e}')
+        return False
+    return row is not None
+
+
+def start_async_recharge_workers(only_if_backlog=False):
+    """Arranca el pool de la cola asíncrona (idempotente por PID).
+
+    Al arrancar, los hilos retoman lo que dejó un proceso anterior. Con
+    only_if_backlog (arranque del proceso) solo se inician si hay órdenes
+    pendientes; si no, los inicia el primer request asíncrono.
+    """
+    global _async_workers_pid
+    if _async_workers_pid == os.getpid():
+        return False
+    if only_if_backlog and not _has_async_backlog():
+        return False
+    with _async_workers_lock:
+        if _async_workers_pid == os.getpid():
+            return False
+        _async_workers_pid = os.getpid()
+        _async_workers.clear()
+        for idx in range(WHITELABEL_ASYNC_WORKERS):
+            t = threading.Thread(target=_async_worker_loop, daemon=True, name=f'wl-recharge-{idx}')
+            t.start()
+            _async_workers.append(t)
+    logger.info(f'[WL API] {WHITELABEL_ASYNC_WORKERS} workers de recarga asíncrona iniciados')
+    return True
+
+
 # ---------------------------------------------------------------------------
 # DDL – llamar desde init_db() de app.py
 # ---------------------------------------------------------------------------
@@ -248,6 +500,12 @@ def init_whitelabel_tables(cursor):
         )
     ''')
     cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_ws_api_key ON webservice_accounts(api_key)')
+    try:
+        cursor.execute('ALTER TABLE webservice_accounts ADD COLUMN api_key_hash TEXT')
+    except Exception:
+        pass
+    _hash_plaintext_api_keys(cursor)
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_ws_api_key_hash ON webservice_accounts(api_key_hash)')
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS api_orders (
@@ -279,8 +537,100 @@ def init_whitelabel_tables(cursor):
         cursor.execute('ALTER TABLE api_orders ADD COLUMN redeemed_pin TEXT DEFAULT \'''\'')
     except Exception:
         pass
+    try:
+        cursor.execute('ALTER TABLE api_orders ADD COLUMN fecha_actualizacion DATETIME')
+    except Exception:
+        pass
+    cursor.execute('UPDATE api_orders SET fecha_actualizacion = COALESCE(fecha_completada, fecha) WHERE fecha_actualizacion IS NULL')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_orders_account ON api_orders(account_id, fecha DESC)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_orders_estado ON api_orders(estado)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_orders_account_external ON api_orders(account_id, external_order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_orders_account_updated ON api_orders(account_id, fecha_actualizacion, id)')
+
+
+def add_async_queue_columns(cursor):
+    """Columnas de la cola asíncrona de api_orders (paso de esquema posterior)."""
+    for column, col_type in (('async_job', "TEXT DEFAULT ''"), ('async_estado', "TEXT DEFAULT ''"),
+                             ('async_lease', 'REAL DEFAULT 0'), ('async_intentos', 'INTEGER DEFAULT 0')):
+        try:
+            cursor.execute(f'ALTER TABLE api_orders ADD COLUMN {column} {col_type}')
+        except Exception:
+            pass
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_orders_async ON api_orders(async_estado, async_lease, id)')
+
+
+def _hash_plaintext_api_keys(cursor):
+    """Migra keys en texto plano: guarda su SHA-256 y deja en api_key solo una versión enmascarada."""
+    rows = cursor.execute(
+        'SELECT id, api_key FROM webservice_accounts WHERE api_key_hash IS NULL'
+    ).fetchall()
+    for row in rows:
+        plain = str(row['api_key'] or '')
+        cursor.execute(
+            'UPDATE webservice_accounts SET api_key_hash = ?, api_key = ? WHERE id = ?',
+            (hash_api_key(plain), mask_api_key(plain), row['id'])
+        )
+
+
+# ---------------------------------------------------------------------------
+# API keys: hash + caché de cuentas autenticadas
+# ---------------------------------------------------------------------------
+
+def hash_api_key(api_key):
+    """SHA-256 hex de la API key; es lo único que se guarda y se indexa."""
+    return hashlib.sha256(str(api_key or '').strip().encode('utf-8')).hexdigest()
+
+
+def mask_api_key(api_key):
+    """Versión no reversible para mostrar en el panel (prefijo + últimos 4)."""
+    api_key = str(api_key or '')
+    if len(api_key) <= 16:
+        return api_key[:4] + '…'
+    return f'{api_key[:12]}…{api_key[-4:]}'
+
+
+# hash(api_key) -> (expira_en, cuenta). Caché por proceso: la invalidación
+# explícita solo alcanza al worker que atendió al admin; el TTL corto acota
+# la ventana en los demás workers.
+_api_key_cache = {}
+_api_key_cache_lock = threading.Lock()
+
+
+def invalidate_api_key_cache(account_id=None):
+    """Descarta cuentas cacheadas (todas, o solo la indicada)."""
+    with _api_key_cache_lock:
+        if account_id is None:
+            _api_key_cache.clear()
+            return
+        for key_hash in [h for h, (_exp, acc) in _api_key_cache.items() if acc.get('id') == account_id]:
+            _api_key_cache.pop(key_hash, None)
+
+
+def get_account_by_api_key(api_key):
+    """Cuenta activa para la API key, consultando la BD solo si no está en caché."""
+    key_hash = hash_api_key(api_key)
+    now = time_module.monotonic()
+    with _api_key_cache_lock:
+        cached = _api_key_cache.get(key_hash)
+        if cached and cached[0] > now:
+            return dict(cached[1])
+
+    conn = _get_conn()
+    try:
+        row = conn.execute(
+            'SELECT * FROM webservice_accounts WHERE api_key_hash = ? AND activo = TRUE',
+            (key_hash,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+
+    account = dict(row)
+    if WHITELABEL_API_KEY_CACHE_TTL_SECONDS > 0:
+        with _api_key_cache_lock:
+            _api_key_cache[key_hash] = (now + WHITELABEL_API_KEY_CACHE_TTL_SECONDS, account)
+    return dict(account)
 
 
 # ---------------------------------------------------------------------------
@@ -289,13 +639,7 @@ def init_whitelabel_tables(cursor):
 
 def _get_account_by_key(api_key):
     """Busca una WebServiceAccount activa por su api_key."""
-    conn = _get_conn()
-    row = conn.execute(
-        'SELECT * FROM webservice_accounts WHERE api_key = ? AND activo = TRUE',
-        (api_key,)
-    ).fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return get_account_by_api_key(api_key)
 
 
 def require_api_key(f):
@@ -510,6 +854,8 @@ def api_v1_recharge():
         player_id    (str)  - ID del jugador
         player_id2   (str)  - Opcional, segundo ID (ej: Zone ID de Mobile Legends)
         external_order_id (str) - Opcional, referencia de la web cliente para trazabilidad
+        async        (bool) - Opcional, responde 202 tras el débito y ejecuta en background
+                              (equivale al header Prefer: respond-async); 503 si la cola está llena
     """
     account = request._ws_account
     usuario_id = account['usuario_id']
@@ -586,6 +932,23 @@ def api_v1_recharge():
             finally:
                 conn_existing.close()
 
+    # Con la cola asíncrona llena se rechaza antes de debitar (el cliente reintenta).
+    wants_async = _wants_async_recharge(data)
+    if wants_async:
+        conn_queue = _get_conn()
+        try:
+            queue_full = _async_queue_full(conn_queue)
+            if queue_full and external_order_id:
+                _clear_idempotent_order(conn_queue, usuario_id, endpoint_key, external_order_id)
+                conn_queue.commit()
+        finally:
+            conn_queue.close()
+        if queue_full:
+            response = jsonify({'ok': False, 'error': 'Cola de recargas asíncronas llena, reintenta más tarde'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(WHITELABEL_ASYNC_RETRY_AFTER_SECONDS)
+            return response
+
     # --- Verificar y descontar saldo atómicamente ---
     conn = _get_conn()
     try:
@@ -610,15 +973,25 @@ def api_v1_recharge():
                 'precio': float(precio),
             }), 402
 
-        # Crear orden en estado pendiente
+        async_job = ''
+        if wants_async:
+            async_job = json.dumps({
+                'game_type': game_type, 'package_id': package_id, 'player_id': player_id,
+                'player_id2': player_id2, 'precio': precio, 'gp_package_id': gp_package_id,
+                'gp_product_id': gp_product_id, 'provider_meta': provider_meta, 'game_name': game_name,
+                'pkg_name': pkg_name, 'endpoint_key': endpoint_key, 'external_order_id': external_order_id,
+            })
+
+        # Crear orden en estado pendiente (en modo asíncrono, ya encolada)
         cur = conn.execute('''
             INSERT INTO api_orders
             (account_id, usuario_id, game_type, game_name, package_id, package_name,
-             player_id, player_id2, precio, estado, external_order_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'procesando', ?)
+             player_id, player_id2, precio, estado, external_order_id, fecha_actualizacion,
+             async_job, async_estado)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'procesando', ?, CURRENT_TIMESTAMP, ?, ?)
             RETURNING id
         ''', (account['id'], usuario_id, game_type, game_name, package_id, pkg_name,
-              player_id, player_id2, precio, external_order_id))
+              player_id, player_id2, precio, external_order_id, async_job, 'pendiente' if wants_async else ''))
         order_id = cur.fetchone()[0]
         conn.commit()
     except Exception as e:
@@ -637,22 +1010,26 @@ def api_v1_recharge():
         except Exception:
             pass
 
-    # --- Ejecutar recarga en background para no bloquear al cliente ---
-    # (se ejecuta síncrono porque el cliente espera el resultado)
+    # --- Modo asíncrono: responder 202; la orden ya está en la cola ---
+    if wants_async:
+        start_async_recharge_workers()
+        _async_wakeup.set()
+        response = jsonify({
+            'ok': True,
+            'order_id': order_id,
+            'status': 'procesando',
+            'external_order_id': external_order_id,
+            'status_url': f'/api/v1/orders/{order_id}',
+        })
+        response.status_code = 202
+        response.headers['Location'] = f'/api/v1/orders/{order_id}'
+        return response
+
+    # --- Modo síncrono: el cliente espera el resultado ---
     result = _execute_recharge(order_id, game_type, package_id, player_id, player_id2,
                                precio, gp_package_id, gp_product_id, usuario_id, account,
-                               provider_meta=provider_meta,
-                               game_name=game_name, pkg_name=pkg_name)
-
-    if external_order_id:
-        try:
-            conn_done = _get_conn()
-            row_done = conn_done.execute('SELECT * FROM api_orders WHERE id = ?', (order_id,)).fetchone()
-            _finalize_idempotent_order(conn_done, usuario_id, endpoint_key, external_order_id, row_done)
-            conn_done.commit()
-            conn_done.close()
-        except Exception:
-            pass
+                               provider_meta=provider_meta, game_name=game_name, pkg_name=pkg_name)
+    _finalize_external_order(usuario_id, endpoint_key, external_order_id, order_id)
 
     return result
 
@@ -743,6 +1120,18 @@ def _execute_recharge(order_id, game_type, package_id, player_id, player_id2,
                       precio, gp_package_id, gp_product_id, usuario_id, account,
                       provider_meta=None, game_name='', pkg_name=''):
     """Ejecuta la recarga según el tipo de juego y actualiza la orden."""
+    response, status_code = _process_recharge_order(
+        order_id, game_type, package_id, player_id, player_id2,
+        precio, gp_package_id, gp_product_id, usuario_id, account,
+        provider_meta=provider_meta, game_name=game_name, pkg_name=pkg_name,
+    )
+    return jsonify(response), status_code
+
+
+def _process_recharge_order(order_id, game_type, package_id, player_id, player_id2,
+                            precio, gp_package_id, gp_product_id, usuario_id, account,
+                            provider_meta=None, game_name='', pkg_name=''):
+    """Ejecuta la recarga y retorna (payload, status_code) sin depender del contexto Flask."""
     _start = time_module.time()
     provider_meta = provider_meta or {}
 
@@ -770,64 +1159,67 @@ def _execute_recharge(order_id, game_type, package_id, player_id, player_id2,
 
     _duration = round(time_module.time() - _start, 1)
 
-    # Actualizar orden
+    # Actualizar orden (solo si sigue abierta: otro worker pudo cerrarla y reembolsarla)
     conn = _get_conn()
     try:
         if result.get('ok'):
-            conn.execute('''
+            cur = conn.execute('''
                 UPDATE api_orders
                 SET estado = 'completada', reference_no = ?, player_name = ?,
-                    duration_seconds = ?, redeemed_pin = ?, fecha_completada = CURRENT_TIMESTAMP
-                WHERE id = ?
+                    duration_seconds = ?, redeemed_pin = ?, fecha_completada = CURRENT_TIMESTAMP,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE id = ? AND estado = 'procesando'
             ''', (result.get('reference_no', ''), result.get('player_name', ''),
                   _duration, result.get('redeemed_pin', ''), order_id))
-
-            # ── Registrar en historial general (transacciones + historial_compras) ──
-            try:
-                _nc = f"WL-{secrets.token_hex(4).upper()}"
-                _tid = f"WL-API-{order_id}"
-                _player_name = result.get('player_name', '')
-                if _player_name:
-                    _pin_info = f"ID: {player_id} - Jugador: {_player_name}"
-                else:
-                    _pin_info = f"ID: {player_id}"
-                if player_id2:
-                    _pin_info = f"ID: {player_id}/{player_id2} - " + _pin_info.split(' - ', 1)[-1]
-                _pin_info += f" [API: {account['nombre']}]"
-
-                _paquete_display = f"{game_name} - {pkg_name}" if game_name else (pkg_name or f"Paquete {package_id}")
-
-                conn.execute('''
-                    INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto, duracion_segundos)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (usuario_id, _nc, _pin_info, _tid, _paquete_display, -precio, _duration))
-
-                _saldo_row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (usuario_id,)).fetchone()
-                _saldo = float(_saldo_row['saldo']) if _saldo_row else 0.0
-                conn.execute('''
-                    INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
-                    VALUES (?, ?, ?, ?, 'compra', ?, ?, ?)
-                ''', (usuario_id, precio, _paquete_display, _pin_info, _duration, _saldo + precio, _saldo))
-
-                _record_whitelabel_profit(conn, usuario_id, game_type, package_id, precio, order_id)
-
+            if cur.rowcount != 1:
+                logger.error(f'[WL API] order={order_id} recargada pero ya estaba cerrada; revisar reembolso '
+                             f'(ref={result.get("reference_no", "")} pin={result.get("redeemed_pin", "")})')
+            else:
+                # ── Registrar en historial general (transacciones + historial_compras) ──
                 try:
-                    from app import update_monthly_spending
-                    update_monthly_spending(conn, usuario_id, precio)
-                except Exception:
-                    pass
-            except Exception as e:
-                logger.warning(f'[WL API] Error registrando transacción general order={order_id}: {e}')
+                    _nc = f"WL-{secrets.token_hex(4).upper()}"
+                    _tid = f"WL-API-{order_id}"
+                    _player_name = result.get('player_name', '')
+                    if _player_name:
+                        _pin_info = f"ID: {player_id} - Jugador: {_player_name}"
+                    else:
+                        _pin_info = f"ID: {player_id}"
+                    if player_id2:
+                        _pin_info = f"ID: {player_id}/{player_id2} - " + _pin_info.split(' - ', 1)[-1]
+                    _pin_info += f" [API: {account['nombre']}]"
+
+                    _paquete_display = f"{game_name} - {pkg_name}" if game_name else (pkg_name or f"Paquete {package_id}")
+
+                    conn.execute('''
+                        INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto, duracion_segundos)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (usuario_id, _nc, _pin_info, _tid, _paquete_display, -precio, _duration))
+
+                    _saldo_row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (usuario_id,)).fetchone()
+                    _saldo = float(_saldo_row['saldo']) if _saldo_row else 0.0
+                    insert_historial_compra(conn, usuario_id, precio, _paquete_display, _pin_info, 'compra',
+                                            _duration, _saldo + precio, _saldo)
+
+                    _record_whitelabel_profit(conn, usuario_id, game_type, package_id, precio, order_id)
+
+                    try:
+                        from app import update_monthly_spending
+                        update_monthly_spending(conn, usuario_id, precio)
+                    except Exception:
+                        pass
+                except Exception as e:
+                    logger.warning(f'[WL API] Error registrando transacción general order={order_id}: {e}')
 
         else:
-            # Reembolsar saldo
-            conn.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (precio, usuario_id))
-            conn.execute('''
+            # Reembolsar saldo solo si este worker es quien cierra la orden
+            cur = conn.execute('''
                 UPDATE api_orders
                 SET estado = 'fallida', error_msg = ?, duration_seconds = ?, redeemed_pin = ?,
-                    fecha_completada = CURRENT_TIMESTAMP
-                WHERE id = ?
+                    fecha_completada = CURRENT_TIMESTAMP, fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE id = ? AND estado = 'procesando'
             ''', (result.get('error', 'Error desconocido'), _duration, result.get('redeemed_pin', ''), order_id))
+            if cur.rowcount == 1:
+                conn.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (precio, usuario_id))
         conn.commit()
     except Exception as e:
         try:
@@ -867,7 +1259,7 @@ def _execute_recharge(order_id, game_type, package_id, player_id, player_id2,
     if not result.get('ok'):
         response['error'] = result.get('error', '')
 
-    return jsonify(response), status_code
+    return response, status_code
 
 
 def _execute_dynamic_script_recharge(order_id, package_id, player_id, provider_meta=None):
@@ -1042,6 +1434,149 @@ def api_v1_order_status(order_id):
     })
 
 
+# ---------------------------------------------------------------------------
+# POST /api/v1/orders/status  — consulta masiva
+# ---------------------------------------------------------------------------
+
+def _parse_bulk_id_list(value, cast):
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    parsed = []
+    for item in value:
+        try:
+            item = cast(item)
+        except (ValueError, TypeError):
+            continue
+        if item != '' and item not in parsed:
+            parsed.append(item)
+    return parsed
+
+
+def _rewind_cursor(updated_at):
+    """`since` que vuelve a cubrir los últimos WHITELABEL_BULK_STATUS_OVERLAP_SECONDS."""
+    try:
+        moment = datetime.fromisoformat(str(updated_at).strip())
+    except ValueError:
+        return str(updated_at)
+    moment = (moment - timedelta(seconds=WHITELABEL_BULK_STATUS_OVERLAP_SECONDS)).replace(microsecond=0, tzinfo=None)
+    return moment.isoformat(sep=' ')
+
+
+def _order_status_item(row):
+    item = _order_payload(row)['order']
+    item['updated_at'] = str(row['fecha_actualizacion']) if row.get('fecha_actualizacion') else item['created_at']
+    return item
+
+
+@bp.route('/api/v1/orders/status', methods=['POST'])
+@require_api_key
+def api_v1_orders_bulk_status():
+    """Consulta el estado de varias órdenes con una sola query.
+
+    Body JSON (una de las dos formas):
+        order_ids          (list[int]) - IDs de orden
+        external_order_ids (list[str]) - referencias de la web cliente
+      ó
+        since    (str) - fecha_actualizacion del último cursor; retorna solo órdenes cambiadas después
+        since_id (int) - Opcional, desempate del cursor (id de la última orden recibida)
+        limit    (int) - Opcional, máximo de órdenes por página
+
+    Con `since`, mientras has_more es true next_cursor avanza exacto. En la
+    última página retrocede WHITELABEL_BULK_STATUS_OVERLAP_SECONDS, así que el
+    siguiente sondeo puede repetir órdenes ya recibidas (el cliente deduplica
+    por id + updated_at). Así no se pierden las escritas por transacciones que
+    confirmaron después de fijar su fecha_actualizacion.
+    """
+    account = request._ws_account
+    data = request.get_json(silent=True) or {}
+
+    order_ids = _parse_bulk_id_list(data.get('order_ids'), int)
+    external_ids = _parse_bulk_id_list(data.get('external_order_ids'), lambda v: str(v).strip())
+    since = str(data.get('since') or '').strip()
+
+    try:
+        limit = int(data.get('limit') or WHITELABEL_BULK_STATUS_MAX)
+    except (ValueError, TypeError):
+        return jsonify({'ok': False, 'error': 'limit debe ser numérico'}), 400
+    limit = min(max(limit, 1), WHITELABEL_BULK_STATUS_MAX)
+
+    if len(order_ids) + len(external_ids) > WHITELABEL_BULK_STATUS_MAX:
+        return jsonify({
+            'ok': False,
+            'error': f'Máximo {WHITELABEL_BULK_STATUS_MAX} órdenes por consulta',
+        }), 400
+
+    if order_ids or external_ids:
+        clauses = []
+        params = [account['id']]
+        if order_ids:
+            clauses.append(f'id IN ({", ".join("?" for _ in order_ids)})')
+            params.extend(order_ids)
+        if external_ids:
+            clauses.append(f'external_order_id IN ({", ".join("?" for _ in external_ids)})')
+            params.extend(external_ids)
+        sql = f'SELECT * FROM api_orders WHERE account_id = ? AND ({" OR ".join(clauses)}) ORDER BY id'
+    elif since:
+        try:
+            since_id = int(data.get('since_id') or 0)
+        except (ValueError, TypeError):
+            return jsonify({'ok': False, 'error': 'since_id debe ser numérico'}), 400
+        sql = (
+            'SELECT * FROM api_orders WHERE account_id = ? '
+            'AND (fecha_actualizacion > ? OR (fecha_actualizacion = ? AND id > ?)) '
+            'ORDER BY fecha_actualizacion, id LIMIT ?'
+        )
+        params = [account['id'], since, since, since_id, limit]
+    else:
+        return jsonify({'ok': False, 'error': 'order_ids, external_order_ids o since requerido'}), 400
+
+    conn = _get_conn()
+    try:
+        rows = conn.execute(sql, tuple(params)).fetchall()
+    finally:
+        conn.close()
+
+    if order_ids or external_ids:
+        # Para external ids repetidos (reintentos) se devuelve la orden más reciente.
+        by_external = {}
+        orders = []
+        for row in rows:
+            ext = row['external_order_id'] or ''
+            if row['id'] in order_ids or not ext:
+                orders.append(row)
+            elif ext in external_ids:
+                by_external[ext] = row
+        seen = {r['id'] for r in orders}
+        orders.extend(r for r in by_external.values() if r['id'] not in seen)
+        found_ids = {r['id'] for r in orders}
+        found_ext = {r['external_order_id'] for r in orders}
+        return jsonify({
+            'ok': True,
+            'orders': [_order_status_item(r) for r in sorted(orders, key=lambda r: r['id'])],
+            'not_found': {
+                'order_ids': [oid for oid in order_ids if oid not in found_ids],
+                'external_order_ids': [ext for ext in external_ids if ext not in found_ext],
+            },
+        })
+
+    items = [_order_status_item(r) for r in rows]
+    has_more = len(items) >= limit
+    if has_more:
+        next_cursor = {'since': items[-1]['updated_at'], 'since_id': items[-1]['id']}
+    elif items:
+        next_cursor = {'since': _rewind_cursor(items[-1]['updated_at']), 'since_id': 0}
+    else:
+        next_cursor = {'since': since, 'since_id': since_id}
+    return jsonify({
+        'ok': True,
+        'orders': items,
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+    })
+
+
 # ---------------------------------------------------------------------------
 # GET /api/v1/order-status?external_order_id=XXX
 # ---------------------------------------------------------------------------
@@ -1228,9 +1763,9 @@ def admin_create_ws_account():
 
     try:
         conn.execute('''
-            INSERT INTO webservice_accounts (nombre, api_key, usuario_id, webhook_url)
-            VALUES (?, ?, ?, ?)
-        ''', (nombre, api_key, usuario_id, webhook_url))
+            INSERT INTO webservice_accounts (nombre, api_key, api_key_hash, usuario_id, webhook_url)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (nombre, mask_api_key(api_key), hash_api_key(api_key), usuario_id, webhook_url))
         conn.commit()
         flash(f'Cuenta API "{nombre}" creada. Key: {api_key}', 'success')
     except Exception as e:
@@ -1261,6 +1796,7 @@ def admin_toggle_ws_account(account_id):
                  (new_val, account_id))
     conn.commit()
     conn.close()
+    invalidate_api_key_cache(account_id)
 
     estado = 'activada' if new_val else 'desactivada'
     flash(f'Cuenta API #{account_id} {estado}.', 'success')
@@ -1282,10 +1818,11 @@ def admin_regenerate_ws_key(account_id):
         return redirect('/admin')
 
     new_key = _generate_api_key()
-    conn.execute('UPDATE webservice_accounts SET api_key = ?, fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = ?',
-                 (new_key, account_id))
+    conn.execute('UPDATE webservice_accounts SET api_key = ?, api_key_hash = ?, fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = ?',
+                 (mask_api_key(new_key), hash_api_key(new_key), account_id))
     conn.commit()
     conn.close()
+    invalidate_api_key_cache(account_id)
 
     flash(f'Nueva API Key para cuenta #{account_id}: {new_key}', 'success')
     return redirect('/admin')
@@ -1336,6 +1873,7 @@ def admin_update_ws_account(account_id):
         params.append(account_id)
         conn.execute(f'UPDATE webservice_accounts SET {", ".join(updates)} WHERE id = ?', params)
         conn.commit()
+        invalidate_api_key_cache(account_id)
         flash(f'Cuenta API #{account_id} actualizada.', 'success')
     conn.close()
     return redirect('/admin')
@@ -1352,6 +1890,7 @@ def admin_delete_ws_account(account_id):
     conn.execute('DELETE FROM webservice_accounts WHERE id = ?', (account_id,))
     conn.commit()
     conn.close()
+    invalidate_api_key_cache(account_id)
 
     flash(f'Cuenta API #{account_id} eliminada.', 'success')
     return redirect('/admin')
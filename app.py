@@ -5,7 +5,7 @@ def get_games_active():
     """Devuelve dict con flags de juegos activos segun tablas de precios."""
     flags = {'freefire': False, 'freefire_global': False, 'bloodstriker': False, 'freefire_id': False}
     try:
-        conn = get_db_connection()
+        conn = get_request_connection()
         flags['freefire'] = conn.execute("SELECT COUNT(1) FROM precios_paquetes WHERE activo = TRUE").fetchone()[0] > 0
         flags['freefire_global'] = conn.execute("SELECT COUNT(1) FROM precios_freefire_global WHERE activo = TRUE").fetchone()[0] > 0
         flags['bloodstriker'] = conn.execute("SELECT COUNT(1) FROM precios_bloodstriker WHERE activo = TRUE").fetchone()[0] > 0
@@ -18,11 +18,16 @@ def get_games_active():
 import logging
 logger = logging.getLogger(__name__)
 
-from flask import Flask, render_template, render_template_string, request, redirect, session, flash, jsonify
+from flask import Flask, render_template, render_template_string, request, redirect, session, flash, jsonify, send_file
 import json
 import csv
 import re
-from pg_compat import get_db_connection, get_db_connection_optimized, PgRow, table_exists as pg_table_exists
+from pg_compat import get_db_connection, get_db_connection_optimized, get_query_stats, load_schema_cache, PgRow, SqliteCursor, table_exists as pg_table_exists
+import pg_compat
+import metrics
+import request_db
+import request_profiler
+from request_db import get_request_connection
 import pytz
 from datetime import datetime
 import hashlib
@@ -32,7 +37,6 @@ import secrets
 from datetime import timedelta, datetime
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_mail import Mail, Message
 import threading
 import hmac as hmac_module
 import time as time_module
@@ -41,19 +45,46 @@ import socket
 import requests
 from pin_manager import create_pin_manager
 from pin_redeemer import PinRedeemResult, get_redeemer_config_from_db
-from redeem_hype_vps import redeem_pin_vps
+from redeem_hype_vps import (
+    VPS_TIMEOUT_S, get_redeem_job, job_result, notify_job_result, redeem_pin_vps, submit_redeem_job, vps_session,
+    wait_for_redeem_job,
+)
 from csrf_utils import csrf_protect, get_csrf_token
 from request_security import build_compat_csp, consume_rate_limit
+from circuit_breaker import CircuitOpenError, get_all_breaker_stats, get_breaker, is_server_error
+from binance_endpoints import BinanceUnavailable, EndpointSelector
 from contextlib import contextmanager
 from functools import lru_cache
 import random
 import string
 import zipfile
 import io
-from admin_stats import bp as admin_stats_bp
+from admin_stats import (
+    bp as admin_stats_bp, fold_closed_profit_days, init_profit_rollup_tables, insert_historial_compra,
+    invalidate_profit_catalog,
+)
 from dynamic_games import bp as dynamic_games_bp, get_all_dynamic_games as get_dynamic_games_list, sync_all_dynamic_games_prices
-from api_whitelabel import bp as whitelabel_bp, init_whitelabel_tables
+from api_whitelabel import (
+    bp as whitelabel_bp, add_async_queue_columns as add_whitelabel_async_queue_columns, init_whitelabel_tables,
+    get_account_by_api_key as get_whitelabel_account_by_api_key,
+    start_async_recharge_workers as start_whitelabel_async_workers,
+)
+from freefire_id_queue import (
+    FFID_REDEEM_MAX_ATTEMPTS,
+    FFID_REDEEM_QUEUE_ENABLED,
+    enqueue_redeem_job,
+    add_vps_job_columns as add_ffid_vps_job_columns,
+    find_vps_job as find_ffid_vps_job,
+    finish_job as finish_ffid_redeem_job,
+    init_freefire_id_queue_tables,
+    notify_new_job,
+    park_job_on_vps as park_ffid_job_on_vps,
+    start_redeem_workers,
+    take_vps_job as take_ffid_vps_job,
+)
+from schema_migrations import run_migrations as run_schema_migrations
 from update_monthly_spending import update_monthly_spending
+from aggregate_writer import increment_aggregate
 
 
 def _get_sqlite_database_path() -> str:
@@ -248,12 +279,14 @@ def _gameclub_post(endpoint_path: str, payload: dict):
             if proxies:
                 request_kwargs['proxies'] = proxies
             with _gameclub_ipv4_only(_gameclub_force_ipv4_enabled()):
-                res = session.post(url, **request_kwargs)
+                res = get_breaker('gameclub').call(session.post, url, is_failure=is_server_error, **request_kwargs)
         try:
             data = res.json()
         except Exception:
             data = {'code': res.status_code, 'message': res.text}
         return res, data
+    except CircuitOpenError as e:
+        return None, {'code': 503, 'message': f'GameClub no disponible temporalmente; reintenta en {e.retry_after}s'}
     except Exception as e:
         return None, {'code': 500, 'message': f'Error conectando a GameClub: {str(e)}'}
 
@@ -326,12 +359,14 @@ def _game_script_headers():
 def _game_script_request(method: str, endpoint_path: str, payload=None):
     url = f"{_game_script_base_url()}/{endpoint_path.lstrip('/')}"
     try:
-        response = requests.request(
+        response = get_breaker('game_script').call(
+            requests.request,
             method=method.upper(),
             url=url,
             json=payload,
             headers=_game_script_headers(),
             timeout=_game_script_timeout_seconds(),
+            is_failure=is_server_error,
         )
         try:
             data = response.json()
@@ -341,6 +376,8 @@ def _game_script_request(method: str, endpoint_path: str, payload=None):
                 'error': response.text or f'HTTP {response.status_code}'
             }
         return response, data
+    except CircuitOpenError as e:
+        return None, {'success': False, 'error': f'Game Script no disponible temporalmente; reintenta en {e.retry_after}s'}
     except Exception as e:
         return None, {'success': False, 'error': f'Error conectando al Game Script: {str(e)}'}
 
@@ -534,13 +571,32 @@ app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = app.config['MAIL_USERNAME']
 
-# Inicializar Flask-Mail
-mail = Mail(app)
+# Flask-Mail se carga en el primer envío, no en cada arranque de worker
+_mail = None
+
+def get_mail():
+    """Instancia de Flask-Mail creada bajo demanda."""
+    global _mail
+    if _mail is None:
+        from flask_mail import Mail
+        _mail = Mail(app)
+    return _mail
+
+def build_mail_message(*args, **kwargs):
+    """Crea un flask_mail.Message importando Flask-Mail bajo demanda."""
+    from flask_mail import Message
+    return Message(*args, **kwargs)
 
 # Registrar blueprint de estadísticas de administración
 app.register_blueprint(admin_stats_bp, url_prefix='/admin/stats')
 app.register_blueprint(dynamic_games_bp)
 app.register_blueprint(whitelabel_bp)
+# Una conexión a la base por request, cerrada en teardown (ver request_db)
+request_db.init_app(app)
+# Latencia por endpoint, tiempo de base y de proveedores en /metrics (ver metrics)
+metrics.init_app(app)
+# Perfilado cProfile de requests bajo demanda (ver request_profiler y /admin/api/profiler)
+request_profiler.init_app(app)
 
 @app.context_processor
 def inject_dynamic_games_menu():
@@ -567,26 +623,28 @@ def inject_csrf_token():
 # get_db_connection y get_db_connection_optimized vienen de pg_compat
 
 # ===== Helpers de persistencia de profit (legacy) =====
-def record_profit_for_transaction(conn, usuario_id, is_admin, juego, paquete_id, cantidad, precio_unitario, transaccion_id=None):
+def record_profit_for_transaction(conn, usuario_id, is_admin, juego, paquete_id, cantidad, precio_unitario, transaccion_id=None,
+                                  sin_ganancia=None, costo_unit=None):
+    """Ledger + agregado diario de la venta.
+
+    `sin_ganancia` y `costo_unit`, si se pasan (leídos de antemano), evitan las
+    dos lecturas y dejan solo escrituras. Ignora sus propios errores: no llamarla
+    dentro de conn.pipeline(), donde un fallo abortaría la compra en PostgreSQL.
+    """
     try:
         if is_admin:
             return
         # No registrar profit para cuentas marcadas sin_ganancia
-        sg = conn.execute('SELECT sin_ganancia FROM usuarios WHERE id = ?', (int(usuario_id),)).fetchone()
-        if sg and sg['sin_ganancia']:
+        if sin_ganancia is None:
+            sg = conn.execute('SELECT sin_ganancia FROM usuarios WHERE id = ?', (int(usuario_id),)).fetchone()
+            sin_ganancia = bool(sg and sg['sin_ganancia'])
+        if sin_ganancia:
             return
         if juego is None or paquete_id is None or cantidad is None or precio_unitario is None:
             return
         cur = conn.cursor()
-        # Buscar costo activo en precios_compra
-        row = cur.execute(
-            """
-            SELECT precio_compra FROM precios_compra
-            WHERE juego = ? AND paquete_id = ? AND activo = 1
-            """,
-            (juego, int(paquete_id))
-        ).fetchone()
-        costo_unit = float(row[0]) if row else 0.0
+        if costo_unit is None:
+            costo_unit = get_active_purchase_cost(conn, juego, paquete_id)
         precio_venta_unit = float(precio_unitario)
         profit_unit = round(precio_venta_unit - costo_unit, 6)
         total = round(profit_unit * int(cantidad), 6)
@@ -605,751 +663,751 @@ def record_profit_for_transaction(conn, usuario_id, is_admin, juego, paquete_id,
             day = datetime.now(tz).date().isoformat()
         except Exception:
             day = datetime.utcnow().date().isoformat()
-        existing = cur.execute("SELECT profit_total FROM profit_daily_aggregate WHERE day = ?", (day,)).fetchone()
-        if existing:
-            cur.execute(
-                "UPDATE profit_daily_aggregate SET profit_total = ?, updated_at = datetime('now') WHERE day = ?",
-                (round(float(existing[0]) + total, 6), day)
-            )
-        else:
-            cur.execute(
-                "INSERT INTO profit_daily_aggregate (day, profit_total) VALUES (?, ?)",
-                (day, total)
-            )
+        increment_aggregate(
+            conn, 'profit_daily_aggregate', {'day': day}, {'profit_total': total},
+            touch=('updated_at', "datetime('now')"),
+        )
     except Exception:
         # No interrumpir la compra por error de estadística
         pass
 
+def get_active_purchase_cost(conn, juego, paquete_id):
+    """Costo activo en precios_compra (0.0 si no hay), en la conexión dada."""
+    row = conn.execute(
+        """
+        SELECT precio_compra FROM precios_compra
+        WHERE juego = ? AND paquete_id = ? AND activo = 1
+        """,
+        (juego, int(paquete_id))
+    ).fetchone()
+    return float(row[0]) if row else 0.0
+
 def return_db_connection(conn):
     """Cierra la conexión (sin pool para evitar problemas de threading)"""
     conn.close()
 
 def init_db():
-    """Inicializa la base de datos con las tablas necesarias - Compatible con Render"""
+    """Inicializa la base de datos aplicando las migraciones pendientes - Compatible con Render
+
+    Con el esquema al día solo cuesta una consulta a schema_version; los pasos
+    pendientes los aplica un único proceso bajo advisory lock.
+    """
     conn = None
     try:
         conn = get_db_connection_optimized()
-        cursor = conn.cursor()
-        
-        # Tabla de usuarios
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre TEXT NOT NULL,
-                apellido TEXT NOT NULL,
-                telefono TEXT NOT NULL,
-                correo TEXT UNIQUE NOT NULL,
-                contraseña TEXT NOT NULL,
-                saldo REAL DEFAULT 0.0,
-                fecha_registro DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de transacciones
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transacciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                numero_control TEXT NOT NULL,
-                pin TEXT NOT NULL,
-                transaccion_id TEXT NOT NULL,
-                monto REAL DEFAULT 0.0,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        # Intentar agregar columna paquete_nombre si no existe (SQLite no soporta IF NOT EXISTS en ADD COLUMN)
-        try:
-            cursor.execute("ALTER TABLE transacciones ADD COLUMN paquete_nombre TEXT")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE transacciones ADD COLUMN duracion_segundos REAL")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE transacciones ADD COLUMN request_id TEXT")
-        except Exception:
-            pass
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS purchase_request_idempotency (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                endpoint TEXT NOT NULL,
-                request_id TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'processing',
-                response_payload TEXT,
-                transaccion_id TEXT,
-                numero_control TEXT,
-                fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-                UNIQUE(usuario_id, endpoint, request_id)
-            )
-        ''')
-        
-        # Tabla historial_compras: registro permanente independiente de transacciones
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS historial_compras (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                monto REAL NOT NULL,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                paquete_nombre TEXT,
-                pin TEXT,
-                tipo_evento TEXT DEFAULT 'compra',
-                duracion_segundos REAL,
-                saldo_antes REAL DEFAULT 0,
-                saldo_despues REAL DEFAULT 0,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_compras(fecha DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_usuario ON historial_compras(usuario_id, fecha DESC)')
-        
-        # Columna sin_ganancia: cuentas marcadas no generan profit, no suman a saldo activo, no compiten en top
-        try:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN sin_ganancia BOOLEAN DEFAULT FALSE")
-        except Exception:
-            pass
-
-        # Columna bono_activo: si True y recarga Binance >= 1000$, se aplica bono del 1.5%
-        try:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN bono_activo BOOLEAN DEFAULT FALSE")
-        except Exception:
-            pass
-    
-        # Tabla de pines de Free Fire LATAM
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pines_freefire (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                monto_id INTEGER NOT NULL,
-                pin_codigo TEXT NOT NULL,
-                usado BOOLEAN DEFAULT FALSE,
-                fecha_agregado DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_usado DATETIME NULL,
-                usuario_id INTEGER NULL,
-                batch_id TEXT NULL,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        
-        # Tabla de pines de Free Fire (nuevo juego)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pines_freefire_global (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                monto_id INTEGER NOT NULL,
-                pin_codigo TEXT NOT NULL,
-                usado BOOLEAN DEFAULT FALSE,
-                fecha_agregado DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_usado DATETIME NULL,
-                usuario_id INTEGER NULL,
-                batch_id TEXT NULL,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-
-        # Migración suave: agregar batch_id si la tabla existía antes
-        try:
-            cursor.execute("ALTER TABLE pines_freefire ADD COLUMN batch_id TEXT")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE pines_freefire_global ADD COLUMN batch_id TEXT")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE transacciones_freefire_id ADD COLUMN pin_codigo TEXT")
-        except Exception:
-            pass
-    
-        # Tabla de precios de Free Fire (nuevo juego)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS precios_freefire_global (
-                id INTEGER PRIMARY KEY,
-                nombre TEXT NOT NULL,
-                precio REAL NOT NULL,
-                descripcion TEXT NOT NULL,
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de precios de paquetes
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS precios_paquetes (
-                id INTEGER PRIMARY KEY,
-                nombre TEXT NOT NULL,
-                precio REAL NOT NULL,
-                descripcion TEXT NOT NULL,
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de precios de Blood Striker
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS precios_bloodstriker (
-                id INTEGER PRIMARY KEY,
-                nombre TEXT NOT NULL,
-                precio REAL NOT NULL,
-                descripcion TEXT NOT NULL,
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Migración: agregar columna gamepoint_package_id a precios_bloodstriker
-        try:
-            cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN gamepoint_package_id INTEGER DEFAULT NULL")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_key TEXT DEFAULT NULL")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_title TEXT DEFAULT NULL")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_price TEXT DEFAULT NULL")
-        except Exception:
-            pass
-        
-        # Tabla de transacciones de Blood Striker
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transacciones_bloodstriker (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                player_id TEXT NOT NULL,
-                paquete_id INTEGER NOT NULL,
-                numero_control TEXT NOT NULL,
-                transaccion_id TEXT NOT NULL,
-                monto REAL DEFAULT 0.0,
-                estado TEXT DEFAULT 'pendiente',
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_procesado DATETIME NULL,
-                admin_id INTEGER NULL,
-                notas TEXT NULL,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-                FOREIGN KEY (admin_id) REFERENCES usuarios (id)
-            )
-        ''')
-        
-        # Migración: agregar columna gamepoint_referenceno a transacciones_bloodstriker
-        try:
-            cursor.execute("ALTER TABLE transacciones_bloodstriker ADD COLUMN gamepoint_referenceno TEXT DEFAULT NULL")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE transacciones_bloodstriker ADD COLUMN request_id TEXT")
-        except Exception:
-            pass
-        
-        # Tabla de precios de Free Fire ID
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS precios_freefire_id (
-                id INTEGER PRIMARY KEY,
-                nombre TEXT NOT NULL,
-                precio REAL NOT NULL,
-                descripcion TEXT NOT NULL,
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de transacciones de Free Fire ID
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transacciones_freefire_id (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                player_id TEXT NOT NULL,
-                paquete_id INTEGER NOT NULL,
-                numero_control TEXT NOT NULL,
-                transaccion_id TEXT NOT NULL,
-                monto REAL DEFAULT 0.0,
-                estado TEXT DEFAULT 'pendiente',
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_procesado DATETIME NULL,
-                admin_id INTEGER NULL,
-                notas TEXT NULL,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-                FOREIGN KEY (admin_id) REFERENCES usuarios (id)
-            )
-        ''')
-        try:
-            cursor.execute("ALTER TABLE transacciones_freefire_id ADD COLUMN request_id TEXT")
-        except Exception:
-            pass
-        
-        # Tabla de configuración de fuentes de pines por monto
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS configuracion_fuentes_pines (
-                monto_id INTEGER PRIMARY KEY,
-                fuente TEXT NOT NULL DEFAULT 'local',
-                activo BOOLEAN DEFAULT TRUE,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                CHECK (fuente IN ('local', 'api_externa'))
-            )
-        ''')
-        
-        # Tabla de créditos de billetera
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS creditos_billetera (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                monto REAL DEFAULT 0.0,
-                saldo_anterior REAL DEFAULT 0.0,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                visto BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        
-        # Tabla de noticias
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS noticias (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                titulo TEXT NOT NULL,
-                contenido TEXT NOT NULL,
-                importante BOOLEAN DEFAULT FALSE,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Tabla para evitar re-importar el mismo archivo CSV por nombre
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admin_imported_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL UNIQUE,
-                imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de noticias vistas por usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS noticias_vistas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                noticia_id INTEGER,
-                fecha_vista DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-                FOREIGN KEY (noticia_id) REFERENCES noticias (id),
-                UNIQUE(usuario_id, noticia_id)
-            )
-        ''')
-        
-        # Tabla de notificaciones personalizadas
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER,
-                titulo TEXT NOT NULL,
-                mensaje TEXT NOT NULL,
-                tipo TEXT DEFAULT 'info',
-                visto BOOLEAN DEFAULT FALSE,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        
-        # Insertar configuración por defecto si no existe (todos en local)
-        cursor.execute('SELECT COUNT(*) FROM configuracion_fuentes_pines')
-        if cursor.fetchone()[0] == 0:
-            configuracion_default = [(i, 'local', True) for i in range(1, 10)]
-            cursor.executemany('''
-                INSERT INTO configuracion_fuentes_pines (monto_id, fuente, activo)
-                VALUES (?, ?, ?)
-            ''', configuracion_default)
-    
-        # Insertar precios por defecto si no existen
-        cursor.execute('SELECT COUNT(*) FROM precios_paquetes')
-        if cursor.fetchone()[0] == 0:
-            precios_default = [
-                (1, '110 💎', 0.66, '110 Diamantes Free Fire', True),
-                (2, '341 💎', 2.25, '341 Diamantes Free Fire', True),
-                (3, '572 💎', 3.66, '572 Diamantes Free Fire', True),
-                (4, '1.166 💎', 7.10, '1.166 Diamantes Free Fire', True),
-                (5, '2.376 💎', 14.44, '2.376 Diamantes Free Fire', True),
-                (6, '6.138 💎', 33.10, '6.138 Diamantes Free Fire', True),
-                (7, 'Tarjeta básica', 0.50, 'Tarjeta básica Free Fire', True),
-                (8, 'Tarjeta semanal', 1.55, 'Tarjeta semanal Free Fire', True),
-                (9, 'Tarjeta mensual', 7.10, 'Tarjeta mensual Free Fire', True)
-            ]
-            cursor.executemany('''
-                INSERT INTO precios_paquetes (id, nombre, precio, descripcion, activo)
-                VALUES (?, ?, ?, ?, ?)
-            ''', precios_default)
-        
-        # Insertar precios de Blood Striker por defecto si no existen
-        cursor.execute('SELECT COUNT(*) FROM precios_bloodstriker')
-        if cursor.fetchone()[0] == 0:
-            precios_bloodstriker = [
-                (1, '100+16 🪙', 0.82, '100+16 Monedas Blood Striker', True),
-                (2, '300+52 🪙', 2.60, '300+52 Monedas Blood Striker', True),
-                (3, '500+94 🪙', 4.30, '500+94 Monedas Blood Striker', True),
-                (4, '1,000+210 🪙', 8.65, '1,000+210 Monedas Blood Striker', True),
-                (5, '2,000+486 🪙', 17.30, '2,000+486 Monedas Blood Striker', True),
-                (6, '5,000+1,380 🪙', 43.15, '5,000+1,380 Monedas Blood Striker', True),
-                (7, 'Pase Elite 🎖️', 3.50, 'Pase Elite Blood Striker', True),
-                (8, 'Pase Elite (Plus) 🎖️', 8.00, 'Pase Elite Plus Blood Striker', True),
-                (9, 'Pase de Mejora 🔫', 1.85, 'Pase de Mejora Blood Striker', True),
-                (10, 'Cofre Camuflaje Ultra 💼', 0.50, 'Cofre Camuflaje Ultra Blood Striker', True)
-            ]
-            cursor.executemany('''
-                INSERT INTO precios_bloodstriker (id, nombre, precio, descripcion, activo)
-                VALUES (?, ?, ?, ?, ?)
-            ''', precios_bloodstriker)
-        
-        # Insertar precios de Free Fire Global por defecto si no existen
-        cursor.execute('SELECT COUNT(*) FROM precios_freefire_global')
-        if cursor.fetchone()[0] == 0:
-            precios_freefire_global = [
-                (1, '100+10 💎', 0.86, '100+10 Diamantes Free Fire', True),
-                (2, '310+31 💎', 2.90, '310+31 Diamantes Free Fire', True),
-                (3, '520+52 💎', 4.00, '520+52 Diamantes Free Fire', True),
-                (4, '1.060+106 💎', 7.75, '1.060+106 Diamantes Free Fire', True),
-                (5, '2.180+218 💎', 15.30, '2.180+218 Diamantes Free Fire', True),
-                (6, '5.600+560 💎', 38.00, '5.600+560 Diamantes Free Fire', True)
-            ]
-            cursor.executemany('''
-                INSERT INTO precios_freefire_global (id, nombre, precio, descripcion, activo)
-                VALUES (?, ?, ?, ?, ?)
-            ''', precios_freefire_global)
-        
-        # Insertar precios de Free Fire ID por defecto si no existen
-        cursor.execute('SELECT COUNT(*) FROM precios_freefire_id')
-        if cursor.fetchone()[0] == 0:
-            precios_freefire_id = [
-                (1, '100+10 💎', 0.90, '100+10 Diamantes Free Fire ID', True),
-                (2, '310+31 💎', 2.95, '310+31 Diamantes Free Fire ID', True),
-                (3, '520+52 💎', 4.10, '520+52 Diamantes Free Fire ID', True),
-                (4, '1.060+106 💎', 7.90, '1.060+106 Diamantes Free Fire ID', True),
-                (5, '2.180+218 💎', 15.50, '2.180+218 Diamantes Free Fire ID', True),
-                (6, '5.600+560 💎', 38.50, '5.600+560 Diamantes Free Fire ID', True)
-            ]
-            cursor.executemany('''
-                INSERT INTO precios_freefire_id (id, nombre, precio, descripcion, activo)
-                VALUES (?, ?, ?, ?, ?)
-            ''', precios_freefire_id)
-        
-        # Tabla de configuración del redeemer automático
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS configuracion_redeemer (
-                clave TEXT PRIMARY KEY,
-                valor TEXT NOT NULL,
-                fecha_actualizacion TEXT DEFAULT (datetime('now'))
-            )
-        ''')
-        
-        # Insertar configuración por defecto del redeemer si no existe
-        cursor.execute('SELECT COUNT(*) FROM configuracion_redeemer')
-        if cursor.fetchone()[0] == 0:
-            redeemer_defaults = [
-                ('nombre_completo', 'Usuario Revendedor'),
-                ('fecha_nacimiento', '01/01/1995'),
-                ('nacionalidad', 'Chile'),
-                ('url_base', 'https://redeem.hype.games/'),
-                ('headless', 'true'),
-                ('timeout_ms', '30000'),
-                ('auto_redeem', 'false'),
-            ]
-            cursor.executemany('''
-                INSERT INTO configuracion_redeemer (clave, valor) VALUES (?, ?)
-            ''', redeemer_defaults)
-        
-        # Tabla de precios de compra (legacy)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS precios_compra (
-                juego TEXT NOT NULL,
-                paquete_id INTEGER NOT NULL,
-                precio_compra REAL NOT NULL,
-                fecha_actualizacion TEXT DEFAULT (datetime('now')),
-                activo INTEGER DEFAULT 1,
-                UNIQUE(juego, paquete_id)
-            )
-        ''')
-
-        # Tabla de ledger de profit (legacy persistente)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS profit_ledger (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                juego TEXT NOT NULL,
-                paquete_id INTEGER NOT NULL,
-                cantidad INTEGER NOT NULL,
-                precio_venta_unit REAL NOT NULL,
-                costo_unit REAL NOT NULL,
-                profit_unit REAL NOT NULL,
-                profit_total REAL NOT NULL,
-                transaccion_id TEXT,
-                fecha TEXT DEFAULT (datetime('now'))
-            )
-        ''')
-
-        # Tabla de agregados diarios de profit (legacy persistente)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS profit_daily_aggregate (
-                day TEXT PRIMARY KEY,
-                profit_total REAL NOT NULL,
-                updated_at TEXT DEFAULT (datetime('now'))
-            )
-        ''')
-        
-        # Tabla de gastos mensuales por usuario (persistente para top clientes)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS monthly_user_spending (
-                usuario_id INTEGER NOT NULL,
-                year_month TEXT NOT NULL,
-                total_spent REAL NOT NULL DEFAULT 0.0,
-                purchases_count INTEGER NOT NULL DEFAULT 0,
-                updated_at TEXT DEFAULT (datetime('now')),
-                PRIMARY KEY (usuario_id, year_month)
-            )
-        ''')
-        
-        # Tabla de estadísticas de ventas semanales
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ventas_semanales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                juego TEXT NOT NULL,
-                paquete_id INTEGER NOT NULL,
-                paquete_nombre TEXT NOT NULL,
-                precio_venta REAL NOT NULL,
-                precio_compra REAL NOT NULL DEFAULT 0.0,
-                ganancia_unitaria REAL NOT NULL DEFAULT 0.0,
-                cantidad_vendida INTEGER NOT NULL DEFAULT 1,
-                ganancia_total REAL NOT NULL DEFAULT 0.0,
-                fecha_venta DATETIME DEFAULT CURRENT_TIMESTAMP,
-                semana_year TEXT NOT NULL,
-                CHECK (cantidad_vendida > 0)
-            )
-        ''')
-        
-        # Insertar precios de compra por defecto si no existen
-        cursor.execute('SELECT COUNT(*) FROM precios_compra')
-        if cursor.fetchone()[0] == 0:
-            precios_compra_default = [
-                # Free Fire LATAM
-                ('freefire_latam', 1, 0.59),  # 110 💎 - costo $0.59, venta $0.66
-                ('freefire_latam', 2, 2.00),  # 341 💎 - costo $2.00, venta $2.25
-                ('freefire_latam', 3, 3.20),  # 572 💎 - costo $3.20, venta $3.66
-                ('freefire_latam', 4, 6.50),  # 1.166 💎 - costo $6.50, venta $7.10
-                ('freefire_latam', 5, 13.00), # 2.376 💎 - costo $13.00, venta $14.44
-                ('freefire_latam', 6, 30.00), # 6.138 💎 - costo $30.00, venta $33.10
-                ('freefire_latam', 7, 0.40),  # Tarjeta básica - costo $0.40, venta $0.50
-                ('freefire_latam', 8, 1.30),  # Tarjeta semanal - costo $1.30, venta $1.55
-                ('freefire_latam', 9, 6.50),  # Tarjeta mensual - costo $6.50, venta $7.10
-                
-                # Free Fire Global
-                ('freefire_global', 1, 0.75), # 100+10 💎 - costo $0.75, venta $0.86
-                ('freefire_global', 2, 2.50), # 310+31 💎 - costo $2.50, venta $2.90
-                ('freefire_global', 3, 3.50), # 520+52 💎 - costo $3.50, venta $4.00
-                ('freefire_global', 4, 7.00), # 1.060+106 💎 - costo $7.00, venta $7.75
-                ('freefire_global', 5, 14.00), # 2.180+218 💎 - costo $14.00, venta $15.30
-                ('freefire_global', 6, 35.00), # 5.600+560 💎 - costo $35.00, venta $38.00
-                
-                # Blood Striker
-                ('bloodstriker', 1, 0.70),   # 100+16 🪙 - costo $0.70, venta $0.82
-                ('bloodstriker', 2, 2.30),   # 300+52 🪙 - costo $2.30, venta $2.60
-                ('bloodstriker', 3, 3.80),   # 500+94 🪙 - costo $3.80, venta $4.30
-                ('bloodstriker', 4, 7.80),   # 1,000+210 🪙 - costo $7.80, venta $8.65
-                ('bloodstriker', 5, 15.50),  # 2,000+486 🪙 - costo $15.50, venta $17.30
-                ('bloodstriker', 6, 39.00),  # 5,000+1,380 🪙 - costo $39.00, venta $43.15
-                ('bloodstriker', 7, 3.00),   # Pase Elite - costo $3.00, venta $3.50
-                ('bloodstriker', 8, 7.20),   # Pase Elite Plus - costo $7.20, venta $8.00
-                ('bloodstriker', 9, 1.60),   # Pase de Mejora - costo $1.60, venta $1.85
-                ('bloodstriker', 10, 0.40),  # Cofre Camuflaje - costo $0.40, venta $0.50
-            ]
-            cursor.executemany('''
-                INSERT INTO precios_compra (juego, paquete_id, precio_compra)
-                VALUES (?, ?, ?)
-            ''', precios_compra_default)
-    
-        # === Tablas para sistema de juegos dinámicos ===
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS juegos_dinamicos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre TEXT NOT NULL,
-                slug TEXT NOT NULL UNIQUE,
-                gamepoint_product_id INTEGER NOT NULL,
-                modo TEXT NOT NULL DEFAULT 'id',
-                color_tema TEXT DEFAULT '#a78bfa',
-                icono TEXT DEFAULT '🎮',
-                activo BOOLEAN DEFAULT FALSE,
-                campos_config TEXT DEFAULT '{}',
-                descripcion TEXT DEFAULT '',
-                ganancia_default REAL DEFAULT 0.10,
-                fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        dynamic_game_columns = [
-            ("modo", "TEXT NOT NULL DEFAULT 'id'"),
-            ("color_tema", "TEXT DEFAULT '#a78bfa'"),
-            ("icono", "TEXT DEFAULT '🎮'"),
-            ("activo", "BOOLEAN DEFAULT FALSE"),
-            ("campos_config", "TEXT DEFAULT '{}'"),
-            ("descripcion", "TEXT DEFAULT ''"),
-            ("ganancia_default", "REAL DEFAULT 0.10"),
-            ("fecha_creacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
-            ("fecha_actualizacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
-        ]
-        for column_name, column_sql in dynamic_game_columns:
-            try:
-                cursor.execute(f"ALTER TABLE juegos_dinamicos ADD COLUMN {column_name} {column_sql}")
-            except Exception:
-                pass
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS paquetes_dinamicos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                juego_id INTEGER NOT NULL,
-                nombre TEXT NOT NULL,
-                precio REAL NOT NULL,
-                descripcion TEXT DEFAULT '',
-                gamepoint_package_id INTEGER,
-                game_script_only BOOLEAN DEFAULT FALSE,
-                game_script_package_key TEXT DEFAULT NULL,
-                game_script_package_title TEXT DEFAULT NULL,
-                game_script_package_price TEXT DEFAULT NULL,
-                activo BOOLEAN DEFAULT TRUE,
-                orden INTEGER DEFAULT 0,
-                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (juego_id) REFERENCES juegos_dinamicos(id)
-            )
-        ''')
-
-        dynamic_package_columns = [
-            ("descripcion", "TEXT DEFAULT ''"),
-            ("gamepoint_package_id", "INTEGER"),
-            ("game_script_only", "BOOLEAN DEFAULT FALSE"),
-            ("game_script_package_key", "TEXT DEFAULT NULL"),
-            ("game_script_package_title", "TEXT DEFAULT NULL"),
-            ("game_script_package_price", "TEXT DEFAULT NULL"),
-            ("activo", "BOOLEAN DEFAULT TRUE"),
-            ("orden", "INTEGER DEFAULT 0"),
-            ("fecha_actualizacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
-        ]
-        for column_name, column_sql in dynamic_package_columns:
-            try:
-                cursor.execute(f"ALTER TABLE paquetes_dinamicos ADD COLUMN {column_name} {column_sql}")
-            except Exception:
-                pass
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transacciones_dinamicas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                juego_id INTEGER NOT NULL,
-                usuario_id INTEGER NOT NULL,
-                player_id TEXT,
-                player_id2 TEXT,
-                servidor TEXT,
-                paquete_id INTEGER NOT NULL,
-                numero_control TEXT NOT NULL,
-                transaccion_id TEXT NOT NULL,
-                monto REAL DEFAULT 0.0,
-                estado TEXT DEFAULT 'pendiente',
-                gamepoint_referenceno TEXT,
-                ingame_name TEXT,
-                pin_entregado TEXT,
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_procesado DATETIME,
-                notas TEXT,
-                FOREIGN KEY (juego_id) REFERENCES juegos_dinamicos(id),
-                FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
-                FOREIGN KEY (paquete_id) REFERENCES paquetes_dinamicos(id)
-            )
-        ''')
-        try:
-            cursor.execute("ALTER TABLE transacciones_dinamicas ADD COLUMN request_id TEXT")
-        except Exception:
-            pass
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_din_usuario ON transacciones_dinamicas(usuario_id, fecha DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_din_juego ON transacciones_dinamicas(juego_id, fecha DESC)')
-
-        # Tabla de log de recargas via API (Inefable Store)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_recharges_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                player_id TEXT NOT NULL,
-                package_id INTEGER NOT NULL,
-                success BOOLEAN NOT NULL,
-                player_name TEXT DEFAULT '',
-                error_msg TEXT DEFAULT '',
-                duration_seconds REAL DEFAULT 0,
-                game_name TEXT DEFAULT '',
-                package_name TEXT DEFAULT '',
-                fecha DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_log_fecha ON api_recharges_log(fecha DESC)')
-        # Migración: agregar columnas game_name y package_name si no existen
-        try:
-            cursor.execute("ALTER TABLE api_recharges_log ADD COLUMN game_name TEXT DEFAULT ''")
-        except Exception:
-            pass
-        try:
-            cursor.execute("ALTER TABLE api_recharges_log ADD COLUMN package_name TEXT DEFAULT ''")
-        except Exception:
-            pass
-
-        # Tablas para API de marca blanca (WebService accounts + órdenes)
-        init_whitelabel_tables(cursor)
-
-        # Crear índices optimizados para mejor rendimiento
-        create_optimized_indexes(cursor)
-        
-        conn.commit()
-        
+        applied = run_schema_migrations(conn, APP_SCHEMA_MIGRATIONS)
+        if applied:
+            print(f"[DB] Migraciones aplicadas: {applied}")
+        # Una consulta carga tablas y columnas para todos los table_exists del proceso
+        load_schema_cache(conn)
     except Exception as e:
         print(f"Error al inicializar la base de datos: {e}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
         raise e
     finally:
         if conn:
             return_db_connection(conn)
 
-def create_optimized_indexes(cursor):
-    """Crea índices optimizados para consultas frecuentes"""
-    indexes = [
-        'CREATE INDEX IF NOT EXISTS idx_usuarios_correo ON usuarios(correo)',
-        'CREATE INDEX IF NOT EXISTS idx_transacciones_usuario_fecha ON transacciones(usuario_id, fecha DESC)',
-        'CREATE INDEX IF NOT EXISTS idx_transacciones_fecha ON transacciones(fecha DESC)',
-        'CREATE UNIQUE INDEX IF NOT EXISTS idx_transacciones_usuario_request_id ON transacciones(usuario_id, request_id)',
-        'CREATE UNIQUE INDEX IF NOT EXISTS idx_ffid_usuario_request_id ON transacciones_freefire_id(usuario_id, request_id)',
-        'CREATE UNIQUE INDEX IF NOT EXISTS idx_tx_din_usuario_request_id ON transacciones_dinamicas(usuario_id, request_id)',
-        'CREATE UNIQUE INDEX IF NOT EXISTS idx_bs_usuario_request_id ON transacciones_bloodstriker(usuario_id, request_id)',
-        'CREATE INDEX IF NOT EXISTS idx_purchase_idempotency_lookup ON purchase_request_idempotency(usuario_id, endpoint, request_id)',
-        'CREATE INDEX IF NOT EXISTS idx_pines_monto_usado ON pines_freefire(monto_id, usado)',
-        'CREATE INDEX IF NOT EXISTS idx_pines_global_monto_usado ON pines_freefire_global(monto_id, usado)',
-        'CREATE INDEX IF NOT EXISTS idx_ventas_semanales_juego_semana ON ventas_semanales(juego, semana_year)',
-        'CREATE INDEX IF NOT EXISTS idx_precios_compra_juego_paquete ON precios_compra(juego, paquete_id, activo)',
-        'CREATE INDEX IF NOT EXISTS idx_bloodstriker_estado ON transacciones_bloodstriker(estado, fecha DESC)',
-        'CREATE INDEX IF NOT EXISTS idx_creditos_usuario_visto ON creditos_billetera(usuario_id, visto)',
-        "CREATE UNIQUE INDEX IF NOT EXISTS idx_recargas_binance_txid_unique ON recargas_binance(binance_transaction_id) WHERE binance_transaction_id IS NOT NULL",
-        'CREATE INDEX IF NOT EXISTS idx_noticias_fecha ON noticias(fecha DESC)'
-    ]
+def _migration_base_schema(cursor):
+    """Migración 1: tablas base (antiguo cuerpo de init_db)."""
+    # Tabla de usuarios
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            apellido TEXT NOT NULL,
+            telefono TEXT NOT NULL,
+            correo TEXT UNIQUE NOT NULL,
+            contraseña TEXT NOT NULL,
+            saldo REAL DEFAULT 0.0,
+            fecha_registro DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
     
-    for index_sql in indexes:
-        try:
-            cursor.execute(index_sql)
-        except Exception as e:
-            print(f"Error creando índice: {e}")
-
-# Cache en memoria para datos frecuentes
-@lru_cache(maxsize=128)
-def get_package_info_with_prices_cached():
-    """Versión cacheada de información de paquetes Free Fire LATAM"""
-    conn = get_db_connection_optimized()
+    # Tabla de transacciones
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transacciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            numero_control TEXT NOT NULL,
+            pin TEXT NOT NULL,
+            transaccion_id TEXT NOT NULL,
+            monto REAL DEFAULT 0.0,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    # Intentar agregar columna paquete_nombre si no existe (SQLite no soporta IF NOT EXISTS en ADD COLUMN)
     try:
-        packages = conn.execute('''
+        cursor.execute("ALTER TABLE transacciones ADD COLUMN paquete_nombre TEXT")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE transacciones ADD COLUMN duracion_segundos REAL")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE transacciones ADD COLUMN request_id TEXT")
+    except Exception:
+        pass
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_request_idempotency (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            endpoint TEXT NOT NULL,
+            request_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'processing',
+            response_payload TEXT,
+            transaccion_id TEXT,
+            numero_control TEXT,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            UNIQUE(usuario_id, endpoint, request_id)
+        )
+    ''')
+    
+    # Tabla historial_compras: registro permanente independiente de transacciones
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historial_compras (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            monto REAL NOT NULL,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            paquete_nombre TEXT,
+            pin TEXT,
+            tipo_evento TEXT DEFAULT 'compra',
+            duracion_segundos REAL,
+            saldo_antes REAL DEFAULT 0,
+            saldo_despues REAL DEFAULT 0,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_compras(fecha DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_usuario ON historial_compras(usuario_id, fecha DESC)')
+    
+    # Columna sin_ganancia: cuentas marcadas no generan profit, no suman a saldo activo, no compiten en top
+    try:
+        cursor.execute("ALTER TABLE usuarios ADD COLUMN sin_ganancia BOOLEAN DEFAULT FALSE")
+    except Exception:
+        pass
+
+    # Columna bono_activo: si True y recarga Binance >= 1000$, se aplica bono del 1.5%
+    try:
+        cursor.execute("ALTER TABLE usuarios ADD COLUMN bono_activo BOOLEAN DEFAULT FALSE")
+    except Exception:
+        pass
+
+    # Tabla de pines de Free Fire LATAM
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pines_freefire (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            monto_id INTEGER NOT NULL,
+            pin_codigo TEXT NOT NULL,
+            usado BOOLEAN DEFAULT FALSE,
+            fecha_agregado DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_usado DATETIME NULL,
+            usuario_id INTEGER NULL,
+            batch_id TEXT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Tabla de pines de Free Fire (nuevo juego)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pines_freefire_global (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            monto_id INTEGER NOT NULL,
+            pin_codigo TEXT NOT NULL,
+            usado BOOLEAN DEFAULT FALSE,
+            fecha_agregado DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_usado DATETIME NULL,
+            usuario_id INTEGER NULL,
+            batch_id TEXT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+
+    # Migración suave: agregar batch_id si la tabla existía antes
+    try:
+        cursor.execute("ALTER TABLE pines_freefire ADD COLUMN batch_id TEXT")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE pines_freefire_global ADD COLUMN batch_id TEXT")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE transacciones_freefire_id ADD COLUMN pin_codigo TEXT")
+    except Exception:
+        pass
+
+    # Tabla de precios de Free Fire (nuevo juego)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precios_freefire_global (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            descripcion TEXT NOT NULL,
+            activo BOOLEAN DEFAULT TRUE,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de precios de paquetes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precios_paquetes (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            descripcion TEXT NOT NULL,
+            activo BOOLEAN DEFAULT TRUE,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de precios de Blood Striker
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precios_bloodstriker (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            descripcion TEXT NOT NULL,
+            activo BOOLEAN DEFAULT TRUE,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Migración: agregar columna gamepoint_package_id a precios_bloodstriker
+    try:
+        cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN gamepoint_package_id INTEGER DEFAULT NULL")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_key TEXT DEFAULT NULL")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_title TEXT DEFAULT NULL")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE precios_bloodstriker ADD COLUMN game_script_package_price TEXT DEFAULT NULL")
+    except Exception:
+        pass
+    
+    # Tabla de transacciones de Blood Striker
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transacciones_bloodstriker (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            player_id TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            numero_control TEXT NOT NULL,
+            transaccion_id TEXT NOT NULL,
+            monto REAL DEFAULT 0.0,
+            estado TEXT DEFAULT 'pendiente',
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_procesado DATETIME NULL,
+            admin_id INTEGER NULL,
+            notas TEXT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (admin_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Migración: agregar columna gamepoint_referenceno a transacciones_bloodstriker
+    try:
+        cursor.execute("ALTER TABLE transacciones_bloodstriker ADD COLUMN gamepoint_referenceno TEXT DEFAULT NULL")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE transacciones_bloodstriker ADD COLUMN request_id TEXT")
+    except Exception:
+        pass
+    
+    # Tabla de precios de Free Fire ID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precios_freefire_id (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            descripcion TEXT NOT NULL,
+            activo BOOLEAN DEFAULT TRUE,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de transacciones de Free Fire ID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transacciones_freefire_id (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            player_id TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            numero_control TEXT NOT NULL,
+            transaccion_id TEXT NOT NULL,
+            monto REAL DEFAULT 0.0,
+            estado TEXT DEFAULT 'pendiente',
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_procesado DATETIME NULL,
+            admin_id INTEGER NULL,
+            notas TEXT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (admin_id) REFERENCES usuarios (id)
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE transacciones_freefire_id ADD COLUMN request_id TEXT")
+    except Exception:
+        pass
+    
+    # Tabla de configuración de fuentes de pines por monto
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS configuracion_fuentes_pines (
+            monto_id INTEGER PRIMARY KEY,
+            fuente TEXT NOT NULL DEFAULT 'local',
+            activo BOOLEAN DEFAULT TRUE,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            CHECK (fuente IN ('local', 'api_externa'))
+        )
+    ''')
+    
+    # Tabla de créditos de billetera
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS creditos_billetera (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            monto REAL DEFAULT 0.0,
+            saldo_anterior REAL DEFAULT 0.0,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            visto BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Tabla de noticias
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS noticias (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            contenido TEXT NOT NULL,
+            importante BOOLEAN DEFAULT FALSE,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabla para evitar re-importar el mismo archivo CSV por nombre
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin_imported_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL UNIQUE,
+            imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de noticias vistas por usuario
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS noticias_vistas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            noticia_id INTEGER,
+            fecha_vista DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (noticia_id) REFERENCES noticias (id),
+            UNIQUE(usuario_id, noticia_id)
+        )
+    ''')
+    
+    # Tabla de notificaciones personalizadas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            titulo TEXT NOT NULL,
+            mensaje TEXT NOT NULL,
+            tipo TEXT DEFAULT 'info',
+            visto BOOLEAN DEFAULT FALSE,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Insertar configuración por defecto si no existe (todos en local)
+    cursor.execute('SELECT COUNT(*) FROM configuracion_fuentes_pines')
+    if cursor.fetchone()[0] == 0:
+        configuracion_default = [(i, 'local', True) for i in range(1, 10)]
+        cursor.executemany('''
+            INSERT INTO configuracion_fuentes_pines (monto_id, fuente, activo)
+            VALUES (?, ?, ?)
+        ''', configuracion_default)
+
+    # Insertar precios por defecto si no existen
+    cursor.execute('SELECT COUNT(*) FROM precios_paquetes')
+    if cursor.fetchone()[0] == 0:
+        precios_default = [
+            (1, '110 💎', 0.66, '110 Diamantes Free Fire', True),
+            (2, '341 💎', 2.25, '341 Diamantes Free Fire', True),
+            (3, '572 💎', 3.66, '572 Diamantes Free Fire', True),
+            (4, '1.166 💎', 7.10, '1.166 Diamantes Free Fire', True),
+            (5, '2.376 💎', 14.44, '2.376 Diamantes Free Fire', True),
+            (6, '6.138 💎', 33.10, '6.138 Diamantes Free Fire', True),
+            (7, 'Tarjeta básica', 0.50, 'Tarjeta básica Free Fire', True),
+            (8, 'Tarjeta semanal', 1.55, 'Tarjeta semanal Free Fire', True),
+            (9, 'Tarjeta mensual', 7.10, 'Tarjeta mensual Free Fire', True)
+        ]
+        cursor.executemany('''
+            INSERT INTO precios_paquetes (id, nombre, precio, descripcion, activo)
+            VALUES (?, ?, ?, ?, ?)
+        ''', precios_default)
+    
+    # Insertar precios de Blood Striker por defecto si no existen
+    cursor.execute('SELECT COUNT(*) FROM precios_bloodstriker')
+    if cursor.fetchone()[0] == 0:
+        precios_bloodstriker = [
+            (1, '100+16 🪙', 0.82, '100+16 Monedas Blood Striker', True),
+            (2, '300+52 🪙', 2.60, '300+52 Monedas Blood Striker', True),
+            (3, '500+94 🪙', 4.30, '500+94 Monedas Blood Striker', True),
+            (4, '1,000+210 🪙', 8.65, '1,000+210 Monedas Blood Striker', True),
+            (5, '2,000+486 🪙', 17.30, '2,000+486 Monedas Blood Striker', True),
+            (6, '5,000+1,380 🪙', 43.15, '5,000+1,380 Monedas Blood Striker', True),
+            (7, 'Pase Elite 🎖️', 3.50, 'Pase Elite Blood Striker', True),
+            (8, 'Pase Elite (Plus) 🎖️', 8.00, 'Pase Elite Plus Blood Striker', True),
+            (9, 'Pase de Mejora 🔫', 1.85, 'Pase de Mejora Blood Striker', True),
+            (10, 'Cofre Camuflaje Ultra 💼', 0.50, 'Cofre Camuflaje Ultra Blood Striker', True)
+        ]
+        cursor.executemany('''
+            INSERT INTO precios_bloodstriker (id, nombre, precio, descripcion, activo)
+            VALUES (?, ?, ?, ?, ?)
+        ''', precios_bloodstriker)
+    
+    # Insertar precios de Free Fire Global por defecto si no existen
+    cursor.execute('SELECT COUNT(*) FROM precios_freefire_global')
+    if cursor.fetchone()[0] == 0:
+        precios_freefire_global = [
+            (1, '100+10 💎', 0.86, '100+10 Diamantes Free Fire', True),
+            (2, '310+31 💎', 2.90, '310+31 Diamantes Free Fire', True),
+            (3, '520+52 💎', 4.00, '520+52 Diamantes Free Fire', True),
+            (4, '1.060+106 💎', 7.75, '1.060+106 Diamantes Free Fire', True),
+            (5, '2.180+218 💎', 15.30, '2.180+218 Diamantes Free Fire', True),
+            (6, '5.600+560 💎', 38.00, '5.600+560 Diamantes Free Fire', True)
+        ]
+        cursor.executemany('''
+            INSERT INTO precios_freefire_global (id, nombre, precio, descripcion, activo)
+            VALUES (?, ?, ?, ?, ?)
+        ''', precios_freefire_global)
+    
+    # Insertar precios de Free Fire ID por defecto si no existen
+    cursor.execute('SELECT COUNT(*) FROM precios_freefire_id')
+    if cursor.fetchone()[0] == 0:
+        precios_freefire_id = [
+            (1, '100+10 💎', 0.90, '100+10 Diamantes Free Fire ID', True),
+            (2, '310+31 💎', 2.95, '310+31 Diamantes Free Fire ID', True),
+            (3, '520+52 💎', 4.10, '520+52 Diamantes Free Fire ID', True),
+            (4, '1.060+106 💎', 7.90, '1.060+106 Diamantes Free Fire ID', True),
+            (5, '2.180+218 💎', 15.50, '2.180+218 Diamantes Free Fire ID', True),
+            (6, '5.600+560 💎', 38.50, '5.600+560 Diamantes Free Fire ID', True)
+        ]
+        cursor.executemany('''
+            INSERT INTO precios_freefire_id (id, nombre, precio, descripcion, activo)
+            VALUES (?, ?, ?, ?, ?)
+        ''', precios_freefire_id)
+    
+    # Tabla de configuración del redeemer automático
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS configuracion_redeemer (
+            clave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL,
+            fecha_actualizacion TEXT DEFAULT (datetime('now'))
+        )
+    ''')
+    
+    # Insertar configuración por defecto del redeemer si no existe
+    cursor.execute('SELECT COUNT(*) FROM configuracion_redeemer')
+    if cursor.fetchone()[0] == 0:
+        redeemer_defaults = [
+            ('nombre_completo', 'Usuario Revendedor'),
+            ('fecha_nacimiento', '01/01/1995'),
+            ('nacionalidad', 'Chile'),
+            ('url_base', 'https://redeem.hype.games/'),
+            ('headless', 'true'),
+            ('timeout_ms', '30000'),
+            ('auto_redeem', 'false'),
+        ]
+        cursor.executemany('''
+            INSERT INTO configuracion_redeemer (clave, valor) VALUES (?, ?)
+        ''', redeemer_defaults)
+    
+    # Tabla de precios de compra (legacy)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precios_compra (
+            juego TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            precio_compra REAL NOT NULL,
+            fecha_actualizacion TEXT DEFAULT (datetime('now')),
+            activo INTEGER DEFAULT 1,
+            UNIQUE(juego, paquete_id)
+        )
+    ''')
+
+    # Tabla de ledger de profit (legacy persistente)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            juego TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            precio_venta_unit REAL NOT NULL,
+            costo_unit REAL NOT NULL,
+            profit_unit REAL NOT NULL,
+            profit_total REAL NOT NULL,
+            transaccion_id TEXT,
+            fecha TEXT DEFAULT (datetime('now'))
+        )
+    ''')
+
+    # Tabla de agregados diarios de profit (legacy persistente)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_daily_aggregate (
+            day TEXT PRIMARY KEY,
+            profit_total REAL NOT NULL,
+            updated_at TEXT DEFAULT (datetime('now'))
+        )
+    ''')
+    
+    # Tabla de gastos mensuales por usuario (persistente para top clientes)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_user_spending (
+            usuario_id INTEGER NOT NULL,
+            year_month TEXT NOT NULL,
+            total_spent REAL NOT NULL DEFAULT 0.0,
+            purchases_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (usuario_id, year_month)
+        )
+    ''')
+    
+    # Tabla de estadísticas de ventas semanales
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas_semanales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            juego TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            paquete_nombre TEXT NOT NULL,
+            precio_venta REAL NOT NULL,
+            precio_compra REAL NOT NULL DEFAULT 0.0,
+            ganancia_unitaria REAL NOT NULL DEFAULT 0.0,
+            cantidad_vendida INTEGER NOT NULL DEFAULT 1,
+            ganancia_total REAL NOT NULL DEFAULT 0.0,
+            fecha_venta DATETIME DEFAULT CURRENT_TIMESTAMP,
+            semana_year TEXT NOT NULL,
+            CHECK (cantidad_vendida > 0)
+        )
+    ''')
+    
+    # Insertar precios de compra por defecto si no existen
+    cursor.execute('SELECT COUNT(*) FROM precios_compra')
+    if cursor.fetchone()[0] == 0:
+        precios_compra_default = [
+            # Free Fire LATAM
+            ('freefire_latam', 1, 0.59),  # 110 💎 - costo $0.59, venta $0.66
+            ('freefire_latam', 2, 2.00),  # 341 💎 - costo $2.00, venta $2.25
+            ('freefire_latam', 3, 3.20),  # 572 💎 - costo $3.20, venta $3.66
+            ('freefire_latam', 4, 6.50),  # 1.166 💎 - costo $6.50, venta $7.10
+            ('freefire_latam', 5, 13.00), # 2.376 💎 - costo $13.00, venta $14.44
+            ('freefire_latam', 6, 30.00), # 6.138 💎 - costo $30.00, venta $33.10
+            ('freefire_latam', 7, 0.40),  # Tarjeta básica - costo $0.40, venta $0.50
+            ('freefire_latam', 8, 1.30),  # Tarjeta semanal - costo $1.30, venta $1.55
+            ('freefire_latam', 9, 6.50),  # Tarjeta mensual - costo $6.50, venta $7.10
+            
+            # Free Fire Global
+            ('freefire_global', 1, 0.75), # 100+10 💎 - costo $0.75, venta $0.86
+            ('freefire_global', 2, 2.50), # 310+31 💎 - costo $2.50, venta $2.90
+            ('freefire_global', 3, 3.50), # 520+52 💎 - costo $3.50, venta $4.00
+            ('freefire_global', 4, 7.00), # 1.060+106 💎 - costo $7.00, venta $7.75
+            ('freefire_global', 5, 14.00), # 2.180+218 💎 - costo $14.00, venta $15.30
+            ('freefire_global', 6, 35.00), # 5.600+560 💎 - costo $35.00, venta $38.00
+            
+            # Blood Striker
+            ('bloodstriker', 1, 0.70),   # 100+16 🪙 - costo $0.70, venta $0.82
+            ('bloodstriker', 2, 2.30),   # 300+52 🪙 - costo $2.30, venta $2.60
+            ('bloodstriker', 3, 3.80),   # 500+94 🪙 - costo $3.80, venta $4.30
+            ('bloodstriker', 4, 7.80),   # 1,000+210 🪙 - costo $7.80, venta $8.65
+            ('bloodstriker', 5, 15.50),  # 2,000+486 🪙 - costo $15.50, venta $17.30
+            ('bloodstriker', 6, 39.00),  # 5,000+1,380 🪙 - costo $39.00, venta $43.15
+            ('bloodstriker', 7, 3.00),   # Pase Elite - costo $3.00, venta $3.50
+            ('bloodstriker', 8, 7.20),   # Pase Elite Plus - costo $7.20, venta $8.00
+            ('bloodstriker', 9, 1.60),   # Pase de Mejora - costo $1.60, venta $1.85
+            ('bloodstriker', 10, 0.40),  # Cofre Camuflaje - costo $0.40, venta $0.50
+        ]
+        cursor.executemany('''
+            INSERT INTO precios_compra (juego, paquete_id, precio_compra)
+            VALUES (?, ?, ?)
+        ''', precios_compra_default)
+
+    # === Tablas para sistema de juegos dinámicos ===
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS juegos_dinamicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            slug TEXT NOT NULL UNIQUE,
+            gamepoint_product_id INTEGER NOT NULL,
+            modo TEXT NOT NULL DEFAULT 'id',
+            color_tema TEXT DEFAULT '#a78bfa',
+            icono TEXT DEFAULT '🎮',
+            activo BOOLEAN DEFAULT FALSE,
+            campos_config TEXT DEFAULT '{}',
+            descripcion TEXT DEFAULT '',
+            ganancia_default REAL DEFAULT 0.10,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    dynamic_game_columns = [
+        ("modo", "TEXT NOT NULL DEFAULT 'id'"),
+        ("color_tema", "TEXT DEFAULT '#a78bfa'"),
+        ("icono", "TEXT DEFAULT '🎮'"),
+        ("activo", "BOOLEAN DEFAULT FALSE"),
+        ("campos_config", "TEXT DEFAULT '{}'"),
+        ("descripcion", "TEXT DEFAULT ''"),
+        ("ganancia_default", "REAL DEFAULT 0.10"),
+        ("fecha_creacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+        ("fecha_actualizacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+    ]
+    for column_name, column_sql in dynamic_game_columns:
+        try:
+            cursor.execute(f"ALTER TABLE juegos_dinamicos ADD COLUMN {column_name} {column_sql}")
+        except Exception:
+            pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paquetes_dinamicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            juego_id INTEGER NOT NULL,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            descripcion TEXT DEFAULT '',
+            gamepoint_package_id INTEGER,
+            game_script_only BOOLEAN DEFAULT FALSE,
+            game_script_package_key TEXT DEFAULT NULL,
+            game_script_package_title TEXT DEFAULT NULL,
+            game_script_package_price TEXT DEFAULT NULL,
+            activo BOOLEAN DEFAULT TRUE,
+            orden INTEGER DEFAULT 0,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (juego_id) REFERENCES juegos_dinamicos(id)
+        )
+    ''')
+
+    dynamic_package_columns = [
+        ("descripcion", "TEXT DEFAULT ''"),
+        ("gamepoint_package_id", "INTEGER"),
+        ("game_script_only", "BOOLEAN DEFAULT FALSE"),
+        ("game_script_package_key", "TEXT DEFAULT NULL"),
+        ("game_script_package_title", "TEXT DEFAULT NULL"),
+        ("game_script_package_price", "TEXT DEFAULT NULL"),
+        ("activo", "BOOLEAN DEFAULT TRUE"),
+        ("orden", "INTEGER DEFAULT 0"),
+        ("fecha_actualizacion", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+    ]
+    for column_name, column_sql in dynamic_package_columns:
+        try:
+            cursor.execute(f"ALTER TABLE paquetes_dinamicos ADD COLUMN {column_name} {column_sql}")
+        except Exception:
+            pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transacciones_dinamicas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            juego_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            player_id TEXT,
+            player_id2 TEXT,
+            servidor TEXT,
+            paquete_id INTEGER NOT NULL,
+            numero_control TEXT NOT NULL,
+            transaccion_id TEXT NOT NULL,
+            monto REAL DEFAULT 0.0,
+            estado TEXT DEFAULT 'pendiente',
+            gamepoint_referenceno TEXT,
+            ingame_name TEXT,
+            pin_entregado TEXT,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_procesado DATETIME,
+            notas TEXT,
+            FOREIGN KEY (juego_id) REFERENCES juegos_dinamicos(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY (paquete_id) REFERENCES paquetes_dinamicos(id)
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE transacciones_dinamicas ADD COLUMN request_id TEXT")
+    except Exception:
+        pass
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_din_usuario ON transacciones_dinamicas(usuario_id, fecha DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_din_juego ON transacciones_dinamicas(juego_id, fecha DESC)')
+
+    # Tabla de log de recargas via API (Inefable Store)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_recharges_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id TEXT NOT NULL,
+            package_id INTEGER NOT NULL,
+            success BOOLEAN NOT NULL,
+            player_name TEXT DEFAULT '',
+            error_msg TEXT DEFAULT '',
+            duration_seconds REAL DEFAULT 0,
+            game_name TEXT DEFAULT '',
+            package_name TEXT DEFAULT '',
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_log_fecha ON api_recharges_log(fecha DESC)')
+    # Migración: agregar columnas game_name y package_name si no existen
+    try:
+        cursor.execute("ALTER TABLE api_recharges_log ADD COLUMN game_name TEXT DEFAULT ''")
+    except Exception:
+        pass
+    try:
+        cursor.execute("ALTER TABLE api_recharges_log ADD COLUMN package_name TEXT DEFAULT ''")
+    except Exception:
+        pass
+
+def create_optimized_indexes(cursor):
+    """Crea índices optimizados para consultas frecuentes"""
+    indexes = [
+        'CREATE INDEX IF NOT EXISTS idx_usuarios_correo ON usuarios(correo)',
+        'CREATE INDEX IF NOT EXISTS idx_transacciones_usuario_fecha ON transacciones(usuario_id, fecha DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_transacciones_fecha ON transacciones(fecha DESC)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_transacciones_usuario_request_id ON transacciones(usuario_id, request_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_ffid_usuario_request_id ON transacciones_freefire_id(usuario_id, request_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_tx_din_usuario_request_id ON transacciones_dinamicas(usuario_id, request_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_bs_usuario_request_id ON transacciones_bloodstriker(usuario_id, request_id)',
+        'CREATE INDEX IF NOT EXISTS idx_purchase_idempotency_lookup ON purchase_request_idempotency(usuario_id, endpoint, request_id)',
+        'CREATE INDEX IF NOT EXISTS idx_pines_monto_usado ON pines_freefire(monto_id, usado)',
+        'CREATE INDEX IF NOT EXISTS idx_pines_global_monto_usado ON pines_freefire_global(monto_id, usado)',
+        'CREATE INDEX IF NOT EXISTS idx_ventas_semanales_juego_semana ON ventas_semanales(juego, semana_year)',
+        'CREATE INDEX IF NOT EXISTS idx_precios_compra_juego_paquete ON precios_compra(juego, paquete_id, activo)',
+        'CREATE INDEX IF NOT EXISTS idx_bloodstriker_estado ON transacciones_bloodstriker(estado, fecha DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_creditos_usuario_visto ON creditos_billetera(usuario_id, visto)',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_recargas_binance_txid_unique ON recargas_binance(binance_transaction_id) WHERE binance_transaction_id IS NOT NULL",
+        'CREATE INDEX IF NOT EXISTS idx_noticias_fecha ON noticias(fecha DESC)'
+    ]
+    
+    for index_sql in indexes:
+        try:
+            cursor.execute(index_sql)
+        except Exception as e:
+            print(f"Error creando índice: {e}")
+
+# Cache en memoria para datos frecuentes
+@lru_cache(maxsize=128)
+def get_package_info_with_prices_cached():
+    """Versión cacheada de información de paquetes Free Fire LATAM"""
+    conn = get_db_connection_optimized()
+    try:
+        packages = conn.execute('''
             SELECT id, nombre, precio, descripcion 
             FROM precios_paquetes 
             WHERE activo = TRUE 
@@ -1419,6 +1477,7 @@ def clear_price_cache():
     get_bloodstriker_prices_cached.cache_clear()
     get_freefire_global_prices_cached.cache_clear()
     get_freefire_id_prices_cached.cache_clear()
+    invalidate_profit_catalog()
 
 @lru_cache(maxsize=1000)
 def convert_to_venezuela_time_cached(utc_datetime_str):
@@ -1485,13 +1544,12 @@ def verify_password(password, hashed):
 
 
 
-def registrar_historial_compra(conn_existente, usuario_id, monto, paquete_nombre, pin='', tipo_evento='compra', duracion_segundos=None, saldo_antes=0, saldo_despues=0):
+def registrar_historial_compra(conn_existente, usuario_id, monto, paquete_nombre, pin='', tipo_evento='compra', duracion_segundos=None, saldo_antes=0, saldo_despues=0, user=None):
     """Registra una compra en el historial permanente (no se borra con transacciones). Usa la conexión existente para evitar bloqueo."""
     try:
-        conn_existente.execute('''
-            INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues))
+        # Las compras se guardan con su ganancia ya atribuida (ver admin_stats.insert_historial_compra)
+        insert_historial_compra(conn_existente, usuario_id, monto, paquete_nombre, pin, tipo_evento,
+                                duracion_segundos, saldo_antes, saldo_despues, user=user)
     except Exception as e:
         logger.error(f"Error registrando historial_compra: {e}")
 
@@ -1541,7 +1599,7 @@ def create_user(nombre, apellido, telefono, correo, contraseña):
 
 def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
     """Obtiene las transacciones de un usuario con información del paquete y paginación"""
-    conn = get_db_connection()
+    conn = get_request_connection()
     
     # Calcular offset para paginación
     offset = (page - 1) * per_page
@@ -1611,7 +1669,7 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
                     transaction_dict['player_name'] = m_name.group(1).strip()
 
                 try:
-                    c_ffid = get_db_connection()
+                    c_ffid = get_request_connection()
                     try:
                         row_ffid = c_ffid.execute(
                             'SELECT pin_codigo, estado, notas FROM transacciones_freefire_id WHERE transaccion_id = ? LIMIT 1',
@@ -1638,7 +1696,7 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
 
                 if api_order_id is not None:
                     try:
-                        c_api = get_db_connection()
+                        c_api = get_request_connection()
                         try:
                             row_api = c_api.execute(
                                 'SELECT game_type, player_id, player_name, redeemed_pin, estado, error_msg, reference_no FROM api_orders WHERE id = ? LIMIT 1',
@@ -1690,7 +1748,7 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
                 transaction_dict['juego_nombre'] = raw_pkg.split(' - ')[0].strip() if ' - ' in raw_pkg else raw_pkg
 
                 try:
-                    c_dg = get_db_connection()
+                    c_dg = get_request_connection()
                     try:
                         row_dg = c_dg.execute(
                             '''SELECT td.player_id, td.player_id2, td.ingame_name, td.pin_entregado,
@@ -1771,7 +1829,7 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
             cantidad_pines = len(pins_list)
             pin_sample = pins_list[0] if pins_list else None
             if pin_sample:
-                c2 = get_db_connection()
+                c2 = get_request_connection()
                 try:
                     row_latam = c2.execute('SELECT monto_id FROM pines_freefire WHERE pin_codigo = ? LIMIT 1', (pin_sample,)).fetchone()
                     row_global = None if row_latam else c2.execute('SELECT monto_id FROM pines_freefire_global WHERE pin_codigo = ? LIMIT 1', (pin_sample,)).fetchone()
@@ -1796,7 +1854,7 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
         # 2) Blood Striker: resolver por transaccion_id -> paquete_id (nombre exacto de precios)
         if not paquete_encontrado:
             try:
-                c3 = get_db_connection()
+                c3 = get_request_connection()
                 try:
                     row_bs = c3.execute('SELECT paquete_id FROM transacciones_bloodstriker WHERE transaccion_id = ? LIMIT 1', (transaction_dict.get('transaccion_id'),)).fetchone()
                 finally:
@@ -1841,7 +1899,6 @@ def get_user_transactions(user_id, is_admin=False, page=1, per_page=10):
 def get_user_wallet_credits(user_id):
     """Obtiene los créditos de billetera de un usuario"""
     conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
     
     credits = conn.execute('''
         SELECT * FROM creditos_billetera 
@@ -1851,9 +1908,9 @@ def get_user_wallet_credits(user_id):
     conn.close()
     return credits
 
-def _ensure_creditos_billetera_schema(conn):
-    """Garantiza columnas de compatibilidad y separa creditos manuales de Binance."""
-    conn.execute('''
+def _migration_creditos_billetera(cursor):
+    """Migración 4: columnas de compatibilidad y separación de créditos manuales vs Binance."""
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS creditos_billetera (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             usuario_id INTEGER,
@@ -1872,13 +1929,12 @@ def _ensure_creditos_billetera_schema(conn):
         "ALTER TABLE creditos_billetera ADD COLUMN origen TEXT DEFAULT 'manual'"
     ):
         try:
-            conn.execute(statement)
-            conn.commit()
+            cursor.execute(statement)
         except Exception:
             pass
 
     try:
-        conn.execute('''
+        cursor.execute('''
             UPDATE creditos_billetera
             SET origen = 'binance'
             WHERE COALESCE(origen, 'manual') != 'binance'
@@ -1891,7 +1947,6 @@ def _ensure_creditos_billetera_schema(conn):
                     AND ABS(strftime('%s', COALESCE(rb.fecha_completada, rb.fecha_creacion)) - strftime('%s', creditos_billetera.fecha)) <= 120
               )
         ''')
-        conn.commit()
     except Exception:
         pass
 
@@ -1912,7 +1967,6 @@ def _build_pagination(page, per_page, total):
 def get_user_wallet_credits_paginated(user_id, page=1, per_page=10):
     """Obtiene créditos manuales de billetera de un usuario con paginación."""
     conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
 
     total = conn.execute('''
         SELECT COUNT(*)
@@ -1939,7 +1993,6 @@ def get_user_wallet_credits_paginated(user_id, page=1, per_page=10):
 def get_all_wallet_credits():
     """Obtiene todos los créditos de billetera del sistema para el admin"""
     conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
     
     try:
         credits = conn.execute('''
@@ -1960,7 +2013,6 @@ def get_all_wallet_credits():
 def get_wallet_credits_stats():
     """Obtiene estadísticas de créditos de billetera para el admin"""
     conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
     
     try:
         # Total de créditos agregados
@@ -2002,8 +2054,7 @@ def get_wallet_credits_stats():
 
 def get_unread_wallet_credits_count(user_id):
     """Obtiene si hay créditos de billetera no vistos (retorna 1 si hay, 0 si no hay)"""
-    conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
+    conn = get_request_connection()
     
     count = conn.execute('''
         SELECT COUNT(*) FROM creditos_billetera 
@@ -2019,7 +2070,6 @@ def get_unread_wallet_credits_count(user_id):
 def mark_wallet_credits_as_read(user_id):
     """Marca todos los créditos de billetera como vistos"""
     conn = get_db_connection()
-    _ensure_creditos_billetera_schema(conn)
     
     conn.execute('''
         UPDATE creditos_billetera 
@@ -2040,9 +2090,6 @@ def api_unread_news():
     if not user_id:
         return jsonify({'news': []})
 
-    create_news_table()
-    create_news_views_table()
-
     conn = get_db_connection()
     rows = conn.execute('''
         SELECT n.id, n.titulo, n.contenido, n.importante, n.fecha, n.imagen_url
@@ -2069,9 +2116,6 @@ def api_dismiss_news(noticia_id):
     if not user_id:
         return jsonify({'status': 'error'}), 400
 
-    create_news_table()
-    create_news_views_table()
-
     conn = get_db_connection()
     try:
         conn.execute('''
@@ -2112,9 +2156,10 @@ BINANCE_API_ENDPOINTS = [
     'https://api.binance.com',
 ]
 
+_binance_selector = EndpointSelector(BINANCE_API_ENDPOINTS)
+
 def binance_get_pay_transactions(start_time=None, end_time=None, limit=100, req_timeout=None, total_timeout_override=None):
     """Consulta historial de transacciones de Binance Pay via GET /sapi/v1/pay/transactions"""
-    import requests as req_lib
     if not BINANCE_API_KEY or not BINANCE_API_SECRET:
         logger.error("Binance API keys no configuradas")
         return None
@@ -2127,6 +2172,7 @@ def binance_get_pay_transactions(start_time=None, end_time=None, limit=100, req_
     if end_time:
         params['endTime'] = str(int(end_time))  # ya viene en milisegundos
     
+    # Se firma una sola vez: la misma petición firmada sirve para cualquier host
     query_string = urllib.parse.urlencode(params)
     signature = binance_create_signature(query_string)
     params['signature'] = signature
@@ -2135,31 +2181,20 @@ def binance_get_pay_transactions(start_time=None, end_time=None, limit=100, req_
     proxies = {'https': BINANCE_PROXY, 'http': BINANCE_PROXY} if BINANCE_PROXY else None
     request_timeout = max(1.0, req_timeout or BINANCE_REQUEST_TIMEOUT_SECONDS)
     total_timeout = max(request_timeout, total_timeout_override or BINANCE_TOTAL_TIMEOUT_SECONDS)
-    started_at = time_module.monotonic()
     
-    last_error = None
-    for base_url in BINANCE_API_ENDPOINTS:
-        elapsed = time_module.monotonic() - started_at
-        if elapsed >= total_timeout:
-            logger.warning(f"Timeout total alcanzado consultando Binance Pay ({elapsed:.2f}s)")
-            break
-
-        url = f'{base_url}/sapi/v1/pay/transactions'
-        try:
-            resp = req_lib.get(url, params=params, headers=headers, timeout=request_timeout, proxies=proxies)
-            data = resp.json()
-            code = str(data.get('code', ''))
-            if code == '000000' or code == '0' or data.get('success') == True:
-                return data.get('data', [])
-            else:
-                logger.error(f"Binance Pay API error ({base_url}): {data}")
-                return None
-        except Exception as e:
-            last_error = e
-            logger.warning(f"Binance endpoint {base_url} falló: {type(e).__name__}")
-            continue
+    try:
+        base_url, data = _binance_selector.get_json(
+            '/sapi/v1/pay/transactions', params=params, headers=headers,
+            timeout=request_timeout, total_timeout=total_timeout, proxies=proxies,
+        )
+    except BinanceUnavailable as e:
+        logger.error(f"Todos los endpoints de Binance fallaron. {e}")
+        return None
     
-    logger.error(f"Todos los endpoints de Binance fallaron. Último error: {last_error}")
+    code = str(data.get('code', ''))
+    if code == '000000' or code == '0' or data.get('success') == True:
+        return data.get('data', [])
+    logger.error(f"Binance Pay API error ({base_url}): {data}")
     return None
 
 def generar_codigo_recarga():
@@ -2221,8 +2256,219 @@ def crear_orden_recarga(user_id, monto):
     finally:
         conn.close()
 
+BINANCE_TX_CACHE_SECONDS = max(float(os.environ.get('BINANCE_TX_CACHE_SECONDS', '10')), 0.0)
+BINANCE_TX_PAGE_LIMIT = 100  # máximo que acepta /sapi/v1/pay/transactions
+BINANCE_TX_MAX_PAGES = max(int(os.environ.get('BINANCE_TX_MAX_PAGES', '5')), 1)
+_RECARGA_CODIGO_RE = re.compile(r'REC-[A-Z0-9]{6}')
+
+# Última ventana consultada a Binance Pay (por proceso); sirve a las verificaciones manuales
+_binance_tx_window = {'start_ts': None, 'fetched_at': 0.0, 'transactions': None}
+_binance_tx_window_lock = threading.Lock()
+
+def _recarga_to_datetime(val):
+    if isinstance(val, datetime):
+        return val
+    if val is None:
+        return None
+    sval = str(val).strip()
+    if not sval:
+        return None
+    try:
+        # Formato legacy SQLite
+        return datetime.strptime(sval, '%Y-%m-%d %H:%M:%S')
+    except Exception:
+        try:
+            # ISO/otros formatos que psycopg pueda devolver serializados
+            return datetime.fromisoformat(sval.replace('Z', '+00:00')).replace(tzinfo=None)
+        except Exception:
+            return None
+
+def binance_fetch_transaction_window(start_ts, use_cache=False, **tx_kwargs):
+    """Transacciones de Binance Pay desde start_ts (ms), paginando hacia atrás por endTime.
+
+    Con use_cache=True reutiliza la última ventana si empieza en o antes de start_ts
+    y tiene menos de BINANCE_TX_CACHE_SECONDS. Una ventana truncada por
+    BINANCE_TX_MAX_PAGES se guarda con el inicio que realmente cubre (después
+    de la transacción más antigua leída), no con start_ts. Devuelve None si
+    Binance no respondió.
+    """
+    if use_cache and BINANCE_TX_CACHE_SECONDS > 0:
+        with _binance_tx_window_lock:
+            cached = dict(_binance_tx_window)
+        if (cached['transactions'] is not None and cached['start_ts'] <= start_ts
+                and time_module.monotonic() - cached['fetched_at'] < BINANCE_TX_CACHE_SECONDS):
+            return cached['transactions']
+
+    fetched_at = time_module.monotonic()
+    transactions = []
+    end_time = None
+    covered_from = start_ts
+    for _ in range(BINANCE_TX_MAX_PAGES):
+        page = binance_get_pay_transactions(start_time=start_ts, end_time=end_time, limit=BINANCE_TX_PAGE_LIMIT, **tx_kwargs)
+        if page is None:
+            # Una página intermedia fallida: lo ya leído es válido, pero no se cachea
+            return transactions or None
+        transactions.extend(page)
+        if len(page) < BINANCE_TX_PAGE_LIMIT:
+            break
+        oldest = min((int(tx.get('transactionTime') or 0) for tx in page), default=0)
+        if not oldest or oldest <= start_ts:
+            break
+        end_time = oldest - 1
+    else:
+        logger.warning(f"Ventana de Binance Pay truncada a {len(transactions)} transacciones (BINANCE_TX_MAX_PAGES={BINANCE_TX_MAX_PAGES})")
+        # Puede haber más transacciones en el mismo milisegundo que la más antigua
+        covered_from = oldest + 1
+
+    with _binance_tx_window_lock:
+        _binance_tx_window.update(start_ts=covered_from, fetched_at=fetched_at, transactions=transactions)
+    return transactions
+
+def _binance_tx_info(tx):
+    """Normaliza una transacción de Binance Pay (nota, monto USDT, tipo, id)."""
+    # La nota puede venir en distintos campos según la versión de la API
+    tx_note = str(tx.get('orderMemo') or tx.get('remark') or tx.get('note') or '').strip().upper()
+    
+    # El monto y currency vienen en fundsDetail (array) o directamente
+    tx_currency = ''
+    tx_amount = 0.0
+    funds = tx.get('fundsDetail') or []
+    if funds and isinstance(funds, list):
+        for f in funds:
+            if str(f.get('currency', '')).upper() == 'USDT':
+                tx_currency = 'USDT'
+                tx_amount = abs(float(f.get('amount', 0)))
+                break
+    if not tx_currency:
+        tx_currency = str(tx.get('currency', '')).upper()
+        tx_amount = abs(float(tx.get('amount', 0)))
+    
+    return {
+        'note': tx_note,
+        'amount': tx_amount,
+        'currency': tx_currency,
+        'order_type': str(tx.get('orderType', '')).upper(),
+        'transaction_id': str(tx.get('transactionId', '') or '').strip(),
+    }
+
+def index_binance_transactions(transactions):
+    """Indexa las transacciones por código de referencia (REC-XXXXXX) encontrado en la nota."""
+    index = {}
+    for tx in transactions:
+        info = _binance_tx_info(tx)
+        # Solo procesar transacciones recibidas - aceptar todos los tipos de ingreso
+        if info['order_type'] not in ('PAY', 'C2C', 'C2C_TRANSFER', 'CRYPTO_BOX', ''):
+            continue
+        for codigo in set(_RECARGA_CODIGO_RE.findall(info['note'])):
+            index.setdefault(codigo, []).append(info)
+    return index
+
+def _buscar_pago_recarga(recarga, index):
+    """Transacción del índice que paga la recarga (código + monto exacto en USDT), o None."""
+    codigo_ref = str(recarga['codigo_referencia']).upper()
+    monto_esperado = float(recarga['monto_unico'])
+    for info in index.get(codigo_ref, []):
+        logger.info(f"  TX: note='{info['note']}', amount={info['amount']}, currency={info['currency']}, orderType={info['order_type']}")
+        if abs(info['amount'] - monto_esperado) < 0.01 and info['currency'] == 'USDT':
+            if not info['transaction_id']:
+                logger.warning(f"Recarga {recarga['id']}: Binance devolvió una transacción sin transactionId; se omite para evitar doble acreditación")
+                continue
+            return info
+    return None
+
+def _acreditar_recarga_binance(recarga, tx_id):
+    """Marca la recarga como completada y acredita el saldo en una sola transacción."""
+    recarga_id = recarga['id']
+    usuario_id = recarga['usuario_id']
+    monto_esperado = float(recarga['monto_unico'])
+    bonus = 0.0
+    monto_total = monto_esperado
+    logger.info(f"  ¡Match encontrado! TX ID: {tx_id}")
+
+    conn2 = None
+    try:
+        # === Transacción atómica: idempotencia + bono + crédito ===
+        conn2 = get_db_connection()
+
+        # Verificar que no se haya procesado ya (idempotencia por binance_transaction_id)
+        ya_procesada = conn2.execute(
+            'SELECT 1 FROM recargas_binance WHERE binance_transaction_id = ? AND estado = ?',
+            (tx_id, 'completada')
+        ).fetchone()
+
+        if ya_procesada:
+            conn2.close()
+            return {'status': 'ya_procesada', 'message': 'Esta transacción ya fue procesada'}
+
+        # Calcular bono 1.5% si el usuario tiene bono_activo y monto >= 1000
+        try:
+            user_row = conn2.execute(
+                'SELECT bono_activo FROM usuarios WHERE id = ?', (usuario_id,)
+            ).fetchone()
+            if user_row and user_row['bono_activo'] and monto_esperado >= 1000:
+                bonus = round(monto_esperado * 0.015, 2)
+                monto_total = monto_esperado + bonus
+                logger.info(f"Recarga {recarga_id}: bono_activo=True, monto={monto_esperado} >= 1000, bono={bonus}, total={monto_total}")
+        except Exception as e_bonus:
+            logger.warning(f"Recarga {recarga_id}: error consultando bono_activo: {e_bonus}")
+
+        # Reclamar la recarga pendiente dentro de la misma transacción.
+        # Si otro hilo/proceso ya la completó, rowcount será 0 y no se toca saldo.
+        claim_result = conn2.execute('''
+            UPDATE recargas_binance 
+            SET estado = 'completada', binance_transaction_id = ?, fecha_completada = CURRENT_TIMESTAMP, bonus = ?
+            WHERE id = ?
+              AND estado = 'pendiente'
+              AND (binance_transaction_id IS NULL OR binance_transaction_id = '')
+        ''', (tx_id, bonus, recarga_id))
+
+        if claim_result.rowcount != 1:
+            conn2.rollback()
+            conn2.close()
+            logger.info(f"Recarga {recarga_id}: otro proceso ya acreditó la transacción {tx_id}")
+            return {'status': 'ya_procesada', 'message': 'Esta transacción ya fue procesada'}
+
+        # Acreditar saldo al usuario (atómico, misma transacción)
+        saldo_row = conn2.execute('SELECT saldo FROM usuarios WHERE id = ?', (usuario_id,)).fetchone()
+        saldo_anterior = saldo_row['saldo'] if saldo_row else 0.0
+        conn2.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (monto_total, usuario_id))
+        conn2.execute('''
+            INSERT INTO creditos_billetera (usuario_id, monto, saldo_anterior, origen)
+            VALUES (?, ?, ?, ?)
+        ''', (usuario_id, monto_total, saldo_anterior, 'binance'))
+
+        conn2.commit()
+        conn2.close()
+
+        logger.info(f"Recarga {recarga_id} completada: usuario={usuario_id}, monto={monto_esperado}, bonus={bonus}, total={monto_total}")
+
+        return {
+            'status': 'completada',
+            'message': f'Recarga completada exitosamente',
+            'monto': monto_esperado,
+            'bonus': bonus,
+            'total_acreditado': monto_total,
+            'transaction_id': tx_id
+        }
+    except Exception as e:
+        try:
+            conn2.rollback()
+            conn2.close()
+        except Exception:
+            pass
+        logger.error(f"Error acreditando recarga {recarga_id}: {e}", exc_info=True)
+        return {'status': 'error', 'message': 'Error al acreditar saldo'}
+
+def _recarga_start_ts(recarga, default):
+    fecha_creacion = _recarga_to_datetime(recarga['fecha_creacion']) or default
+    return int(fecha_creacion.timestamp() * 1000) - 60000  # 1 min antes
+
 def verificar_recarga_binance(recarga_id, _binance_tx_kwargs=None):
-    """Verifica si una recarga pendiente fue pagada consultando Binance Pay API"""
+    """Verifica si una recarga pendiente fue pagada consultando Binance Pay API.
+
+    Pensada para la verificación manual/polling del usuario: reutiliza la ventana
+    de transacciones recién consultada si todavía es fresca.
+    """
     if _binance_tx_kwargs is None:
         _binance_tx_kwargs = {}
     conn = get_db_connection()
@@ -2233,28 +2479,10 @@ def verificar_recarga_binance(recarga_id, _binance_tx_kwargs=None):
     if not recarga:
         conn.close()
         return {'status': 'error', 'message': 'Recarga no encontrada o ya procesada'}
-    
-    def _to_datetime(val):
-        if isinstance(val, datetime):
-            return val
-        if val is None:
-            return None
-        sval = str(val).strip()
-        if not sval:
-            return None
-        try:
-            # Formato legacy SQLite
-            return datetime.strptime(sval, '%Y-%m-%d %H:%M:%S')
-        except Exception:
-            try:
-                # ISO/otros formatos que psycopg pueda devolver serializados
-                return datetime.fromisoformat(sval.replace('Z', '+00:00')).replace(tzinfo=None)
-            except Exception:
-                return None
 
     # Verificar expiración (fechas almacenadas en UTC)
     ahora_utc = datetime.utcnow()
-    fecha_exp = _to_datetime(recarga['fecha_expiracion'])
+    fecha_exp = _recarga_to_datetime(recarga['fecha_expiracion'])
     if not fecha_exp:
         conn.close()
         return {'status': 'error', 'message': 'fecha_expiracion inválida'}
@@ -2268,173 +2496,89 @@ def verificar_recarga_binance(recarga_id, _binance_tx_kwargs=None):
     conn.close()
     
     # Consultar transacciones de Binance Pay
-    fecha_creacion = _to_datetime(recarga['fecha_creacion']) or ahora_utc
-    start_ts = int(fecha_creacion.timestamp() * 1000) - 60000  # 1 min antes
-    
-    transactions = binance_get_pay_transactions(start_time=start_ts, **_binance_tx_kwargs)
+    transactions = binance_fetch_transaction_window(
+        _recarga_start_ts(recarga, ahora_utc), use_cache=True, **_binance_tx_kwargs
+    )
     if transactions is None:
         return {'status': 'error', 'message': 'Error al consultar Binance Pay API'}
     
     codigo_ref = recarga['codigo_referencia']
     monto_esperado = float(recarga['monto_unico'])
-    
-    # Guardar datos antes de buscar (la conexión original ya se cerró)
-    usuario_id = recarga['usuario_id']
-    
     logger.info(f"Verificando recarga {recarga_id}: codigo={codigo_ref}, monto={monto_esperado}, transacciones encontradas={len(transactions)}")
     
-    # Buscar transacción que coincida: note contiene el código Y amount coincide
-    # La API de Binance Pay devuelve: orderMemo/remark para la nota, fundsDetail para currency/amount
-    for tx in transactions:
-        # La nota puede venir en distintos campos según la versión de la API
-        tx_note = str(tx.get('orderMemo') or tx.get('remark') or tx.get('note') or '').strip().upper()
-        
-        # El monto y currency vienen en fundsDetail (array) o directamente
-        tx_currency = ''
-        tx_amount = 0.0
-        funds = tx.get('fundsDetail') or []
-        if funds and isinstance(funds, list):
-            for f in funds:
-                if str(f.get('currency', '')).upper() == 'USDT':
-                    tx_currency = 'USDT'
-                    tx_amount = abs(float(f.get('amount', 0)))
-                    break
-        if not tx_currency:
-            tx_currency = str(tx.get('currency', '')).upper()
-            tx_amount = abs(float(tx.get('amount', 0)))
-        
-        tx_order_type = str(tx.get('orderType', '')).upper()
-        
-        logger.info(f"  TX: note='{tx_note}', amount={tx_amount}, currency={tx_currency}, orderType={tx_order_type}")
-        
-        # Solo procesar transacciones recibidas - aceptar todos los tipos de ingreso
-        if tx_order_type and tx_order_type not in ('PAY', 'C2C', 'C2C_TRANSFER', 'CRYPTO_BOX', ''):
-            continue
-        
-        # Verificar: nota contiene el código de referencia Y monto coincide Y es USDT
-        if codigo_ref.upper() in tx_note and abs(tx_amount - monto_esperado) < 0.01 and tx_currency == 'USDT':
-            logger.info(f"  ¡Match encontrado! TX ID: {tx.get('transactionId', '')}")
-            # ¡Match encontrado! Acreditar saldo
-            bonus = 0.0
-            monto_total = monto_esperado
-            tx_id = str(tx.get('transactionId', '') or '').strip()
-
-            if not tx_id:
-                logger.warning(f"Recarga {recarga_id}: Binance devolvió una transacción sin transactionId; se omite para evitar doble acreditación")
-                continue
-            
-            try:
-                # === Transacción atómica: idempotencia + bono + crédito ===
-                conn2 = get_db_connection()
-
-                # Verificar que no se haya procesado ya (idempotencia por binance_transaction_id)
-                ya_procesada = conn2.execute(
-                    'SELECT 1 FROM recargas_binance WHERE binance_transaction_id = ? AND estado = ?',
-                    (tx_id, 'completada')
-                ).fetchone()
-
-                if ya_procesada:
-                    conn2.close()
-                    return {'status': 'ya_procesada', 'message': 'Esta transacción ya fue procesada'}
-
-                # Calcular bono 1.5% si el usuario tiene bono_activo y monto >= 1000
-                try:
-                    user_row = conn2.execute(
-                        'SELECT bono_activo FROM usuarios WHERE id = ?', (usuario_id,)
-                    ).fetchone()
-                    if user_row and user_row['bono_activo'] and monto_esperado >= 1000:
-                        bonus = round(monto_esperado * 0.015, 2)
-                        monto_total = monto_esperado + bonus
-                        logger.info(f"Recarga {recarga_id}: bono_activo=True, monto={monto_esperado} >= 1000, bono={bonus}, total={monto_total}")
-                except Exception as e_bonus:
-                    logger.warning(f"Recarga {recarga_id}: error consultando bono_activo: {e_bonus}")
-
-                # Reclamar la recarga pendiente dentro de la misma transacción.
-                # Si otro hilo/proceso ya la completó, rowcount será 0 y no se toca saldo.
-                claim_result = conn2.execute('''
-                    UPDATE recargas_binance 
-                    SET estado = 'completada', binance_transaction_id = ?, fecha_completada = CURRENT_TIMESTAMP, bonus = ?
-                    WHERE id = ?
-                      AND estado = 'pendiente'
-                      AND (binance_transaction_id IS NULL OR binance_transaction_id = '')
-                ''', (tx_id, bonus, recarga_id))
-
-                if claim_result.rowcount != 1:
-                    conn2.rollback()
-                    conn2.close()
-                    logger.info(f"Recarga {recarga_id}: otro proceso ya acreditó la transacción {tx_id}")
-                    return {'status': 'ya_procesada', 'message': 'Esta transacción ya fue procesada'}
-
-                # Acreditar saldo al usuario (atómico, misma transacción)
-                saldo_row = conn2.execute('SELECT saldo FROM usuarios WHERE id = ?', (usuario_id,)).fetchone()
-                saldo_anterior = saldo_row['saldo'] if saldo_row else 0.0
-                _ensure_creditos_billetera_schema(conn2)
-                conn2.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (monto_total, usuario_id))
-                conn2.execute('''
-                    INSERT INTO creditos_billetera (usuario_id, monto, saldo_anterior, origen)
-                    VALUES (?, ?, ?, ?)
-                ''', (usuario_id, monto_total, saldo_anterior, 'binance'))
-
-                conn2.commit()
-                conn2.close()
-
-                logger.info(f"Recarga {recarga_id} completada: usuario={usuario_id}, monto={monto_esperado}, bonus={bonus}, total={monto_total}")
-
-                return {
-                    'status': 'completada',
-                    'message': f'Recarga completada exitosamente',
-                    'monto': monto_esperado,
-                    'bonus': bonus,
-                    'total_acreditado': monto_total,
-                    'transaction_id': tx_id
-                }
-            except Exception as e:
-                try:
-                    conn2.rollback()
-                    conn2.close()
-                except Exception:
-                    pass
-                logger.error(f"Error acreditando recarga {recarga_id}: {e}", exc_info=True)
-                return {'status': 'error', 'message': 'Error al acreditar saldo'}
+    match = _buscar_pago_recarga(recarga, index_binance_transactions(transactions))
+    if match:
+        return _acreditar_recarga_binance(recarga, match['transaction_id'])
     
     if len(transactions) > 0:
         logger.info(f"Recarga {recarga_id}: {len(transactions)} transacciones revisadas, ninguna coincide con codigo={codigo_ref} monto={monto_esperado}")
     
     return {'status': 'pendiente', 'message': 'Pago no detectado aún. Asegúrate de enviar el monto exacto con el código como nota y espera unos segundos.'}
 
-def _ensure_recargas_table():
-    """Crea la tabla recargas_binance si no existe"""
+def verificar_recargas_pendientes_binance(_binance_tx_kwargs=None):
+    """Verifica todas las recargas pendientes con una sola consulta a Binance Pay.
+
+    La ventana empieza en la fecha_creacion más antigua pendiente; las transacciones
+    se indexan por código de referencia y cada recarga se busca en memoria.
+    Devuelve {'pendientes', 'completadas', 'transacciones'} o None si Binance no respondió.
+    """
+    if _binance_tx_kwargs is None:
+        _binance_tx_kwargs = {}
     conn = get_db_connection()
     try:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS recargas_binance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_id INTEGER NOT NULL,
-                codigo_referencia TEXT NOT NULL UNIQUE,
-                monto_solicitado REAL NOT NULL,
-                monto_unico REAL NOT NULL,
-                estado TEXT DEFAULT 'pendiente',
-                binance_transaction_id TEXT,
-                fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                fecha_expiracion DATETIME NOT NULL,
-                fecha_completada DATETIME,
-                bonus REAL DEFAULT 0.0,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        ''')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_recargas_usuario ON recargas_binance(usuario_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_recargas_estado ON recargas_binance(estado)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_recargas_codigo ON recargas_binance(codigo_referencia)')
-        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_recargas_binance_txid_unique ON recargas_binance(binance_transaction_id) WHERE binance_transaction_id IS NOT NULL")
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Error creando tabla recargas_binance: {e}")
+        pendientes = conn.execute('''
+            SELECT * FROM recargas_binance WHERE estado = 'pendiente' AND fecha_expiracion >= CURRENT_TIMESTAMP
+        ''').fetchall()
     finally:
         conn.close()
 
+    resumen = {'pendientes': len(pendientes), 'completadas': 0, 'transacciones': 0}
+    if not pendientes:
+        return resumen
+
+    ahora_utc = datetime.utcnow()
+    start_ts = min(_recarga_start_ts(rec, ahora_utc) for rec in pendientes)
+    transactions = binance_fetch_transaction_window(start_ts, **_binance_tx_kwargs)
+    if transactions is None:
+        logger.error(f"No se pudo consultar Binance Pay para {len(pendientes)} recargas pendientes")
+        return None
+    resumen['transacciones'] = len(transactions)
+
+    index = index_binance_transactions(transactions)
+    for rec in pendientes:
+        match = _buscar_pago_recarga(rec, index)
+        if not match:
+            continue
+        resultado = _acreditar_recarga_binance(rec, match['transaction_id'])
+        if resultado['status'] == 'completada':
+            resumen['completadas'] += 1
+    return resumen
+
+def _migration_recargas_binance(cursor):
+    """Migración 5: tabla recargas_binance."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recargas_binance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            codigo_referencia TEXT NOT NULL UNIQUE,
+            monto_solicitado REAL NOT NULL,
+            monto_unico REAL NOT NULL,
+            estado TEXT DEFAULT 'pendiente',
+            binance_transaction_id TEXT,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_expiracion DATETIME NOT NULL,
+            fecha_completada DATETIME,
+            bonus REAL DEFAULT 0.0,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recargas_usuario ON recargas_binance(usuario_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recargas_estado ON recargas_binance(estado)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recargas_codigo ON recargas_binance(codigo_referencia)')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_recargas_binance_txid_unique ON recargas_binance(binance_transaction_id) WHERE binance_transaction_id IS NOT NULL")
+
 def expirar_recargas_vencidas():
     """Marca como expiradas las recargas que pasaron su tiempo límite"""
-    _ensure_recargas_table()
     conn = get_db_connection()
     try:
         conn.execute('''
@@ -2476,7 +2620,6 @@ def _recarga_to_dict(row):
 
 def get_all_recargas_admin(limit=50):
     """Obtiene todas las recargas de todos los usuarios (para admin)"""
-    _ensure_recargas_table()
     conn = get_db_connection()
     recargas = conn.execute('''
         SELECT r.*, u.nombre, u.apellido, u.correo
@@ -2497,7 +2640,6 @@ def get_all_recargas_admin(limit=50):
 
 def get_recargas_usuario(user_id, limit=20):
     """Obtiene el historial de recargas de un usuario"""
-    _ensure_recargas_table()
     conn = get_db_connection()
     recargas = conn.execute('''
         SELECT * FROM recargas_binance 
@@ -2510,7 +2652,6 @@ def get_recargas_usuario(user_id, limit=20):
 
 def get_recargas_usuario_paginated(user_id, page=1, per_page=10):
     """Obtiene el historial de recargas Binance de un usuario con paginación."""
-    _ensure_recargas_table()
     conn = get_db_connection()
     total = conn.execute('''
         SELECT COUNT(*)
@@ -2556,25 +2697,16 @@ def _binance_verification_loop():
             if not BINANCE_API_KEY or not BINANCE_API_SECRET:
                 continue
             
-            conn = get_db_connection()
-            pendientes = conn.execute('''
-                SELECT id FROM recargas_binance WHERE estado = 'pendiente'
-            ''').fetchall()
-            conn.close()
-            
-            for rec in pendientes:
-                try:
-                    verificar_recarga_binance(rec['id'], _binance_tx_kwargs={'req_timeout': 15, 'total_timeout_override': 30})
-                    time_module.sleep(2)  # Rate limit
-                except Exception as e:
-                    logger.error(f"Error verificando recarga {rec['id']}: {e}")
+            # Una sola consulta a Binance por ciclo para todas las recargas pendientes
+            resumen = verificar_recargas_pendientes_binance(
+                _binance_tx_kwargs={'req_timeout': 15, 'total_timeout_override': 30}
+            )
+            if resumen and resumen['completadas']:
+                logger.info(f"[Binance] Ciclo de verificación: {resumen}")
         except Exception as e:
             logger.error(f"Error en binance verification loop: {e}")
             time_module.sleep(60)
 
-# Iniciar thread de verificación automática
-_binance_verify_thread = threading.Thread(target=_binance_verification_loop, daemon=True)
-_binance_verify_thread.start()
 
 
 # === Juegos Dinámicos: Sincronización automática de precios cada 6 horas ===
@@ -2599,9 +2731,6 @@ def _dyngame_price_sync_loop():
             logger.error(f"[DynPrice AutoSync] Error: {e}")
         time_module.sleep(_DYN_SYNC_INTERVAL_HOURS * 3600)
 
-_dyn_price_sync_thread = threading.Thread(target=_dyngame_price_sync_loop, daemon=True)
-_dyn_price_sync_thread.start()
-logger.info(f"[DynPrice AutoSync] Thread iniciado — sincronización cada {_DYN_SYNC_INTERVAL_HOURS}h")
 
 
 # === Gift Cards: Polling de seriales pendientes cada 60s ===
@@ -2621,15 +2750,83 @@ def _dyngame_serial_poll_loop():
             logger.error(f"[DynGame Poll Loop] Error: {e}")
         time_module.sleep(_DYN_GAME_POLL_INTERVAL_SECONDS)
 
-_dyngame_poll_thread = threading.Thread(target=_dyngame_serial_poll_loop, daemon=True)
-_dyngame_poll_thread.start()
-logger.info(f"[DynGame Poll] Thread iniciado — verificación GamePoint pendiente cada {_DYN_GAME_POLL_INTERVAL_SECONDS}s")
+
+def _migration_aggregate_unique_keys(cursor):
+    """Migración 10: clave única en ventas_semanales para el upsert atómico.
+
+    Antes de crear el índice se fusionan los duplicados que dejaron compras
+    simultáneas (se suman en la fila de menor id y se borran las demás).
+    """
+    cursor.execute('''
+        UPDATE ventas_semanales SET
+            cantidad_vendida = (
+                SELECT SUM(v2.cantidad_vendida) FROM ventas_semanales v2
+                WHERE v2.juego = ventas_semanales.juego AND v2.paquete_id = ventas_semanales.paquete_id
+                  AND v2.semana_year = ventas_semanales.semana_year
+            ),
+            ganancia_total = (
+                SELECT SUM(v2.ganancia_total) FROM ventas_semanales v2
+                WHERE v2.juego = ventas_semanales.juego AND v2.paquete_id = ventas_semanales.paquete_id
+                  AND v2.semana_year = ventas_semanales.semana_year
+            )
+        WHERE id IN (
+            SELECT MIN(id) FROM ventas_semanales
+            GROUP BY juego, paquete_id, semana_year HAVING COUNT(*) > 1
+        )
+    ''')
+    cursor.execute('''
+        DELETE FROM ventas_semanales WHERE id NOT IN (
+            SELECT MIN(id) FROM ventas_semanales GROUP BY juego, paquete_id, semana_year
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_ventas_semanales_dia
+        ON ventas_semanales (juego, paquete_id, semana_year)
+    ''')
+
+# Día local (Caracas, UTC-4) guardado por fila: los filtros por día hacen range-scan
+# sobre índices en lugar de evaluar DATE(fecha, '-4 hours') en cada fila.
+_LOCAL_DAY_INDEXES = {
+    'historial_compras': [('tipo_evento', 'local_day'), ('usuario_id', 'local_day')],
+    'transacciones': [('local_day',), ('usuario_id', 'local_day')],
+    'transacciones_freefire_id': [('local_day',), ('estado', 'local_day'), ('usuario_id', 'local_day')],
+    'transacciones_bloodstriker': [('local_day',), ('usuario_id', 'local_day')],
+    'transacciones_dinamicas': [('local_day',), ('usuario_id', 'local_day')],
+    'creditos_billetera': [('local_day',), ('usuario_id', 'local_day')],
+}
+
+
+def _migration_local_day_columns(cursor):
+    """Migración 11: columna generada local_day (DATE(fecha, '-4 hours')) e índices compuestos.
+
+    Al ser generada, las filas existentes quedan rellenas al agregarla y cada
+    INSERT la calcula sin tocar los puntos de escritura. En PostgreSQL es STORED
+    (reescribe la tabla una vez); en SQLite es VIRTUAL e indexable.
+    """
+    is_sqlite = isinstance(cursor, SqliteCursor)
+    for table, indexes in _LOCAL_DAY_INDEXES.items():
+        if is_sqlite:
+            try:
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD COLUMN local_day TEXT "
+                    f"GENERATED ALWAYS AS (DATE(fecha, '-4 hours')) VIRTUAL"
+                )
+            except Exception:
+                pass
+        else:
+            cursor.execute(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS local_day DATE "
+                f"GENERATED ALWAYS AS (CAST(fecha - INTERVAL '4 hours' AS DATE)) STORED"
+            )
+        for columns in indexes:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})"
+            )
 
 # Funciones para sistema de noticias
-def create_news_table():
-    """Crea la tabla de noticias si no existe"""
-    conn = get_db_connection()
-    conn.execute('''
+def _migration_noticias(cursor):
+    """Migración 6: noticias y registro de noticias vistas por usuario."""
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS noticias (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             titulo TEXT NOT NULL,
@@ -2638,19 +2835,11 @@ def create_news_table():
             fecha DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.commit()
-    # Migración: agregar columna imagen_url si no existe
     try:
-        conn.execute('ALTER TABLE noticias ADD COLUMN imagen_url TEXT')
-        conn.commit()
-    except:
+        cursor.execute('ALTER TABLE noticias ADD COLUMN imagen_url TEXT')
+    except Exception:
         pass
-    conn.close()
-
-def create_news_views_table():
-    """Crea la tabla para rastrear noticias vistas por usuario"""
-    conn = get_db_connection()
-    conn.execute('''
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS noticias_vistas (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             usuario_id INTEGER,
@@ -2661,12 +2850,29 @@ def create_news_views_table():
             UNIQUE(usuario_id, noticia_id)
         )
     ''')
-    conn.commit()
-    conn.close()
+
+def _migration_notificaciones_personalizadas(cursor):
+    """Migración 7: notificaciones personalizadas por usuario (con tag)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            titulo TEXT NOT NULL,
+            mensaje TEXT NOT NULL,
+            tipo TEXT DEFAULT 'info',
+            tag TEXT,
+            visto BOOLEAN DEFAULT FALSE,
+            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
+    except Exception:
+        pass
 
 def create_news(titulo, contenido, importante=False, imagen_url=None):
     """Crea una nueva noticia"""
-    create_news_table()
     conn = get_db_connection()
     conn.execute('''
         INSERT INTO noticias (titulo, contenido, importante, imagen_url)
@@ -2680,7 +2886,6 @@ def create_news(titulo, contenido, importante=False, imagen_url=None):
 
 def get_all_news():
     """Obtiene todas las noticias ordenadas por fecha (más recientes primero)"""
-    create_news_table()
     conn = get_db_connection()
     news = conn.execute('''
         SELECT * FROM noticias 
@@ -2691,8 +2896,6 @@ def get_all_news():
 
 def get_user_news(user_id):
     """Obtiene las noticias para un usuario específico"""
-    create_news_table()
-    create_news_views_table()
     conn = get_db_connection()
     news = conn.execute('''
         SELECT * FROM noticias 
@@ -2704,9 +2907,7 @@ def get_user_news(user_id):
 
 def get_unread_news_count(user_id):
     """Obtiene el número de noticias no leídas por un usuario"""
-    create_news_table()
-    create_news_views_table()
-    conn = get_db_connection()
+    conn = get_request_connection()
     
     # Contar noticias que el usuario no ha visto
     count = conn.execute('''
@@ -2723,8 +2924,6 @@ def get_unread_news_count(user_id):
 
 def mark_news_as_read(user_id):
     """Marca todas las noticias como leídas para un usuario"""
-    create_news_table()
-    create_news_views_table()
     conn = get_db_connection()
     
     # Obtener todas las noticias que el usuario no ha visto
@@ -2760,26 +2959,6 @@ def delete_news(news_id):
 def create_personal_notification(user_id, titulo, mensaje, tipo='success'):
     """Crea una notificación personalizada para un usuario específico"""
     conn = get_db_connection()
-    # Crear tabla si no existe
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            titulo TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            tipo TEXT DEFAULT 'info',
-            tag TEXT,
-            visto BOOLEAN DEFAULT FALSE,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-
-    # Migración suave: agregar columna tag si la tabla ya existía
-    try:
-        conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-    except Exception:
-        pass
     
     conn.execute('''
         INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo, tag)
@@ -2794,26 +2973,6 @@ def create_personal_notification(user_id, titulo, mensaje, tipo='success'):
 def get_user_personal_notifications(user_id):
     """Obtiene las notificaciones personalizadas de un usuario"""
     conn = get_db_connection()
-    # Crear tabla si no existe
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            titulo TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            tipo TEXT DEFAULT 'info',
-            tag TEXT,
-            visto BOOLEAN DEFAULT FALSE,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-
-    # Migración suave: agregar columna tag si la tabla ya existía
-    try:
-        conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-    except Exception:
-        pass
     
     notifications = conn.execute('''
         SELECT * FROM notificaciones_personalizadas
@@ -2828,27 +2987,7 @@ def get_user_personal_notifications(user_id):
 
 def get_unread_personal_notifications_count(user_id):
     """Obtiene el número de notificaciones personalizadas no leídas"""
-    conn = get_db_connection()
-    # Crear tabla si no existe
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            titulo TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            tipo TEXT DEFAULT 'info',
-            tag TEXT,
-            visto BOOLEAN DEFAULT FALSE,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-
-    # Migración suave: agregar columna tag si la tabla ya existía
-    try:
-        conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-    except Exception:
-        pass
+    conn = get_request_connection()
     
     count = conn.execute('''
         SELECT COUNT(*) FROM notificaciones_personalizadas
@@ -2859,30 +2998,10 @@ def get_unread_personal_notifications_count(user_id):
     conn.close()
     
     return 1 if count > 0 else 0
-
-def mark_personal_notifications_as_read(user_id):
-    """Marca todas las notificaciones personalizadas como leídas y las elimina"""
-    conn = get_db_connection()
-    # Crear tabla si no existe
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            titulo TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            tipo TEXT DEFAULT 'info',
-            tag TEXT,
-            visto BOOLEAN DEFAULT FALSE,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-
-    # Migración suave: agregar columna tag si la tabla ya existía
-    try:
-        conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-    except Exception:
-        pass
+
+def mark_personal_notifications_as_read(user_id):
+    """Marca todas las notificaciones personalizadas como leídas y las elimina"""
+    conn = get_db_connection()
     
     # Eliminar todas las notificaciones del usuario EXCEPTO las de recarga Blood Striker
     conn.execute('''
@@ -2966,8 +3085,28 @@ def debug_database_info():
     
     print("=" * 50)
 
-# Inicializar la base de datos al iniciar la aplicación
-debug_database_info()
+# Pasos de esquema en orden; agregar cambios nuevos como versiones nuevas,
+# nunca editando un paso ya desplegado.
+APP_SCHEMA_MIGRATIONS = [
+    (1, 'esquema_base', _migration_base_schema),
+    (2, 'api_marca_blanca', init_whitelabel_tables),
+    (3, 'cola_freefire_id', init_freefire_id_queue_tables),
+    (4, 'creditos_billetera', _migration_creditos_billetera),
+    (5, 'recargas_binance', _migration_recargas_binance),
+    (6, 'noticias', _migration_noticias),
+    (7, 'notificaciones_personalizadas', _migration_notificaciones_personalizadas),
+    (8, 'indices_optimizados', create_optimized_indexes),
+    (9, 'ganancia_por_venta', init_profit_rollup_tables),
+    (10, 'agregados_atomicos', _migration_aggregate_unique_keys),
+    (11, 'dia_local_indexado', _migration_local_day_columns),
+    (12, 'cola_freefire_id_jobs_vps', add_ffid_vps_job_columns),
+    (13, 'api_marca_blanca_cola_asincrona', add_whitelabel_async_queue_columns),
+]
+
+# Inicializar la base de datos al iniciar la aplicación. El volcado de debug
+# (incluye COUNT(*) por tabla) solo con DEBUG_DATABASE_INFO=1.
+if str(os.environ.get('DEBUG_DATABASE_INFO', '')).strip().lower() in {'1', 'true', 'yes', 'on'}:
+    debug_database_info()
 init_db()
 
 @app.route('/')
@@ -2998,7 +3137,7 @@ def index():
         # Usuario normal ve solo sus transacciones
         if 'user_db_id' in session:
             # Actualizar saldo desde la base de datos SIEMPRE
-            conn = get_db_connection()
+            conn = get_request_connection()
             user = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (session['user_db_id'],)).fetchone()
             if user:
                 session['saldo'] = user['saldo']
@@ -3368,23 +3507,6 @@ def api_bloodstriker_reload_notifications():
         return jsonify({'notifications': []})
 
     conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            titulo TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            tipo TEXT DEFAULT 'info',
-            tag TEXT,
-            visto BOOLEAN DEFAULT FALSE,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    try:
-        conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-    except Exception:
-        pass
 
     rows = conn.execute('''
         SELECT id, titulo, mensaje, tipo, fecha
@@ -3475,20 +3597,20 @@ def update_user_balance(user_id, new_balance):
 def debit_user_balance_atomic(conn, user_id, amount):
     """Descuenta saldo de forma atómica y valida fondos en la misma operación."""
     amount = round(float(amount), 2)
-    cursor = conn.execute(
-        'UPDATE usuarios SET saldo = saldo - ? WHERE id = ? AND saldo >= ?',
+    # RETURNING: un solo viaje a la base en el caso normal (también dentro de conn.pipeline())
+    rows = conn.execute(
+        'UPDATE usuarios SET saldo = saldo - ? WHERE id = ? AND saldo >= ? RETURNING saldo',
         (amount, user_id, amount)
-    )
+    ).fetchall()
 
-    if cursor.rowcount == 0:
+    if not rows:
         row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (user_id,)).fetchone()
         return {
             'ok': False,
             'saldo_actual': float(row['saldo']) if row else 0.0,
         }
 
-    row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (user_id,)).fetchone()
-    saldo_despues = float(row['saldo']) if row else 0.0
+    saldo_despues = float(rows[0]['saldo'])
     return {
         'ok': True,
         'saldo_antes': round(saldo_despues + amount, 2),
@@ -3586,27 +3708,6 @@ def add_credit_to_user(user_id, amount):
     """Añade crédito al saldo de un usuario y registra en billetera"""
     conn = get_db_connection()
     
-    # Crear tabla de créditos de billetera si no existe
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS creditos_billetera (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER,
-            monto REAL DEFAULT 0.0,
-            saldo_anterior REAL DEFAULT 0.0,
-            fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Agregar columna 'saldo_anterior' si no existe (para compatibilidad con datos existentes)
-    try:
-        conn.execute('ALTER TABLE creditos_billetera ADD COLUMN saldo_anterior REAL DEFAULT 0.0')
-        conn.commit()
-    except:
-        pass  # La columna ya existe
-    
-    _ensure_creditos_billetera_schema(conn)
-
     # Obtener saldo actual del usuario antes de agregar el crédito
     user_data = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (user_id,)).fetchone()
     saldo_anterior = user_data['saldo'] if user_data else 0.0
@@ -4038,20 +4139,10 @@ def _find_whitelabel_account_by_key(api_key: str):
     if not normalized_key:
         return None
 
-    conn = get_db_connection()
-    try:
-        row = conn.execute(
-            '''
-            SELECT id, nombre, api_key, usuario_id, webhook_url, activo
-            FROM webservice_accounts
-            WHERE api_key = ? AND activo = TRUE
-            LIMIT 1
-            ''',
-            (normalized_key,)
-        ).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    account = get_whitelabel_account_by_api_key(normalized_key)
+    if not account:
+        return None
+    return {k: account.get(k) for k in ('id', 'nombre', 'api_key', 'usuario_id', 'webhook_url', 'activo')}
 
 
 def _resolve_whitelabel_api_context(*, require_user: bool = True):
@@ -4583,7 +4674,7 @@ def get_pending_bloodstriker_transactions():
 
 def get_user_pending_bloodstriker_transactions(user_id):
     """Obtiene las transacciones pendientes de Blood Striker de un usuario específico"""
-    conn = get_db_connection()
+    conn = get_request_connection()
     transactions = conn.execute('''
         SELECT bs.*, u.nombre, u.apellido, p.nombre as paquete_nombre
         FROM transacciones_bloodstriker bs
@@ -4985,7 +5076,7 @@ def _sort_transactions_with_queue_priority(transactions):
 
 def get_user_pending_freefire_id_transactions(user_id):
     """Obtiene las transacciones activas de Free Fire ID de un usuario específico."""
-    conn = get_db_connection()
+    conn = get_request_connection()
     transactions = conn.execute('''
         SELECT fi.*, u.nombre, u.apellido, p.nombre as paquete_nombre
         FROM transacciones_freefire_id fi
@@ -5019,7 +5110,7 @@ def get_user_pending_freefire_id_transactions(user_id):
 
 def get_user_pending_dynamic_transactions(user_id):
     """Obtiene las transacciones activas de juegos dinámicos de un usuario específico."""
-    conn = get_db_connection()
+    conn = get_request_connection()
     transactions = conn.execute('''
         SELECT td.*, u.nombre, u.apellido, jd.nombre as juego_nombre, jd.modo as juego_modo, pd.nombre as paquete_nombre
         FROM transacciones_dinamicas td
@@ -5090,11 +5181,12 @@ def verify_pin_already_redeemed(pin_code, player_id, config=None, consider_missi
             
             timeout = 30
             
-            resp = requests.post(
-                vps_url + "/verify",
+            resp = get_breaker('vps_redeemer').call(
+                vps_session().post,
+                vps_url.rstrip('/') + "/verify",
                 json=payload,
                 timeout=timeout,
-                headers={"Content-Type": "application/json"},
+                is_failure=is_server_error,
             )
             
             if resp.status_code == 200:
@@ -5103,8 +5195,8 @@ def verify_pin_already_redeemed(pin_code, player_id, config=None, consider_missi
                     logger.warning(f"[FreeFire ID] PIN {pin_code[:8]}... ya fue redimido (verify endpoint)")
                     return True
                     
-        except requests.exceptions.RequestException:
-            # Si no hay endpoint /verify, continuar con método alternativo
+        except (requests.exceptions.RequestException, CircuitOpenError):
+            # Si no hay endpoint /verify (o el VPS está caído), continuar con método alternativo
             logger.info(f"[FreeFire ID] Endpoint /verify no disponible, usando método alternativo")
         
         # Intento 2: Verificar en base de datos local si hay transacciones exitosas recientes
@@ -5184,6 +5276,254 @@ def restore_freefire_id_pin_if_unverified(monto_id, pin_code, player_id, config=
             except Exception:
                 pass
 
+def _log_freefire_id_api_recharge(player_id, package_id, success, player_name='', error_msg='', duration=0.0, package_name=''):
+    """Registra un intento de recarga FF ID vía API en api_recharges_log."""
+    try:
+        _lc = get_db_connection()
+        _lc.execute(
+            'INSERT INTO api_recharges_log (player_id, package_id, success, player_name, error_msg, duration_seconds, game_name, package_name) VALUES (?,?,?,?,?,?,?,?)',
+            (player_id, package_id, 1 if success else 0, player_name, error_msg, duration, 'Free Fire ID', package_name)
+        )
+        _lc.commit()
+        _lc.close()
+    except Exception as _le:
+        logger.warning(f'[API FF-ID] No se pudo guardar log: {_le}')
+
+
+def _load_freefire_id_job_tx(job):
+    conn = get_db_connection()
+    try:
+        return conn.execute(
+            'SELECT id, usuario_id, estado, transaccion_id, numero_control FROM transacciones_freefire_id WHERE id = ?',
+            (job['transaction_id'],)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _process_freefire_id_redeem_job(job):
+    """Handler del pool de redención FF ID: envía el PIN al VPS y libera el worker.
+
+    El job queda en `esperando_vps` y lo cierra el callback del VPS o el sondeo
+    (`_check_freefire_id_vps_job`). Un VPS antiguo que responde el resultado en
+    el mismo POST se cierra aquí mismo. En una reanudación (intentos > 1)
+    primero se verifica si el PIN ya quedó redimido, y si ya se había enviado
+    no se reenvía: se vuelve a esperar el mismo job remoto.
+    """
+    job_id = job['id']
+    source = job.get('source') or 'web'
+    pin_codigo = job['pin_codigo']
+    player_id = job['player_id']
+
+    tx = _load_freefire_id_job_tx(job)
+    if not tx:
+        finish_ffid_redeem_job(job_id, 'rechazado', error_msg='Transacción no encontrada')
+        return
+    if source != 'admin' and tx['estado'] in ('aprobado', 'rechazado'):
+        # Otro proceso ya cerró la transacción (p. ej. ajuste manual del admin).
+        finish_ffid_redeem_job(job_id, tx['estado'], error_msg='Transacción ya cerrada')
+        return
+
+    redeemer_config = get_redeemer_config_from_db(get_db_connection)
+    _start = time_module.time()
+    redeem_result = None
+    verified_used = False
+    error_msg = ''
+
+    if int(job.get('intentos') or 1) > 1:
+        verified_used = verify_pin_already_redeemed(pin_codigo, player_id, config=redeemer_config)
+
+    if not verified_used:
+        if int(job.get('intentos') or 1) > FFID_REDEEM_MAX_ATTEMPTS:
+            error_msg = 'Se agotaron los reintentos de redención'
+        elif job.get('vps_job_id'):
+            park_ffid_job_on_vps(job_id, job['vps_job_id'])
+            return
+        else:
+            try:
+                submitted = submit_redeem_job(pin_codigo, player_id, redeemer_config, request_id=tx['transaccion_id'])
+                if isinstance(submitted, dict) and submitted.get('job_id'):
+                    park_ffid_job_on_vps(job_id, submitted['job_id'])
+                    logger.info(f"[FFID Queue] job={job_id} enviado al VPS (job remoto {submitted['job_id']})")
+                    return
+                # Envío fallido o VPS síncrono: el resultado ya está, no hay espera
+                redeem_result = wait_for_redeem_job(submitted, redeemer_config)
+            except Exception as e:
+                logger.error(f"[FFID Queue] Error en redención job={job_id}: {str(e)}")
+                error_msg = str(e)
+
+    _close_freefire_id_redeem_job(job, tx, redeemer_config, redeem_result, verified_used, error_msg,
+                                  round(time_module.time() - _start, 1))
+
+
+def _close_freefire_id_redeem_job(job, tx, redeemer_config, redeem_result, verified_used=False, error_msg='',
+                                  duration=0.0):
+    """Cierra transacción y job con el resultado de la redención (o su falla)."""
+    job_id = job['id']
+    success = verified_used or bool(redeem_result and redeem_result.success)
+    if not success:
+        error_msg = error_msg or (redeem_result.message if redeem_result else '') or 'Error desconocido en la redención'
+        pin_restore = restore_freefire_id_pin_if_unverified(
+            job['paquete_id'],
+            job['pin_codigo'],
+            job['player_id'],
+            config=redeemer_config,
+            log_prefix='[FFID Queue]',
+        )
+        verified_used = bool(pin_restore.get('verified_used'))
+        success = verified_used
+
+    player_name = (redeem_result.player_name if redeem_result else '') or ''
+
+    if success:
+        _finalize_queued_freefire_id_success(job, tx, player_name, duration, verified_used=verified_used)
+        finish_ffid_redeem_job(job_id, 'aprobado', player_name=player_name, duracion_segundos=duration)
+    else:
+        _finalize_queued_freefire_id_failure(job, tx, error_msg, duration)
+        finish_ffid_redeem_job(job_id, 'rechazado', error_msg=error_msg, duracion_segundos=duration)
+
+
+def _close_parked_freefire_id_job(job, redeem_result, redeemer_config, worker_id):
+    """Cierra un job en `esperando_vps`; si otro (callback o sondeo) ya lo tomó, no hace nada."""
+    if not take_ffid_vps_job(job['id'], worker_id):
+        return False
+    tx = _load_freefire_id_job_tx(job)
+    if not tx:
+        finish_ffid_redeem_job(job['id'], 'rechazado', error_msg='Transacción no encontrada')
+        return True
+    duration = round(time_module.time() - float(job.get('vps_enviado_at') or time_module.time()), 1)
+    _close_freefire_id_redeem_job(job, tx, redeemer_config, redeem_result, duration=duration)
+    return True
+
+
+def _check_freefire_id_vps_job(job):
+    """Sondeo de un job en `esperando_vps`: consulta GET /jobs/<id> y lo cierra si terminó."""
+    redeemer_config = get_redeemer_config_from_db(get_db_connection)
+    try:
+        data = get_redeem_job(job['vps_job_id'], redeemer_config)
+    except Exception as e:
+        logger.warning(f"[FFID Queue] No se pudo consultar el job VPS {job['vps_job_id']}: {e}")
+        data = None
+    redeem_result = job_result(data, job['pin_codigo'], job['player_id'])
+    if redeem_result is None:
+        waited = time_module.time() - float(job.get('vps_enviado_at') or 0)
+        timeout = int(redeemer_config.get('vps_timeout_s') or os.environ.get('VPS_TIMEOUT_S', VPS_TIMEOUT_S))
+        if waited < timeout:
+            return  # sigue en el VPS; el lease ya programó el próximo chequeo
+        redeem_result = PinRedeemResult(False, f'El VPS no respondió en {timeout}s. Reintenta.',
+                                        job['pin_codigo'], job['player_id'])
+    _close_parked_freefire_id_job(job, redeem_result, redeemer_config, job.get('worker_id') or 'vps-check')
+
+
+def _finalize_queued_freefire_id_success(job, tx, player_name, duration, verified_used=False):
+    source = job.get('source') or 'web'
+    user_id = job['usuario_id']
+    request_id = job.get('request_id') or ''
+
+    if source == 'admin':
+        _approve_freefire_id_transaction_records(
+            tx['id'],
+            job.get('admin_id'),
+            pin_usado=job['pin_codigo'],
+            auto_redeemed=True,
+        )
+        return
+
+    note = f'Redención en cola exitosa. Jugador: {player_name}' if player_name else 'Redención en cola exitosa'
+    if verified_used:
+        note = 'Verificada como exitosa tras fallo de la redención en cola'
+    update_freefire_id_transaction_status(tx['id'], 'aprobado', user_id, note, register_general_tx=False)
+
+    conn = get_db_connection()
+    try:
+        sync_freefire_id_purchase_records(conn, tx['id'])
+        conn.execute(
+            'UPDATE transacciones SET duracion_segundos = ? WHERE transaccion_id = ?',
+            (duration, tx['transaccion_id'])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    packages_info = get_freefire_id_prices_cached()
+    package_name = packages_info.get(job['paquete_id'], {}).get('nombre', 'FF ID')
+
+    if source == 'api':
+        _log_freefire_id_api_recharge(job['player_id'], job['paquete_id'], True, player_name=player_name,
+                                      duration=duration, package_name=package_name)
+        if request_id:
+            payload = {'ok': True, 'player_name': player_name, 'duration': duration,
+                       'transaccion_id': tx['transaccion_id']}
+            if verified_used:
+                payload['verified_after_error'] = True
+            _complete_whitelabel_api_purchase(user_id, 'api_freefire_id', request_id, payload,
+                                              tx['transaccion_id'], tx['numero_control'])
+        return
+
+    # source == 'web': solo se cobró (y cuenta como venta) a usuarios no admin
+    if job.get('saldo_cobrado'):
+        register_weekly_sale('freefire_id', job['paquete_id'], package_name, job['precio'], 1)
+    if request_id:
+        conn = get_db_connection()
+        try:
+            complete_idempotent_purchase(
+                conn,
+                user_id,
+                'validar_freefire_id',
+                request_id,
+                {
+                    'paquete_nombre': f"{package_name} / ${float(job['precio'] or 0):.2f}",
+                    'monto_compra': job['precio'],
+                    'numero_control': tx['numero_control'],
+                    'transaccion_id': tx['transaccion_id'],
+                    'player_id': job['player_id'],
+                    'player_name': player_name,
+                    'estado': 'completado',
+                },
+                tx['transaccion_id'],
+                tx['numero_control'],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _finalize_queued_freefire_id_failure(job, tx, error_msg, duration):
+    source = job.get('source') or 'web'
+    user_id = job['usuario_id']
+    request_id = job.get('request_id') or ''
+
+    if source == 'admin':
+        # Igual que la aprobación síncrona: la transacción queda para revisión manual.
+        logger.warning(f"[FFID Queue] Reintento admin fallido tx={tx['id']}: {error_msg}")
+        return
+
+    if source == 'web' and job.get('saldo_cobrado'):
+        conn = get_db_connection()
+        try:
+            conn.execute('UPDATE usuarios SET saldo = saldo + ? WHERE id = ?', (job['precio'], user_id))
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"[FFID Queue] Saldo ${job['precio']} reembolsado al usuario {user_id}")
+
+    update_freefire_id_transaction_status(tx['id'], 'rechazado', user_id, f'Auto-redención fallida: {error_msg[:200]}')
+
+    if source == 'api':
+        _log_freefire_id_api_recharge(job['player_id'], job['paquete_id'], False, error_msg=error_msg, duration=duration)
+        if request_id:
+            _clear_whitelabel_api_purchase(user_id, 'api_freefire_id', request_id)
+        return
+
+    if request_id:
+        conn = get_db_connection()
+        try:
+            clear_idempotent_purchase(conn, user_id, 'validar_freefire_id', request_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+
 def audit_freefire_id_inconsistent_transactions():
     """
     Audita y detecta transacciones inconsistentes de Free Fire ID.
@@ -5427,12 +5767,12 @@ def send_freefire_id_notification(transaction_data):
         <p><a href="#">Ir al panel de administración para procesar</a></p>
         """
         
-        msg = Message(subject, recipients=[admin_email], html=body)
+        msg = build_mail_message(subject, recipients=[admin_email], html=body)
         
         def send_async():
             with app.app_context():
                 try:
-                    mail.send(msg)
+                    get_mail().send(msg)
                 except Exception as e:
                     print(f"Error al enviar correo: {str(e)}")
         
@@ -5471,7 +5811,7 @@ def send_email_async(app, msg):
     """Envía correo de forma asíncrona"""
     with app.app_context():
         try:
-            mail.send(msg)
+            get_mail().send(msg)
             print("Correo de notificación enviado exitosamente")
         except Exception as e:
             print(f"Error al enviar correo: {str(e)}")
@@ -5488,7 +5828,7 @@ def send_bloodstriker_notification(transaction_data):
         admin_email = os.environ.get('ADMIN_EMAIL', 'admin@inefable.com')
         
         # Crear mensaje
-        msg = Message(
+        msg = build_mail_message(
             subject='🎯 Nueva Transacción Blood Striker Pendiente',
             recipients=[admin_email],
             sender=app.config['MAIL_DEFAULT_SENDER']
@@ -6772,6 +7112,13 @@ def validar_freefire_latam():
             except Exception:
                 pass
             
+            # Registrar venta en estadísticas semanales (solo para usuarios normales)
+            if not is_admin:
+                try:
+                    register_weekly_sale('freefire_latam', monto_id, package_info.get('nombre', 'Paquete'), precio_unitario, cantidad, conn=conn)
+                except Exception:
+                    pass
+            
             conn.commit()
             
         except Exception as e:
@@ -6785,10 +7132,6 @@ def validar_freefire_latam():
         if not is_admin:
             session['saldo'] = saldo_actual - precio_total
         
-        # Registrar venta en estadísticas semanales (solo para usuarios normales)
-        if not is_admin:
-            register_weekly_sale('freefire_latam', monto_id, package_info.get('nombre', 'Paquete'), precio_unitario, cantidad)
-        
         # Guardar datos de la compra en la sesión para mostrar después del redirect
         if cantidad == 1:
             # Para un solo pin
@@ -7836,6 +8179,7 @@ def _bloodstrike_sync_prices_internal(deactivate_missing=False, deactivate_unmap
     # Limpiar caches
     try:
         get_bloodstriker_prices_cached.cache_clear()
+        invalidate_profit_catalog()
     except Exception:
         pass
     
@@ -8218,23 +8562,6 @@ def approve_bloodstriker_transaction(transaction_id):
             # Crear notificación personalizada para el usuario
             titulo = "🎯 Blood Striker - Recarga realizada con éxito"
             mensaje = f"Blood Striker: Recarga realizada con éxito. {bs_transaction['paquete_nombre']} por ${bs_transaction['precio']:.2f}. ID: {bs_transaction['player_id']}"
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS notificaciones_personalizadas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario_id INTEGER,
-                    titulo TEXT NOT NULL,
-                    mensaje TEXT NOT NULL,
-                    tipo TEXT DEFAULT 'info',
-                    tag TEXT,
-                    visto BOOLEAN DEFAULT FALSE,
-                    fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-                )
-            ''')
-            try:
-                conn.execute("ALTER TABLE notificaciones_personalizadas ADD COLUMN tag TEXT")
-            except Exception:
-                pass
             try:
                 conn.execute('''
                     INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo, tag)
@@ -8536,6 +8863,51 @@ def validar_freefire_id():
                 conn.close()
             except Exception:
                 pass
+
+        # 5a. Con cola habilitada: encolar y responder con la vista "procesando"
+        if FFID_REDEEM_QUEUE_ENABLED:
+            conn = get_db_connection()
+            try:
+                enqueue_redeem_job(
+                    conn,
+                    transaction_data['id'],
+                    source='web',
+                    usuario_id=user_id,
+                    player_id=player_id,
+                    paquete_id=package_id,
+                    pin_codigo=pin_codigo,
+                    precio=precio,
+                    saldo_cobrado=saldo_cobrado,
+                    request_id=request_id,
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            notify_new_job()
+
+            session['compra_freefire_id_exitosa'] = {
+                'paquete_nombre': paquete_nombre,
+                'monto_compra': precio,
+                'numero_control': transaction_data['numero_control'],
+                'transaccion_id': transaction_data['transaccion_id'],
+                'player_id': player_id,
+                'player_name': '',
+                'estado': 'procesando'
+            }
+            if idempotency_enabled:
+                conn = get_db_connection()
+                save_processing_idempotent_purchase(
+                    conn,
+                    user_id,
+                    endpoint_key,
+                    request_id,
+                    session['compra_freefire_id_exitosa'],
+                    transaction_data['transaccion_id'],
+                    transaction_data['numero_control']
+                )
+                conn.commit()
+                conn.close()
+            return redirect('/juego/freefire_id?compra=exitosa')
         
         # 5. Ejecutar redención automática (medir duración)
         import time as _time
@@ -8925,7 +9297,7 @@ def admin_freefire_id_pin_log():
                 LEFT JOIN usuarios u ON fi.usuario_id = u.id
                 LEFT JOIN precios_freefire_id p ON fi.paquete_id = p.id
                 WHERE fi.estado = 'rechazado'
-                  AND DATE(fi.fecha, '-4 hours') >= ?
+                  AND fi.local_day >= ?
                 ORDER BY fi.fecha DESC
             ''', (cutoff_day,)).fetchall()
         else:
@@ -8955,7 +9327,7 @@ def admin_freefire_id_pin_log():
                     FROM transacciones_freefire_id fi
                     LEFT JOIN usuarios u ON fi.usuario_id = u.id
                     LEFT JOIN precios_freefire_id p ON fi.paquete_id = p.id
-                    WHERE DATE(fi.fecha, '-4 hours') = ?
+                    WHERE fi.local_day = ?
 
                     UNION ALL
 
@@ -8990,7 +9362,7 @@ def admin_freefire_id_pin_log():
                       AND ao.game_type = 'freefire_id'
                       AND t.pin IS NOT NULL
                       AND TRIM(t.pin) <> ''
-                      AND DATE(t.fecha, '-4 hours') = ?
+                      AND t.local_day = ?
                 ) tx
                 ORDER BY tx.fecha DESC
             ''', (venezuela_day, venezuela_day)).fetchall()
@@ -9293,6 +9665,92 @@ PIN_LOG_TEMPLATE = r'''
 </html>
 '''
 
+def _approve_freefire_id_transaction_records(transaction_id, admin_user_id, pin_usado=None, auto_redeemed=False):
+    """Registra la aprobación de una transacción FFID: historial, profit, venta semanal y notificación."""
+    conn = get_db_connection()
+    try:
+        fi_transaction = conn.execute('''
+            SELECT fi.*, u.nombre, u.apellido, p.nombre as paquete_nombre, p.precio
+            FROM transacciones_freefire_id fi
+            JOIN usuarios u ON fi.usuario_id = u.id
+            JOIN precios_freefire_id p ON fi.paquete_id = p.id
+            WHERE fi.id = ?
+        ''', (transaction_id,)).fetchone()
+        if not fi_transaction:
+            return False
+
+        pin_info = f"ID: {fi_transaction['player_id']} - Usuario: {fi_transaction['nombre']} {fi_transaction['apellido']}"
+        if pin_usado:
+            pin_info += f" - PIN: {pin_usado[:8]}..."
+        if auto_redeemed:
+            pin_info += " [AUTO-REDIMIDO]"
+        
+        conn.execute('''
+            INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            admin_user_id,
+            fi_transaction['numero_control'],
+            pin_info,
+            fi_transaction['transaccion_id'],
+            fi_transaction['paquete_nombre'],
+            fi_transaction['monto']
+        ))
+        # Registrar en historial permanente
+        _fi_precio = abs(fi_transaction['monto'])
+        _fi_saldo_row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (fi_transaction['usuario_id'],)).fetchone()
+        _fi_saldo = _fi_saldo_row['saldo'] if _fi_saldo_row else 0
+        registrar_historial_compra(conn, fi_transaction['usuario_id'], _fi_precio, fi_transaction['paquete_nombre'], f"ID: {fi_transaction['player_id']}", 'compra', None, _fi_saldo + _fi_precio, _fi_saldo)
+        
+        # Persistir profit (legacy)
+        try:
+            admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
+            admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
+            is_admin_target = fi_transaction['usuario_id'] in admin_ids
+            record_profit_for_transaction(conn, fi_transaction['usuario_id'], is_admin_target, 'freefire_id', fi_transaction['paquete_id'], 1, fi_transaction['precio'], fi_transaction['transaccion_id'])
+        except Exception:
+            pass
+        
+        conn.commit()
+        
+        # Registrar venta en estadísticas semanales (solo para usuarios normales)
+        admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
+        admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
+        is_admin_user = fi_transaction['usuario_id'] in admin_ids
+        
+        if not is_admin_user:
+            register_weekly_sale(
+                'freefire_id', 
+                fi_transaction['paquete_id'], 
+                fi_transaction['paquete_nombre'], 
+                fi_transaction['precio'], 
+                1
+            )
+        
+        # Crear notificación personalizada para el usuario
+        titulo = "Free Fire ID - Recarga realizada"
+        mensaje = f"Free Fire ID: Recarga realizada con exito. {fi_transaction['paquete_nombre']} por ${fi_transaction['precio']:.2f}. ID: {fi_transaction['player_id']}"
+        if auto_redeemed:
+            mensaje += " (Automatica)"
+        try:
+            conn.execute('''
+                INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo, tag)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (fi_transaction['usuario_id'], titulo, mensaje, 'success', 'freefire_id_reload'))
+            conn.commit()
+        except Exception:
+            conn.execute('''
+                INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo)
+                VALUES (?, ?, ?, ?)
+            ''', (fi_transaction['usuario_id'], titulo, mensaje, 'success'))
+            conn.commit()
+    finally:
+        conn.close()
+
+    update_freefire_id_transaction_status(transaction_id, 'aprobado', admin_user_id)
+    return True
+
+
 @app.route('/admin/approve_freefire_id/<int:transaction_id>', methods=['POST'])
 @csrf_protect('/')
 def approve_freefire_id_transaction(transaction_id):
@@ -9335,6 +9793,32 @@ def approve_freefire_id_transaction(transaction_id):
             
             pin_codigo = pin_disponible['pin_codigo']
             player_id = fi_transaction['player_id']
+
+            if FFID_REDEEM_QUEUE_ENABLED:
+                # La redención corre en el pool; el worker aprueba la transacción al terminar.
+                try:
+                    enqueue_redeem_job(
+                        conn,
+                        transaction_id,
+                        source='admin',
+                        usuario_id=fi_transaction['usuario_id'],
+                        player_id=player_id,
+                        paquete_id=paquete_id,
+                        pin_codigo=pin_codigo,
+                        precio=fi_transaction['precio'],
+                        admin_id=session.get('user_db_id'),
+                    )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    conn.close()
+                    restore_freefire_id_pin_if_unverified(paquete_id, pin_codigo, None, log_prefix='[FreeFire ID Admin]')
+                    flash(f'No se pudo encolar la redención (¿ya está en cola?): {str(e)[:120]}', 'error')
+                    return redirect('/')
+                conn.close()
+                notify_new_job()
+                flash(f'Redención encolada para jugador {player_id}. La transacción se aprobará al completarse.', 'info')
+                return redirect('/')
             
             # 2. Ejecutar la redención automática en redeempins.com
             try:
@@ -9375,77 +9859,13 @@ def approve_freefire_id_transaction(transaction_id):
             pin_usado = pin_codigo
         
         # === APROBAR TRANSACCIÓN ===
-        admin_user_id = session.get('user_db_id')
-        
-        pin_info = f"ID: {fi_transaction['player_id']} - Usuario: {fi_transaction['nombre']} {fi_transaction['apellido']}"
-        if pin_usado:
-            pin_info += f" - PIN: {pin_usado[:8]}..."
-        if redeem_result and redeem_result.success:
-            pin_info += " [AUTO-REDIMIDO]"
-        
-        conn.execute('''
-            INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            admin_user_id,
-            fi_transaction['numero_control'],
-            pin_info,
-            fi_transaction['transaccion_id'],
-            fi_transaction['paquete_nombre'],
-            fi_transaction['monto']
-        ))
-        # Registrar en historial permanente
-        _fi_precio = abs(fi_transaction['monto'])
-        _fi_saldo_row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (fi_transaction['usuario_id'],)).fetchone()
-        _fi_saldo = _fi_saldo_row['saldo'] if _fi_saldo_row else 0
-        registrar_historial_compra(conn, fi_transaction['usuario_id'], _fi_precio, fi_transaction['paquete_nombre'], f"ID: {fi_transaction['player_id']}", 'compra', None, _fi_saldo + _fi_precio, _fi_saldo)
-        
-        # Persistir profit (legacy)
-        try:
-            admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
-            admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
-            is_admin_target = fi_transaction['usuario_id'] in admin_ids
-            record_profit_for_transaction(conn, fi_transaction['usuario_id'], is_admin_target, 'freefire_id', fi_transaction['paquete_id'], 1, fi_transaction['precio'], fi_transaction['transaccion_id'])
-        except Exception:
-            pass
-        
-        conn.commit()
-        
-        # Registrar venta en estadísticas semanales (solo para usuarios normales)
-        admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
-        admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
-        is_admin_user = fi_transaction['usuario_id'] in admin_ids
-        
-        if not is_admin_user:
-            register_weekly_sale(
-                'freefire_id', 
-                fi_transaction['paquete_id'], 
-                fi_transaction['paquete_nombre'], 
-                fi_transaction['precio'], 
-                1
-            )
-        
-        # Crear notificación personalizada para el usuario
-        titulo = "Free Fire ID - Recarga realizada"
-        mensaje = f"Free Fire ID: Recarga realizada con exito. {fi_transaction['paquete_nombre']} por ${fi_transaction['precio']:.2f}. ID: {fi_transaction['player_id']}"
-        if redeem_result and redeem_result.success:
-            mensaje += " (Automatica)"
-        try:
-            conn.execute('''
-                INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo, tag)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (fi_transaction['usuario_id'], titulo, mensaje, 'success', 'freefire_id_reload'))
-            conn.commit()
-        except Exception:
-            conn.execute('''
-                INSERT INTO notificaciones_personalizadas (usuario_id, titulo, mensaje, tipo)
-                VALUES (?, ?, ?, ?)
-            ''', (fi_transaction['usuario_id'], titulo, mensaje, 'success'))
-            conn.commit()
-        
         conn.close()
-        
-        update_freefire_id_transaction_status(transaction_id, 'aprobado', session.get('user_db_id'))
+        _approve_freefire_id_transaction_records(
+            transaction_id,
+            session.get('user_db_id'),
+            pin_usado=pin_usado,
+            auto_redeemed=bool(redeem_result and redeem_result.success),
+        )
         
         if redeem_result and redeem_result.success:
             flash(f'Transaccion aprobada y pin redimido automaticamente para jugador {fi_transaction["player_id"]}', 'success')
@@ -10089,6 +10509,7 @@ def update_purchase_price(juego, paquete_id, nuevo_precio):
         
         conn.execute(query, (str(juego), int(paquete_id), float(nuevo_precio)))
         conn.commit()
+        invalidate_profit_catalog()
         
         return True
         
@@ -10190,53 +10611,47 @@ def get_profit_analysis():
     conn.close()
     return freefire_latam_analysis + freefire_global_analysis + bloodstriker_analysis + freefire_id_analysis
 
-def register_weekly_sale(juego, paquete_id, paquete_nombre, precio_venta, cantidad=1):
-    """Registra una venta en las estadísticas diarias (corregido para resetear a las 12 AM)"""
+def register_weekly_sale(juego, paquete_id, paquete_nombre, precio_venta, cantidad=1, conn=None):
+    """Registra una venta en las estadísticas diarias (corregido para resetear a las 12 AM)
+
+    Con `conn` escribe en la conexión de la compra (sin commit); si no, abre una propia.
+    """
     from datetime import datetime
     import pytz
     
-    conn = get_db_connection()
-    
-    # Obtener precio de compra
-    precio_compra = get_purchase_price(juego, paquete_id)
-    ganancia_unitaria = precio_venta - precio_compra
-    ganancia_total = ganancia_unitaria * cantidad
-    
-    # Usar zona horaria de Venezuela para calcular el día correcto
-    venezuela_tz = pytz.timezone('America/Caracas')
-    now_venezuela = datetime.now(venezuela_tz)
-    
-    # Calcular día del año (formato: YYYY-MM-DD) - resetea a las 12:00 AM
-    dia_year = now_venezuela.strftime('%Y-%m-%d')
-    
-    # Verificar si ya existe un registro para este día y paquete
-    existing = conn.execute('''
-        SELECT id, cantidad_vendida, ganancia_total FROM ventas_semanales 
-        WHERE juego = ? AND paquete_id = ? AND semana_year = ?
-    ''', (juego, paquete_id, dia_year)).fetchone()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     
-    if existing:
-        # Actualizar registro existente
-        nueva_cantidad = existing['cantidad_vendida'] + cantidad
-        nueva_ganancia_total = existing['ganancia_total'] + ganancia_total
+    try:
+        # Obtener precio de compra
+        precio_compra = get_active_purchase_cost(conn, str(juego), paquete_id)
+        ganancia_unitaria = precio_venta - precio_compra
+        ganancia_total = ganancia_unitaria * cantidad
         
-        conn.execute('''
-            UPDATE ventas_semanales 
-            SET cantidad_vendida = ?, ganancia_total = ?, fecha_venta = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (nueva_cantidad, nueva_ganancia_total, existing['id']))
-    else:
-        # Crear nuevo registro
-        conn.execute('''
-            INSERT INTO ventas_semanales 
-            (juego, paquete_id, paquete_nombre, precio_venta, precio_compra, 
-             ganancia_unitaria, cantidad_vendida, ganancia_total, semana_year)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (juego, paquete_id, paquete_nombre, precio_venta, precio_compra, 
-              ganancia_unitaria, cantidad, ganancia_total, dia_year))
-    
-    conn.commit()
-    conn.close()
+        # Usar zona horaria de Venezuela para calcular el día correcto
+        venezuela_tz = pytz.timezone('America/Caracas')
+        now_venezuela = datetime.now(venezuela_tz)
+        
+        # Calcular día del año (formato: YYYY-MM-DD) - resetea a las 12:00 AM
+        dia_year = now_venezuela.strftime('%Y-%m-%d')
+        
+        # Una sola sentencia atómica por (juego, paquete, día)
+        increment_aggregate(
+            conn, 'ventas_semanales',
+            {'juego': juego, 'paquete_id': paquete_id, 'semana_year': dia_year},
+            {'cantidad_vendida': cantidad, 'ganancia_total': ganancia_total},
+            insert_values={
+                'paquete_nombre': paquete_nombre, 'precio_venta': precio_venta,
+                'precio_compra': precio_compra, 'ganancia_unitaria': ganancia_unitaria,
+            },
+            touch=('fecha_venta', 'CURRENT_TIMESTAMP'),
+        )
+        if own_conn:
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
 
 def get_weekly_sales_stats():
     """Obtiene estadísticas de ventas del día actual (corregido para usar días)"""
@@ -10366,6 +10781,17 @@ def clean_old_transactions():
     conn = get_db_connection()
     
     try:
+        # Antes de purgar historial_compras, consolidar la ganancia de los días cerrados en el
+        # rollup diario. fold_closed_profit_days hace su propio commit: va antes de los DELETE.
+        hist_folded = False
+        try:
+            oldest = conn.execute("SELECT MIN(local_day) AS day FROM historial_compras WHERE tipo_evento = 'compra'").fetchone()
+            if oldest and oldest['day']:
+                fold_closed_profit_days(conn, str(oldest['day']), datetime.now().date().isoformat())
+            hist_folded = True
+        except Exception as e:
+            logger.warning(f"No se pudo consolidar la ganancia; se conserva historial_compras: {e}")
+
         # Conservar el mes actual y el inmediatamente anterior.
         fecha_limite = get_orders_retention_cutoff(datetime.now())
         fecha_limite_str = fecha_limite.strftime('%Y-%m-%d %H:%M:%S')
@@ -10394,9 +10820,11 @@ def clean_old_transactions():
         
         # Eliminar historial_compras más antiguo de 3 días (mismo rango que la visualización en Costo)
         fecha_limite_hist = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
-        deleted_hist = conn.execute('''
-            DELETE FROM historial_compras WHERE fecha < ?
-        ''', (fecha_limite_hist,)).rowcount
+        deleted_hist = 0
+        if hist_folded:
+            deleted_hist = conn.execute('''
+                DELETE FROM historial_compras WHERE fecha < ?
+            ''', (fecha_limite_hist,)).rowcount
         
         conn.commit()
         
@@ -10860,6 +11288,13 @@ def validar_freefire():
         except Exception:
             pass
         
+        # Registrar venta en estadísticas semanales (solo para usuarios normales)
+        if not is_admin:
+            try:
+                register_weekly_sale('freefire_global', monto_id, package_info.get('nombre', 'Paquete'), precio_unitario, cantidad, conn=conn)
+            except Exception:
+                pass
+        
         success_payload = {
             'paquete_nombre': paquete_nombre,
             'monto_compra': precio_total,
@@ -10909,10 +11344,6 @@ def validar_freefire():
     if not is_admin:
         session['saldo'] = saldo_actual - precio_total
     
-    # Registrar venta en estadísticas semanales (solo para usuarios normales)
-    if not is_admin:
-        register_weekly_sale('freefire_global', monto_id, package_info.get('nombre', 'Paquete'), precio_unitario, cantidad)
-    
     # Guardar datos de la compra en la sesión para mostrar después del redirect
     if cantidad == 1:
         # Para un solo pin
@@ -10972,7 +11403,7 @@ def dashboard():
         preset = 'hoy'
     
     # Actualizar saldo desde la base de datos y obtener transacciones
-    conn = get_db_connection()
+    conn = get_request_connection()
     
     if is_admin:
         # Admin ve estadísticas globales
@@ -10983,7 +11414,7 @@ def dashboard():
                  u.id as usuario_id, u.nombre, u.apellido
             FROM historial_compras h
             JOIN usuarios u ON h.usuario_id = u.id
-            WHERE h.tipo_evento = 'compra' AND DATE(h.fecha, '-4 hours') BETWEEN ? AND ?
+            WHERE h.tipo_evento = 'compra' AND h.local_day BETWEEN ? AND ?
             ORDER BY h.fecha DESC
         ''', (fecha_inicio, fecha_fin)).fetchall()
         
@@ -11031,7 +11462,7 @@ def dashboard():
                  u.id as usuario_id, u.nombre, u.apellido
             FROM historial_compras h
             JOIN usuarios u ON h.usuario_id = u.id
-            WHERE h.usuario_id = ? AND h.tipo_evento = 'compra' AND DATE(h.fecha, '-4 hours') BETWEEN ? AND ?
+            WHERE h.usuario_id = ? AND h.tipo_evento = 'compra' AND h.local_day BETWEEN ? AND ?
             ORDER BY h.fecha DESC
         ''', (user_id, fecha_inicio, fecha_fin)).fetchall()
         
@@ -11089,7 +11520,7 @@ def dashboard():
             pins_list = [p.strip() for p in (raw_pin.replace('\r','').split('\n') if '\n' in raw_pin else [raw_pin]) if p.strip()]
             pin_sample = pins_list[0] if pins_list else None
             if pin_sample:
-                c2 = get_db_connection()
+                c2 = get_request_connection()
                 try:
                     row_latam = c2.execute('SELECT monto_id FROM pines_freefire WHERE pin_codigo = ? LIMIT 1', (pin_sample,)).fetchone()
                     row_global = None if row_latam else c2.execute('SELECT monto_id FROM pines_freefire_global WHERE pin_codigo = ? LIMIT 1', (pin_sample,)).fetchone()
@@ -11313,16 +11744,12 @@ def dashboard():
     ganancia_mes_periodo = today.strftime('%Y-%m')
     if is_admin:
         try:
-            from admin_stats import (
-                _load_dashboard_profit_catalog,
-                _resolve_dashboard_profit_amount,
-                compute_admin_profit_by_day,
-            )
+            from admin_stats import compute_admin_profit_by_day, get_profit_catalog_index
 
-            metrics_conn = get_db_connection()
+            metrics_conn = get_request_connection()
             try:
-                dashboard_profit_catalog = _load_dashboard_profit_catalog(metrics_conn)
-                resolve_dashboard_profit_amount = _resolve_dashboard_profit_amount
+                dashboard_profit_catalog = get_profit_catalog_index(metrics_conn)
+                resolve_dashboard_profit_amount = dashboard_profit_catalog.profit_amount
 
                 month_start_local = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
                 if month_start_local.month == 12:
@@ -11347,7 +11774,6 @@ def dashboard():
     if is_admin and dashboard_profit_catalog and resolve_dashboard_profit_amount:
         for transaction in dashboard_source_transactions:
             profit_unit, profit_total = resolve_dashboard_profit_amount(
-                dashboard_profit_catalog,
                 transaction.get('dashboard_item'),
                 transaction.get('dashboard_package'),
                 float(transaction.get('monto') or 0.0),
@@ -11498,7 +11924,7 @@ def dashboard():
     # Contador total de usuarios (para estadísticas de admin)
     total_users = 0
     try:
-        c_count = get_db_connection()
+        c_count = get_request_connection()
         total_users = c_count.execute('SELECT COUNT(*) FROM usuarios').fetchone()[0]
     finally:
         try:
@@ -11769,68 +12195,75 @@ def api_simple_endpoint():
                 quantity = len(pins_list)
                 precio_total = precio_unitario * quantity
         
-        # Descontar saldo de forma atómica
-        conn = get_db_connection()
-        debit_result = debit_user_balance_atomic(conn, user['id'], precio_total)
-        if not debit_result['ok']:
-            conn.close()
-            if local_pins_reserved:
-                pin_manager.restore_local_pins(package_id, local_pins_reserved)
-            return jsonify({
-                'status': 'error',
-                'code': '402',
-                'message': f'Saldo insuficiente. Necesitas ${precio_total:.2f} pero tienes ${debit_result["saldo_actual"]:.2f}'
-            }), 402
-
-        saldo_actual = debit_result['saldo_antes']
-        nuevo_saldo = debit_result['saldo_despues']
-        
-        # Crear registro de transacción
-        pins_texto = '\n'.join(pins_list)
-        
         # Generar datos de la transacción
+        pins_texto = '\n'.join(pins_list)
         numero_control = ''.join(random.choices(string.digits, k=10))
         transaccion_id = 'API-' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
         
         # Calcular nombre del paquete tal como en Admin y con cantidad
         paquete_nombre = f"{package_info['nombre']} x{quantity}" if quantity > 1 else package_info['nombre']
         
-        conn.execute('''
-            INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user['id'], numero_control, pins_texto, transaccion_id, paquete_nombre, -precio_total))
-        
-        # Registrar en historial permanente
-        registrar_historial_compra(conn, user['id'], precio_total, paquete_nombre, pins_texto, 'compra', None, saldo_actual, nuevo_saldo)
+        admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
+        admin_emails_env = os.environ.get('ADMIN_EMAILS', '').strip()
+        single_admin_email = os.environ.get('ADMIN_EMAIL', '').strip()
+        admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
+        admin_emails = [x.strip() for x in admin_emails_env.split(',') if x.strip()]
+        if single_admin_email and single_admin_email not in admin_emails:
+            admin_emails.append(single_admin_email)
+        is_admin_user = (user['id'] in admin_ids) or (user['correo'] in admin_emails)
         
-        # Persistir profit (legacy) también para compras vía API
+        conn = get_db_connection()
         try:
-            admin_ids_env = os.environ.get('ADMIN_USER_IDS', '').strip()
-            admin_emails_env = os.environ.get('ADMIN_EMAILS', '').strip()
-            single_admin_email = os.environ.get('ADMIN_EMAIL', '').strip()
-            admin_ids = [int(x.strip()) for x in admin_ids_env.split(',') if x.strip().isdigit()]
-            admin_emails = [x.strip() for x in admin_emails_env.split(',') if x.strip()]
-            if single_admin_email and single_admin_email not in admin_emails:
-                admin_emails.append(single_admin_email)
-            is_admin_user = (user['id'] in admin_ids) or (user['correo'] in admin_emails)
-            record_profit_for_transaction(conn, user['id'], is_admin_user, 'freefire_latam', package_id, quantity, precio_unitario, transaccion_id)
-        except Exception:
-            pass
-        
-        # Limitar transacciones (100 para admin, 30 para usuarios normales)
-        limit = 100 if is_admin_user else 30
-        conn.execute('''
-            DELETE FROM transacciones 
-            WHERE usuario_id = ? AND id NOT IN (
-                SELECT id FROM (SELECT id FROM transacciones 
-                WHERE usuario_id = ? 
-                ORDER BY fecha DESC 
-                LIMIT ?) AS keep_ids
-            )
-        ''', (user['id'], user['id'], limit))
+            # Lecturas antes del lote: dentro de conn.pipeline() solo el débito espera respuesta
+            costo_unit = get_active_purchase_cost(conn, 'freefire_latam', package_id)
+            
+            # El lote lleva solo lo que no puede fallar sin deshacer la compra: en
+            # PostgreSQL un error dentro de la transacción la aborta entera.
+            with conn.pipeline():
+                # Descontar saldo de forma atómica
+                debit_result = debit_user_balance_atomic(conn, user['id'], precio_total)
+                if debit_result['ok']:
+                    saldo_actual = debit_result['saldo_antes']
+                    nuevo_saldo = debit_result['saldo_despues']
+                    
+                    # Crear registro de transacción
+                    conn.execute('''
+                        INSERT INTO transacciones (usuario_id, numero_control, pin, transaccion_id, paquete_nombre, monto)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (user['id'], numero_control, pins_texto, transaccion_id, paquete_nombre, -precio_total))
+                    
+                    # Limitar transacciones (100 para admin, 30 para usuarios normales)
+                    limit = 100 if is_admin_user else 30
+                    conn.execute('''
+                        DELETE FROM transacciones 
+                        WHERE usuario_id = ? AND id NOT IN (
+                            SELECT id FROM (SELECT id FROM transacciones 
+                            WHERE usuario_id = ? 
+                            ORDER BY fecha DESC 
+                            LIMIT ?) AS keep_ids
+                        )
+                    ''', (user['id'], user['id'], limit))
+            
+            # Estadísticas con la compra ya confirmada: cada helper ignora sus propios
+            # errores y, en autocommit, un fallo no arrastra al débito.
+            if debit_result['ok']:
+                registrar_historial_compra(conn, user['id'], precio_total, paquete_nombre, pins_texto, 'compra', None,
+                                           saldo_actual, nuevo_saldo, user=user)
+                record_profit_for_transaction(conn, user['id'], is_admin_user, 'freefire_latam', package_id, quantity,
+                                              precio_unitario, transaccion_id,
+                                              sin_ganancia=bool(user.get('sin_ganancia')), costo_unit=costo_unit)
+                conn.commit()
+        finally:
+            conn.close()
         
-        conn.commit()
-        conn.close()
+        if not debit_result['ok']:
+            if local_pins_reserved:
+                pin_manager.restore_local_pins(package_id, local_pins_reserved)
+            return jsonify({
+                'status': 'error',
+                'code': '402',
+                'message': f'Saldo insuficiente. Necesitas ${precio_total:.2f} pero tienes ${debit_result["saldo_actual"]:.2f}'
+            }), 402
         
         # Preparar respuesta exitosa
         response_data = {
@@ -12065,19 +12498,19 @@ def admin_costos_summary():
 
         # Gasto hoy (desde historial permanente)
         r_hoy = conn.execute(
-            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND DATE(fecha, '-4 hours') = ?",
+            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND local_day = ?",
             (admin_id, today_str)
         ).fetchone()
 
         # Gasto semanal
         r_sem = conn.execute(
-            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND DATE(fecha, '-4 hours') >= ?",
+            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND local_day >= ?",
             (admin_id, week_start)
         ).fetchone()
 
         # Gasto mensual
         r_mes = conn.execute(
-            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND DATE(fecha, '-4 hours') >= ?",
+            "SELECT COALESCE(SUM(monto), 0) as total, COUNT(*) as cnt FROM historial_compras WHERE usuario_id = ? AND local_day >= ?",
             (admin_id, month_start)
         ).fetchone()
 
@@ -12145,7 +12578,7 @@ def admin_get_costos_day(day):
                 h.saldo_antes as h_saldo_antes, h.saldo_despues as h_saldo_despues
             FROM historial_compras h
             JOIN usuarios u ON h.usuario_id = u.id
-            WHERE DATE(h.fecha, '-4 hours') = ? {user_filter_h}
+            WHERE h.local_day = ? {user_filter_h}
         '''
 
         # 2. Créditos añadidos (creditos_billetera)
@@ -12160,7 +12593,7 @@ def admin_get_costos_day(day):
                 NULL as h_saldo_antes, NULL as h_saldo_despues
             FROM creditos_billetera cb
             JOIN usuarios u ON cb.usuario_id = u.id
-            WHERE DATE(cb.fecha, '-4 hours') = ? {user_filter_cb}
+            WHERE cb.local_day = ? {user_filter_cb}
         '''
 
         # 3. Recargas FF ID fallidas/rechazadas (reembolso)
@@ -12176,7 +12609,7 @@ def admin_get_costos_day(day):
                 NULL as h_saldo_antes, NULL as h_saldo_despues
             FROM transacciones_freefire_id fi
             JOIN usuarios u ON fi.usuario_id = u.id
-            WHERE DATE(fi.fecha, '-4 hours') = ? AND fi.estado = 'rechazado' {user_filter_fi}
+            WHERE fi.local_day = ? AND fi.estado = 'rechazado' {user_filter_fi}
         '''
 
         # 4. Recargas Binance completadas
@@ -12317,21 +12750,21 @@ def admin_get_user_costos_detail(day, user_id):
             SELECT h.id, h.monto, h.fecha, h.paquete_nombre, h.pin, h.tipo_evento, h.duracion_segundos,
                 h.saldo_antes as h_saldo_antes, h.saldo_despues as h_saldo_despues
             FROM historial_compras h
-            WHERE h.usuario_id = ? AND DATE(h.fecha, '-4 hours') = ?
+            WHERE h.usuario_id = ? AND h.local_day = ?
         '''
         # Créditos
         q2 = '''
             SELECT cb.id, cb.monto, cb.fecha, 'Crédito añadido' as paquete_nombre, '' as pin, 'credito' as tipo_evento, NULL as duracion_segundos,
                 NULL as h_saldo_antes, NULL as h_saldo_despues
             FROM creditos_billetera cb
-            WHERE cb.usuario_id = ? AND DATE(cb.fecha, '-4 hours') = ?
+            WHERE cb.usuario_id = ? AND cb.local_day = ?
         '''
         # Reembolsos FF ID
         q3 = '''
             SELECT fi.id, fi.monto, fi.fecha, 'FF ID Fallida (reembolso)' as paquete_nombre, fi.player_id as pin, 'reembolso' as tipo_evento, NULL as duracion_segundos,
                 NULL as h_saldo_antes, NULL as h_saldo_despues
             FROM transacciones_freefire_id fi
-            WHERE fi.usuario_id = ? AND DATE(fi.fecha, '-4 hours') = ? AND fi.estado = 'rechazado'
+            WHERE fi.usuario_id = ? AND fi.local_day = ? AND fi.estado = 'rechazado'
         '''
         # Recargas Binance completadas
         q4 = '''
@@ -13232,6 +13665,43 @@ def api_recharge_freefire_id():
         except Exception as _txe:
             logger.warning(f'[API FF-ID] No se pudo actualizar transacción FFID {transaction_data.get("id")}: {_txe}')
 
+    if FFID_REDEEM_QUEUE_ENABLED:
+        conn_queue = get_db_connection()
+        try:
+            enqueue_redeem_job(
+                conn_queue,
+                transaction_data['id'],
+                source='api',
+                usuario_id=api_user_id,
+                player_id=player_id,
+                paquete_id=package_id,
+                pin_codigo=pin_codigo,
+                precio=precio,
+                request_id=request_id,
+            )
+            conn_queue.commit()
+        except Exception as e:
+            logger.error(f'[API FF-ID] Error encolando redención: {e}')
+            _update_ffid_api_transaction('rechazado', f'No se pudo encolar la redención: {str(e)[:200]}')
+            restore_freefire_id_pin_if_unverified(package_id, pin_codigo, None, log_prefix='[API FF-ID]')
+            _clear_whitelabel_api_purchase(api_user_id, endpoint_key, request_id)
+            return jsonify({'ok': False, 'error': 'No se pudo encolar la recarga'}), 500
+        finally:
+            conn_queue.close()
+        notify_new_job()
+
+        processing_payload = {
+            'ok': True,
+            'purchase_status': 'processing',
+            'transaccion_id': transaction_data['transaccion_id'],
+            'numero_control': transaction_data['numero_control'],
+        }
+        _save_whitelabel_api_purchase_processing(
+            api_user_id, endpoint_key, request_id, processing_payload,
+            transaction_data['transaccion_id'], transaction_data['numero_control'],
+        )
+        return jsonify(processing_payload), 202
+
     try:
         redeem_result = redeem_pin_vps(pin_codigo, player_id, redeemer_config)
     except Exception as e:
@@ -13271,16 +13741,8 @@ def api_recharge_freefire_id():
         pass
 
     def _log_api_recharge(success, player_name='', error_msg=''):
-        try:
-            _lc = get_db_connection()
-            _lc.execute(
-                'INSERT INTO api_recharges_log (player_id, package_id, success, player_name, error_msg, duration_seconds, game_name, package_name) VALUES (?,?,?,?,?,?,?,?)',
-                (player_id, package_id, 1 if success else 0, player_name, error_msg, _dur, 'Free Fire ID', _ff_pkg_name)
-            )
-            _lc.commit()
-            _lc.close()
-        except Exception as _le:
-            logger.warning(f'[API FF-ID] No se pudo guardar log: {_le}')
+        _log_freefire_id_api_recharge(player_id, package_id, success, player_name=player_name,
+                                      error_msg=error_msg, duration=_dur, package_name=_ff_pkg_name)
 
     if redeem_result and redeem_result.success:
         pname = redeem_result.player_name or ''
@@ -13379,7 +13841,7 @@ def _send_daily_backup():
         with app.app_context():
             fecha = datetime.now(pytz.timezone('America/Caracas')).strftime('%Y-%m-%d')
             zip_buf = _build_backup_zip()
-            msg = Message(
+            msg = build_mail_message(
                 subject=f'[Inefable Store] Backup diario {fecha}',
                 recipients=[dest],
                 body=(
@@ -13395,7 +13857,7 @@ def _send_daily_backup():
                 content_type='application/zip',
                 data=zip_buf.read()
             )
-            mail.send(msg)
+            get_mail().send(msg)
             logger.info(f'[Backup] Backup diario enviado a {dest}')
     except Exception as e:
         logger.error(f'[Backup] Error enviando backup: {e}')
@@ -13416,10 +13878,151 @@ def _backup_scheduler_thread():
         _send_daily_backup()
 
 
-# Iniciar thread de backup (evita doble arranque en modo debug)
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug:
-    _bt = threading.Thread(target=_backup_scheduler_thread, daemon=True)
-    _bt.start()
+# === Hilos en background ===
+# Se arrancan una vez por proceso desde start_background_workers(). Con
+# APP_DEFER_BACKGROUND_WORKERS (lo activa gunicorn.conf.py) no se arrancan al
+# importar: gunicorn los inicia en cada worker tras el fork, así preload_app
+# puede importar la app en el master sin dejar hilos allí.
+APP_DEFER_BACKGROUND_WORKERS = str(os.environ.get('APP_DEFER_BACKGROUND_WORKERS', '')).strip().lower() in {'1', 'true', 'yes', 'on'}
+
+_background_workers_pid = None
+_background_workers_lock = threading.Lock()
+
+
+def start_background_workers():
+    """Arranca los hilos en background del proceso actual (idempotente por PID)."""
+    global _background_workers_pid
+    with _background_workers_lock:
+        if _background_workers_pid == os.getpid():
+            return False
+        _background_workers_pid = os.getpid()
+
+    threading.Thread(target=_binance_verification_loop, daemon=True, name='binance-verify').start()
+
+    threading.Thread(target=_dyngame_price_sync_loop, daemon=True, name='dyn-price-sync').start()
+    logger.info(f"[DynPrice AutoSync] Thread iniciado — sincronización cada {_DYN_SYNC_INTERVAL_HOURS}h")
+
+    threading.Thread(target=_dyngame_serial_poll_loop, daemon=True, name='dyn-game-poll').start()
+    logger.info(f"[DynGame Poll] Thread iniciado — verificación GamePoint pendiente cada {_DYN_GAME_POLL_INTERVAL_SECONDS}s")
+
+    # Backup diario (evita doble arranque en modo debug)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug:
+        threading.Thread(target=_backup_scheduler_thread, daemon=True, name='daily-backup').start()
+
+    # Cola persistente de /api/v1/recharge asíncrono: retoma lo que quedó de procesos anteriores
+    start_whitelabel_async_workers(only_if_backlog=True)
+
+    # Pool de redenciones Free Fire ID en cola
+    if FFID_REDEEM_QUEUE_ENABLED:
+        start_redeem_workers(_process_freefire_id_redeem_job, vps_handler=_check_freefire_id_vps_job)
+    return True
+
+
+if not APP_DEFER_BACKGROUND_WORKERS:
+    start_background_workers()
+
+
+@app.route('/api/vps/callback', methods=['POST'])
+def vps_job_callback():
+    """Aviso del VPS cuando termina un job de redención (ver redeem_hype_vps).
+
+    El cuerpo solo aporta el job_id: el resultado se vuelve a pedir al VPS
+    (GET /jobs/<id>) para no aceptar un resultado inventado en el aviso.
+    """
+    expected_token = os.environ.get('VPS_CALLBACK_TOKEN', '').strip()
+    if not expected_token:
+        return jsonify({'ok': False, 'error': 'Callback no configurado'}), 503
+    provided_token = request.headers.get('X-Callback-Token', '').strip()
+    if not hmac_module.compare_digest(provided_token, expected_token):
+        return jsonify({'ok': False, 'error': 'Token inválido'}), 401
+
+    data = request.get_json(silent=True) or {}
+    job_id = str(data.get('job_id') or '').strip()
+    if not job_id:
+        return jsonify({'ok': False, 'error': 'job_id requerido'}), 400
+
+    redeemer_config = get_redeemer_config_from_db(get_db_connection)
+    try:
+        job_data = get_redeem_job(job_id, redeemer_config)
+    except Exception as e:
+        logger.warning(f'[VPS Callback] No se pudo consultar el job {job_id}: {e}')
+        return jsonify({'ok': False, 'error': 'No se pudo consultar el job en el VPS'}), 502
+
+    parked = find_ffid_vps_job(job_id)
+    if parked:
+        redeem_result = job_result(job_data, parked['pin_codigo'], parked['player_id'])
+        if redeem_result is None:
+            return jsonify({'ok': True, 'pending': True})
+        closed = _close_parked_freefire_id_job(parked, redeem_result, redeemer_config, f'callback:{os.getpid()}')
+        return jsonify({'ok': True, 'closed': closed})
+    # Espera síncrona: si el hilo está en otro worker, lo resolverá su sondeo
+    return jsonify({'ok': True, 'delivered': notify_job_result(job_id, job_data)})
+
+
+@app.route('/admin/api/circuit_breakers')
+def admin_circuit_breakers():
+    """Estado de los circuit breakers y latencias por proveedor (proceso actual)."""
+    if not session.get('is_admin'):
+        return jsonify({'ok': False, 'error': 'Acceso denegado'}), 403
+    return jsonify({
+        'ok': True,
+        'pid': os.getpid(),
+        'breakers': get_all_breaker_stats(),
+        'binance_endpoints': _binance_selector.stats(),
+    })
+
+
+@app.route('/admin/api/sql_stats')
+def admin_sql_stats():
+    """Top-N de consultas por huella (proceso actual); requiere PG_QUERY_STATS=1."""
+    if not session.get('is_admin'):
+        return jsonify({'ok': False, 'error': 'Acceso denegado'}), 403
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except (TypeError, ValueError):
+        limit = 20
+    return jsonify({
+        'ok': True,
+        'pid': os.getpid(),
+        'enabled': pg_compat.QUERY_STATS_ENABLED,
+        'slow_query_ms': pg_compat.SLOW_QUERY_MS,
+        'order': request.args.get('order', 'total'),
+        'queries': get_query_stats(limit, request.args.get('order', 'total')),
+    })
+
+
+@app.route('/admin/api/profiler', methods=['GET', 'POST'])
+@csrf_protect('/admin')
+def admin_request_profiler():
+    """Activa/desactiva el perfilado de requests y lista los perfiles guardados."""
+    if not session.get('is_admin'):
+        return jsonify({'ok': False, 'error': 'Acceso denegado'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        try:
+            config = request_profiler.set_config(
+                enabled=str(data.get('enabled', '')).strip().lower() in ('1', 'true', 'yes', 'on'),
+                sample_rate=data.get('sample_rate') or 0.0,
+                endpoint=data.get('endpoint') or '',
+                path_prefix=data.get('path_prefix') or '',
+                user_id=data.get('user_id'),
+                duration_minutes=data.get('duration_minutes') or request_profiler.DEFAULT_DURATION_MINUTES,
+            )
+        except (TypeError, ValueError):
+            return jsonify({'ok': False, 'error': 'Parámetros inválidos'}), 400
+    else:
+        config = request_profiler.get_config()
+    return jsonify({'ok': True, 'config': config, 'profiles': request_profiler.list_profiles()})
+
+
+@app.route('/admin/api/profiler/<name>')
+def admin_request_profile_download(name):
+    if not session.get('is_admin'):
+        return jsonify({'ok': False, 'error': 'Acceso denegado'}), 403
+    path = request_profiler.profile_path(name)
+    if path is None:
+        return jsonify({'ok': False, 'error': 'Perfil no encontrado'}), 404
+    return send_file(path, mimetype='application/gzip', as_attachment=True, download_name=name)
 
 
 @app.route('/admin/api_recharges_log')
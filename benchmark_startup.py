@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark de arranque de la app web
+Mide, en procesos nuevos, el tiempo de `import app` y la latencia de la
+primera petición, y reporta qué dependencias pesadas quedaron cargadas.
+
+Uso:
+    python benchmark_startup.py            # 5 corridas
+    python benchmark_startup.py --runs 10 --path /auth
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('playwright', 'flask_mail', 'httpx')
+
+_CHILD_CODE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app as web_app
+t1 = time.perf_counter()
+client = web_app.app.test_client()
+resp = client.get(sys.argv[1])
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'first_request_s': t2 - t1,
+    'status': resp.status_code,
+    'heavy': [m for m in sys.argv[2].split(',') if m in sys.modules],
+}))
+'''
+
+
+def run_once(path):
+    env = dict(os.environ)
+    # Sin hilos en background: solo medir import + primera petición
+    env.setdefault('APP_DEFER_BACKGROUND_WORKERS', '1')
+    out = subprocess.run(
+        [sys.executable, '-c', _CHILD_CODE, path, ','.join(HEAVY_MODULES)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip()[-2000:])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de arranque de app.py')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/auth', help='Ruta de la primera petición')
+    args = parser.parse_args()
+
+    results = [run_once(args.path) for _ in range(max(args.runs, 1))]
+    imports = [r['import_s'] * 1000 for r in results]
+    firsts = [r['first_request_s'] * 1000 for r in results]
+
+    print(f"Corridas: {len(results)}  (GET {args.path} -> {results[-1]['status']})")
+    print(f"import app       mediana {statistics.median(imports):8.1f} ms  min {min(imports):8.1f} ms  max {max(imports):8.1f} ms")
+    print(f"primera petición mediana {statistics.median(firsts):8.1f} ms  min {min(firsts):8.1f} ms  max {max(firsts):8.1f} ms")
+    heavy = sorted({m for r in results for m in r['heavy']})
+    print(f"Dependencias pesadas cargadas: {', '.join(heavy) if heavy else 'ninguna'}")
+
+
+if __name__ == '__main__':
+    main()
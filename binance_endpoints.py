@@ -0,0 +1,178 @@
+"""
+Selector de endpoints de Binance con peticiones de cobertura (hedged)
+=====================================================================
+Binance expone varios hosts equivalentes (api1..api4, api). En lugar de
+probarlos siempre en el mismo orden, se lleva por host un promedio móvil
+exponencial (EWMA) de latencia y de tasa de error y se ordena por puntaje.
+
+Cada consulta va primero al host más rápido; si no respondió tras
+BINANCE_HEDGE_DELAY_SECONDS se lanza una segunda petición al siguiente host y
+se usa la primera respuesta válida. Un error de transporte pasa de inmediato al
+siguiente host. Las peticiones usan una requests.Session persistente por host
+(keep-alive, sin handshake TLS por llamada) y respetan el circuit breaker
+`binance:<host>`: un host con el circuito abierto se omite.
+"""
+
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitOpenError, get_breaker, is_server_error
+
+logger = logging.getLogger(__name__)
+
+BINANCE_HEDGE_DELAY_SECONDS = max(float(os.environ.get('BINANCE_HEDGE_DELAY_SECONDS', '0.3')), 0.05)
+BINANCE_HEDGE_MAX_IN_FLIGHT = max(int(os.environ.get('BINANCE_HEDGE_MAX_IN_FLIGHT', '2')), 1)
+BINANCE_EWMA_ALPHA = min(max(float(os.environ.get('BINANCE_EWMA_ALPHA', '0.3')), 0.01), 1.0)
+# Latencia supuesta para un host sin muestras; todos empatan y se respeta el orden configurado.
+BINANCE_EWMA_INITIAL_SECONDS = 0.5
+# Cuánto pesa la tasa de error en el puntaje (un host con 100% de error cuenta 5x más lento).
+BINANCE_ERROR_PENALTY = 4.0
+
+
+class BinanceUnavailable(Exception):
+    """Ningún endpoint de Binance devolvió una respuesta válida a tiempo."""
+
+
+class EndpointSelector:
+    def __init__(self, base_urls, *, alpha=None, hedge_delay=None, max_in_flight=None):
+        self.base_urls = list(base_urls)
+        self.alpha = alpha or BINANCE_EWMA_ALPHA
+        self.hedge_delay = hedge_delay or BINANCE_HEDGE_DELAY_SECONDS
+        self.max_in_flight = max_in_flight or BINANCE_HEDGE_MAX_IN_FLIGHT
+        self._lock = threading.Lock()
+        self._latency = {url: BINANCE_EWMA_INITIAL_SECONDS for url in self.base_urls}
+        self._error_rate = {url: 0.0 for url in self.base_urls}
+        self._samples = {url: 0 for url in self.base_urls}
+        self._sessions = {}
+        self._executor = None
+
+    # --- estadísticas ---
+
+    def record(self, base_url, latency_seconds, ok):
+        with self._lock:
+            a = self.alpha
+            if self._samples.get(base_url, 0) == 0 and ok:
+                self._latency[base_url] = latency_seconds
+            else:
+                self._latency[base_url] = a * latency_seconds + (1 - a) * self._latency.get(base_url, latency_seconds)
+            self._error_rate[base_url] = a * (0.0 if ok else 1.0) + (1 - a) * self._error_rate.get(base_url, 0.0)
+            self._samples[base_url] = self._samples.get(base_url, 0) + 1
+
+    def _score(self, base_url):
+        return self._latency[base_url] * (1.0 + BINANCE_ERROR_PENALTY * self._error_rate[base_url])
+
+    def ranked(self):
+        """Hosts ordenados del más rápido al más lento (empates: orden configurado)."""
+        with self._lock:
+            return sorted(self.base_urls, key=self._score)
+
+    def stats(self):
+        with self._lock:
+            return [{
+                'endpoint': url,
+                'latency_ewma_ms': round(self._latency[url] * 1000.0, 1),
+                'error_rate_ewma': round(self._error_rate[url], 4),
+                'samples': self._samples[url],
+            } for url in sorted(self.base_urls, key=self._score)]
+
+    # --- transporte ---
+
+    def session(self, base_url):
+        sess = self._sessions.get(base_url)
+        if sess is None:
+            with self._lock:
+                sess = self._sessions.get(base_url)
+                if sess is None:
+                    sess = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+                    sess.mount('https://', adapter)
+                    sess.mount('http://', adapter)
+                    self._sessions[base_url] = sess
+        return sess
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(len(self.base_urls), 2), thread_name_prefix='binance-hedge'
+                    )
+        return self._executor
+
+    def _attempt(self, base_url, path, *, params, headers, timeout, proxies):
+        """Una petición a un host; devuelve el JSON o lanza. Actualiza el EWMA."""
+        breaker = get_breaker(f'binance:{urllib.parse.urlparse(base_url).netloc}')
+        started = time.perf_counter()
+        try:
+            resp = breaker.call(
+                self.session(base_url).get, f'{base_url}{path}',
+                params=params, headers=headers, timeout=timeout, proxies=proxies,
+                is_failure=is_server_error,
+            )
+            if is_server_error(resp):
+                raise BinanceUnavailable(f'HTTP {resp.status_code}')
+            data = resp.json()
+        except CircuitOpenError:
+            # No hubo petición: no ensuciar la latencia del host
+            raise
+        except Exception:
+            # Una falla cuenta como si hubiera tardado el timeout completo
+            self.record(base_url, max(time.perf_counter() - started, timeout), ok=False)
+            raise
+        self.record(base_url, time.perf_counter() - started, ok=True)
+        return data
+
+    def get_json(self, path, *, params=None, headers=None, timeout, total_timeout, proxies=None):
+        """GET `path` con cobertura entre hosts. Devuelve (base_url, json) o lanza BinanceUnavailable."""
+        order = self.ranked()
+        deadline = time.monotonic() + total_timeout
+        executor = self._get_executor()
+        pending = {}
+        next_idx = 0
+        last_error = None
+
+        def _launch():
+            nonlocal next_idx
+            base_url = order[next_idx]
+            next_idx += 1
+            remaining = max(deadline - time.monotonic(), 0.1)
+            future = executor.submit(
+                self._attempt, base_url, path,
+                params=params, headers=headers, timeout=min(timeout, remaining), proxies=proxies,
+            )
+            pending[future] = base_url
+
+        _launch()
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            can_hedge = next_idx < len(order) and len(pending) < self.max_in_flight
+            done, _ = wait(
+                list(pending), timeout=min(self.hedge_delay, remaining) if can_hedge else remaining,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                if can_hedge:
+                    logger.info(f'[Binance] {pending[next(iter(pending))]} lento; cobertura a {order[next_idx]}')
+                    _launch()
+                continue
+            for future in done:
+                base_url = pending.pop(future)
+                try:
+                    return base_url, future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f'Binance endpoint {base_url} falló: {type(e).__name__}')
+            # Fallo de transporte: pasar al siguiente host sin esperar el retardo de cobertura
+            if next_idx < len(order) and len(pending) < self.max_in_flight:
+                _launch()
+
+        raise BinanceUnavailable(f'Ningún endpoint respondió a tiempo. Último error: {last_error}')
@@ -0,0 +1,226 @@
+"""
+Circuit breakers para proveedores externos
+==========================================
+Un breaker por proveedor (GameClub, Inefable, VPS redeemer, Game Script,
+endpoints de Binance) con ventana deslizante de resultados. Si la tasa de fallos supera el
+umbral, el circuito se abre y las llamadas fallan al instante (CircuitOpenError)
+en lugar de esperar el timeout completo; tras CIRCUIT_BREAKER_OPEN_SECONDS pasa
+a semiabierto y deja pasar una sola llamada de prueba.
+
+Cada llamada queda marcada con el estado en que fue admitida: solo la prueba
+semiabierta cierra o reabre el circuito. Una llamada lenta admitida con el
+circuito cerrado que termina durante la prueba no la libera ni decide por ella.
+
+El estado es por proceso (cada worker gunicorn decide por su cuenta), que es lo
+que importa para no agotar sus propios hilos.
+
+Uso:
+    breaker = get_breaker('gameclub')
+    resp = breaker.call(session.post, url, json=body, is_failure=is_server_error)
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+CIRCUIT_BREAKER_WINDOW_SECONDS = max(float(os.environ.get('CIRCUIT_BREAKER_WINDOW_SECONDS', '60')), 1.0)
+CIRCUIT_BREAKER_MIN_CALLS = max(int(os.environ.get('CIRCUIT_BREAKER_MIN_CALLS', '5')), 1)
+CIRCUIT_BREAKER_FAILURE_RATE = min(max(float(os.environ.get('CIRCUIT_BREAKER_FAILURE_RATE', '0.5')), 0.01), 1.0)
+CIRCUIT_BREAKER_OPEN_SECONDS = max(float(os.environ.get('CIRCUIT_BREAKER_OPEN_SECONDS', '30')), 1.0)
+CIRCUIT_BREAKER_LATENCY_SAMPLES = max(int(os.environ.get('CIRCUIT_BREAKER_LATENCY_SAMPLES', '200')), 10)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """El proveedor tiene el circuito abierto; la llamada no se realizó."""
+
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = max(int(retry_after + 0.999), 1)
+        super().__init__(f'Circuito abierto para {provider}; reintentar en {self.retry_after}s')
+
+
+def is_server_error(response):
+    """Clasificador por defecto para respuestas HTTP: 5xx cuenta como fallo."""
+    status = getattr(response, 'status_code', None)
+    return status is not None and status >= 500
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+
+class CircuitBreaker:
+    def __init__(self, name, *, window_seconds=None, min_calls=None, failure_rate=None,
+                 open_seconds=None, clock=time.monotonic):
+        self.name = name
+        self.window_seconds = window_seconds or CIRCUIT_BREAKER_WINDOW_SECONDS
+        self.min_calls = min_calls or CIRCUIT_BREAKER_MIN_CALLS
+        self.failure_rate = failure_rate or CIRCUIT_BREAKER_FAILURE_RATE
+        self.open_seconds = open_seconds or CIRCUIT_BREAKER_OPEN_SECONDS
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results = deque()  # (timestamp, ok)
+        self._latencies = deque(maxlen=CIRCUIT_BREAKER_LATENCY_SAMPLES)
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._rejected = 0
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._results and self._results[0][0] < cutoff:
+            self._results.popleft()
+
+    def _retry_after(self, now):
+        return max(self._opened_at + self.open_seconds - now, 0.0)
+
+    def before_call(self):
+        """Reserva la llamada o lanza CircuitOpenError. Devuelve el estado en que se admitió."""
+        now = self._clock()
+        with self._lock:
+            if self._state == STATE_OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, self._retry_after(now))
+                self._state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self._probe_in_flight = True
+                return STATE_HALF_OPEN
+            return STATE_CLOSED
+
+    def record(self, ok, latency_seconds, admitted_state=STATE_CLOSED):
+        now = self._clock()
+        with self._lock:
+            self._latencies.append(float(latency_seconds))
+            if admitted_state == STATE_HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._state = STATE_CLOSED
+                    self._results.clear()
+                else:
+                    self._state = STATE_OPEN
+                    self._opened_at = now
+                return
+            if self._state != STATE_CLOSED:
+                # Admitida antes de abrirse: no cuenta para la prueba en curso
+                return
+
+            self._results.append((now, bool(ok)))
+            self._prune(now)
+            total = len(self._results)
+            if total >= self.min_calls:
+                failures = sum(1 for _, res in self._results if not res)
+                if failures / total >= self.failure_rate:
+                    self._state = STATE_OPEN
+                    self._opened_at = now
+
+    def call(self, fn, *args, is_failure=None, **kwargs):
+        """Ejecuta fn bajo el breaker. Excepciones y is_failure(result) cuentan como fallo."""
+        admitted_state = self.before_call()
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            self.record(False, elapsed, admitted_state)
+            _notify_call(self.name, elapsed, 'error')
+            raise
+        elapsed = time.perf_counter() - started
+        failed = bool(is_failure(result)) if is_failure else False
+        self.record(not failed, elapsed, admitted_state)
+        _notify_call(self.name, elapsed, 'failure' if failed else 'ok')
+        return result
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                return STATE_HALF_OPEN
+            return self._state
+
+    def snapshot(self):
+        now = self._clock()
+        with self._lock:
+            self._prune(now)
+            total = len(self._results)
+            failures = sum(1 for _, ok in self._results if not ok)
+            latencies = sorted(self._latencies)
+            state = self._state
+            if state == STATE_OPEN and now - self._opened_at >= self.open_seconds:
+                state = STATE_HALF_OPEN
+            return {
+                'provider': self.name,
+                'state': state,
+                'window_calls': total,
+                'window_failures': failures,
+                'failure_rate': round(failures / total, 4) if total else 0.0,
+                'rejected_total': self._rejected,
+                'retry_after_seconds': round(self._retry_after(now), 1) if state == STATE_OPEN else 0,
+                'latency_ms': {
+                    'p50': _ms(_percentile(latencies, 50)),
+                    'p90': _ms(_percentile(latencies, 90)),
+                    'p99': _ms(_percentile(latencies, 99)),
+                    'samples': len(latencies),
+                },
+            }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 1)
+
+
+_call_listeners = []
+
+
+def add_call_listener(callback):
+    """Registra callback(proveedor, segundos, resultado) para cada llamada hecha (lo usa metrics)."""
+    if callback not in _call_listeners:
+        _call_listeners.append(callback)
+
+
+def remove_call_listener(callback):
+    if callback in _call_listeners:
+        _call_listeners.remove(callback)
+
+
+def _notify_call(name, seconds, outcome):
+    for callback in list(_call_listeners):
+        try:
+            callback(name, seconds, outcome)
+        except Exception:
+            pass
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Breaker del proveedor `name` (uno por proceso)."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name)
+                _breakers[name] = breaker
+    return breaker
+
+
+def get_all_breaker_stats():
+    """Estado y percentiles de latencia de todos los breakers del proceso."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in sorted(breakers, key=lambda b: b.name)}
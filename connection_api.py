@@ -9,6 +9,7 @@ import sqlite3
 import hashlib
 import os
 import secrets
+import threading
 import time
 from datetime import datetime
 from functools import wraps
@@ -16,6 +17,7 @@ import random
 import string
 import pytz
 from werkzeug.security import check_password_hash
+from admin_stats import insert_historial_compra
 from pin_manager import create_pin_manager
 from request_security import consume_rate_limit, get_request_client_ip
 
@@ -28,6 +30,8 @@ connection_app.secret_key = os.environ.get('CONNECTION_API_SECRET_KEY', secrets.
 # Configuración de la base de datos (usar la misma que la aplicación principal)
 DATABASE = os.environ.get('DATABASE_PATH', 'usuarios.db')
 CONNECTION_API_TOKEN_TTL_SECONDS = int(os.environ.get('CONNECTION_API_TOKEN_TTL_SECONDS', '86400'))
+CONNECTION_API_TOKEN_SWEEP_INTERVAL_SECONDS = max(int(os.environ.get('CONNECTION_API_TOKEN_SWEEP_INTERVAL_SECONDS', '600')), 30)
+CONNECTION_API_TOKEN_CACHE_MAX = max(int(os.environ.get('CONNECTION_API_TOKEN_CACHE_MAX', '10000')), 100)
 CONNECTION_API_LOGIN_RATE_LIMIT_ATTEMPTS = max(int(os.environ.get('CONNECTION_API_LOGIN_RATE_LIMIT_ATTEMPTS', '12')), 1)
 CONNECTION_API_LOGIN_RATE_LIMIT_WINDOW_SECONDS = max(int(os.environ.get('CONNECTION_API_LOGIN_RATE_LIMIT_WINDOW_SECONDS', '300')), 1)
 CONNECTION_API_AUTH_FAILURE_LIMIT = max(int(os.environ.get('CONNECTION_API_AUTH_FAILURE_LIMIT', '30')), 1)
@@ -85,10 +89,85 @@ def cleanup_expired_connection_api_tokens(conn):
     """Elimina tokens expirados para reducir exposición y basura."""
     conn.execute('DELETE FROM connection_api_tokens WHERE expires_at <= ?', (int(time.time()),))
 
+# Estado de tokens en memoria: el esquema se asegura una sola vez por proceso,
+# la limpieza de expirados la hace un hilo periódico y los tokens ya validados
+# se recuerdan hasta su expires_at (token -> (usuario_id, expires_at)).
+_token_runtime_lock = threading.Lock()
+_token_schema_ready = False
+_token_sweeper_started = False
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+def _sweep_expired_connection_api_tokens():
+    """Limpia tokens expirados en BD y en caché (ejecutado por el sweeper)."""
+    now = int(time.time())
+    with _token_cache_lock:
+        for token in [t for t, (_, exp) in _token_cache.items() if exp <= now]:
+            _token_cache.pop(token, None)
+
+    conn = get_db_connection()
+    try:
+        cleanup_expired_connection_api_tokens(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _connection_api_token_sweeper():
+    while True:
+        time.sleep(CONNECTION_API_TOKEN_SWEEP_INTERVAL_SECONDS)
+        try:
+            _sweep_expired_connection_api_tokens()
+        except Exception as e:
+            print(f"⚠️ Error limpiando tokens de la API de conexión: {e}")
+
+def init_connection_api_tokens():
+    """Crea el esquema de tokens y arranca el sweeper (una vez por proceso)."""
+    global _token_schema_ready, _token_sweeper_started
+    if _token_schema_ready and _token_sweeper_started:
+        return
+    with _token_runtime_lock:
+        if not _token_schema_ready:
+            conn = get_db_connection()
+            try:
+                ensure_connection_api_token_schema(conn)
+                cleanup_expired_connection_api_tokens(conn)
+                conn.commit()
+            finally:
+                conn.close()
+            _token_schema_ready = True
+        if not _token_sweeper_started:
+            threading.Thread(
+                target=_connection_api_token_sweeper,
+                daemon=True,
+                name='connection-api-token-sweeper',
+            ).start()
+            _token_sweeper_started = True
+
+def _cache_connection_api_token(token, user_id, expires_at):
+    with _token_cache_lock:
+        if len(_token_cache) >= CONNECTION_API_TOKEN_CACHE_MAX:
+            now = int(time.time())
+            for cached in [t for t, (_, exp) in _token_cache.items() if exp <= now]:
+                _token_cache.pop(cached, None)
+            if len(_token_cache) >= CONNECTION_API_TOKEN_CACHE_MAX:
+                _token_cache.clear()
+        _token_cache[token] = (int(user_id), int(expires_at))
+
+def _get_cached_connection_api_token(token, now):
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+        if cached and cached[1] <= now:
+            _token_cache.pop(token, None)
+            return None
+        return cached
+
+def _forget_connection_api_token(token):
+    with _token_cache_lock:
+        _token_cache.pop(token, None)
+
 def create_connection_api_token(conn, user_id):
     """Genera y persiste un token bearer para la API de conexión."""
-    ensure_connection_api_token_schema(conn)
-    cleanup_expired_connection_api_tokens(conn)
+    init_connection_api_tokens()
 
     token = secrets.token_urlsafe(32)
     expires_at = int(time.time()) + max(CONNECTION_API_TOKEN_TTL_SECONDS, 60)
@@ -98,6 +177,42 @@ def create_connection_api_token(conn, user_id):
     )
     return token, expires_at
 
+def _load_connection_api_token_user(token):
+    """Resuelve el usuario del token: una consulta con o sin caché.
+
+    Con el token en caché solo se lee la fila del usuario (el saldo debe
+    estar fresco); si no, se valida contra connection_api_tokens y se cachea.
+    """
+    now = int(time.time())
+    cached = _get_cached_connection_api_token(token, now)
+
+    conn = get_db_connection()
+    try:
+        if cached:
+            user = conn.execute('SELECT * FROM usuarios WHERE id = ?', (cached[0],)).fetchone()
+            if not user:
+                _forget_connection_api_token(token)
+                return None
+            return dict(user)
+
+        row = conn.execute(
+            '''
+            SELECT u.*, t.expires_at AS connection_api_token_expires_at
+            FROM connection_api_tokens t
+            JOIN usuarios u ON u.id = t.usuario_id
+            WHERE t.token = ? AND t.expires_at > ?
+            ''',
+            (token, now)
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if not row:
+        return None
+    user = dict(row)
+    _cache_connection_api_token(token, user['id'], user.pop('connection_api_token_expires_at'))
+    return user
+
 def get_connection_api_authenticated_user():
     """Resuelve el usuario autenticado por bearer token."""
     client_ip = get_request_client_ip(request)
@@ -125,22 +240,8 @@ def get_connection_api_authenticated_user():
             return None, _rate_limited_response('Demasiados intentos de autenticación Bearer.', rate_state)
         return None, (jsonify({'status': 'error', 'message': 'Token Bearer requerido'}), 401)
 
-    conn = get_db_connection()
-    try:
-        ensure_connection_api_token_schema(conn)
-        cleanup_expired_connection_api_tokens(conn)
-        user = conn.execute(
-            '''
-            SELECT u.*
-            FROM connection_api_tokens t
-            JOIN usuarios u ON u.id = t.usuario_id
-            WHERE t.token = ? AND t.expires_at > ?
-            ''',
-            (token, int(time.time()))
-        ).fetchone()
-        conn.commit()
-    finally:
-        conn.close()
+    init_connection_api_tokens()
+    user = _load_connection_api_token_user(token)
 
     if not user:
         rate_state = consume_rate_limit(
@@ -328,10 +429,9 @@ def create_transaction_record(user_id, pin_code, paquete_nombre, precio, conn=No
 
 def persist_purchase_metrics(conn, user_id, package_id, quantity, paquete_nombre, pin_text, precio_total, saldo_antes, saldo_despues, transaccion_id):
     try:
-        conn.execute('''
-            INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
-            VALUES (?, ?, ?, ?, 'compra', NULL, ?, ?)
-        ''', (user_id, precio_total, paquete_nombre, pin_text, saldo_antes, saldo_despues))
+        # Misma escritura que la web: la venta queda con su ganancia ya atribuida
+        insert_historial_compra(conn, user_id, precio_total, paquete_nombre, pin_text, 'compra', None,
+                                saldo_antes, saldo_despues)
     except Exception:
         pass
 
@@ -975,5 +1075,6 @@ if __name__ == '__main__':
     print("🌐 API de Conexión corriendo en: http://localhost:5002")
     print("🔗 URL de tu web: https://inefablerevendedores.co/")
     print("=" * 60)
-    
+
+    init_connection_api_tokens()
     connection_app.run(debug=True, port=5002, host='0.0.0.0')
@@ -14,6 +14,7 @@ import logging
 
 from flask import Blueprint, jsonify, request, render_template, session, flash, redirect
 from csrf_utils import csrf_protect
+from admin_stats import insert_historial_compra, invalidate_profit_catalog
 
 logger = logging.getLogger(__name__)
 
@@ -682,6 +683,7 @@ def admin_delete_game(game_id):
     conn.execute('DELETE FROM transacciones_dinamicas WHERE juego_id=?', (game_id,))
     conn.execute('DELETE FROM juegos_dinamicos WHERE id=?', (game_id,))
     conn.commit()
+    invalidate_profit_catalog()
     conn.close()
     if request.is_json:
         return jsonify({'success': True})
@@ -762,6 +764,7 @@ def admin_add_package(game_id):
             except Exception:
                 pass
 
+        invalidate_profit_catalog()
         return jsonify({'success': True, 'package_id': pkg_id})
     except Exception as e:
         logger.exception('Error agregando paquete dinámico al juego %s', game_id)
@@ -800,6 +803,7 @@ def admin_update_package(pkg_id):
         fecha_actualizacion=CURRENT_TIMESTAMP WHERE id=?
     ''', (nombre, precio, descripcion, int(gp_pkg_id) if gp_pkg_id else None, activo, orden, pkg_id))
     conn.commit()
+    invalidate_profit_catalog()
     conn.close()
     return jsonify({'success': True})
 
@@ -812,6 +816,7 @@ def admin_delete_package(pkg_id):
     conn = _get_conn()
     conn.execute('DELETE FROM paquetes_dinamicos WHERE id=?', (pkg_id,))
     conn.commit()
+    invalidate_profit_catalog()
     conn.close()
     return jsonify({'success': True})
 
@@ -866,6 +871,7 @@ def admin_auto_import_packages(game_id):
             created += 1
 
         conn.commit()
+        invalidate_profit_catalog()
         conn.close()
 
         return jsonify({
@@ -1054,6 +1060,7 @@ def sync_dynamic_game_prices(game_id):
         report.append(entry)
 
     conn.commit()
+    invalidate_profit_catalog()
     conn.close()
 
     return {
@@ -1382,10 +1389,8 @@ def validar_dinamico(slug):
 
                 _saldo_row = conn.execute('SELECT saldo FROM usuarios WHERE id = ?', (user_id,)).fetchone()
                 _saldo = _saldo_row['saldo'] if _saldo_row else 0
-                conn.execute('''
-                    INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
-                    VALUES (?, ?, ?, ?, 'compra', ?, ?, ?)
-                ''', (user_id, precio, paquete_display, pin_info, _duration, _saldo + precio, _saldo))
+                insert_historial_compra(conn, user_id, precio, paquete_display, pin_info, 'compra',
+                                        _duration, _saldo + precio, _saldo)
 
                 try:
                     juego_key = f'dyn_{game["slug"]}'
@@ -1409,7 +1414,7 @@ def validar_dinamico(slug):
 
                 if not is_admin:
                     try:
-                        register_weekly_sale(f'dyn_{game["slug"]}', package_id, pkg['nombre'], precio, 1)
+                        register_weekly_sale(f'dyn_{game["slug"]}', package_id, pkg['nombre'], precio, 1, conn=conn)
                     except Exception:
                         pass
 
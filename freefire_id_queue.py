@@ -0,0 +1,375 @@
+"""
+Cola de redenciones Free Fire ID
+================================
+Cola respaldada en base de datos para sacar `redeem_pin_vps` (y la verificación
+posterior contra `/verify`) del ciclo HTTP. La web crea la transacción en
+`procesando`, encola un job y responde de inmediato; cada proceso arranca
+FFID_REDEEM_WORKERS hilos que reclaman los jobs y cierran la orden en
+`aprobado` o `rechazado`.
+
+FFID_REDEEM_MAX_ACTIVE (alineado con la capacidad del VPS) es el tope global,
+sumando todos los procesos gunicorn: el reclamo cuenta los jobs activos
+(`procesando` con lease vigente y `esperando_vps` recientes) dentro del mismo
+UPDATE y no toma uno nuevo si ya se llegó al tope. En PostgreSQL el UPDATE va
+bajo pg_advisory_xact_lock para que dos procesos no cuenten a la vez.
+
+Estados del job:
+  pendiente     → en cola, sin worker
+  procesando    → reclamado por un worker con lease vigente (lease_expires_at)
+  esperando_vps → PIN enviado al VPS (vps_job_id); el worker ya quedó libre
+  aprobado / rechazado → terminado
+
+Un worker solo envía el PIN al VPS y estaciona el job en `esperando_vps`; lo
+cierra el callback del VPS (/api/vps/callback) o el hilo de sondeo, que cada
+FFID_VPS_CHECK_SECONDS consulta GET /jobs/<id>. Para cerrar, el job vuelve a
+`procesando` con un UPDATE condicionado (`take_vps_job`), así callback y
+sondeo nunca lo cierran dos veces.
+
+Si un proceso muere con un job en `procesando`, el lease vence y otro worker lo
+retoma con `intentos > 0`; el handler debe verificar entonces si el PIN ya quedó
+redimido antes de reintentar (y no reenviarlo si ya tiene vps_job_id).
+"""
+
+import logging
+import os
+import socket
+import threading
+import time as time_module
+
+from pg_compat import SqliteConnection
+
+logger = logging.getLogger(__name__)
+
+FFID_REDEEM_QUEUE_ENABLED = str(os.environ.get('FFID_REDEEM_QUEUE_ENABLED', '')).strip().lower() in {'1', 'true', 'yes', 'on'}
+FFID_REDEEM_WORKERS = max(int(os.environ.get('FFID_REDEEM_WORKERS', '2')), 1)
+# Tope de jobs activos entre todos los procesos (por defecto, lo de un proceso)
+FFID_REDEEM_MAX_ACTIVE = max(int(os.environ.get('FFID_REDEEM_MAX_ACTIVE', str(FFID_REDEEM_WORKERS))), 1)
+FFID_REDEEM_POLL_SECONDS = max(float(os.environ.get('FFID_REDEEM_POLL_SECONDS', '1.5')), 0.2)
+# El VPS tiene timeout de 120s; el lease debe cubrirlo con margen.
+FFID_REDEEM_LEASE_SECONDS = max(int(os.environ.get('FFID_REDEEM_LEASE_SECONDS', '300')), 30)
+FFID_REDEEM_MAX_ATTEMPTS = max(int(os.environ.get('FFID_REDEEM_MAX_ATTEMPTS', '3')), 1)
+FFID_VPS_CHECK_SECONDS = max(float(os.environ.get('FFID_VPS_CHECK_SECONDS', '5')), 0.5)
+
+JOB_FINAL_STATES = ('aprobado', 'rechazado')
+JOB_WAITING_VPS = 'esperando_vps'
+
+# Clave fija para pg_advisory_xact_lock del reclamo (bigint).
+FFID_CLAIM_LOCK_KEY = 510_051_032
+
+# Jobs que ocupan capacidad del VPS: en curso con lease vigente, o ya enviados
+# y sin cerrar (hasta un lease desde el envío, por si el cierre se perdió).
+_ACTIVE_JOBS_SQL = f'''
+    SELECT COUNT(*) FROM ffid_redeem_jobs
+    WHERE (estado = 'procesando' AND lease_expires_at >= ?)
+       OR (estado = '{JOB_WAITING_VPS}' AND vps_enviado_at >= ?)
+'''
+
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _get_conn():
+    from pg_compat import get_db_connection
+    return get_db_connection()
+
+
+# ---------------------------------------------------------------------------
+# DDL – llamar desde init_db() de app.py
+# ---------------------------------------------------------------------------
+
+def init_freefire_id_queue_tables(cursor):
+    """Crea la tabla de jobs de redención. Llamar desde init_db() en app.py."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ffid_redeem_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id INTEGER NOT NULL UNIQUE,
+            source TEXT NOT NULL DEFAULT 'web',
+            usuario_id INTEGER,
+            player_id TEXT NOT NULL,
+            paquete_id INTEGER NOT NULL,
+            pin_codigo TEXT NOT NULL,
+            precio REAL DEFAULT 0,
+            saldo_cobrado BOOLEAN DEFAULT FALSE,
+            request_id TEXT DEFAULT '',
+            admin_id INTEGER,
+            estado TEXT DEFAULT 'pendiente',
+            intentos INTEGER DEFAULT 0,
+            worker_id TEXT DEFAULT '',
+            lease_expires_at REAL DEFAULT 0,
+            player_name TEXT DEFAULT '',
+            error_msg TEXT DEFAULT '',
+            duracion_segundos REAL DEFAULT 0,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ffid_redeem_jobs_estado ON ffid_redeem_jobs(estado, lease_expires_at, id)')
+
+
+def add_vps_job_columns(cursor):
+    """Columnas del job remoto en el VPS (paso de esquema posterior a la tabla)."""
+    for column, col_type in (('vps_job_id', "TEXT DEFAULT ''"), ('vps_enviado_at', 'REAL DEFAULT 0')):
+        try:
+            cursor.execute(f'ALTER TABLE ffid_redeem_jobs ADD COLUMN {column} {col_type}')
+        except Exception:
+            pass
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ffid_redeem_jobs_vps_job ON ffid_redeem_jobs(vps_job_id)')
+
+
+# ---------------------------------------------------------------------------
+# Operaciones de cola
+# ---------------------------------------------------------------------------
+
+def enqueue_redeem_job(conn, transaction_id, *, source, usuario_id, player_id, paquete_id,
+                       pin_codigo, precio=0.0, saldo_cobrado=False, request_id='', admin_id=None):
+    """Inserta un job en `pendiente` usando la conexión del llamador (sin commit).
+
+    Un job terminado de la misma transacción se reemplaza (p. ej. reintento
+    desde el panel admin); si hay uno activo, la restricción UNIQUE lo impide.
+    """
+    conn.execute(
+        "DELETE FROM ffid_redeem_jobs WHERE transaction_id = ? AND estado IN ('aprobado', 'rechazado')",
+        (transaction_id,)
+    )
+    conn.execute('''
+        INSERT INTO ffid_redeem_jobs
+        (transaction_id, source, usuario_id, player_id, paquete_id, pin_codigo,
+         precio, saldo_cobrado, request_id, admin_id, estado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pendiente')
+    ''', (transaction_id, source, usuario_id, str(player_id), int(paquete_id), pin_codigo,
+          float(precio or 0), bool(saldo_cobrado), request_id or '', admin_id))
+
+
+def notify_new_job():
+    """Despierta a los workers locales para no esperar al siguiente poll."""
+    _wakeup.set()
+
+
+def _lock_claims(conn):
+    # SQLite ya serializa las escrituras; en PostgreSQL el lock se libera con
+    # el commit/rollback del reclamo.
+    if not isinstance(conn, SqliteConnection):
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (FFID_CLAIM_LOCK_KEY,))
+
+
+def count_active_jobs(conn, now):
+    """Jobs que hoy ocupan capacidad del VPS, sumando todos los procesos."""
+    row = conn.execute(_ACTIVE_JOBS_SQL, (now, now - FFID_REDEEM_LEASE_SECONDS)).fetchone()
+    return int(row[0] or 0)
+
+
+def claim_next_job(worker_id, *, now=None):
+    """Reclama el job más antiguo disponible (pendiente o con lease vencido).
+
+    Usa un UPDATE condicionado por estado/lease para que dos workers (o dos
+    procesos gunicorn) nunca se queden con el mismo job, y por el conteo de
+    jobs activos para no pasar de FFID_REDEEM_MAX_ACTIVE.
+    """
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        if count_active_jobs(conn, now) >= FFID_REDEEM_MAX_ACTIVE:
+            conn.rollback()
+            return None
+        candidates = conn.execute('''
+            SELECT id FROM ffid_redeem_jobs
+            WHERE estado = 'pendiente'
+               OR (estado = 'procesando' AND lease_expires_at < ?)
+            ORDER BY id
+            LIMIT 5
+        ''', (now,)).fetchall()
+        for cand in candidates:
+            _lock_claims(conn)
+            cur = conn.execute(f'''
+                UPDATE ffid_redeem_jobs
+                SET estado = 'procesando', worker_id = ?, lease_expires_at = ?,
+                    intentos = intentos + 1, fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE id = ?
+                  AND (estado = 'pendiente' OR (estado = 'procesando' AND lease_expires_at < ?))
+                  AND ({_ACTIVE_JOBS_SQL}) < ?
+            ''', (worker_id, now + FFID_REDEEM_LEASE_SECONDS, cand['id'], now,
+                  now, now - FFID_REDEEM_LEASE_SECONDS, FFID_REDEEM_MAX_ACTIVE))
+            if cur.rowcount == 1:
+                conn.commit()
+                row = conn.execute('SELECT * FROM ffid_redeem_jobs WHERE id = ?', (cand['id'],)).fetchone()
+                return dict(row) if row else None
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def park_job_on_vps(job_id, vps_job_id, *, now=None):
+    """Deja el job en `esperando_vps` tras enviar el PIN; el worker queda libre.
+
+    Si el job ya tenía ese vps_job_id (reanudación) se conserva la hora de envío.
+    """
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        conn.execute('''
+            UPDATE ffid_redeem_jobs
+            SET estado = ?, vps_enviado_at = CASE WHEN vps_job_id = ? AND vps_enviado_at > 0
+                                                  THEN vps_enviado_at ELSE ? END,
+                vps_job_id = ?, lease_expires_at = ?, fecha_actualizacion = CURRENT_TIMESTAMP
+            WHERE id = ? AND estado = 'procesando'
+        ''', (JOB_WAITING_VPS, str(vps_job_id), now, str(vps_job_id), now + FFID_VPS_CHECK_SECONDS, job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def claim_due_vps_check(worker_id, *, now=None):
+    """Reserva el siguiente job en `esperando_vps` al que le toca consultar el VPS.
+
+    Solo corre el lease hasta el próximo chequeo: el job sigue esperando y
+    otro proceso no lo consulta a la vez.
+    """
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        candidates = conn.execute('''
+            SELECT id FROM ffid_redeem_jobs
+            WHERE estado = ? AND lease_expires_at < ?
+            ORDER BY lease_expires_at, id
+            LIMIT 5
+        ''', (JOB_WAITING_VPS, now)).fetchall()
+        for cand in candidates:
+            cur = conn.execute('''
+                UPDATE ffid_redeem_jobs
+                SET worker_id = ?, lease_expires_at = ?
+                WHERE id = ? AND estado = ? AND lease_expires_at < ?
+            ''', (worker_id, now + FFID_VPS_CHECK_SECONDS, cand['id'], JOB_WAITING_VPS, now))
+            if cur.rowcount == 1:
+                conn.commit()
+                row = conn.execute('SELECT * FROM ffid_redeem_jobs WHERE id = ?', (cand['id'],)).fetchone()
+                return dict(row) if row else None
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def find_vps_job(vps_job_id):
+    """Job en `esperando_vps` con ese id de job remoto, o None."""
+    conn = _get_conn()
+    try:
+        row = conn.execute(
+            'SELECT * FROM ffid_redeem_jobs WHERE vps_job_id = ? AND estado = ? ORDER BY id DESC LIMIT 1',
+            (str(vps_job_id), JOB_WAITING_VPS)
+        ).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def take_vps_job(job_id, worker_id, *, now=None):
+    """`esperando_vps` → `procesando` para cerrarlo; True solo para quien gana."""
+    now = time_module.time() if now is None else now
+    conn = _get_conn()
+    try:
+        cur = conn.execute('''
+            UPDATE ffid_redeem_jobs
+            SET estado = 'procesando', worker_id = ?, lease_expires_at = ?,
+                fecha_actualizacion = CURRENT_TIMESTAMP
+            WHERE id = ? AND estado = ?
+        ''', (worker_id, now + FFID_REDEEM_LEASE_SECONDS, job_id, JOB_WAITING_VPS))
+        conn.commit()
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def finish_job(job_id, estado, *, player_name='', error_msg='', duracion_segundos=0.0):
+    """Marca el job como terminado (`aprobado` o `rechazado`)."""
+    if estado not in JOB_FINAL_STATES:
+        raise ValueError(f'Estado final inválido: {estado}')
+    conn = _get_conn()
+    try:
+        conn.execute('''
+            UPDATE ffid_redeem_jobs
+            SET estado = ?, player_name = ?, error_msg = ?, duracion_segundos = ?,
+                lease_expires_at = 0, fecha_actualizacion = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (estado, player_name or '', (error_msg or '')[:500], float(duracion_segundos or 0), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_queue_stats():
+    """Cantidad de jobs por estado (para el panel admin)."""
+    conn = _get_conn()
+    try:
+        rows = conn.execute('SELECT estado, COUNT(*) AS total FROM ffid_redeem_jobs GROUP BY estado').fetchall()
+        return {r['estado']: int(r['total']) for r in rows}
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Pool de workers
+# ---------------------------------------------------------------------------
+
+def _worker_loop(worker_id, handler):
+    while True:
+        job = None
+        try:
+            job = claim_next_job(worker_id)
+        except Exception as e:
+            logger.error(f'[FFID Queue] {worker_id} error reclamando job: {e}')
+
+        if not job:
+            _wakeup.wait(FFID_REDEEM_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+
+        try:
+            handler(job)
+        except Exception as e:
+            # El handler es responsable de cerrar el job. Si revienta, el lease
+            # vence y el job se retoma con verificación previa.
+            logger.error(f'[FFID Queue] {worker_id} error procesando job {job.get("id")}: {e}')
+
+
+def _vps_check_loop(worker_id, vps_handler):
+    while True:
+        job = None
+        try:
+            job = claim_due_vps_check(worker_id)
+        except Exception as e:
+            logger.error(f'[FFID Queue] {worker_id} error reclamando chequeo VPS: {e}')
+
+        if not job:
+            time_module.sleep(min(FFID_VPS_CHECK_SECONDS, FFID_REDEEM_POLL_SECONDS))
+            continue
+
+        try:
+            vps_handler(job)
+        except Exception as e:
+            logger.error(f'[FFID Queue] {worker_id} error consultando job VPS {job.get("vps_job_id")}: {e}')
+
+
+def start_redeem_workers(handler, worker_count=None, vps_handler=None):
+    """Arranca el pool de workers y el hilo de sondeo al VPS (idempotente por proceso).
+
+    vps_handler(job) recibe los jobs en `esperando_vps` cuyo chequeo venció.
+    """
+    worker_count = worker_count or FFID_REDEEM_WORKERS
+    with _workers_lock:
+        if _workers:
+            return len(_workers)
+        base_id = f'{socket.gethostname()}:{os.getpid()}'
+        for idx in range(worker_count):
+            worker_id = f'{base_id}:{idx}'
+            t = threading.Thread(target=_worker_loop, args=(worker_id, handler), daemon=True,
+                                 name=f'ffid-redeem-{idx}')
+            t.start()
+            _workers.append(t)
+        if vps_handler is not None:
+            t = threading.Thread(target=_vps_check_loop, args=(f'{base_id}:vps', vps_handler), daemon=True,
+                                 name='ffid-vps-check')
+            t.start()
+    logger.info(f'[FFID Queue] {worker_count} workers iniciados')
+    return worker_count
@@ -13,3 +13,20 @@ bind = "0.0.0.0:" + os.environ.get("PORT", "8000")
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+# Preload opcional: el master importa la app una sola vez (migraciones
+# incluidas) y los workers la heredan por fork. Los hilos en background nunca
+# se arrancan en el master; cada worker los inicia tras el fork.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "").strip().lower() in {"1", "true", "yes", "on"}
+os.environ.setdefault("APP_DEFER_BACKGROUND_WORKERS", "1")
+
+
+def post_worker_init(worker):
+    import app as web_app
+    web_app.start_background_workers()
+
+
+def on_starting(server):
+    # Las métricas multiproceso (METRICS_MULTIPROC_DIR) empiezan de cero en cada arranque
+    import metrics
+    metrics.reset_multiprocess_dir()
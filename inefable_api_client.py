@@ -1,13 +1,25 @@
 import requests
 import os
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 import json
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitOpenError, get_breaker, is_server_error
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INEFABLE_API_TIMEOUT_SECONDS = max(float(os.environ.get('INEFABLE_API_TIMEOUT_SECONDS', '30')), 1.0)
+# Máximo de peticiones simultáneas a la API externa (compartido por proceso)
+INEFABLE_MAX_IN_FLIGHT = max(int(os.environ.get('INEFABLE_MAX_IN_FLIGHT', '4')), 1)
+# Tope total para una orden de varios pines
+INEFABLE_BATCH_DEADLINE_SECONDS = max(float(os.environ.get('INEFABLE_BATCH_DEADLINE_SECONDS', '45')), 1.0)
+
 
 def _redact_request_params(params):
     sanitized = dict(params or {})
@@ -49,17 +61,27 @@ class InefableAPIClient:
         }
         
         # Timeout para las peticiones
-        self.timeout = 30
+        self.timeout = INEFABLE_API_TIMEOUT_SECONDS
+
+        # Sesión keep-alive compartida; el pool cubre las peticiones concurrentes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=INEFABLE_MAX_IN_FLIGHT)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
         
-    def _make_request(self, params):
+    def _make_request(self, params, timeout=None):
         """Realiza una petición a la API externa"""
         try:
             logger.info(f"Realizando petición a API externa con parámetros: {_redact_request_params(params)}")
             
-            response = requests.get(
+            response = get_breaker('inefable').call(
+                self.session.get,
                 self.base_url,
                 params=params,
-                timeout=self.timeout,
+                timeout=timeout or self.timeout,
+                is_failure=is_server_error,
                 headers={
                     'User-Agent': 'InefablePines/1.0',
                     'Accept': 'application/json, text/plain, */*'
@@ -80,6 +102,13 @@ class InefableAPIClient:
                     'raw_response': True
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(f"API externa con circuito abierto: {e}")
+            return {
+                'status': 'error',
+                'message': f'API externa no disponible temporalmente; reintenta en {e.retry_after}s',
+                'error_type': 'circuit_open'
+            }
         except requests.exceptions.Timeout:
             logger.error("Timeout al conectar con API externa")
             return {
@@ -129,13 +158,14 @@ class InefableAPIClient:
             logger.error(f"Error en conexión con API externa: {result.get('message', 'Error desconocido')}")
             return False, result.get('message', 'Error desconocido')
     
-    def request_pin(self, monto_id, numero_destino=0):
+    def request_pin(self, monto_id, numero_destino=0, timeout=None):
         """
         Solicita un pin de Free Fire a la API externa
         
         Args:
             monto_id (int): ID del monto local (1-9)
             numero_destino (int): Número de destino (0 para pines)
+            timeout (float): Timeout de la petición (por defecto self.timeout)
             
         Returns:
             dict: Resultado de la operación
@@ -163,7 +193,7 @@ class InefableAPIClient:
             
             logger.info(f"Solicitando pin para monto_id {monto_id} (monto externo: {monto_externo})")
             
-            result = self._make_request(params)
+            result = self._make_request(params, timeout=timeout)
             
             if result.get('status') == 'success':
                 # Procesar respuesta exitosa
@@ -182,6 +212,54 @@ class InefableAPIClient:
                 'error_type': 'unexpected'
             }
     
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=INEFABLE_MAX_IN_FLIGHT,
+                    thread_name_prefix='inefable-pin',
+                )
+            return self._executor
+
+    def request_pins(self, monto_id, cantidad, deadline_seconds=None):
+        """
+        Solicita varios pines en paralelo (como máximo INEFABLE_MAX_IN_FLIGHT a la vez).
+
+        Las peticiones que aún no arrancaron se descartan al vencer el plazo total
+        o tras el primer error; las que ya están en vuelo se esperan (con timeout
+        recortado al plazo restante) para no perder pines ya cobrados.
+
+        Returns:
+            dict: {'pins': [pin_data, ...], 'errores': ['Pin N: mensaje', ...]}
+        """
+        deadline = time.monotonic() + (deadline_seconds or INEFABLE_BATCH_DEADLINE_SECONDS)
+        stop = threading.Event()
+
+        def _fetch(index):
+            remaining = deadline - time.monotonic()
+            if stop.is_set():
+                return index, {'status': 'error', 'message': 'Cancelado tras un error previo', 'error_type': 'cancelled'}
+            if remaining <= 0:
+                return index, {'status': 'error', 'message': 'Plazo total agotado', 'error_type': 'deadline'}
+            result = self.request_pin(monto_id, timeout=min(self.timeout, remaining))
+            if result.get('status') != 'success':
+                stop.set()
+            return index, result
+
+        executor = self._get_executor()
+        futures = [executor.submit(_fetch, i) for i in range(cantidad)]
+        wait(futures)
+
+        pins = []
+        errores = []
+        for future in futures:
+            index, result = future.result()
+            if result.get('status') == 'success':
+                pins.append(result)
+            else:
+                errores.append(f"Pin {index + 1}: {result.get('message', 'Error desconocido')}")
+        return {'pins': pins, 'errores': errores}
+
     def _process_pin_response(self, response, monto_id):
         """Procesa la respuesta de la API externa para extraer el pin"""
         try:
@@ -0,0 +1,281 @@
+"""
+Métricas estilo Prometheus
+==========================
+Capa de instrumentación sin dependencias externas, expuesta en `/metrics`
+(formato de texto de Prometheus):
+
+  - http_requests_total{blueprint, endpoint, method, status}
+  - http_request_duration_seconds{blueprint, endpoint, method}   (histograma)
+  - http_request_db_queries_total / http_request_db_seconds_total{blueprint, endpoint}
+    (aportadas por pg_compat: consultas y tiempo de base por request)
+  - outbound_request_duration_seconds{service, outcome}          (histograma)
+    (toda llamada a proveedores pasa por circuit_breaker: GameClub, Inefable,
+    VPS, Game Script, Binance)
+
+Cada worker gunicorn acumula en memoria. Con METRICS_MULTIPROC_DIR, cada
+worker vuelca su estado a `<dir>/metrics_<pid>_<id>.json` (como mucho cada
+METRICS_FLUSH_SECONDS) y `/metrics` suma los archivos de todos los workers,
+incluidos los que ya terminaron. El directorio se vacía al arrancar el master
+(ver gunicorn.conf.py). Sin directorio, `/metrics` muestra solo el proceso
+que atiende.
+
+Acceso: sesión de administrador o `Authorization: Bearer <METRICS_TOKEN>`
+para el scraper.
+"""
+
+import atexit
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import Response, g, has_request_context, jsonify, request, session
+
+from circuit_breaker import add_call_listener
+from pg_compat import add_query_listener
+
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '').strip()
+METRICS_FLUSH_SECONDS = max(float(os.environ.get('METRICS_FLUSH_SECONDS', '5')), 0.0)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '').strip()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_HELP = {
+    'http_requests_total': ('counter', 'Requests atendidos por endpoint y status.'),
+    'http_request_duration_seconds': ('histogram', 'Latencia de los requests por endpoint.'),
+    'http_request_db_queries_total': ('counter', 'Consultas a la base hechas dentro de requests.'),
+    'http_request_db_seconds_total': ('counter', 'Tiempo en la base dentro de requests.'),
+    'outbound_request_duration_seconds': ('histogram', 'Latencia de las llamadas a proveedores externos.'),
+}
+
+
+class MetricsRegistry:
+    """Contadores e histogramas del proceso; las claves son (nombre, etiquetas ordenadas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}  # clave -> [cuenta por bucket..., +Inf, suma]
+
+    def inc(self, name, labels, value=1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(LATENCY_BUCKETS)] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+            }
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+def merge_snapshots(snapshots):
+    """Suma los snapshots de varios procesos."""
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, series in snap.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            histograms[key] = list(series) if merged is None else [a + b for a, b in zip(merged, series)]
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_text(counters, histograms):
+    """Formato de exposición de texto de Prometheus."""
+    lines = []
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, help_text = _HELP.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+            cumulative += series[len(LATENCY_BUCKETS)]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {series[-1]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# ---------------------------------------------------------------------------
+# Volcado multiproceso
+# ---------------------------------------------------------------------------
+
+_flush_state = {'pid': None, 'path': None, 'flushed_at': 0.0}
+_flush_lock = threading.Lock()
+
+
+def _process_file():
+    pid = os.getpid()
+    if _flush_state['pid'] != pid:
+        # Proceso nuevo (fork de gunicorn): archivo propio, aunque el pid se reutilice
+        _flush_state.update(pid=pid, path=os.path.join(
+            METRICS_MULTIPROC_DIR, f'metrics_{pid}_{uuid.uuid4().hex[:8]}.json'), flushed_at=0.0)
+    return _flush_state['path']
+
+
+def flush(force=False):
+    """Escribe el snapshot de este proceso en METRICS_MULTIPROC_DIR (si está configurado)."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    now = time.monotonic()
+    with _flush_lock:
+        path = _process_file()
+        if not force and now - _flush_state['flushed_at'] < METRICS_FLUSH_SECONDS:
+            return
+        _flush_state['flushed_at'] = now
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(registry.snapshot(), fh)
+        os.replace(tmp_path, path)
+
+
+def reset_multiprocess_dir():
+    """Borra los volcados previos; llamar una vez al arrancar el master."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, 'metrics_*.json*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def collect():
+    """(contadores, histogramas) de todos los workers, o del proceso actual sin directorio."""
+    if not METRICS_MULTIPROC_DIR:
+        return merge_snapshots([registry.snapshot()])
+    flush(force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, 'metrics_*.json')):
+        try:
+            with open(path, encoding='utf-8') as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return merge_snapshots(snapshots)
+
+
+# ---------------------------------------------------------------------------
+# Hooks de Flask, pg_compat y circuit_breaker
+# ---------------------------------------------------------------------------
+
+def _request_labels():
+    return {
+        'blueprint': request.blueprint or 'app',
+        # Sin endpoint (404) se agrupa todo: la ruta cruda dispararía la cardinalidad
+        'endpoint': request.endpoint or '<sin_ruta>',
+    }
+
+
+def _start_request():
+    g._metrics = {'started': time.perf_counter(), 'db_queries': 0, 'db_seconds': 0.0}
+
+
+def _record_request(status):
+    state = g.pop('_metrics', None)
+    if state is None:
+        return
+    labels = _request_labels()
+    elapsed = time.perf_counter() - state['started']
+    registry.inc('http_requests_total', dict(labels, method=request.method, status=str(status)))
+    registry.observe('http_request_duration_seconds', dict(labels, method=request.method), elapsed)
+    if state['db_queries']:
+        registry.inc('http_request_db_queries_total', labels, state['db_queries'])
+        registry.inc('http_request_db_seconds_total', labels, state['db_seconds'])
+    flush()
+
+
+def _after_request(response):
+    _record_request(response.status_code)
+    return response
+
+
+def _teardown_request(exc=None):
+    # Solo llega con el estado pendiente si after_request no corrió (excepción no manejada)
+    _record_request(500)
+
+
+def _on_query(conn, sql, seconds):
+    if has_request_context():
+        state = g.get('_metrics')
+        if state is not None:
+            state['db_queries'] += 1
+            state['db_seconds'] += seconds
+
+
+def _on_outbound_call(service, seconds, outcome):
+    registry.observe('outbound_request_duration_seconds', {'service': service, 'outcome': outcome}, seconds)
+
+
+def _authorized():
+    if session.get('is_admin'):
+        return True
+    if not METRICS_TOKEN:
+        return False
+    auth = request.headers.get('Authorization', '')
+    return auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].strip(), METRICS_TOKEN)
+
+
+def metrics_view():
+    if not _authorized():
+        return jsonify({'ok': False, 'error': 'Acceso denegado'}), 403
+    counters, histograms = collect()
+    return Response(render_text(counters, histograms), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Registra los hooks de medición y la ruta /metrics."""
+    add_query_listener(_on_query)
+    add_call_listener(_on_outbound_call)
+    app.before_request(_start_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    atexit.register(flush, True)
@@ -6,14 +6,31 @@ Migrates Revendedores51 data from SQLite (usuarios.db) to PostgreSQL.
 Usage (on VPS):
     python3 migrate_sqlite_to_pg.py --sqlite /home/apps/web-b-revendedores/data/usuarios.db
 
+Fast mode (COPY FROM STDIN in batches, independent tables in parallel
+processes, resumable per-table checkpoints, row-content verification):
+    python3 migrate_sqlite_to_pg.py --sqlite usuarios.db --copy --jobs 4
+
+Each batch is COPYed into a temporary staging table and moved into the real
+table with INSERT ... SELECT ... ON CONFLICT DO NOTHING, so rows that already
+exist in PostgreSQL (e.g. created by the app) are skipped instead of aborting
+the batch. Re-running the same --copy command after a failure resumes each
+table from its last committed batch. Use --truncate to start over from scratch.
+
+Verification compares row counts and an md5 over the canonical text of every
+row (ordered by id) on both sides, not just counts.
+
 Requires DATABASE_URL set in environment (or .env file).
 """
 
 import os
 import sys
+import struct
+import hashlib
 import sqlite3
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -62,6 +79,11 @@ TABLES = [
     'recargas_binance',
 ]
 
+# Checkpoint table used by --copy mode (lives in the target database)
+CHECKPOINT_TABLE = '_sqlite_migration_checkpoints'
+DEFAULT_COPY_BATCH_ROWS = 20000
+DEFAULT_COPY_JOBS = min(4, os.cpu_count() or 1)
+
 
 def get_pg_conn(url: str):
     if url.startswith('postgres://'):
@@ -215,6 +237,311 @@ def migrate_table(sq_conn, pg_conn, table_name: str, dry_run=False):
     return inserted
 
 
+# ---------------------------------------------------------------------------
+# COPY mode
+# ---------------------------------------------------------------------------
+
+def ensure_checkpoint_table(pg_conn):
+    pg_conn.cursor().execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            last_rowid BIGINT NOT NULL DEFAULT 0,
+            rows_copied BIGINT NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+
+def clear_checkpoints(pg_conn, tables):
+    pg_conn.cursor().execute(
+        f'DELETE FROM {CHECKPOINT_TABLE} WHERE table_name = ANY(%s)', (list(tables),)
+    )
+
+
+def get_checkpoint(pg_cur, table_name: str):
+    pg_cur.execute(
+        f'SELECT last_rowid, rows_copied, done FROM {CHECKPOINT_TABLE} WHERE table_name = %s',
+        (table_name,)
+    )
+    row = pg_cur.fetchone()
+    if not row:
+        return 0, 0, False
+    return int(row['last_rowid']), int(row['rows_copied']), bool(row['done'])
+
+
+def _save_checkpoint(pg_cur, table_name: str, last_rowid: int, rows_copied: int, done: bool):
+    pg_cur.execute(
+        f"""
+        INSERT INTO {CHECKPOINT_TABLE} (table_name, last_rowid, rows_copied, done, updated_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON CONFLICT (table_name) DO UPDATE
+        SET last_rowid = EXCLUDED.last_rowid, rows_copied = EXCLUDED.rows_copied,
+            done = EXCLUDED.done, updated_at = NOW()
+        """,
+        (table_name, last_rowid, rows_copied, done)
+    )
+
+
+def _staging_table_name(table_name: str) -> str:
+    return f'_stage_{table_name}'
+
+
+def _create_staging_table(pg_cur, table_name: str, col_list: str):
+    """Temp table with the copied columns only: no constraints, no defaults.
+
+    ON COMMIT DELETE ROWS empties it at the end of every batch transaction.
+    """
+    stage = _staging_table_name(table_name)
+    pg_cur.execute(f'DROP TABLE IF EXISTS "{stage}"')
+    pg_cur.execute(
+        f'CREATE TEMP TABLE "{stage}" ON COMMIT DELETE ROWS AS '
+        f'SELECT {col_list} FROM "{table_name}" WITH NO DATA'
+    )
+
+
+def copy_table(sqlite_path: str, db_url: str, table_name: str, batch_rows=DEFAULT_COPY_BATCH_ROWS):
+    """Stream one SQLite table into PostgreSQL with COPY FROM STDIN.
+
+    Each batch is COPYed into a temp staging table, moved into the target
+    with INSERT ... SELECT ... ON CONFLICT DO NOTHING and checkpointed, all
+    in the same PG transaction: a row that already exists is skipped instead
+    of failing the whole batch, and a crash loses at most the batch in
+    flight. A re-run resumes after the last committed rowid. Runs in its own
+    process when --jobs > 1.
+    """
+    sq_conn = get_sqlite_conn(sqlite_path)
+    pg_conn = get_pg_conn(db_url)
+    try:
+        sq_cur = sq_conn.cursor()
+        pg_cur = pg_conn.cursor()
+
+        if not table_exists_sqlite(sq_cur, table_name):
+            log.info(f"  SKIP {table_name} (not in SQLite)")
+            return 0
+        if not table_exists_pg(pg_cur, table_name):
+            log.warning(f"  SKIP {table_name} (not in PostgreSQL — run app first to create schema)")
+            return 0
+
+        sq_cols = get_columns(sq_cur, table_name)
+        pg_meta = get_pg_columns_meta(pg_cur, table_name)
+        cols = [c for c in sq_cols if c in pg_meta]
+        if not cols:
+            log.warning(f"  SKIP {table_name} (no common columns between SQLite and PostgreSQL)")
+            return 0
+
+        last_rowid, rows_copied, done = get_checkpoint(pg_cur, table_name)
+        if done:
+            log.info(f"  {table_name}: already copied ({rows_copied} rows, checkpoint)")
+            return 0
+        if last_rowid:
+            log.info(f"  {table_name}: resuming after rowid {last_rowid} ({rows_copied} rows already copied)")
+
+        sq_col_list = ', '.join(f'"{c}"' for c in cols)
+        select_sql = (
+            f'SELECT rowid AS "__rowid", {sq_col_list} FROM "{table_name}" '
+            'WHERE rowid > ? ORDER BY rowid LIMIT ?'
+        )
+        stage = _staging_table_name(table_name)
+        _create_staging_table(pg_cur, table_name, sq_col_list)
+        copy_sql = f'COPY "{stage}" ({sq_col_list}) FROM STDIN'
+        merge_sql = (
+            f'INSERT INTO "{table_name}" ({sq_col_list}) '
+            f'SELECT {sq_col_list} FROM "{stage}" ON CONFLICT DO NOTHING'
+        )
+        copied_now = 0
+        skipped_now = 0
+        while True:
+            sq_cur.execute(select_sql, (last_rowid, batch_rows))
+            rows = sq_cur.fetchall()
+            if not rows:
+                break
+            with pg_conn.transaction():
+                with pg_cur.copy(copy_sql) as copy:
+                    for row in rows:
+                        copy.write_row([_coerce_value_for_pg(row[c], pg_meta.get(c)) for c in cols])
+                pg_cur.execute(merge_sql)
+                inserted = max(pg_cur.rowcount or 0, 0)
+                last_rowid = int(rows[-1]['__rowid'])
+                rows_copied += inserted
+                _save_checkpoint(pg_cur, table_name, last_rowid, rows_copied, False)
+            copied_now += inserted
+            skipped_now += len(rows) - inserted
+
+        _save_checkpoint(pg_cur, table_name, last_rowid, rows_copied, True)
+        pg_cur.execute(f'DROP TABLE IF EXISTS "{stage}"')
+        log.info(f"  {table_name}: {copied_now} rows copied, {skipped_now} skipped (conflicts) "
+                 f"({rows_copied} total)")
+        return copied_now
+    finally:
+        sq_conn.close()
+        pg_conn.close()
+
+
+def _toposort_levels(tables, edges):
+    """Group tables into levels: a table only depends on tables of earlier levels.
+
+    `edges` are (child, parent) foreign-key pairs. Tables within a level are
+    independent and can be copied in parallel. Cycles fall back to one table
+    per level in the original order.
+    """
+    selected = list(tables)
+    deps = {t: set() for t in selected}
+    for child, parent in edges:
+        if child in deps and parent in deps and child != parent:
+            deps[child].add(parent)
+
+    levels = []
+    placed = set()
+    while len(placed) < len(selected):
+        level = [t for t in selected if t not in placed and deps[t] <= placed]
+        if not level:
+            level = [next(t for t in selected if t not in placed)]
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
+def dependency_levels(pg_conn, tables):
+    pg_cur = pg_conn.cursor()
+    pg_cur.execute("""
+        SELECT cl.relname AS child, pl.relname AS parent
+        FROM pg_constraint c
+        JOIN pg_class cl ON cl.oid = c.conrelid
+        JOIN pg_class pl ON pl.oid = c.confrelid
+        JOIN pg_namespace n ON n.oid = cl.relnamespace
+        WHERE c.contype = 'f' AND n.nspname = 'public'
+    """)
+    edges = [(r['child'], r['parent']) for r in pg_cur.fetchall()]
+    return _toposort_levels(tables, edges)
+
+
+def run_copy_migration(sqlite_path: str, db_url: str, tables, jobs=DEFAULT_COPY_JOBS,
+                       batch_rows=DEFAULT_COPY_BATCH_ROWS):
+    pg_conn = get_pg_conn(db_url)
+    try:
+        ensure_checkpoint_table(pg_conn)
+        levels = dependency_levels(pg_conn, tables)
+    finally:
+        pg_conn.close()
+
+    total = 0
+    for idx, level in enumerate(levels, start=1):
+        log.info(f"COPY level {idx}/{len(levels)}: {', '.join(level)}")
+        if jobs <= 1 or len(level) == 1:
+            for table in level:
+                total += copy_table(sqlite_path, db_url, table, batch_rows)
+            continue
+        with ProcessPoolExecutor(max_workers=min(jobs, len(level))) as executor:
+            futures = {t: executor.submit(copy_table, sqlite_path, db_url, t, batch_rows) for t in level}
+            failed = []
+            for table, future in futures.items():
+                try:
+                    total += future.result()
+                except Exception as e:
+                    log.error(f"  {table}: COPY failed: {e}")
+                    failed.append(table)
+        if failed:
+            # Dependent tables would fail on FKs; stop here and let a re-run resume.
+            raise RuntimeError(f"COPY failed for: {', '.join(failed)} (re-run to resume)")
+    return total
+
+
+_INT_TYPES = ('smallint', 'integer', 'bigint')
+_FLOAT_TYPES = ('double precision', 'numeric')
+
+
+def _canonical_timestamp(value, pg_type: str) -> str:
+    dt = value
+    if not isinstance(dt, datetime):
+        dt = datetime.fromisoformat(str(value).strip())
+    if dt.tzinfo is not None:
+        if pg_type == 'timestamp with time zone':
+            dt = dt.astimezone(timezone.utc)
+        dt = dt.replace(tzinfo=None)
+    return dt.isoformat(sep=' ')
+
+
+def _canonical_value(value, pg_type) -> str:
+    """Text form of one value that is identical whether it was read from
+    SQLite (as stored) or from PostgreSQL (after the COPY coercion)."""
+    value = _coerce_value_for_pg(value, pg_type)
+    if value is None:
+        return '\\N'
+    try:
+        if pg_type == 'boolean':
+            return 't' if value else 'f'
+        if pg_type in _INT_TYPES:
+            return str(int(value))
+        if pg_type == 'real':
+            return repr(struct.unpack('f', struct.pack('f', float(value)))[0])
+        if pg_type in _FLOAT_TYPES:
+            return repr(float(value))
+        if pg_type and pg_type.startswith('timestamp'):
+            return _canonical_timestamp(value, pg_type)
+        if pg_type == 'date':
+            if isinstance(value, datetime):
+                return value.date().isoformat()
+            if isinstance(value, date):
+                return value.isoformat()
+            return date.fromisoformat(str(value).strip()[:10]).isoformat()
+    except (TypeError, ValueError, OverflowError, struct.error):
+        pass
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _rows_checksum(rows, cols, pg_meta, ordered: bool):
+    """(row count, md5 hex) over the canonical text of `rows`.
+
+    Rows must arrive ordered by id when `ordered`; otherwise the canonical
+    lines are sorted here so both sides hash in the same order.
+    """
+    lines = ('\t'.join(_canonical_value(row[c], pg_meta.get(c)) for c in cols) for row in rows)
+    if not ordered:
+        lines = iter(sorted(lines))
+    digest = hashlib.md5()
+    count = 0
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+        digest.update(b'\n')
+        count += 1
+    return count, digest.hexdigest()
+
+
+def verify_tables(sq_conn, pg_conn, tables):
+    """Compare row count and an md5 of every row's canonical text per table.
+
+    Only the columns both sides share are hashed, ordered by id when the
+    table has one. Returns the tables that differ.
+    """
+    sq_cur = sq_conn.cursor()
+    pg_cur = pg_conn.cursor()
+    mismatches = []
+    for table in tables:
+        if not table_exists_sqlite(sq_cur, table) or not table_exists_pg(pg_cur, table):
+            continue
+        pg_meta = get_pg_columns_meta(pg_cur, table)
+        cols = [c for c in get_columns(sq_cur, table) if c in pg_meta]
+        if not cols:
+            continue
+        has_id = 'id' in cols
+        col_list = ', '.join(f'"{c}"' for c in cols)
+        order = ' ORDER BY "id"' if has_id else ''
+        sq_cur.execute(f'SELECT {col_list} FROM "{table}"{order}')
+        sq_fp = _rows_checksum(sq_cur, cols, pg_meta, has_id)
+        pg_fp = _rows_checksum(pg_cur.stream(f'SELECT {col_list} FROM "{table}"{order}'),
+                               cols, pg_meta, has_id)
+        if sq_fp == pg_fp:
+            log.info(f"  OK {table}: {sq_fp[0]} rows, md5 {sq_fp[1][:12]}")
+        else:
+            log.warning(f"  MISMATCH {table}: sqlite rows={sq_fp[0]} md5={sq_fp[1][:12]} | "
+                        f"pg rows={pg_fp[0]} md5={pg_fp[1][:12]}")
+            mismatches.append(table)
+    return mismatches
+
+
 def truncate_tables(pg_conn, tables):
     """Truncate selected tables in reverse dependency order."""
     pg_cur = pg_conn.cursor()
@@ -258,6 +585,14 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Count rows without inserting')
     parser.add_argument('--tables', nargs='*', help='Specific tables to migrate (default: all)')
     parser.add_argument('--truncate', action='store_true', help='Truncate target tables before import')
+    parser.add_argument('--copy', action='store_true',
+                        help='Stream tables with COPY FROM STDIN (batched, parallel, resumable)')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_COPY_JOBS,
+                        help=f'Parallel worker processes for --copy (default: {DEFAULT_COPY_JOBS})')
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_COPY_BATCH_ROWS,
+                        help=f'Rows per COPY batch/checkpoint (default: {DEFAULT_COPY_BATCH_ROWS})')
+    parser.add_argument('--verify-only', action='store_true',
+                        help='Only compare row counts and row-content md5 between SQLite and PostgreSQL')
     args = parser.parse_args()
 
     db_url = os.environ.get('DATABASE_URL', '').strip()
@@ -270,6 +605,7 @@ def main():
     log.info(f"SQLite source: {args.sqlite}")
     log.info(f"PostgreSQL target: {db_url.split('@')[-1]}")
     log.info(f"Dry run: {args.dry_run}")
+    log.info(f"Mode: {'COPY' if args.copy else 'row-by-row'}")
     log.info("")
 
     sq_conn = get_sqlite_conn(args.sqlite)
@@ -277,20 +613,38 @@ def main():
 
     tables = args.tables if args.tables else TABLES
 
+    if args.verify_only:
+        mismatches = verify_tables(sq_conn, pg_conn, tables)
+        sq_conn.close()
+        pg_conn.close()
+        sys.exit(1 if mismatches else 0)
+
     if args.truncate and not args.dry_run:
         log.info("Truncating target tables before import...")
         truncate_tables(pg_conn, tables)
+        if args.copy:
+            ensure_checkpoint_table(pg_conn)
+            clear_checkpoints(pg_conn, tables)
 
     total = 0
-    for table in tables:
-        log.info(f"Migrating: {table}")
-        n = migrate_table(sq_conn, pg_conn, table, dry_run=args.dry_run)
-        total += n
-
+    if args.copy and not args.dry_run:
+        total = run_copy_migration(args.sqlite, db_url, tables, jobs=max(args.jobs, 1),
+                                   batch_rows=max(args.batch_rows, 1))
+    else:
+        for table in tables:
+            log.info(f"Migrating: {table}")
+            n = migrate_table(sq_conn, pg_conn, table, dry_run=args.dry_run)
+            total += n
+
+    mismatches = []
     if not args.dry_run:
         log.info("")
         log.info("Resetting SERIAL sequences...")
         reset_sequences(pg_conn)
+        if args.copy:
+            log.info("")
+            log.info("Verifying row counts and row-content checksums...")
+            mismatches = verify_tables(sq_conn, pg_conn, tables)
 
     sq_conn.close()
     pg_conn.close()
@@ -299,6 +653,8 @@ def main():
     log.info(f"Done. Total rows processed: {total}")
     if args.dry_run:
         log.info("(dry run — nothing was written)")
+    if mismatches:
+        sys.exit(f"Verification failed for: {', '.join(mismatches)}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+VPS de redención simulado
+=========================
+Implementa el protocolo de jobs de redeem_hype_vps (submit/batch/poll/verify)
+sin navegador, para pruebas y desarrollo local. Un PIN que empieza con "FAIL"
+termina en error; el resto se redime tras `job_seconds`.
+
+Uso:
+    python mock_vps_server.py --port 5000 --job-seconds 3
+    VPS_REDEEM_URL=http://127.0.0.1:5000/redeem python app.py
+
+En pruebas:
+    server, url = start_mock_vps(job_seconds=0.1)
+    ...
+    server.shutdown()
+"""
+import argparse
+import itertools
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockVpsState:
+    def __init__(self, job_seconds=0.2, legacy=False):
+        self.job_seconds = job_seconds
+        self.legacy = legacy  # True: responde sincrónico como el VPS antiguo
+        self.jobs = {}
+        self.redeemed = set()
+        self.submitted = 0
+        self.polls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def result_for(self, payload):
+        pin = str(payload.get('pin_key', ''))
+        if pin.upper().startswith('FAIL'):
+            return {'success': False, 'message': 'PIN inválido o ya usado'}
+        with self._lock:
+            self.redeemed.add(pin)
+        return {'success': True, 'message': 'Recarga completada', 'player_name': f"Jugador {payload.get('player_id')}"}
+
+    def create_job(self, payload):
+        with self._lock:
+            job_id = f'job-{next(self._ids)}'
+            self.jobs[job_id] = {'job_id': job_id, 'status': 'queued', 'result': None}
+            self.submitted += 1
+        timer = threading.Timer(self.job_seconds, self._finish, args=(job_id, payload))
+        timer.daemon = True
+        timer.start()
+        return job_id
+
+    def _finish(self, job_id, payload):
+        result = self.result_for(payload)
+        with self._lock:
+            job = self.jobs[job_id]
+            job.update(status='done' if result['success'] else 'failed', result=result)
+            snapshot = dict(job)
+        callback_url = payload.get('callback_url')
+        if callback_url:
+            try:
+                req = urllib.request.Request(
+                    callback_url, data=json.dumps(snapshot).encode(), method='POST',
+                    headers={'Content-Type': 'application/json',
+                             'X-Callback-Token': payload.get('callback_token') or ''},
+                )
+                urllib.request.urlopen(req, timeout=5).close()
+            except Exception:
+                pass
+
+    def get_job(self, job_id):
+        with self._lock:
+            self.polls += 1
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_POST(self):
+        state = self.state
+        payload = self._body()
+        if self.path == '/redeem':
+            if state.legacy or not payload.get('async'):
+                return self._json(200, state.result_for(payload))
+            return self._json(202, {'job_id': state.create_job(payload), 'status': 'queued'})
+        if self.path == '/redeem/batch' and not state.legacy:
+            jobs = [{'job_id': state.create_job(item), 'request_id': item.get('request_id'), 'status': 'queued'}
+                    for item in payload.get('items') or []]
+            return self._json(202, {'jobs': jobs})
+        if self.path == '/redeem/verify':
+            return self._json(200, {'already_redeemed': str(payload.get('pin_key')) in state.redeemed})
+        self._json(404, {'error': 'not found'})
+
+    def do_GET(self):
+        prefix = '/redeem/jobs/'
+        if self.path.startswith(prefix) and not self.state.legacy:
+            job = self.state.get_job(self.path[len(prefix):])
+            if job:
+                return self._json(200, job)
+        if self.path == '/health':
+            return self._json(200, {'ok': True})
+        self._json(404, {'error': 'not found'})
+
+
+def start_mock_vps(host='127.0.0.1', port=0, job_seconds=0.2, legacy=False):
+    """Arranca el VPS simulado en un hilo. Devuelve (server, url de /redeem); server.state tiene los contadores."""
+    state = MockVpsState(job_seconds=job_seconds, legacy=legacy)
+    handler = type('MockVpsHandler', (_Handler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name='mock-vps', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/redeem'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VPS de redención simulado')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--job-seconds', type=float, default=3.0)
+    parser.add_argument('--legacy', action='store_true', help='Responder sincrónico (VPS antiguo)')
+    args = parser.parse_args()
+    server, url = start_mock_vps(args.host, args.port, args.job_seconds, args.legacy)
+    print(f'VPS simulado escuchando en {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,12 +10,21 @@ Handles automatically:
   - CREATE TABLE schema fixes: AUTOINCREMENT->SERIAL, DATETIME->TIMESTAMP
   - Row objects that support both dict-key and positional (row[0]) access
   - row_factory assignment (no-op, always uses dict_row)
+  - Schema metadata cache for table_exists / column_exists, invalidated by DDL
+  - conn.pipeline(): one transaction whose writes are sent as a single batch
+  - Opt-in per-fingerprint query statistics and slow-query log (PG_QUERY_STATS)
 """
 
 import os
 import re
+import sys
 import logging
 import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
 
 import psycopg
 from psycopg.rows import dict_row
@@ -253,18 +262,19 @@ class PgRow:
 class PgCursor:
     """Wraps a psycopg v3 dict-row cursor to return PgRow objects."""
 
-    def __init__(self, cur):
+    def __init__(self, cur, owner=None):
         self._cur = cur
+        self._owner = owner
 
     def execute(self, sql: str, params=None):
         sql_pg = _convert_sql(sql)
         if sql_pg is None:
             return self  # PRAGMA no-op
-        try:
-            safe_params = _normalize_bool_params(sql_pg, params)
-            self._cur.execute(sql_pg, safe_params)
-        except Exception:
-            raise
+        safe_params = _normalize_bool_params(sql_pg, params)
+        started = time.perf_counter()
+        self._cur.execute(sql_pg, safe_params)
+        if self._owner is not None:
+            self._owner._after_execute(sql_pg, time.perf_counter() - started, self._cur)
         return self
 
     def executemany(self, sql: str, params_list):
@@ -275,7 +285,10 @@ class PgCursor:
             _normalize_bool_params(sql_pg, p)
             for p in (params_list or [])
         ]
+        started = time.perf_counter()
         self._cur.executemany(sql_pg, safe_list)
+        if self._owner is not None:
+            self._owner._after_execute(sql_pg, time.perf_counter() - started, self._cur)
         return self
 
     def fetchone(self):
@@ -322,6 +335,150 @@ class _NoOpCursor:
         pass
 
 
+# ---------------------------------------------------------------------------
+# Connection and query listeners (request_db accounting, metrics)
+# ---------------------------------------------------------------------------
+
+_connection_listeners = []
+
+
+def add_connection_listener(callback):
+    """Register callback(conn), called for every connection opened in this process."""
+    if callback not in _connection_listeners:
+        _connection_listeners.append(callback)
+
+
+def remove_connection_listener(callback):
+    if callback in _connection_listeners:
+        _connection_listeners.remove(callback)
+
+
+def _notify_connection_opened(conn):
+    for callback in list(_connection_listeners):
+        try:
+            callback(conn)
+        except Exception:
+            logger.debug('[pg_compat] connection listener failed', exc_info=True)
+
+
+_query_listeners = []
+
+
+def add_query_listener(callback):
+    """Register callback(conn, sql, seconds), called after every statement (used by metrics)."""
+    if callback not in _query_listeners:
+        _query_listeners.append(callback)
+
+
+def remove_query_listener(callback):
+    if callback in _query_listeners:
+        _query_listeners.remove(callback)
+
+
+def _notify_query(conn, sql, seconds):
+    for callback in list(_query_listeners):
+        try:
+            callback(conn, sql, seconds)
+        except Exception:
+            logger.debug('[pg_compat] query listener failed', exc_info=True)
+
+
+# ---------------------------------------------------------------------------
+# Query statistics by fingerprint + slow-query log (opt-in)
+# ---------------------------------------------------------------------------
+# Con PG_QUERY_STATS=1 cada sentencia se normaliza a una huella (literales y
+# listas IN/VALUES colapsadas) y se acumulan llamadas, tiempo total/medio/p95
+# y filas por huella, en memoria del proceso. Las que superan
+# PG_SLOW_QUERY_MS van al log con el archivo y la línea de quien la ejecutó.
+
+QUERY_STATS_ENABLED = os.environ.get('PG_QUERY_STATS', '').strip().lower() in ('1', 'true', 'yes', 'on')
+SLOW_QUERY_MS = max(float(os.environ.get('PG_SLOW_QUERY_MS', '500')), 0.0)
+QUERY_STATS_MAX_FINGERPRINTS = max(int(os.environ.get('PG_QUERY_STATS_MAX_FINGERPRINTS', '2000')), 10)
+QUERY_STATS_SAMPLES = max(int(os.environ.get('PG_QUERY_STATS_SAMPLES', '200')), 10)
+_OVERFLOW_FINGERPRINT = '<otras huellas>'
+
+_FP_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_FP_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_FP_PARAM_RE = re.compile(r'%s|\$\d+')
+_FP_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_FP_VALUES_RE = re.compile(r'\bVALUES\s*\([^()]*\)(?:\s*,\s*\([^()]*\))*', re.IGNORECASE)
+_FP_SPACE_RE = re.compile(r'\s+')
+
+_query_stats = {}  # huella -> {'calls', 'total', 'max', 'rows', 'samples'}
+_query_stats_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_sql(sql: str) -> str:
+    """Normalize a statement so every call site with different literals shares one key."""
+    fp = _FP_STRING_RE.sub('?', sql)
+    fp = _FP_PARAM_RE.sub('?', fp)
+    fp = _FP_NUMBER_RE.sub('?', fp)
+    fp = _FP_IN_LIST_RE.sub('IN (...)', fp)
+    fp = _FP_VALUES_RE.sub('VALUES (...)', fp)
+    return _FP_SPACE_RE.sub(' ', fp).strip()
+
+
+def _query_caller():
+    """file:line of the first frame outside this module."""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}'
+
+
+def record_query_stats(sql: str, seconds: float, rowcount: int = -1):
+    fp = fingerprint_sql(sql)
+    with _query_stats_lock:
+        entry = _query_stats.get(fp)
+        if entry is None:
+            if len(_query_stats) >= QUERY_STATS_MAX_FINGERPRINTS:
+                fp = _OVERFLOW_FINGERPRINT
+                entry = _query_stats.get(fp)
+            if entry is None:
+                entry = _query_stats[fp] = {
+                    'calls': 0, 'total': 0.0, 'max': 0.0, 'rows': 0,
+                    'samples': deque(maxlen=QUERY_STATS_SAMPLES),
+                }
+        entry['calls'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        if rowcount is not None and rowcount > 0:
+            entry['rows'] += rowcount
+        entry['samples'].append(seconds)
+    if seconds * 1000.0 >= SLOW_QUERY_MS:
+        logger.warning(f'[pg_compat] consulta lenta ({seconds * 1000.0:.0f} ms) en {_query_caller()}: {fp[:500]}')
+
+
+def get_query_stats(limit: int = 20, order_by: str = 'total'):
+    """Top-N fingerprints of this process, sorted by total/mean/p95/calls/rows."""
+    with _query_stats_lock:
+        items = [(fp, dict(entry, samples=sorted(entry['samples']))) for fp, entry in _query_stats.items()]
+    result = []
+    for fp, entry in items:
+        samples = entry['samples']
+        p95 = samples[min(int(round(0.95 * (len(samples) - 1))), len(samples) - 1)] if samples else 0.0
+        result.append({
+            'fingerprint': fp,
+            'calls': entry['calls'],
+            'total_ms': round(entry['total'] * 1000.0, 2),
+            'mean_ms': round(entry['total'] * 1000.0 / entry['calls'], 3) if entry['calls'] else 0.0,
+            'p95_ms': round(p95 * 1000.0, 3),
+            'max_ms': round(entry['max'] * 1000.0, 3),
+            'rows': entry['rows'],
+        })
+    key = {'total': 'total_ms', 'mean': 'mean_ms', 'p95': 'p95_ms', 'calls': 'calls', 'rows': 'rows'}.get(order_by, 'total_ms')
+    result.sort(key=lambda item: item[key], reverse=True)
+    return result[:max(int(limit), 1)]
+
+
+def reset_query_stats():
+    with _query_stats_lock:
+        _query_stats.clear()
+
+
 # ---------------------------------------------------------------------------
 # SQLite wrappers (dev fallback)
 # ---------------------------------------------------------------------------
@@ -329,20 +486,27 @@ class _NoOpCursor:
 class SqliteCursor:
     """Wrap sqlite3 cursor to return PgRow-compatible rows."""
 
-    def __init__(self, cur):
+    def __init__(self, cur, owner=None):
         self._cur = cur
+        self._owner = owner
 
     def execute(self, sql: str, params=None):
         sql_sq = _convert_sql_for_sqlite(sql)
+        started = time.perf_counter()
         if params is None:
             self._cur.execute(sql_sq)
         else:
             self._cur.execute(sql_sq, params)
+        if self._owner is not None:
+            self._owner._after_execute(sql_sq, time.perf_counter() - started, self._cur)
         return self
 
     def executemany(self, sql: str, params_list):
         sql_sq = _convert_sql_for_sqlite(sql)
+        started = time.perf_counter()
         self._cur.executemany(sql_sq, params_list)
+        if self._owner is not None:
+            self._owner._after_execute(sql_sq, time.perf_counter() - started, self._cur)
         return self
 
     def fetchone(self):
@@ -371,13 +535,61 @@ class SqliteCursor:
         self._cur.close()
 
 
-class SqliteConnection:
+class _ConnectionLifecycle:
+    """Common bookkeeping for both wrappers: query count, DDL and scoped close."""
+
+    query_count = 0
+    query_seconds = 0.0
+    closed = False
+    _scoped = False
+
+    def _after_execute(self, sql: str, seconds: float = 0.0, raw_cursor=None):
+        self.query_count += 1
+        self.query_seconds += seconds
+        _note_ddl(self._schema_key, sql)
+        if _query_listeners:
+            _notify_query(self, sql, seconds)
+        if QUERY_STATS_ENABLED:
+            record_query_stats(sql, seconds, getattr(raw_cursor, 'rowcount', -1))
+
+    def set_scoped(self, scoped: bool = True):
+        """Scoped connections ignore close(); the owner releases them with close_scoped()."""
+        self._scoped = scoped
+
+    def close(self):
+        if self._scoped or self.closed:
+            return
+        self.closed = True
+        self._conn.close()
+
+    def close_scoped(self):
+        self._scoped = False
+        self.close()
+
+    @contextmanager
+    def pipeline(self):
+        """Run the block as one transaction; commit on exit, roll back on error.
+
+        SQLite has no pipeline mode: statements still run one by one, which
+        costs nothing locally. Do not call commit() inside the block.
+        """
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+
+class SqliteConnection(_ConnectionLifecycle):
     """sqlite3-compatible wrapper aligned to PgConnection interface."""
 
     def __init__(self, db_path: str):
         self._db_path = db_path
+        self._schema_key = ('sqlite', os.path.abspath(db_path))
         self._conn = sqlite3.connect(db_path)
         self._conn.row_factory = sqlite3.Row
+        _notify_connection_opened(self)
 
     @property
     def row_factory(self):
@@ -389,7 +601,7 @@ class SqliteConnection:
         pass
 
     def _raw_cursor(self) -> SqliteCursor:
-        return SqliteCursor(self._conn.cursor())
+        return SqliteCursor(self._conn.cursor(), self)
 
     def execute(self, sql: str, params=None):
         cur = self._raw_cursor()
@@ -408,9 +620,6 @@ class SqliteConnection:
     def rollback(self):
         self._conn.rollback()
 
-    def close(self):
-        self._conn.close()
-
     def __enter__(self):
         return self
 
@@ -429,7 +638,7 @@ class SqliteConnection:
 # PgConnection wrapper
 # ---------------------------------------------------------------------------
 
-class PgConnection:
+class PgConnection(_ConnectionLifecycle):
     """
     Wraps a psycopg (v3) connection to expose sqlite3-compatible interface.
 
@@ -441,12 +650,14 @@ class PgConnection:
     """
 
     def __init__(self, dsn: str):
+        self._schema_key = ('pg', dsn)
         self._conn = psycopg.connect(dsn, row_factory=dict_row)
         # Importante: el código legacy usa muchos try/except para DDL (ALTER TABLE ...)
         # asumiendo comportamiento SQLite. En PostgreSQL, un error deja abortada la
         # transacción completa. Usamos autocommit para emular el flujo SQLite y evitar
         # InFailedSqlTransaction cuando esos errores esperados se capturan y se ignoran.
         self._conn.autocommit = True
+        _notify_connection_opened(self)
 
     # row_factory is set in many places — make it a no-op
     @property
@@ -459,18 +670,17 @@ class PgConnection:
 
     # ------------------------------------------------------------------
     def _raw_cursor(self) -> PgCursor:
-        return PgCursor(self._conn.cursor())
+        return PgCursor(self._conn.cursor(), self)
 
     def execute(self, sql: str, params=None):
         sql_pg = _convert_sql(sql)
         if sql_pg is None:
             return _NoOpCursor()
         cur = self._raw_cursor()
-        try:
-            safe_params = _normalize_bool_params(sql_pg, params)
-            cur._cur.execute(sql_pg, safe_params)
-        except Exception:
-            raise
+        safe_params = _normalize_bool_params(sql_pg, params)
+        started = time.perf_counter()
+        cur._cur.execute(sql_pg, safe_params)
+        self._after_execute(sql_pg, time.perf_counter() - started, cur._cur)
         return cur
 
     def executemany(self, sql: str, params_list):
@@ -482,21 +692,39 @@ class PgConnection:
             _normalize_bool_params(sql_pg, p)
             for p in (params_list or [])
         ]
+        started = time.perf_counter()
         cur._cur.executemany(sql_pg, safe_list)
+        self._after_execute(sql_pg, time.perf_counter() - started, cur._cur)
         return cur
 
     def cursor(self) -> PgCursor:
         return self._raw_cursor()
 
+    @contextmanager
+    def pipeline(self):
+        """Run the block as one transaction in psycopg pipeline mode.
+
+        Statements are queued and sent together; the server round trip happens
+        only when a result is needed (fetchone/fetchall/rowcount) and at COMMIT.
+        Put the reads the block depends on first, or before the block, so the
+        writes after them go out as one batch. Errors from queued statements
+        surface at the next sync and roll back the whole block, so keep
+        best-effort writes (the ones that swallow their own errors) out of it.
+        """
+        if not psycopg.Pipeline.is_supported():
+            with self._conn.transaction():
+                yield self
+            return
+        with self._conn.pipeline():
+            with self._conn.transaction():
+                yield self
+
     def commit(self):
         self._conn.commit()
 
     def rollback(self):
         self._conn.rollback()
 
-    def close(self):
-        self._conn.close()
-
     def __enter__(self):
         return self
 
@@ -512,13 +740,78 @@ class PgConnection:
 
 
 # ---------------------------------------------------------------------------
-# table_exists helper (replaces sqlite_master checks)
+# Schema metadata cache (table_exists / column_exists)
 # ---------------------------------------------------------------------------
+# El esquema solo cambia al migrar: una consulta carga todas las tablas y
+# columnas de la base y se reutiliza en el proceso. Cualquier CREATE/ALTER/DROP
+# ejecutado por estos wrappers invalida la entrada; el TTL cubre el DDL hecho
+# por otros procesos.
 
-def table_exists(conn: PgConnection, table_name: str) -> bool:
-    """Check if a table exists in the current PostgreSQL database."""
+SCHEMA_CACHE_TTL_SECONDS = max(float(os.environ.get('PG_SCHEMA_CACHE_SECONDS', '300')), 0.0)
+_schema_cache = {}  # schema_key -> {'loaded_at': monotonic, 'columns': {tabla: frozenset(columnas)}}
+_schema_cache_lock = threading.Lock()
+_DDL_PREFIXES = ('CREATE', 'ALTER', 'DROP')
+
+
+def _note_ddl(schema_key, sql: str):
+    if schema_key is not None and sql.lstrip()[:6].upper().startswith(_DDL_PREFIXES):
+        invalidate_schema_cache(schema_key)
+
+
+def invalidate_schema_cache(conn_or_key=None):
+    """Descarta los metadatos cacheados de una base (o de todas si no se indica)."""
+    key = getattr(conn_or_key, '_schema_key', conn_or_key)
+    with _schema_cache_lock:
+        if key is None:
+            _schema_cache.clear()
+        else:
+            _schema_cache.pop(key, None)
+
+
+def _load_schema_columns(conn):
+    if isinstance(conn, SqliteConnection):
+        rows = conn.execute(
+            "SELECT m.name AS table_name, p.name AS column_name "
+            "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+            "WHERE m.type = 'table'"
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = 'public'"
+        ).fetchall()
+    columns = {}
+    for row in rows:
+        columns.setdefault(row['table_name'], set()).add(row['column_name'])
+    return {table: frozenset(cols) for table, cols in columns.items()}
+
+
+def load_schema_cache(conn):
+    """Tablas y columnas de la base de `conn` ({tabla: columnas}), cacheadas por proceso.
+
+    Devuelve None si la conexión no admite caché o la consulta falla.
+    """
+    key = getattr(conn, '_schema_key', None)
+    if key is None:
+        return None
+    now = time.monotonic()
+    with _schema_cache_lock:
+        entry = _schema_cache.get(key)
+        if entry is not None and now - entry['loaded_at'] < SCHEMA_CACHE_TTL_SECONDS:
+            return entry['columns']
     try:
-        if isinstance(conn, SqliteConnection):
+        columns = _load_schema_columns(conn)
+    except Exception:
+        return None
+    with _schema_cache_lock:
+        _schema_cache[key] = {'loaded_at': now, 'columns': columns}
+    return columns
+
+
+def _table_exists_uncached(conn, table_name: str) -> bool:
+    try:
+        # sqlite3.Connection: las APIs standalone (connection_api) usan sqlite3 directo
+        if isinstance(conn, (SqliteConnection, sqlite3.Connection)):
             cur = conn.execute(
                 "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?",
                 (table_name,)
@@ -534,6 +827,37 @@ def table_exists(conn: PgConnection, table_name: str) -> bool:
         return False
 
 
+def _column_exists_uncached(conn, table_name: str, column_name: str) -> bool:
+    try:
+        if isinstance(conn, (SqliteConnection, sqlite3.Connection)):
+            rows = conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+            return any(row['name'] == column_name for row in rows)
+        cur = conn.execute(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = %s AND column_name = %s",
+            (table_name, column_name)
+        )
+        return cur.fetchone() is not None
+    except Exception:
+        return False
+
+
+def table_exists(conn: PgConnection, table_name: str) -> bool:
+    """Check if a table exists in the current database (served from the schema cache)."""
+    schema = load_schema_cache(conn)
+    if schema is None:
+        return _table_exists_uncached(conn, table_name)
+    return table_name in schema
+
+
+def column_exists(conn: PgConnection, table_name: str, column_name: str) -> bool:
+    """Check if a column exists on a table (served from the schema cache)."""
+    schema = load_schema_cache(conn)
+    if schema is None:
+        return _column_exists_uncached(conn, table_name, column_name)
+    return column_name in schema.get(table_name, ())
+
+
 # ---------------------------------------------------------------------------
 # Connection factory
 # ---------------------------------------------------------------------------
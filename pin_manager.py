@@ -246,29 +246,19 @@ class PinManager:
     
     def _request_multiple_pins_from_api(self, monto_id, cantidad):
         """
-        Solicita múltiples pines de la API externa haciendo llamadas individuales
+        Solicita múltiples pines de la API externa en paralelo (con tope de
+        concurrencia y plazo total en el cliente)
         """
-        pines_obtenidos = []
-        errores = []
-        
-        for i in range(cantidad):
-            logger.info(f"Solicitando pin {i+1}/{cantidad} de API externa para monto_id {monto_id}")
-            
-            api_result = self.inefable_client.request_pin(monto_id)
-            
-            if api_result.get('status') == 'success':
-                pines_obtenidos.append({
-                    'pin_code': api_result.get('pin_code'),
-                    'source': 'inefable_api'
-                })
-                logger.info(f"Pin {i+1}/{cantidad} obtenido exitosamente de API externa")
-            else:
-                error_msg = api_result.get('message', 'Error desconocido')
-                errores.append(f"Pin {i+1}: {error_msg}")
-                logger.error(f"Error al obtener pin {i+1}/{cantidad} de API externa: {error_msg}")
-                
-                # Si falla una solicitud, detener el proceso
-                break
+        logger.info(f"Solicitando {cantidad} pines de API externa para monto_id {monto_id}")
+        batch = self.inefable_client.request_pins(monto_id, cantidad)
+
+        pines_obtenidos = [
+            {'pin_code': pin.get('pin_code'), 'source': 'inefable_api'}
+            for pin in batch['pins']
+        ]
+        errores = batch['errores']
+        for error_msg in errores:
+            logger.error(f"Error al obtener pin de API externa: {error_msg}")
         
         # Resultado final
         if len(pines_obtenidos) == cantidad:
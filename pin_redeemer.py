@@ -18,16 +18,26 @@ import os
 import subprocess
 import shutil
 from datetime import datetime
-try:
-    from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
-except ImportError:
-    async_playwright = None
-    PlaywrightTimeout = None
 
 logger = logging.getLogger(__name__)
 
+# Playwright se importa en el primer uso: cargarlo al importar el módulo
+# encarecía el arranque de cada worker web aunque nunca redimiera un PIN.
+async_playwright = None
+PlaywrightTimeout = None
+
 _chromium_installed = False
 
+
+def _load_playwright():
+    """Importa Playwright bajo demanda (una vez por proceso)."""
+    global async_playwright, PlaywrightTimeout
+    if async_playwright is None:
+        from playwright.async_api import async_playwright as _async_playwright, TimeoutError as _PlaywrightTimeout
+        async_playwright = _async_playwright
+        PlaywrightTimeout = _PlaywrightTimeout
+    return async_playwright
+
 def ensure_chromium_installed():
     """Instala Chromium de Playwright si no está disponible."""
     global _chromium_installed
@@ -102,6 +112,8 @@ async def redeem_pin_async(pin_code, player_id, config=None):
     
     logger.info(f"[PinRedeemer] Iniciando redencion - PIN: {pin_code[:8]}... Player: {player_id} (headless={cfg['headless']})")
     
+    _load_playwright()
+
     # Asegurar que Chromium esté instalado
     ensure_chromium_installed()
     
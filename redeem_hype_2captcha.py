@@ -1,8 +1,11 @@
 import logging
 import os
 import re
+import threading
 import time
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import httpx
 
@@ -26,9 +29,59 @@ DEFAULT_USER_AGENT = (
 )
 
 
+# Tiempo típico de resolución de v3 en 2Captcha; se ajusta con lo observado (EWMA por action)
+CAPTCHA_EXPECTED_SOLVE_S = max(float(os.environ.get("TWOCAPTCHA_EXPECTED_SOLVE_S", "10")), 1.0)
+CAPTCHA_POLL_MIN_S = max(float(os.environ.get("TWOCAPTCHA_POLL_MIN_S", "1")), 0.2)
+CAPTCHA_POLL_MAX_S = max(float(os.environ.get("TWOCAPTCHA_POLL_MAX_S", "5")), CAPTCHA_POLL_MIN_S)
+# Pool de tokens resueltos por adelantado (0 = desactivado). Los tokens v3 vencen a los 120s.
+CAPTCHA_PRESOLVE_POOL = max(int(os.environ.get("TWOCAPTCHA_PRESOLVE_POOL", "0")), 0)
+CAPTCHA_TOKEN_TTL_S = max(float(os.environ.get("TWOCAPTCHA_TOKEN_TTL_S", "100")), 10.0)
+# Sin demanda durante este tiempo el pool deja de reponer (para no gastar saldo en vano)
+CAPTCHA_POOL_IDLE_S = max(float(os.environ.get("TWOCAPTCHA_POOL_IDLE_S", "300")), 0.0)
+
+_client = None
+_client_lock = threading.Lock()
+_solve_ewma = {}
+_solve_ewma_lock = threading.Lock()
+
+
+def _captcha_client():
+    """Cliente HTTP persistente para la API de 2Captcha."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(timeout=30, limits=httpx.Limits(max_keepalive_connections=10))
+    return _client
+
+
+def _expected_solve_s(action):
+    with _solve_ewma_lock:
+        return _solve_ewma.get(action, CAPTCHA_EXPECTED_SOLVE_S)
+
+
+def _record_solve_time(action, seconds):
+    with _solve_ewma_lock:
+        prev = _solve_ewma.get(action, CAPTCHA_EXPECTED_SOLVE_S)
+        _solve_ewma[action] = 0.3 * seconds + 0.7 * prev
+
+
+def _poll_delays(expected_s):
+    """Esperas entre sondeos: la primera cerca del tiempo típico, luego cada
+    CAPTCHA_POLL_MIN_S hasta 1.5x lo esperado y después con backoff hasta CAPTCHA_POLL_MAX_S."""
+    waited = max(expected_s * 0.8, CAPTCHA_POLL_MIN_S)
+    yield waited
+    interval = CAPTCHA_POLL_MIN_S
+    while True:
+        if waited >= expected_s * 1.5:
+            interval = min(interval * 1.5, CAPTCHA_POLL_MAX_S)
+        waited += interval
+        yield interval
+
+
 def _solve_recaptcha_v3(api_key: str, pageurl: str, sitekey: str,
                         action: str = "validate", min_score: float = 0.3,
-                        timeout_s: int = 120, poll_interval: int = 5) -> str:
+                        timeout_s: int = 120) -> str:
     """Resuelve reCAPTCHA v3 usando la API de 2Captcha."""
     params = {
         "key": api_key,
@@ -41,7 +94,9 @@ def _solve_recaptcha_v3(api_key: str, pageurl: str, sitekey: str,
         "json": "1",
     }
 
-    resp = httpx.post(TWOCAPTCHA_IN, data=params, timeout=30)
+    client = _captcha_client()
+    started = time.monotonic()
+    resp = client.post(TWOCAPTCHA_IN, data=params, timeout=30)
     data = resp.json()
 
     if data.get("status") != 1:
@@ -50,11 +105,14 @@ def _solve_recaptcha_v3(api_key: str, pageurl: str, sitekey: str,
     task_id = data["request"]
     logger.info(f"[2Captcha] Tarea creada: {task_id}")
 
-    deadline = time.time() + timeout_s
-    while time.time() < deadline:
-        time.sleep(poll_interval)
+    deadline = started + timeout_s
+    for delay in _poll_delays(_expected_solve_s(action)):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
 
-        res = httpx.get(TWOCAPTCHA_RES, params={
+        res = client.get(TWOCAPTCHA_RES, params={
             "key": api_key,
             "action": "get",
             "id": task_id,
@@ -64,7 +122,9 @@ def _solve_recaptcha_v3(api_key: str, pageurl: str, sitekey: str,
 
         if result.get("status") == 1:
             token = result["request"]
-            logger.info(f"[2Captcha] Token obtenido (len={len(token)})")
+            elapsed = time.monotonic() - started
+            _record_solve_time(action, elapsed)
+            logger.info(f"[2Captcha] Token obtenido en {elapsed:.1f}s (len={len(token)})")
             return token
 
         if result.get("request") == "CAPCHA_NOT_READY":
@@ -75,6 +135,126 @@ def _solve_recaptcha_v3(api_key: str, pageurl: str, sitekey: str,
     raise TimeoutError(f"2Captcha no resolvió en {timeout_s}s")
 
 
+class CaptchaTokenPool:
+    """Mantiene hasta `size` tokens resueltos (o en curso) por delante de la demanda.
+
+    Cada token guarda su vencimiento; take() descarta los vencidos y devuelve el
+    más nuevo válido o None (el llamador resuelve en línea). Un timer por token
+    encarga el reemplazo `refresh_lead_s` antes de que venza, así el pool no se
+    vacía entre un take() y el siguiente. Tras CAPTCHA_POOL_IDLE_S sin take()
+    el pool deja de reponer.
+    """
+
+    def __init__(self, solver, size, ttl_s=None, idle_s=None, refresh_lead_s=None):
+        self._solver = solver
+        self.size = size
+        self.ttl_s = ttl_s or CAPTCHA_TOKEN_TTL_S
+        self.idle_s = CAPTCHA_POOL_IDLE_S if idle_s is None else idle_s
+        # Margen para resolver el reemplazo antes de que venza el token actual
+        self.refresh_lead_s = min(CAPTCHA_EXPECTED_SOLVE_S, self.ttl_s / 2) if refresh_lead_s is None else refresh_lead_s
+        self._lock = threading.Lock()
+        self._tokens = deque()  # (expires_at, token)
+        self._in_flight = 0
+        self._last_demand = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=max(size, 1), thread_name_prefix="captcha-pool")
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failed = 0
+
+    def _prune(self, now):
+        while self._tokens and self._tokens[0][0] <= now:
+            self._tokens.popleft()
+            self.expired += 1
+
+    def _refill_locked(self, now):
+        if self.idle_s and now - self._last_demand > self.idle_s:
+            return
+        # Los que vencen antes de lo que tarda un reemplazo ya no cuentan
+        fresh = sum(1 for expires_at, _ in self._tokens if expires_at - self.refresh_lead_s > now)
+        missing = self.size - fresh - self._in_flight
+        for _ in range(max(missing, 0)):
+            self._in_flight += 1
+            self._executor.submit(self._solve_one)
+
+    def _solve_one(self):
+        try:
+            token = self._solver()
+        except Exception as e:
+            logger.warning(f"[2Captcha] Pool: fallo resolviendo token anticipado: {e}")
+            with self._lock:
+                self._in_flight -= 1
+                self.failed += 1
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            self._tokens.append((now + self.ttl_s, token))
+            self._prune(now)
+            self._refill_locked(now)
+        timer = threading.Timer(max(self.ttl_s - self.refresh_lead_s, 0.0), self._refresh)
+        timer.daemon = True
+        timer.start()
+
+    def _refresh(self):
+        # Timer de vencimiento: reponer solo si hubo demanda reciente
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._refill_locked(now)
+
+    def warm(self):
+        with self._lock:
+            self._last_demand = time.monotonic()
+            self._refill_locked(self._last_demand)
+
+    def take(self):
+        now = time.monotonic()
+        with self._lock:
+            self._last_demand = now
+            self._prune(now)
+            token = self._tokens.pop()[1] if self._tokens else None
+            if token:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._refill_locked(now)
+        return token
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return {"ready": len(self._tokens), "in_flight": self._in_flight, "hits": self.hits,
+                    "misses": self.misses, "expired": self.expired, "failed": self.failed}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_captcha_token(api_key, action, min_score, timeout_s):
+    """Token del pool anticipado si está activo y tiene uno vigente; si no, se resuelve en línea."""
+    if CAPTCHA_PRESOLVE_POOL:
+        key = (api_key, action, min_score)
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = CaptchaTokenPool(
+                    lambda: _solve_recaptcha_v3(api_key=api_key, pageurl=BASE_URL, sitekey=RECAPTCHA_SITEKEY,
+                                                action=action, min_score=min_score, timeout_s=timeout_s),
+                    CAPTCHA_PRESOLVE_POOL,
+                )
+                _pools[key] = pool
+        token = pool.take()
+        if token:
+            logger.info(f"[2Captcha] Token '{action}' tomado del pool anticipado")
+            return token
+    return _solve_recaptcha_v3(
+        api_key=api_key, pageurl=BASE_URL, sitekey=RECAPTCHA_SITEKEY,
+        action=action, min_score=min_score, timeout_s=timeout_s,
+    )
+
+
 def _extract_hidden_fields(html: str) -> dict:
     """Extrae campos ocultos del HTML de respuesta."""
     fields = {}
@@ -192,10 +372,7 @@ def redeem_pin_2captcha(pin_code, player_id, config=None):
                 # ========== PASO 1: POST /validate (validar PIN) ==========
                 logger.info(f"[2Captcha] Paso 1/2: Resolviendo captcha para /validate...")
                 try:
-                    token1 = _solve_recaptcha_v3(
-                        api_key=api_key, pageurl=BASE_URL, sitekey=RECAPTCHA_SITEKEY,
-                        action="validate", min_score=captcha_min_score, timeout_s=captcha_timeout,
-                    )
+                    token1 = _get_captcha_token(api_key, "validate", captcha_min_score, captcha_timeout)
                 except Exception as e:
                     ultimo_error = f"Error 2Captcha (validate): {e}"
                     logger.error(f"[2Captcha] {ultimo_error}")
@@ -234,10 +411,7 @@ def redeem_pin_2captcha(pin_code, player_id, config=None):
                 # ========== PASO 2: POST /confirm (redención final) ==========
                 logger.info(f"[2Captcha] Paso 2/2: Resolviendo captcha para /confirm...")
                 try:
-                    token2 = _solve_recaptcha_v3(
-                        api_key=api_key, pageurl=BASE_URL, sitekey=RECAPTCHA_SITEKEY,
-                        action="KEY_REDEEM", min_score=captcha_min_score, timeout_s=captcha_timeout,
-                    )
+                    token2 = _get_captcha_token(api_key, "KEY_REDEEM", captcha_min_score, captcha_timeout)
                 except Exception as e:
                     ultimo_error = f"Error 2Captcha (confirm): {e}"
                     logger.error(f"[2Captcha] {ultimo_error}")
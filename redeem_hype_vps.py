@@ -2,38 +2,94 @@
 Redención de PIN via VPS remoto con Playwright.
 Tu web solo envía PIN + Player ID al VPS, y el VPS hace todo el trabajo pesado
 (navegador, captcha, redención). Respuesta en ~20s.
+
+Protocolo de jobs (submit/poll):
+  POST {VPS_REDEEM_URL}              payload + "async": true
+      → 202 {"job_id": "...", "status": "queued"}
+      (un VPS antiguo responde 200 con el resultado final; se acepta igual)
+  POST {VPS_REDEEM_URL}/batch        {"items": [payload, ...], "async": true}
+      → 202 {"jobs": [{"job_id": "...", "request_id": "..."}, ...]}
+  GET  {VPS_REDEEM_URL}/jobs/<id>    → {"status": "queued|running|done|failed", "result": {...}}
+
+Si VPS_CALLBACK_URL está configurada se envía como "callback_url" (con
+"callback_token", que el VPS devuelve en X-Callback-Token) y el VPS puede
+avisar el resultado; `notify_job_result()` despierta al hilo que espera
+ese job en este proceso. Si el aviso llega a otro worker, el sondeo lo cubre.
+El cuerpo del aviso no se usa como resultado: se vuelve a consultar
+GET /jobs/<id> al VPS, que es la fuente de verdad.
+
+`redeem_pin_vps()` espera el resultado (hasta VPS_TIMEOUT_S); solo lo usan
+los modos síncronos. La cola FF ID (freefire_id_queue) envía con
+`submit_redeem_job()` y cierra la orden desde el callback o el sondeo, sin
+ocupar un hilo durante la redención.
+Todas las llamadas usan una sola requests.Session con pool de conexiones.
 """
 import logging
 import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from circuit_breaker import CircuitOpenError, get_breaker, is_server_error
 from pin_redeemer import PinRedeemResult
 
 logger = logging.getLogger(__name__)
 
 VPS_DEFAULT_URL = "http://74.208.158.70:5000/redeem"
 VPS_TIMEOUT_S = 120
+VPS_CONNECT_TIMEOUT_S = max(float(os.environ.get("VPS_CONNECT_TIMEOUT_S", "5")), 1.0)
+VPS_POLL_INTERVAL_S = max(float(os.environ.get("VPS_POLL_INTERVAL_S", "2")), 0.05)
+VPS_POLL_MAX_INTERVAL_S = max(float(os.environ.get("VPS_POLL_MAX_INTERVAL_S", "5")), VPS_POLL_INTERVAL_S)
+VPS_POOL_SIZE = max(int(os.environ.get("VPS_POOL_SIZE", "10")), 1)
+VPS_CALLBACK_URL = os.environ.get("VPS_CALLBACK_URL", "")
 
+JOB_PENDING_STATES = ("queued", "running", "pendiente", "procesando")
 
-def redeem_pin_vps(pin_code, player_id, config=None, request_id=None):
-    """
-    Envía PIN + Player ID al VPS y recoge el resultado.
-    El VPS ejecuta Playwright + captcha y devuelve éxito/error.
-    """
+_session = None
+_session_lock = threading.Lock()
+
+# job_id -> threading.Event / resultado recibido por callback
+_job_events = {}
+_job_results = {}
+_job_lock = threading.Lock()
+
+
+def vps_session():
+    """Sesión HTTP compartida (keep-alive) para todas las llamadas al VPS."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=VPS_POOL_SIZE, max_retries=0)
+                sess.mount("http://", adapter)
+                sess.mount("https://", adapter)
+                sess.headers.update({"Content-Type": "application/json"})
+                _session = sess
+    return _session
+
+
+def _vps_settings(config):
     cfg = dict(config or {})
-    vps_url = cfg.get("vps_url") or os.environ.get("VPS_REDEEM_URL", VPS_DEFAULT_URL)
+    vps_url = (cfg.get("vps_url") or os.environ.get("VPS_REDEEM_URL", VPS_DEFAULT_URL)).rstrip("/")
     timeout = int(cfg.get("vps_timeout_s") or os.environ.get("VPS_TIMEOUT_S", VPS_TIMEOUT_S))
+    return cfg, vps_url, timeout
 
-    nombre = cfg.get("nombre_completo") or cfg.get("nombre_cliente") or "Usuario Revendedor"
-    born_at = cfg.get("fecha_nacimiento") or "01/01/1995"
 
+def _validate(pin_code, player_id):
     # Validación mínima antes de enviar
     if not pin_code or len(str(pin_code).strip()) < 10:
         return PinRedeemResult(False, "PIN inválido o vacío", pin_code, player_id)
     if not player_id or not str(player_id).strip().isdigit():
         return PinRedeemResult(False, "Player ID inválido (debe ser numérico)", pin_code, player_id)
+    return None
+
 
+def _build_payload(pin_code, player_id, cfg, request_id=None):
+    nombre = cfg.get("nombre_completo") or cfg.get("nombre_cliente") or "Usuario Revendedor"
+    born_at = cfg.get("fecha_nacimiento") or "01/01/1995"
     country = cfg.get("pais") or cfg.get("country") or "Chile"
 
     payload = {
@@ -42,39 +98,196 @@ def redeem_pin_vps(pin_code, player_id, config=None, request_id=None):
         "full_name": nombre,
         "birth_date": born_at,
         "country": country,
+        "async": True,
     }
     if request_id:
         payload["request_id"] = str(request_id)
+    if VPS_CALLBACK_URL:
+        payload["callback_url"] = VPS_CALLBACK_URL
+        payload["callback_token"] = os.environ.get("VPS_CALLBACK_TOKEN", "")
+    return payload
 
-    logger.info(f"[VPS] Enviando PIN {pin_code[:8]}... + ID {player_id} a {vps_url}")
 
-    try:
-        resp = requests.post(
-            vps_url,
-            json=payload,
-            timeout=timeout,
-            headers={"Content-Type": "application/json"},
-        )
-    except requests.exceptions.Timeout:
+def _vps_call(method, url, timeout, **kwargs):
+    return get_breaker("vps_redeemer").call(
+        getattr(vps_session(), method), url,
+        timeout=(VPS_CONNECT_TIMEOUT_S, timeout),
+        is_failure=is_server_error,
+        **kwargs,
+    )
+
+
+def _connection_error_result(e, vps_url, timeout, pin_code, player_id):
+    if isinstance(e, CircuitOpenError):
+        logger.error(f"[VPS] Circuito abierto: {e}")
+        return PinRedeemResult(False, f"El VPS no está disponible temporalmente. Reintenta en {e.retry_after}s.", pin_code, player_id)
+    if isinstance(e, requests.exceptions.Timeout):
         logger.error(f"[VPS] Timeout ({timeout}s) esperando respuesta del VPS")
         return PinRedeemResult(False, f"El VPS no respondió en {timeout}s. Reintenta.", pin_code, player_id)
-    except requests.exceptions.ConnectionError:
+    if isinstance(e, requests.exceptions.ConnectionError):
         logger.error(f"[VPS] No se pudo conectar al VPS en {vps_url}")
         return PinRedeemResult(False, "No se pudo conectar al VPS. Verifica que esté encendido.", pin_code, player_id)
-    except Exception as e:
-        logger.error(f"[VPS] Error inesperado: {e}")
-        return PinRedeemResult(False, f"Error de conexión: {str(e)}", pin_code, player_id)
+    logger.error(f"[VPS] Error inesperado: {e}")
+    return PinRedeemResult(False, f"Error de conexión: {str(e)}", pin_code, player_id)
 
-    logger.info(f"[VPS] Respuesta HTTP {resp.status_code}")
 
-    # Parsear respuesta JSON del VPS
+def _job_from_response(resp, pin_code, player_id, request_id=None):
+    """Convierte la respuesta del submit en job; un 200 de VPS antiguo ya es el resultado final."""
     try:
         data = resp.json()
     except Exception:
-        logger.warning(f"[VPS] Respuesta no-JSON: {resp.text[:300]}")
-        if resp.status_code == 200:
+        data = None
+    job = {"pin_code": pin_code, "player_id": player_id, "request_id": request_id, "http_status": resp.status_code}
+    if resp.status_code == 202 and isinstance(data, dict) and data.get("job_id"):
+        job.update(job_id=str(data["job_id"]), status=data.get("status") or "queued", result=None)
+    else:
+        job.update(job_id=None, status="done", result=data if data is not None else {"raw": resp.text[:300]})
+    return job
+
+
+def submit_redeem_job(pin_code, player_id, config=None, request_id=None):
+    """Envía el PIN al VPS y devuelve el job sin esperar la redención (o PinRedeemResult si falla el envío)."""
+    cfg, vps_url, timeout = _vps_settings(config)
+    invalid = _validate(pin_code, player_id)
+    if invalid:
+        return invalid
+
+    payload = _build_payload(pin_code, player_id, cfg, request_id)
+    logger.info(f"[VPS] Enviando PIN {pin_code[:8]}... + ID {player_id} a {vps_url}")
+    try:
+        resp = _vps_call("post", vps_url, timeout, json=payload)
+    except Exception as e:
+        return _connection_error_result(e, vps_url, timeout, pin_code, player_id)
+    logger.info(f"[VPS] Respuesta HTTP {resp.status_code}")
+    return _job_from_response(resp, pin_code, player_id, request_id)
+
+
+def submit_redeem_batch(items, config=None):
+    """Envía varios PINs en una sola petición. items: [(pin_code, player_id, request_id), ...].
+
+    Devuelve una lista alineada con items (job o PinRedeemResult). Si el VPS no
+    tiene /batch, se envían uno por uno.
+    """
+    cfg, vps_url, timeout = _vps_settings(config)
+    out = [None] * len(items)
+    payloads = []
+    for i, (pin_code, player_id, request_id) in enumerate(items):
+        out[i] = _validate(pin_code, player_id)
+        if out[i] is None:
+            payloads.append((i, _build_payload(pin_code, player_id, cfg, request_id or f"batch-{i}")))
+    if not payloads:
+        return out
+
+    try:
+        resp = _vps_call("post", f"{vps_url}/batch", timeout, json={"items": [p for _, p in payloads], "async": True})
+    except Exception as e:
+        for i, _ in payloads:
+            pin_code, player_id, _rid = items[i]
+            out[i] = _connection_error_result(e, vps_url, timeout, pin_code, player_id)
+        return out
+
+    if resp.status_code in (404, 405):
+        for i, _ in payloads:
+            pin_code, player_id, request_id = items[i]
+            out[i] = submit_redeem_job(pin_code, player_id, config, request_id=request_id)
+        return out
+
+    try:
+        jobs = {str(j.get("request_id")): j for j in (resp.json().get("jobs") or [])}
+    except Exception:
+        jobs = {}
+    for i, payload in payloads:
+        pin_code, player_id, request_id = items[i]
+        data = jobs.get(payload["request_id"])
+        if data and data.get("job_id"):
+            out[i] = {"pin_code": pin_code, "player_id": player_id, "request_id": request_id,
+                      "http_status": resp.status_code, "job_id": str(data["job_id"]),
+                      "status": data.get("status") or "queued", "result": None}
+        else:
+            out[i] = PinRedeemResult(False, f"El VPS no aceptó el PIN en el lote (HTTP {resp.status_code})", pin_code, player_id)
+    return out
+
+
+def get_redeem_job(job_id, config=None):
+    """Consulta el estado de un job en el VPS: {'status', 'result'}."""
+    _cfg, vps_url, _timeout = _vps_settings(config)
+    resp = _vps_call("get", f"{vps_url}/jobs/{job_id}", VPS_CONNECT_TIMEOUT_S * 2)
+    if resp.status_code == 404:
+        return {"status": "failed", "result": {"success": False, "message": "Job no encontrado en el VPS"}}
+    resp.raise_for_status()
+    return resp.json()
+
+
+def notify_job_result(job_id, data):
+    """Callback del VPS: guarda el resultado y despierta al hilo que espera ese job."""
+    job_id = str(job_id)
+    with _job_lock:
+        _job_results[job_id] = data
+        event = _job_events.get(job_id)
+    if event:
+        event.set()
+    return event is not None
+
+
+def wait_for_redeem_job(job, config=None, timeout=None):
+    """Espera el resultado de un job (callback o sondeo con intervalo creciente) y lo interpreta."""
+    if isinstance(job, PinRedeemResult):
+        return job
+    _cfg, vps_url, default_timeout = _vps_settings(config)
+    timeout = timeout or default_timeout
+    pin_code, player_id = job["pin_code"], job["player_id"]
+    if not job.get("job_id"):
+        return _result_from_data(job["result"], job.get("http_status", 200), pin_code, player_id)
+
+    job_id = job["job_id"]
+    event = threading.Event()
+    with _job_lock:
+        _job_events[job_id] = event
+    deadline = time.monotonic() + timeout
+    interval = VPS_POLL_INTERVAL_S
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(f"[VPS] Timeout ({timeout}s) esperando el job {job_id}")
+                return PinRedeemResult(False, f"El VPS no respondió en {timeout}s. Reintenta.", pin_code, player_id)
+            event.wait(min(interval, remaining))
+            with _job_lock:
+                data = _job_results.pop(job_id, None)
+            if data is None:
+                try:
+                    data = get_redeem_job(job_id, config)
+                except Exception as e:
+                    if isinstance(e, CircuitOpenError):
+                        return _connection_error_result(e, vps_url, timeout, pin_code, player_id)
+                    logger.warning(f"[VPS] Error consultando job {job_id}: {e}")
+                    data = None
+            result = job_result(data, pin_code, player_id)
+            if result is not None:
+                return result
+            interval = min(interval * 1.5, VPS_POLL_MAX_INTERVAL_S)
+    finally:
+        with _job_lock:
+            _job_events.pop(job_id, None)
+            _job_results.pop(job_id, None)
+
+
+def job_result(data, pin_code, player_id):
+    """Interpreta la respuesta de GET /jobs/<id>: PinRedeemResult si terminó, None si sigue pendiente."""
+    if not data or str(data.get("status", "")).lower() in JOB_PENDING_STATES:
+        return None
+    result = data.get("result")
+    return _result_from_data(result if isinstance(result, dict) else data, 200, pin_code, player_id)
+
+
+def _result_from_data(data, status_code, pin_code, player_id):
+    if not isinstance(data, dict):
+        data = {"raw": str(data)}
+    if set(data) == {"raw"}:
+        logger.warning(f"[VPS] Respuesta no-JSON: {data['raw'][:300]}")
+        if status_code == 200:
             return PinRedeemResult(True, "Recarga procesada (VPS)", pin_code, player_id)
-        return PinRedeemResult(False, f"VPS HTTP {resp.status_code}: respuesta inválida", pin_code, player_id)
+        return PinRedeemResult(False, f"VPS HTTP {status_code}: respuesta inválida", pin_code, player_id)
 
     logger.info(f"[VPS] Respuesta: {data}")
 
@@ -88,4 +301,13 @@ def redeem_pin_vps(pin_code, player_id, config=None, request_id=None):
         return PinRedeemResult(True, mensaje or "Recarga completada (VPS)", pin_code, player_id, player_name=player_name)
     else:
         logger.warning(f"[VPS] Redención fallida: {mensaje}")
-        return PinRedeemResult(False, mensaje or f"Error del VPS (HTTP {resp.status_code})", pin_code, player_id)
+        return PinRedeemResult(False, mensaje or f"Error del VPS (HTTP {status_code})", pin_code, player_id)
+
+
+def redeem_pin_vps(pin_code, player_id, config=None, request_id=None):
+    """
+    Envía PIN + Player ID al VPS y recoge el resultado.
+    El VPS ejecuta Playwright + captcha y devuelve éxito/error.
+    """
+    job = submit_redeem_job(pin_code, player_id, config, request_id=request_id)
+    return wait_for_redeem_job(job, config)
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+
+class Saturated(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class PhaseTimings:
+    """Últimas muestras por fase (queue_wait, captcha, post) con percentiles."""
+
+    def __init__(self, samples: int):
+        self._phases: Dict[str, deque] = {}
+        self._samples = samples
+
+    def record(self, phase: str, seconds: float):
+        self._phases.setdefault(phase, deque(maxlen=self._samples)).append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out = {}
+        for phase, values in self._phases.items():
+            ordered = sorted(values)
+            pick = lambda pct: round(ordered[min(int(pct / 100 * len(ordered)), len(ordered) - 1)] * 1000, 1)
+            out[phase] = {"p50_ms": pick(50), "p90_ms": pick(90), "max_ms": round(ordered[-1] * 1000, 1), "samples": len(ordered)}
+        return out
+
+
+class AdmissionController:
+    """Semáforo del tamaño de la capacidad de navegadores + cola de espera acotada."""
+
+    def __init__(self, capacity: int, queue_max: int, queue_timeout_s: float, timings: Optional[PhaseTimings] = None):
+        self.capacity = capacity
+        self.queue_max = queue_max
+        self.queue_timeout_s = queue_timeout_s
+        self.timings = timings
+        self._sem = asyncio.Semaphore(capacity)
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self._service_s = 20.0  # EWMA del tiempo por redención, para estimar Retry-After
+
+    def retry_after(self) -> int:
+        turns = (self.waiting + self.in_flight) / self.capacity
+        return max(int(self._service_s * max(turns, 1.0) + 0.999), 1)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.in_flight >= self.capacity and self.waiting >= self.queue_max:
+            self.rejected += 1
+            raise Saturated("Servicio saturado", self.retry_after())
+
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise Saturated("Tiempo de espera en cola agotado", self.retry_after())
+        finally:
+            self.waiting -= 1
+        if self.timings is not None:
+            self.timings.record("queue_wait", time.perf_counter() - started)
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._service_s = 0.2 * (time.perf_counter() - started) + 0.8 * self._service_s
+            self.in_flight -= 1
+            self._sem.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "queue_max": self.queue_max,
+            "admitted_total": self.admitted,
+            "rejected_total": self.rejected,
+            "queue_timeouts_total": self.queue_timeouts,
+            "service_time_ewma_s": round(self._service_s, 2),
+        }
@@ -0,0 +1,28 @@
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, Optional
+
+import httpx
+
+
+def build_http_client(timeout_s: float, concurrency: int, headers: Dict[str, str],
+                      transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """Cliente compartido (keep-alive) cuyo cookie jar no guarda nada.
+
+    El jar rechaza todos los dominios: una cookie de sesión que Hype devuelva
+    tras la redención de un cliente no se reenvía en la de otro.
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout_s, connect=timeout_s),
+        follow_redirects=True,
+        headers=headers,
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency),
+        transport=transport,
+    )
+
+
+def cookie_header(cookies: Dict[str, str]) -> Dict[str, str]:
+    """Header Cookie explícito para un request (vacío si no hay cookies)."""
+    if not cookies:
+        return {}
+    return {"Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items())}
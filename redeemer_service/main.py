@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 import os
+import time
 from typing import Any, Dict, Optional
 
 import httpx
@@ -9,6 +10,9 @@ from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 from playwright.async_api import async_playwright
 
+from admission import AdmissionController, PhaseTimings, Saturated
+from hype_http import build_http_client, cookie_header
+
 logger = logging.getLogger("redeemer_service")
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 
@@ -23,6 +27,23 @@ DEFAULT_USER_AGENT = (
     "Chrome/120.0.0.0 Safari/537.36"
 )
 
+# Control de admisión: cada redención abre un Chromium, así que la concurrencia
+# se limita a lo que aguanta la RAM del VPS y el resto espera en una cola acotada.
+BROWSER_CONCURRENCY = max(int(os.environ.get("BROWSER_CONCURRENCY", "2")), 1)
+REDEEM_QUEUE_MAX = max(int(os.environ.get("REDEEM_QUEUE_MAX", "8")), 0)
+REDEEM_QUEUE_TIMEOUT_S = max(float(os.environ.get("REDEEM_QUEUE_TIMEOUT_S", "30")), 0.1)
+# Cada cuánto se repite el GET de calentamiento (cookies) del cliente compartido
+WARMUP_TTL_S = max(float(os.environ.get("WARMUP_TTL_S", "600")), 0.0)
+TIMING_SAMPLES = 200
+
+
+timings = PhaseTimings(TIMING_SAMPLES)
+admission = AdmissionController(BROWSER_CONCURRENCY, REDEEM_QUEUE_MAX, REDEEM_QUEUE_TIMEOUT_S, timings=timings)
+
+_http_client: Optional[httpx.AsyncClient] = None
+_warmed_at = 0.0
+_warm_cookies: Dict[str, str] = {}
+
 
 class RedeemRequest(BaseModel):
     Key: str
@@ -110,38 +131,71 @@ def _parse_httpx_response(resp: httpx.Response) -> Dict[str, Any]:
     return {"raw": resp.text}
 
 
-async def _redeem_with_httpx(*, payload: Dict[str, Any], timeout_s: float, user_agent: str) -> httpx.Response:
+def _build_http_client() -> httpx.AsyncClient:
     headers = {
         "Accept": "application/json, text/plain, */*",
         "Content-Type": "application/json;charset=UTF-8",
         "Origin": "https://redeem.hype.games",
         "Referer": "https://redeem.hype.games/",
-        "User-Agent": user_agent,
+        "User-Agent": os.environ.get("USER_AGENT", DEFAULT_USER_AGENT),
     }
+    return build_http_client(float(os.environ.get("HTTP_TIMEOUT_S", "30")), BROWSER_CONCURRENCY, headers)
 
-    timeout = httpx.Timeout(timeout_s, connect=timeout_s)
 
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True, headers=headers) as client:
-        # Warm-up para cookies/sesión
-        await client.get(HYPE_BASE_URL)
-        return await client.post(HYPE_API_URL, content=json.dumps(payload))
+async def _redeem_with_httpx(*, payload: Dict[str, Any]) -> httpx.Response:
+    global _warmed_at, _warm_cookies
+    client = _http_client
+    # Warm-up para cookies anónimas: una vez por WARMUP_TTL_S, no en cada redención.
+    # El cliente no guarda cookies; solo viajan las del warm-up, nunca las que
+    # devolvió la redención de otro cliente.
+    if WARMUP_TTL_S and time.monotonic() - _warmed_at > WARMUP_TTL_S:
+        warmup = await client.get(HYPE_BASE_URL)
+        _warm_cookies = dict(warmup.cookies)
+        _warmed_at = time.monotonic()
+    return await client.post(HYPE_API_URL, content=json.dumps(payload), headers=cookie_header(_warm_cookies))
 
 
 app = FastAPI(title="Inefable Redeemer Service", version="1.0.0")
 
 
+@app.on_event("startup")
+async def _startup():
+    global _http_client
+    _http_client = _build_http_client()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if _http_client is not None:
+        await _http_client.aclose()
+
+
 @app.get("/health")
 async def health():
     return {"ok": True}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {"admission": admission.snapshot(), "timings": timings.snapshot()}
+
+
 @app.post("/redeem", response_model=RedeemResponse)
 async def redeem(req: RedeemRequest):
+    try:
+        async with admission.slot():
+            return await _redeem(req)
+    except Saturated as e:
+        logger.warning(f"{e.reason}: {admission.snapshot()}")
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+
+async def _redeem(req: RedeemRequest) -> RedeemResponse:
     timeout_ms = int(os.environ.get("PW_TIMEOUT_MS", "30000"))
-    http_timeout_s = float(os.environ.get("HTTP_TIMEOUT_S", "30"))
     user_agent = os.environ.get("USER_AGENT", DEFAULT_USER_AGENT)
 
     # Fase de seguridad: Playwright -> CaptchaToken
+    started = time.perf_counter()
     try:
         captcha_token = await _get_recaptcha_token(timeout_ms=timeout_ms, user_agent=user_agent)
     except asyncio.TimeoutError:
@@ -149,6 +203,8 @@ async def redeem(req: RedeemRequest):
     except Exception as e:
         logger.exception("Error obteniendo CaptchaToken")
         raise HTTPException(status_code=502, detail=f"Error obteniendo CaptchaToken: {str(e)}")
+    finally:
+        timings.record("captcha", time.perf_counter() - started)
 
     # Fase de ejecución: HTTPX -> POST directo
     payload = {
@@ -164,13 +220,16 @@ async def redeem(req: RedeemRequest):
         "ProductId": str(req.ProductId),
     }
 
+    started = time.perf_counter()
     try:
-        resp = await _redeem_with_httpx(payload=payload, timeout_s=http_timeout_s, user_agent=user_agent)
+        resp = await _redeem_with_httpx(payload=payload)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout en POST /api/v1/account")
     except Exception as e:
         logger.exception("Error en POST /api/v1/account")
         raise HTTPException(status_code=502, detail=f"Error HTTP: {str(e)}")
+    finally:
+        timings.record("post", time.perf_counter() - started)
 
     data = _parse_httpx_response(resp)
     success = 200 <= resp.status_code < 300
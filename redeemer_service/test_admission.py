@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+import httpx
+
+from admission import AdmissionController, PhaseTimings, Saturated
+from hype_http import build_http_client, cookie_header
+
+
+class AdmissionControllerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_limits_concurrency_and_rejects_when_queue_is_full(self):
+        timings = PhaseTimings(10)
+        admission = AdmissionController(capacity=2, queue_max=1, queue_timeout_s=5, timings=timings)
+        release = asyncio.Event()
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with admission.slot():
+                peak = max(peak, admission.in_flight)
+                await release.wait()
+
+        tasks = [asyncio.create_task(work()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        self.assertEqual((admission.in_flight, admission.waiting), (2, 1))
+
+        with self.assertRaises(Saturated) as ctx:
+            async with admission.slot():
+                pass
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(admission.rejected, 1)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(peak, 2)
+        self.assertEqual(admission.snapshot()["admitted_total"], 3)
+        self.assertEqual(timings.snapshot()["queue_wait"]["samples"], 3)
+
+    async def test_queue_wait_times_out(self):
+        admission = AdmissionController(capacity=1, queue_max=5, queue_timeout_s=0.05)
+        async with admission.slot():
+            with self.assertRaises(Saturated):
+                async with admission.slot():
+                    pass
+        self.assertEqual((admission.queue_timeouts, admission.waiting, admission.in_flight), (1, 0, 0))
+
+
+class SharedClientCookieTests(unittest.IsolatedAsyncioTestCase):
+    async def test_cookies_from_one_customer_do_not_reach_the_next(self):
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers.get("cookie"))
+            return httpx.Response(200, headers={"set-cookie": f"sesion=cliente{len(seen)}; Path=/"}, json={})
+
+        client = build_http_client(5, 2, {}, transport=httpx.MockTransport(handler))
+        try:
+            await client.post("https://redeem.hype.games/api/v1/account")
+            await client.post("https://redeem.hype.games/api/v1/account", headers=cookie_header({"warm": "1"}))
+        finally:
+            await client.aclose()
+
+        self.assertEqual(seen, [None, "warm=1"])
+        self.assertEqual(len(client.cookies), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Conexión a la base por request
+==============================
+Una vista como `/` o `/dashboard` llamaba a varios helpers (noticias,
+notificaciones, pendientes, saldo...) y cada uno abría su propia conexión.
+`get_request_connection()` abre una sola conexión por request, perezosamente,
+y la guarda en `flask.g`. Los helpers siguen llamando a `conn.close()` como
+siempre: en una conexión de request es un no-op y la cierra `teardown_request`.
+Fuera de un request (hilos de fondo, scripts) devuelve una conexión normal.
+
+Con DB_REQUEST_DEBUG=1 cada request registra cuántas conexiones abrió y
+cuántas consultas hizo (también en las cabeceras X-DB-Connections y
+X-DB-Queries) y avisa de las conexiones que siguen abiertas al terminar.
+"""
+
+import logging
+import os
+
+from flask import g, has_request_context, request
+
+from pg_compat import add_connection_listener, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+DB_REQUEST_DEBUG = os.environ.get('DB_REQUEST_DEBUG', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_request_connection():
+    """Conexión compartida del request actual (o una conexión nueva fuera de un request)."""
+    if not has_request_context():
+        return get_db_connection()
+    conn = g.get('_request_db_conn')
+    if conn is None or conn.closed:
+        conn = get_db_connection()
+        conn.set_scoped(True)
+        g._request_db_conn = conn
+    return conn
+
+
+def _track_connection(conn):
+    if has_request_context():
+        opened = g.get('_request_db_opened')
+        if opened is None:
+            opened = g._request_db_opened = []
+        opened.append(conn)
+
+
+def request_db_stats():
+    """(conexiones abiertas, consultas ejecutadas) en el request actual; requiere DB_REQUEST_DEBUG."""
+    opened = g.get('_request_db_opened') or []
+    return len(opened), sum(conn.query_count for conn in opened)
+
+
+def _close_request_connection(exc=None):
+    conn = g.pop('_request_db_conn', None)
+    if conn is None:
+        return
+    if exc is not None:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    try:
+        conn.close_scoped()
+    except Exception as e:
+        logger.warning(f'[DB] No se pudo cerrar la conexión del request: {e}')
+
+
+def _add_debug_headers(response):
+    connections, queries = request_db_stats()
+    response.headers['X-DB-Connections'] = str(connections)
+    response.headers['X-DB-Queries'] = str(queries)
+    return response
+
+
+def _report_request(exc=None):
+    _close_request_connection(exc)
+    opened = g.pop('_request_db_opened', None) or []
+    if not opened:
+        return
+    leaked = [conn for conn in opened if not conn.closed]
+    queries = sum(conn.query_count for conn in opened)
+    logger.info(f'[DB] {request.method} {request.path}: {len(opened)} conexiones, {queries} consultas')
+    if leaked:
+        logger.warning(
+            f'[DB] {request.method} {request.path}: {len(leaked)} conexión(es) siguen abiertas al terminar el request'
+        )
+
+
+def init_app(app):
+    """Registra el cierre por request (y, en modo debug, el conteo de conexiones/consultas)."""
+    if DB_REQUEST_DEBUG:
+        add_connection_listener(_track_connection)
+        app.after_request(_add_debug_headers)
+        app.teardown_request(_report_request)
+    else:
+        app.teardown_request(_close_request_connection)
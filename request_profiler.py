@@ -0,0 +1,211 @@
+"""
+Perfilado de requests en producción, bajo demanda
+=================================================
+Un administrador activa el modo desde /admin/api/profiler (POST) con:
+  - sample_rate: fracción de requests a perfilar (0..1), o bien
+  - endpoint / path_prefix / user_id: perfila todos los requests que cumplan
+    los filtros indicados (si hay filtros, sample_rate no se usa);
+  - duration_minutes: se apaga solo al vencer (por defecto 15).
+
+La configuración vive en REQUEST_PROFILE_DIR/config.json, así que la ven todos
+los workers gunicorn del host; cada worker la relee solo cuando cambia su mtime
+(como mucho cada REQUEST_PROFILE_CHECK_SECONDS). Desactivado, el costo por
+request es una comparación de reloj.
+
+Cada request perfilado se mide con cProfile y se guarda comprimido como
+`<fecha>_<pid>_<endpoint>_<ms>ms.prof.gz` (stats de pstats serializadas con
+marshal y gzip) en un buffer circular en disco: se borran los más viejos al
+pasar de REQUEST_PROFILE_MAX_FILES archivos o REQUEST_PROFILE_MAX_MB.
+Para leerlo: `gunzip x.prof.gz && python -m pstats x.prof`.
+
+Un solo request perfilado a la vez por proceso (cProfile es por hilo y los
+perfiladores simultáneos se pisan); los demás pasan sin perfilar.
+"""
+
+import cProfile
+import gzip
+import json
+import logging
+import marshal
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request, session
+
+logger = logging.getLogger(__name__)
+
+REQUEST_PROFILE_DIR = os.environ.get('REQUEST_PROFILE_DIR', '').strip() or os.path.join(
+    tempfile.gettempdir(), 'revendedores_profiles')
+REQUEST_PROFILE_MAX_FILES = max(int(os.environ.get('REQUEST_PROFILE_MAX_FILES', '50')), 1)
+REQUEST_PROFILE_MAX_MB = max(float(os.environ.get('REQUEST_PROFILE_MAX_MB', '50')), 1.0)
+REQUEST_PROFILE_CHECK_SECONDS = max(float(os.environ.get('REQUEST_PROFILE_CHECK_SECONDS', '2')), 0.0)
+DEFAULT_DURATION_MINUTES = 15
+
+_CONFIG_FILE = 'config.json'
+_PROFILE_NAME_RE = re.compile(r'^[0-9T]+_\d+_[A-Za-z0-9_.-]+_\d+ms\.prof\.gz$')
+_DISABLED = {'enabled': False}
+
+_state = {'config': _DISABLED, 'mtime': None, 'checked_at': 0.0}
+_state_lock = threading.Lock()
+_profile_lock = threading.Lock()
+
+
+def _config_path():
+    return os.path.join(REQUEST_PROFILE_DIR, _CONFIG_FILE)
+
+
+def get_config():
+    """Configuración vigente (releída del disco si cambió)."""
+    now = time.monotonic()
+    if now - _state['checked_at'] < REQUEST_PROFILE_CHECK_SECONDS:
+        return _state['config']
+    with _state_lock:
+        _state['checked_at'] = now
+        try:
+            mtime = os.stat(_config_path()).st_mtime
+        except OSError:
+            _state.update(config=_DISABLED, mtime=None)
+            return _DISABLED
+        if mtime != _state['mtime']:
+            try:
+                with open(_config_path(), encoding='utf-8') as fh:
+                    config = json.load(fh)
+            except (OSError, ValueError):
+                config = _DISABLED
+            _state.update(config=config, mtime=mtime)
+        return _state['config']
+
+
+def set_config(enabled, sample_rate=0.0, endpoint='', path_prefix='', user_id=None,
+               duration_minutes=DEFAULT_DURATION_MINUTES):
+    """Guarda la configuración para todos los workers del host y la devuelve."""
+    config = {'enabled': bool(enabled)}
+    if config['enabled']:
+        config.update(
+            sample_rate=min(max(float(sample_rate or 0.0), 0.0), 1.0),
+            endpoint=str(endpoint or '').strip(),
+            path_prefix=str(path_prefix or '').strip(),
+            user_id=int(user_id) if user_id not in (None, '') else None,
+            expires_at=time.time() + max(float(duration_minutes or DEFAULT_DURATION_MINUTES), 1.0) * 60.0,
+        )
+    os.makedirs(REQUEST_PROFILE_DIR, exist_ok=True)
+    tmp_path = f'{_config_path()}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(config, fh)
+    os.replace(tmp_path, _config_path())
+    with _state_lock:
+        _state.update(config=config, mtime=None, checked_at=0.0)
+    return config
+
+
+def _should_profile(config):
+    if not config.get('enabled') or time.time() >= config.get('expires_at', 0):
+        return False
+    filters = False
+    if config.get('endpoint'):
+        filters = True
+        if request.endpoint != config['endpoint']:
+            return False
+    if config.get('path_prefix'):
+        filters = True
+        if not request.path.startswith(config['path_prefix']):
+            return False
+    if config.get('user_id') is not None:
+        filters = True
+        if session.get('user_db_id') != config['user_id']:
+            return False
+    return filters or random.random() < config.get('sample_rate', 0.0)
+
+
+def _start_profile():
+    config = get_config()
+    if not config.get('enabled') or not _should_profile(config):
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    profiler = cProfile.Profile()
+    g._request_profile = (profiler, time.perf_counter())
+    profiler.enable()
+
+
+def _finish_profile(exc=None):
+    state = g.pop('_request_profile', None)
+    if state is None:
+        return
+    profiler, started = state
+    try:
+        profiler.disable()
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        _write_profile(profiler, request.endpoint or 'sin_ruta', elapsed_ms)
+    except Exception as e:
+        logger.warning(f'[profiler] No se pudo guardar el perfil: {e}')
+    finally:
+        _profile_lock.release()
+
+
+def _write_profile(profiler, endpoint, elapsed_ms):
+    profiler.create_stats()
+    safe_endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint)[:80]
+    name = f'{datetime.now().strftime("%Y%m%dT%H%M%S%f")}_{os.getpid()}_{safe_endpoint}_{elapsed_ms}ms.prof.gz'
+    os.makedirs(REQUEST_PROFILE_DIR, exist_ok=True)
+    with gzip.open(os.path.join(REQUEST_PROFILE_DIR, name), 'wb') as fh:
+        fh.write(marshal.dumps(profiler.stats))
+    _trim_ring_buffer()
+    return name
+
+
+def _trim_ring_buffer():
+    profiles = list_profiles()  # más nuevo primero
+    max_bytes = REQUEST_PROFILE_MAX_MB * 1024 * 1024
+    total = 0
+    for index, item in enumerate(profiles):
+        total += item['size']
+        if index >= REQUEST_PROFILE_MAX_FILES or total > max_bytes:
+            try:
+                os.remove(os.path.join(REQUEST_PROFILE_DIR, item['name']))
+            except OSError:
+                pass
+
+
+def list_profiles():
+    """Perfiles guardados, del más nuevo al más viejo."""
+    try:
+        names = [n for n in os.listdir(REQUEST_PROFILE_DIR) if _PROFILE_NAME_RE.match(n)]
+    except OSError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        try:
+            size = os.path.getsize(os.path.join(REQUEST_PROFILE_DIR, name))
+        except OSError:
+            continue
+        stamp, pid, rest = name.split('_', 2)
+        endpoint, duration = rest[:-len('.prof.gz')].rsplit('_', 1)
+        profiles.append({
+            'name': name,
+            'size': size,
+            'created_at': datetime.strptime(stamp, '%Y%m%dT%H%M%S%f').isoformat(timespec='seconds'),
+            'pid': int(pid),
+            'endpoint': endpoint,
+            'duration_ms': int(duration[:-2]),
+        })
+    return profiles
+
+
+def profile_path(name):
+    """Ruta del perfil `name`, o None si el nombre no es válido o no existe."""
+    if not _PROFILE_NAME_RE.match(name or ''):
+        return None
+    path = os.path.join(REQUEST_PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def init_app(app):
+    """Registra los hooks de perfilado (sin efecto mientras esté desactivado)."""
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)
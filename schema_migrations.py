@@ -0,0 +1,120 @@
+"""
+Migraciones de esquema versionadas
+==================================
+Reemplaza el DDL que antes corría completo en cada arranque de worker (y en
+algunas rutas de request). Cada migración es un paso `(version, nombre, fn)`
+con `fn(cursor)`; la tabla `schema_version` registra las versiones aplicadas.
+
+Arranque de un worker:
+  1. Una sola consulta `SELECT MAX(version) FROM schema_version`.
+  2. Si hay pasos pendientes, se toma un lock (pg_advisory_lock en PostgreSQL,
+     lock de proceso en SQLite de desarrollo), se vuelve a leer la versión y
+     solo el primer proceso aplica los pasos, en orden.
+
+Los pasos deben ser idempotentes (IF NOT EXISTS / ALTER dentro de try): con
+autocommit en PostgreSQL un paso que falla a medias se reintenta completo en el
+siguiente arranque.
+"""
+
+import logging
+import threading
+
+from pg_compat import SqliteConnection, invalidate_schema_cache
+
+logger = logging.getLogger(__name__)
+
+# Clave fija para pg_advisory_lock (bigint); compartida por todos los procesos.
+SCHEMA_MIGRATIONS_LOCK_KEY = 510_051_031
+
+_local_lock = threading.Lock()
+
+
+def _ensure_schema_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            aplicada_en DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def get_schema_version(conn):
+    """Versión aplicada más alta (0 si la tabla aún no existe)."""
+    try:
+        row = conn.execute('SELECT MAX(version) AS version FROM schema_version').fetchone()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return 0
+    if not row or row['version'] is None:
+        return 0
+    return int(row['version'])
+
+
+def _validate(migrations):
+    versions = [m[0] for m in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError('Las migraciones deben tener versiones únicas y en orden ascendente')
+
+
+def _acquire_lock(conn):
+    if isinstance(conn, SqliteConnection):
+        _local_lock.acquire()
+    else:
+        conn.execute('SELECT pg_advisory_lock(?)', (SCHEMA_MIGRATIONS_LOCK_KEY,))
+
+
+def _release_lock(conn):
+    if isinstance(conn, SqliteConnection):
+        _local_lock.release()
+        return
+    try:
+        conn.execute('SELECT pg_advisory_unlock(?)', (SCHEMA_MIGRATIONS_LOCK_KEY,))
+    except Exception as e:
+        # Al cerrar la conexión PostgreSQL libera el lock de todas formas.
+        logger.warning(f'[Migraciones] No se pudo liberar el advisory lock: {e}')
+
+
+def run_migrations(conn, migrations):
+    """Aplica los pasos pendientes y devuelve la lista de versiones aplicadas."""
+    _validate(migrations)
+    if not migrations:
+        return []
+    latest = migrations[-1][0]
+    if get_schema_version(conn) >= latest:
+        return []
+
+    applied = []
+    _acquire_lock(conn)
+    try:
+        _ensure_schema_version_table(conn)
+        current = get_schema_version(conn)
+        for version, nombre, step in migrations:
+            if version <= current:
+                continue
+            logger.info(f'[Migraciones] Aplicando {version}: {nombre}')
+            step(conn.cursor())
+            conn.execute(
+                'INSERT INTO schema_version (version, nombre) VALUES (?, ?)',
+                (version, nombre)
+            )
+            conn.commit()
+            applied.append(version)
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        _release_lock(conn)
+        # Los pasos crean/alteran tablas: los metadatos cacheados ya no sirven
+        invalidate_schema_cache(conn)
+
+    if applied:
+        logger.info(f'[Migraciones] Esquema actualizado a la versión {applied[-1]}')
+    return applied
@@ -14,6 +14,7 @@ import random
 import string
 import pytz
 from werkzeug.security import check_password_hash
+from admin_stats import insert_historial_compra
 from pin_manager import create_pin_manager
 from request_security import consume_rate_limit, get_request_client_ip
 
@@ -201,10 +202,9 @@ def create_transaction_record(user_id, pin_code, paquete_nombre, precio, conn=No
 
 def persist_purchase_metrics(conn, user_id, package_id, quantity, paquete_nombre, pin_text, precio_total, saldo_antes, saldo_despues, transaccion_id):
     try:
-        conn.execute('''
-            INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, tipo_evento, duracion_segundos, saldo_antes, saldo_despues)
-            VALUES (?, ?, ?, ?, 'compra', NULL, ?, ?)
-        ''', (user_id, precio_total, paquete_nombre, pin_text, saldo_antes, saldo_despues))
+        # Misma escritura que la web: la venta queda con su ganancia ya atribuida
+        insert_historial_compra(conn, user_id, precio_total, paquete_nombre, pin_text, 'compra', None,
+                                saldo_antes, saldo_despues)
     except Exception:
         pass
 
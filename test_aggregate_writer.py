@@ -0,0 +1,157 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from aggregate_writer import increment_aggregate
+from pg_compat import SqliteConnection
+from update_monthly_spending import update_monthly_spending
+
+
+class IncrementAggregateTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('''
+            CREATE TABLE profit_daily_aggregate (
+                day TEXT PRIMARY KEY, profit_total REAL NOT NULL, updated_at TEXT DEFAULT (datetime('now'))
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE monthly_user_spending (
+                usuario_id INTEGER NOT NULL, year_month TEXT NOT NULL,
+                total_spent REAL NOT NULL DEFAULT 0.0, purchases_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT (datetime('now')), PRIMARY KEY (usuario_id, year_month)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE ventas_semanales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, juego TEXT NOT NULL, paquete_id INTEGER NOT NULL,
+                paquete_nombre TEXT NOT NULL, precio_venta REAL NOT NULL, precio_compra REAL NOT NULL DEFAULT 0.0,
+                ganancia_unitaria REAL NOT NULL DEFAULT 0.0, cantidad_vendida INTEGER NOT NULL DEFAULT 1,
+                ganancia_total REAL NOT NULL DEFAULT 0.0, fecha_venta DATETIME DEFAULT CURRENT_TIMESTAMP,
+                semana_year TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _conn(self):
+        return SqliteConnection(self.db_path)
+
+    def test_first_write_inserts_and_later_writes_add(self):
+        conn = self._conn()
+        increment_aggregate(conn, 'profit_daily_aggregate', {'day': '2026-01-01'}, {'profit_total': 1.5})
+        increment_aggregate(conn, 'profit_daily_aggregate', {'day': '2026-01-01'}, {'profit_total': 0.25},
+                            touch=('updated_at', "'tocado'"))
+        increment_aggregate(conn, 'profit_daily_aggregate', {'day': '2026-01-02'}, {'profit_total': 3.0})
+        conn.commit()
+        rows = conn.execute('SELECT day, profit_total, updated_at FROM profit_daily_aggregate ORDER BY day').fetchall()
+        conn.close()
+        self.assertEqual([(r['day'], r['profit_total']) for r in rows], [('2026-01-01', 1.75), ('2026-01-02', 3.0)])
+        self.assertEqual(rows[0]['updated_at'], 'tocado')
+
+    def test_insert_values_are_only_written_on_create(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE UNIQUE INDEX ux_ventas_semanales_dia ON ventas_semanales (juego, paquete_id, semana_year)
+        ''')
+        keys = {'juego': 'bloodstriker', 'paquete_id': 1, 'semana_year': '2026-01-01'}
+        for precio in (2.0, 9.0):
+            increment_aggregate(conn, 'ventas_semanales', keys, {'cantidad_vendida': 1, 'ganancia_total': 0.5},
+                                insert_values={'paquete_nombre': '100', 'precio_venta': precio})
+        row = conn.execute('SELECT COUNT(*) AS n, MAX(cantidad_vendida) AS c, MAX(ganancia_total) AS g, '
+                           'MAX(precio_venta) AS p FROM ventas_semanales').fetchone()
+        conn.close()
+        self.assertEqual((row['n'], row['c'], row['g'], row['p']), (1, 2, 1.0, 2.0))
+
+    def test_concurrent_increments_are_not_lost(self):
+        errors = []
+
+        def worker():
+            conn = self._conn()
+            try:
+                for _ in range(20):
+                    update_monthly_spending(conn, 7, 1.0)
+                    conn.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        conn = self._conn()
+        row = conn.execute('SELECT total_spent, purchases_count FROM monthly_user_spending WHERE usuario_id = 7').fetchone()
+        conn.close()
+        self.assertEqual(errors, [])
+        self.assertEqual((row['total_spent'], row['purchases_count']), (80.0, 80))
+
+    def test_rejects_invalid_identifiers(self):
+        conn = self._conn()
+        with self.assertRaises(ValueError):
+            increment_aggregate(conn, 'profit_daily_aggregate; DROP TABLE x', {'day': '2026-01-01'}, {'profit_total': 1})
+        with self.assertRaises(ValueError):
+            increment_aggregate(conn, 'profit_daily_aggregate', {'day': '2026-01-01'}, {'profit_total': 1},
+                                touch=('updated_at = 1, day', "'x'"))
+        conn.close()
+
+
+class WeeklySalesMigrationTests(unittest.TestCase):
+    def test_duplicates_are_merged_before_unique_index(self):
+        import app
+
+        fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, db_path)
+        conn = SqliteConnection(db_path)
+        conn.execute('''
+            CREATE TABLE ventas_semanales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, juego TEXT NOT NULL, paquete_id INTEGER NOT NULL,
+                paquete_nombre TEXT NOT NULL, precio_venta REAL NOT NULL, precio_compra REAL NOT NULL DEFAULT 0.0,
+                ganancia_unitaria REAL NOT NULL DEFAULT 0.0, cantidad_vendida INTEGER NOT NULL DEFAULT 1,
+                ganancia_total REAL NOT NULL DEFAULT 0.0, fecha_venta DATETIME DEFAULT CURRENT_TIMESTAMP,
+                semana_year TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE TABLE precios_compra (juego TEXT, paquete_id INTEGER, precio_compra REAL, activo INTEGER DEFAULT 1)')
+        conn.execute("INSERT INTO precios_compra (juego, paquete_id, precio_compra) VALUES ('bloodstriker', 1, 1.5)")
+        for cantidad in (1, 2):
+            conn.execute('''
+                INSERT INTO ventas_semanales (juego, paquete_id, paquete_nombre, precio_venta, cantidad_vendida,
+                                              ganancia_total, semana_year)
+                VALUES ('bloodstriker', 1, '100', 2.0, ?, ?, '2026-01-01')
+            ''', (cantidad, cantidad * 0.5))
+        conn.execute('''
+            INSERT INTO ventas_semanales (juego, paquete_id, paquete_nombre, precio_venta, semana_year)
+            VALUES ('bloodstriker', 2, '500', 8.0, '2026-01-01')
+        ''')
+
+        app._migration_aggregate_unique_keys(conn.cursor())
+        conn.commit()
+        rows = conn.execute('SELECT id, paquete_id, cantidad_vendida, ganancia_total FROM ventas_semanales ORDER BY id').fetchall()
+        self.assertEqual([tuple(r[k] for k in ('id', 'paquete_id', 'cantidad_vendida', 'ganancia_total')) for r in rows],
+                         [(1, 1, 3, 1.5), (3, 2, 1, 0.0)])
+
+        # Las ventas del día se suman en una fila, en la conexión de la compra y sin commit propio
+        app.register_weekly_sale('bloodstriker', 1, '100', 2.0, 2, conn=conn)
+        app.register_weekly_sale('bloodstriker', 1, '100', 2.0, 1, conn=conn)
+        today = conn.execute("SELECT cantidad_vendida, ganancia_total, precio_compra FROM ventas_semanales "
+                             "WHERE semana_year <> '2026-01-01'").fetchall()
+        self.assertEqual([(r['cantidad_vendida'], r['ganancia_total'], r['precio_compra']) for r in today],
+                         [(3, 1.5, 1.5)])
+        conn.rollback()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM ventas_semanales').fetchone()[0], 2)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import api_whitelabel
+from pg_compat import SqliteConnection
+
+
+class WhitelabelApiKeyCacheTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('''
+            CREATE TABLE webservice_accounts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL,
+                api_key TEXT NOT NULL UNIQUE,
+                usuario_id INTEGER NOT NULL,
+                webhook_url TEXT DEFAULT '',
+                activo BOOLEAN DEFAULT TRUE
+            )
+        ''')
+        conn.execute("INSERT INTO webservice_accounts (nombre, api_key, usuario_id) VALUES ('Legacy', 'wsk_plaintextkey0123456789abcdef', 1)")
+        conn.commit()
+        api_whitelabel.init_whitelabel_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        self.connections = 0
+
+        def _conn():
+            self.connections += 1
+            return SqliteConnection(self.db_path)
+
+        self._patch = patch.object(api_whitelabel, '_get_conn', side_effect=_conn)
+        self._patch.start()
+        api_whitelabel.invalidate_api_key_cache()
+
+    def tearDown(self):
+        self._patch.stop()
+        api_whitelabel.invalidate_api_key_cache()
+        os.remove(self.db_path)
+
+    def test_plaintext_keys_are_migrated_to_hash(self):
+        conn = SqliteConnection(self.db_path)
+        row = conn.execute('SELECT api_key, api_key_hash FROM webservice_accounts WHERE id = 1').fetchone()
+        conn.close()
+
+        self.assertNotIn('0123456789abcdef', row['api_key'])
+        self.assertEqual(row['api_key_hash'], api_whitelabel.hash_api_key('wsk_plaintextkey0123456789abcdef'))
+
+    def test_lookup_is_cached_until_invalidated(self):
+        key = 'wsk_plaintextkey0123456789abcdef'
+
+        self.assertEqual(api_whitelabel.get_account_by_api_key(key)['id'], 1)
+        self.assertEqual(api_whitelabel.get_account_by_api_key(key)['id'], 1)
+        self.assertEqual(self.connections, 1)
+
+        conn = SqliteConnection(self.db_path)
+        conn.execute('UPDATE webservice_accounts SET activo = FALSE WHERE id = 1')
+        conn.commit()
+        conn.close()
+        api_whitelabel.invalidate_api_key_cache(1)
+
+        self.assertIsNone(api_whitelabel.get_account_by_api_key(key))
+        self.assertEqual(self.connections, 2)
+
+    def test_unknown_key_is_rejected(self):
+        self.assertIsNone(api_whitelabel.get_account_by_api_key('wsk_desconocida'))
+
+
+if __name__ == '__main__':
+    unittest.main()
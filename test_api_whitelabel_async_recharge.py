@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import api_whitelabel
+from pg_compat import SqliteConnection
+
+PACKAGE = ('dynamic', 'Juego', 'Paquete', 3.5, 44, 777, {'provider': 'gamepoint'})
+
+
+class WhitelabelAsyncRechargeTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, saldo REAL)')
+        conn.execute('INSERT INTO usuarios (id, saldo) VALUES (1, 10.0)')
+        api_whitelabel.init_whitelabel_tables(conn.cursor())
+        api_whitelabel.add_async_queue_columns(conn.cursor())
+        conn.execute("INSERT INTO webservice_accounts (id, nombre, api_key, usuario_id) VALUES (7, 'Cuenta Demo', 'k', 1)")
+        conn.commit()
+        conn.close()
+
+        self.app = Flask(__name__)
+        self.app.register_blueprint(api_whitelabel.bp)
+        self.client = self.app.test_client()
+        for patcher in (
+            patch.object(api_whitelabel, '_get_conn', side_effect=lambda: SqliteConnection(self.db_path)),
+            patch.object(api_whitelabel, '_get_account_by_key',
+                         return_value={'id': 7, 'usuario_id': 1, 'nombre': 'Cuenta Demo', 'webhook_url': ''}),
+            patch.object(api_whitelabel, '_resolve_package', return_value=PACKAGE),
+            patch.object(api_whitelabel, 'start_async_recharge_workers'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _query(self, sql, params=()):
+        conn = SqliteConnection(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def _post_async(self):
+        return self.client.post('/api/v1/recharge', headers={'X-API-Key': 'wsk_test'},
+                                json={'package_id': 44, 'player_id': '123456', 'async': True})
+
+    def test_wants_async_recharge_accepts_body_flag_and_prefer_header(self):
+        with self.app.test_request_context('/api/v1/recharge', method='POST'):
+            self.assertTrue(api_whitelabel._wants_async_recharge({'async': True}))
+            self.assertTrue(api_whitelabel._wants_async_recharge({'async': 'true'}))
+            self.assertFalse(api_whitelabel._wants_async_recharge({}))
+
+        with self.app.test_request_context('/api/v1/recharge', method='POST', headers={'Prefer': 'respond-async'}):
+            self.assertTrue(api_whitelabel._wants_async_recharge({}))
+
+    def test_async_request_is_debited_queued_and_answered_with_202(self):
+        resp = self._post_async()
+
+        self.assertEqual(resp.status_code, 202)
+        data = resp.get_json()
+        self.assertEqual(data['status'], 'procesando')
+        self.assertEqual(resp.headers['Location'], f"/api/v1/orders/{data['order_id']}")
+        self.assertEqual(self._query('SELECT saldo FROM usuarios WHERE id = 1')['saldo'], 6.5)
+        order = self._query('SELECT * FROM api_orders WHERE id = ?', (data['order_id'],))
+        self.assertEqual((order['estado'], order['async_estado']), ('procesando', 'pendiente'))
+        self.assertEqual(json.loads(order['async_job'])['gp_package_id'], 44)
+        api_whitelabel.start_async_recharge_workers.assert_called_once_with()
+
+        claimed = api_whitelabel.claim_async_order()
+        self.assertEqual(claimed['id'], data['order_id'])
+        with patch.object(api_whitelabel, '_process_recharge_order', return_value=({'ok': True}, 200)) as process_mock:
+            api_whitelabel._run_async_order(claimed)
+
+        args, kwargs = process_mock.call_args
+        self.assertEqual(args[:8], (data['order_id'], 'dynamic', 44, '123456', '', 3.5, 44, 777))
+        self.assertEqual(args[9]['nombre'], 'Cuenta Demo')
+        self.assertEqual(kwargs['pkg_name'], 'Paquete')
+        self.assertEqual(self._query('SELECT async_estado FROM api_orders WHERE id = ?',
+                                     (data['order_id'],))['async_estado'], 'terminado')
+        self.assertIsNone(api_whitelabel.claim_async_order())
+
+    def test_full_queue_answers_503_without_debiting(self):
+        with patch.object(api_whitelabel, 'WHITELABEL_ASYNC_WORKERS', 1), \
+                patch.object(api_whitelabel, 'WHITELABEL_ASYNC_MAX_PENDING', 0):
+            self.assertEqual(self._post_async().status_code, 202)
+            resp = self._post_async()
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], str(api_whitelabel.WHITELABEL_ASYNC_RETRY_AFTER_SECONDS))
+        self.assertEqual(self._query('SELECT saldo FROM usuarios WHERE id = 1')['saldo'], 6.5)
+        self.assertEqual(self._query('SELECT COUNT(*) AS n FROM api_orders')['n'], 1)
+
+    def test_order_interrupted_mid_run_is_refunded_not_retried(self):
+        order_id = self._post_async().get_json()['order_id']
+        api_whitelabel.claim_async_order(now=1000.0)
+        # El proceso murió: el lease vence y otro worker la reclama
+        expired = 1000.0 + api_whitelabel.WHITELABEL_ASYNC_LEASE_SECONDS + 1
+        claimed = api_whitelabel.claim_async_order(now=expired)
+        self.assertEqual((claimed['id'], claimed['async_intentos']), (order_id, 2))
+
+        with patch.object(api_whitelabel, '_process_recharge_order') as process_mock:
+            api_whitelabel._run_async_order(claimed)
+
+        process_mock.assert_not_called()
+        order = self._query('SELECT estado, async_estado FROM api_orders WHERE id = ?', (order_id,))
+        self.assertEqual((order['estado'], order['async_estado']), ('fallida', 'terminado'))
+        self.assertEqual(self._query('SELECT saldo FROM usuarios WHERE id = 1')['saldo'], 10.0)
+
+    def test_overlapping_workers_on_expired_lease_refund_once(self):
+        order_id = self._post_async().get_json()['order_id']
+        first = api_whitelabel.claim_async_order(now=1000.0)
+        lease = api_whitelabel.WHITELABEL_ASYNC_LEASE_SECONDS
+        # Mientras el primero renueva, nadie más la reclama
+        self.assertTrue(api_whitelabel.renew_async_lease(order_id, 1, now=1000.0 + lease - 1))
+        self.assertIsNone(api_whitelabel.claim_async_order(now=1000.0 + lease + 1))
+
+        # El primero se cuelga sin renovar: el segundo la reclama y reembolsa
+        second = api_whitelabel.claim_async_order(now=1000.0 + 2 * lease)
+        api_whitelabel._run_async_order(second)
+        self.assertFalse(api_whitelabel.renew_async_lease(order_id, 1))
+        self.assertEqual(self._query('SELECT saldo FROM usuarios WHERE id = 1')['saldo'], 10.0)
+
+        # El primero termina después: ni segundo reembolso ni 'completada' sobre 'fallida'
+        job = json.loads(first['async_job'])
+        for result in ({'ok': False, 'error': 'timeout'}, {'ok': True, 'reference_no': 'R1'}):
+            with patch.object(api_whitelabel, '_execute_gamepoint_recharge', return_value=result), \
+                    patch.object(api_whitelabel, 'insert_historial_compra') as historial_mock:
+                api_whitelabel._process_recharge_order(
+                    order_id, 'dynamic', 44, '123456', '', job['precio'], 44, 777, 1,
+                    {'id': 7, 'nombre': 'Cuenta Demo', 'webhook_url': ''}, provider_meta=job['provider_meta'],
+                )
+            historial_mock.assert_not_called()
+
+        self.assertEqual(self._query('SELECT saldo FROM usuarios WHERE id = 1')['saldo'], 10.0)
+        self.assertEqual(self._query('SELECT estado FROM api_orders WHERE id = ?', (order_id,))['estado'], 'fallida')
+
+
+if __name__ == '__main__':
+    unittest.main()
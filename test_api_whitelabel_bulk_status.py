@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import api_whitelabel
+from pg_compat import SqliteConnection
+
+
+class WhitelabelBulkStatusTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        api_whitelabel.init_whitelabel_tables(conn.cursor())
+        rows = [
+            (1, 7, 'completada', 'EXT-1', '2026-01-01 10:00:00'),
+            (2, 7, 'procesando', 'EXT-2', '2026-01-01 10:05:00'),
+            (3, 7, 'fallida', 'EXT-2', '2026-01-01 10:05:00'),
+            (4, 8, 'completada', 'EXT-9', '2026-01-01 10:06:00'),
+        ]
+        for order_id, account_id, estado, ext, updated in rows:
+            conn.execute('''
+                INSERT INTO api_orders (id, account_id, usuario_id, game_type, package_id, player_id, precio,
+                                        estado, external_order_id, fecha_actualizacion)
+                VALUES (?, ?, 1, 'dynamic', 44, '123', 1.5, ?, ?, ?)
+            ''', (order_id, account_id, estado, ext, updated))
+        conn.commit()
+        conn.close()
+
+        self.app = Flask(__name__)
+        self.app.register_blueprint(api_whitelabel.bp)
+        self.client = self.app.test_client()
+        self._patches = [
+            patch.object(api_whitelabel, '_get_conn', side_effect=lambda: SqliteConnection(self.db_path)),
+            patch.object(api_whitelabel, '_get_account_by_key', return_value={'id': 7, 'usuario_id': 1, 'activo': True}),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        os.remove(self.db_path)
+
+    def _post(self, body):
+        return self.client.post('/api/v1/orders/status', json=body, headers={'X-API-Key': 'wsk_test'})
+
+    def test_lookup_by_ids_and_external_ids_is_scoped_to_account(self):
+        resp = self._post({'order_ids': [1, 4, 99], 'external_order_ids': ['EXT-2', 'EXT-X']})
+        data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([o['id'] for o in data['orders']], [1, 3])
+        self.assertEqual(data['not_found']['order_ids'], [4, 99])
+        self.assertEqual(data['not_found']['external_order_ids'], ['EXT-X'])
+
+    def test_since_cursor_pages_through_changes(self):
+        first = self._post({'since': '2026-01-01 09:00:00', 'limit': 2}).get_json()
+        self.assertEqual([o['id'] for o in first['orders']], [1, 2])
+        self.assertTrue(first['has_more'])
+
+        second = self._post(dict(first['next_cursor'], limit=2)).get_json()
+        self.assertEqual([o['id'] for o in second['orders']], [3])
+        self.assertFalse(second['has_more'])
+        # Al quedar al día, el cursor retrocede la ventana de solapamiento
+        self.assertEqual(second['next_cursor'], {'since': '2026-01-01 10:04:30', 'since_id': 0})
+
+    def test_late_commit_with_older_timestamp_is_picked_up_by_next_poll(self):
+        first = self._post({'since': '2026-01-01 09:00:00'}).get_json()
+        self.assertEqual([o['id'] for o in first['orders']], [1, 2, 3])
+
+        # Una transacción que fijó su fecha antes del último cambio visto confirma tarde
+        conn = SqliteConnection(self.db_path)
+        conn.execute('''
+            INSERT INTO api_orders (id, account_id, usuario_id, game_type, package_id, player_id, precio,
+                                    estado, external_order_id, fecha_actualizacion)
+            VALUES (5, 7, 1, 'dynamic', 44, '123', 1.5, 'completada', 'EXT-5', '2026-01-01 10:04:50')
+        ''')
+        conn.commit()
+        conn.close()
+
+        second = self._post(first['next_cursor']).get_json()
+        self.assertIn(5, [o['id'] for o in second['orders']])
+
+    def test_rejects_requests_over_the_limit(self):
+        with patch.object(api_whitelabel, 'WHITELABEL_BULK_STATUS_MAX', 2):
+            resp = self._post({'order_ids': [1, 2, 3]})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_requires_ids_or_since(self):
+        self.assertEqual(self._post({}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class BackgroundWorkersStartupTests(unittest.TestCase):
+    def setUp(self):
+        import app
+        self.app = app
+
+    def test_background_workers_start_once_per_process(self):
+        app = self.app
+        thread_cls = MagicMock()
+        with patch.object(app, '_background_workers_pid', None), \
+             patch.object(app.threading, 'Thread', thread_cls), \
+             patch.object(app, 'FFID_REDEEM_QUEUE_ENABLED', True), \
+             patch.object(app, 'start_redeem_workers') as redeem_workers_mock, \
+             patch.object(app, 'start_whitelabel_async_workers') as whitelabel_workers_mock:
+            self.assertTrue(app.start_background_workers())
+            self.assertFalse(app.start_background_workers())
+
+        names = [c.kwargs['name'] for c in thread_cls.call_args_list]
+        self.assertEqual(names.count('binance-verify'), 1)
+        self.assertIn('dyn-game-poll', names)
+        redeem_workers_mock.assert_called_once_with(app._process_freefire_id_redeem_job,
+                                                    vps_handler=app._check_freefire_id_vps_job)
+        whitelabel_workers_mock.assert_called_once_with(only_if_backlog=True)
+
+    def test_forked_process_starts_its_own_workers(self):
+        app = self.app
+        with patch.object(app, '_background_workers_pid', -1), \
+             patch.object(app.threading, 'Thread', MagicMock()), \
+             patch.object(app, 'FFID_REDEEM_QUEUE_ENABLED', False), \
+             patch.object(app, 'start_whitelabel_async_workers'):
+            self.assertTrue(app.start_background_workers())
+
+    def test_mail_is_created_lazily(self):
+        app = self.app
+        with patch.object(app, '_mail', None):
+            mail = app.get_mail()
+            self.assertIs(app.get_mail(), mail)
+
+
+if __name__ == '__main__':
+    unittest.main()
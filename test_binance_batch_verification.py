@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pg_compat import SqliteConnection
+
+
+def _tx(codigo, monto, tx_id, currency='USDT'):
+    return {
+        'orderType': 'C2C',
+        'transactionId': tx_id,
+        'orderMemo': f'pago {codigo.lower()}',
+        'fundsDetail': [{'currency': currency, 'amount': str(monto)}],
+    }
+
+
+class BinanceBatchVerificationTests(unittest.TestCase):
+    def setUp(self):
+        import app
+        self.app = app
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, saldo REAL DEFAULT 0.0, bono_activo BOOLEAN DEFAULT FALSE)')
+        app._migration_recargas_binance(conn.cursor())
+        app._migration_creditos_billetera(conn.cursor())
+        for user_id, codigo, monto in ((1, 'REC-AAA111', 10.0), (2, 'REC-BBB222', 25.0), (3, 'REC-CCC333', 40.0)):
+            conn.execute('INSERT INTO usuarios (id, saldo) VALUES (?, 0)', (user_id,))
+            conn.execute('''
+                INSERT INTO recargas_binance (usuario_id, codigo_referencia, monto_solicitado, monto_unico, fecha_expiracion)
+                VALUES (?, ?, ?, ?, datetime('now', '+10 minutes'))
+            ''', (user_id, codigo, monto, monto))
+        conn.commit()
+        conn.close()
+
+        self.transactions = [
+            _tx('REC-AAA111', 10.0, 'T1'),
+            _tx('REC-BBB222', 24.0, 'T2'),  # monto distinto: no acredita
+            _tx('REC-CCC333', 40.0, 'T3'),
+        ]
+        self._patches = [
+            patch.object(app, 'get_db_connection', side_effect=lambda: SqliteConnection(self.db_path)),
+            patch.object(app, 'binance_get_pay_transactions', side_effect=lambda **kw: list(self.transactions)),
+            patch.dict(app._binance_tx_window, {'start_ts': None, 'fetched_at': 0.0, 'transactions': None}),
+        ]
+        mocks = [p.start() for p in self._patches]
+        self.fetch_mock = mocks[1]
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        os.remove(self.db_path)
+
+    def _saldos(self):
+        conn = SqliteConnection(self.db_path)
+        rows = conn.execute('SELECT id, saldo FROM usuarios ORDER BY id').fetchall()
+        conn.close()
+        return [r['saldo'] for r in rows]
+
+    def test_cycle_fetches_once_and_credits_all_matches(self):
+        resumen = self.app.verificar_recargas_pendientes_binance()
+
+        self.assertEqual(self.fetch_mock.call_count, 1)
+        self.assertEqual(resumen, {'pendientes': 3, 'completadas': 2, 'transacciones': 3})
+        self.assertEqual(self._saldos(), [10.0, 0.0, 40.0])
+
+        # Un segundo ciclo no vuelve a acreditar
+        self.app.verificar_recargas_pendientes_binance()
+        self.assertEqual(self._saldos(), [10.0, 0.0, 40.0])
+
+    def test_manual_verification_reuses_fresh_window(self):
+        self.transactions = []
+        self.app.verificar_recargas_pendientes_binance()
+        self.assertEqual(self.fetch_mock.call_count, 1)
+
+        resultado = self.app.verificar_recarga_binance(2)
+        self.assertEqual(resultado['status'], 'pendiente')
+        self.assertEqual(self.fetch_mock.call_count, 1)
+
+        with patch.object(self.app, 'BINANCE_TX_CACHE_SECONDS', 0):
+            self.transactions = [_tx('REC-BBB222', 25.0, 'T9')]
+            resultado = self.app.verificar_recarga_binance(2)
+        self.assertEqual(resultado['status'], 'completada')
+        self.assertEqual(self.fetch_mock.call_count, 2)
+
+    def test_truncated_window_is_cached_only_for_what_it_covers(self):
+        self.transactions = [dict(_tx('REC-AAA111', 10.0, 'T1'), transactionTime=6000),
+                             dict(_tx('REC-BBB222', 25.0, 'T2'), transactionTime=5000)]
+        with patch.object(self.app, 'BINANCE_TX_PAGE_LIMIT', 2), patch.object(self.app, 'BINANCE_TX_MAX_PAGES', 1):
+            self.app.binance_fetch_transaction_window(1000)
+            self.assertEqual(self.app._binance_tx_window['start_ts'], 5001)
+
+            # Desde antes de lo cubierto hay que volver a consultar; dentro, se reutiliza
+            self.app.binance_fetch_transaction_window(1000, use_cache=True)
+            self.assertEqual(self.fetch_mock.call_count, 2)
+            self.app.binance_fetch_transaction_window(5500, use_cache=True)
+            self.assertEqual(self.fetch_mock.call_count, 2)
+
+    def test_index_groups_transactions_by_reference_code(self):
+        index = self.app.index_binance_transactions(self.transactions + [_tx('sin codigo', 5, 'T4')])
+        self.assertEqual(sorted(index), ['REC-AAA111', 'REC-BBB222', 'REC-CCC333'])
+        self.assertEqual(index['REC-AAA111'][0]['transaction_id'], 'T1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import binance_endpoints
+from binance_endpoints import BinanceUnavailable, EndpointSelector
+from circuit_breaker import CircuitBreaker
+
+HOSTS = ['https://api1.test', 'https://api2.test', 'https://api3.test']
+
+
+class EndpointSelectorTests(unittest.TestCase):
+    def _selector(self, behaviour, hedge_delay=0.05):
+        """behaviour: base_url -> (segundos, resultado o excepción)."""
+        selector = EndpointSelector(HOSTS, hedge_delay=hedge_delay)
+        self.calls = []
+        lock = threading.Lock()
+
+        def _attempt(base_url, path, *, params, headers, timeout, proxies):
+            with lock:
+                self.calls.append(base_url)
+            delay, result = behaviour[base_url]
+            time.sleep(delay)
+            if isinstance(result, Exception):
+                selector.record(base_url, timeout, ok=False)
+                raise result
+            selector.record(base_url, delay, ok=True)
+            return result
+
+        selector._attempt = _attempt
+        return selector
+
+    def test_slow_primary_is_hedged_to_next_host(self):
+        selector = self._selector({
+            HOSTS[0]: (1.0, {'code': '000000', 'host': 1}),
+            HOSTS[1]: (0.01, {'code': '000000', 'host': 2}),
+            HOSTS[2]: (0.01, {'code': '000000', 'host': 3}),
+        })
+        started = time.monotonic()
+        base_url, data = selector.get_json('/x', timeout=2, total_timeout=3)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual((base_url, data['host']), (HOSTS[1], 2))
+        self.assertEqual(self.calls, HOSTS[:2])
+
+    def test_transport_error_falls_through_without_waiting(self):
+        selector = self._selector({
+            HOSTS[0]: (0.0, ConnectionError('reset')),
+            HOSTS[1]: (0.0, {'code': '000000', 'host': 2}),
+            HOSTS[2]: (0.0, {'code': '000000', 'host': 3}),
+        }, hedge_delay=5)
+
+        base_url, _ = selector.get_json('/x', timeout=2, total_timeout=3)
+        self.assertEqual(base_url, HOSTS[1])
+
+    def test_ranking_prefers_fast_and_healthy_hosts(self):
+        selector = EndpointSelector(HOSTS)
+        self.assertEqual(selector.ranked(), HOSTS)
+
+        selector.record(HOSTS[0], 0.9, ok=True)
+        selector.record(HOSTS[1], 0.05, ok=True)
+        selector.record(HOSTS[2], 0.02, ok=False)
+
+        self.assertEqual(selector.ranked()[0], HOSTS[1])
+        self.assertEqual(selector.stats()[0]['endpoint'], HOSTS[1])
+
+    def test_raises_when_every_host_fails(self):
+        selector = self._selector({h: (0.0, ConnectionError('down')) for h in HOSTS})
+        with self.assertRaises(BinanceUnavailable):
+            selector.get_json('/x', timeout=1, total_timeout=1)
+        self.assertEqual(sorted(self.calls), HOSTS)
+
+    def test_sessions_are_reused_per_host(self):
+        selector = EndpointSelector(HOSTS)
+        self.assertIs(selector.session(HOSTS[0]), selector.session(HOSTS[0]))
+        self.assertIsNot(selector.session(HOSTS[0]), selector.session(HOSTS[1]))
+
+    def test_open_circuit_skips_host(self):
+        selector = EndpointSelector(HOSTS[:2], hedge_delay=5)
+        ok = type('Resp', (), {'status_code': 200, 'json': lambda self: {'code': '000000'}})()
+
+        breakers = {f'binance:{h[8:]}': CircuitBreaker(h, min_calls=1) for h in HOSTS[:2]}
+        breakers['binance:api1.test'].record(False, 0.1)
+
+        with patch.object(binance_endpoints, 'get_breaker', side_effect=breakers.__getitem__), \
+                patch.object(selector.session(HOSTS[1]), 'get', return_value=ok):
+            base_url, data = selector.get_json('/x', timeout=1, total_timeout=2)
+
+        self.assertEqual(base_url, HOSTS[1])
+        # El rechazo por circuito abierto no cuenta como muestra de latencia
+        self.assertEqual(selector.stats()[-1]['samples'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('prov', window_seconds=60, min_calls=4, failure_rate=0.5,
+                                      open_seconds=30, clock=self.clock)
+
+    def _fail(self):
+        with self.assertRaises(RuntimeError):
+            self.breaker.call(MagicMock(side_effect=RuntimeError('down')))
+
+    def test_opens_after_failure_rate_and_fails_fast(self):
+        self.breaker.call(lambda: 'ok')
+        self.breaker.call(lambda: 'ok')
+        self._fail()
+        self.assertEqual(self.breaker.state, 'closed')
+        self._fail()
+        self.assertEqual(self.breaker.state, 'open')
+
+        fn = MagicMock()
+        with self.assertRaises(CircuitOpenError) as ctx:
+            self.breaker.call(fn)
+        fn.assert_not_called()
+        self.assertEqual(ctx.exception.retry_after, 30)
+
+    def test_half_open_probe_closes_or_reopens(self):
+        for _ in range(4):
+            self._fail()
+        self.clock.now += 31
+        self.assertEqual(self.breaker.state, 'half_open')
+
+        self._fail()
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.clock.now += 31
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_only_one_probe_in_half_open(self):
+        for _ in range(4):
+            self._fail()
+        self.clock.now += 31
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_slow_call_admitted_closed_does_not_settle_the_probe(self):
+        slow = self.breaker.before_call()
+        for _ in range(4):
+            self._fail()
+        self.clock.now += 31
+        probe = self.breaker.before_call()
+        self.assertEqual((slow, probe), ('closed', 'half_open'))
+
+        # La llamada lenta termina bien durante la prueba: no cierra ni libera
+        self.breaker.record(True, 40.0, slow)
+        self.assertEqual(self.breaker.state, 'half_open')
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record(False, 0.1, probe)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_result_classifier_and_old_failures_expire(self):
+        resp = MagicMock(status_code=503)
+        for _ in range(3):
+            self.breaker.call(lambda: resp, is_failure=circuit_breaker.is_server_error)
+        self.clock.now += 61
+        self.breaker.call(lambda: resp, is_failure=circuit_breaker.is_server_error)
+        self.assertEqual(self.breaker.state, 'closed')
+
+        snap = self.breaker.snapshot()
+        self.assertEqual(snap['window_calls'], 1)
+        self.assertEqual(snap['latency_ms']['samples'], 4)
+
+
+class ProviderIntegrationTests(unittest.TestCase):
+    def test_game_script_fails_fast_when_circuit_is_open(self):
+        import app
+        breaker = MagicMock()
+        breaker.call.side_effect = CircuitOpenError('game_script', 12)
+        with patch.object(app, 'get_breaker', return_value=breaker):
+            response, data = app._game_script_request('POST', 'comprar', {'roleId': '1'})
+
+        breaker.call.assert_called_once()
+        self.assertIsNone(response)
+        self.assertFalse(data['success'])
+        self.assertIn('12s', data['error'])
+
+    def test_vps_redeem_fails_fast_when_circuit_is_open(self):
+        import redeem_hype_vps
+        breaker = MagicMock()
+        breaker.call.side_effect = CircuitOpenError('vps_redeemer', 12)
+        with patch.object(redeem_hype_vps, 'get_breaker', return_value=breaker):
+            result = redeem_hype_vps.redeem_pin_vps('PINCODE123456', '123456789')
+
+        self.assertFalse(result.success)
+        self.assertIn('12s', result.message)
+
+    def test_inefable_request_reports_circuit_open(self):
+        import inefable_api_client
+        breaker = MagicMock()
+        breaker.call.side_effect = CircuitOpenError('inefable', 5)
+        with patch.object(inefable_api_client, 'get_breaker', return_value=breaker):
+            result = inefable_api_client.InefableAPIClient()._make_request({'action': 'recarga'})
+
+        self.assertEqual(result['error_type'], 'circuit_open')
+
+
+if __name__ == '__main__':
+    unittest.main()
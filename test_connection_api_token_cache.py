@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import connection_api
+
+
+class ConnectionApiTokenCacheTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, correo TEXT, saldo REAL)')
+        conn.execute("INSERT INTO usuarios (id, correo, saldo) VALUES (1, 'demo@ejemplo.com', 10.0)")
+        conn.commit()
+        conn.close()
+
+        self.statements = []
+
+        def _conn():
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.set_trace_callback(self.statements.append)
+            return conn
+
+        self._patches = [
+            patch.object(connection_api, 'get_db_connection', side_effect=_conn),
+            patch.object(connection_api, '_token_schema_ready', False),
+            patch.object(connection_api, '_token_sweeper_started', True),
+            patch.object(connection_api, '_token_cache', {}),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        os.remove(self.db_path)
+
+    def _issue_token(self):
+        conn = connection_api.get_db_connection()
+        token, _ = connection_api.create_connection_api_token(conn, 1)
+        conn.commit()
+        conn.close()
+        return token
+
+    def test_schema_is_created_once_and_cached_token_costs_one_query(self):
+        token = self._issue_token()
+        self.assertEqual(connection_api._load_connection_api_token_user(token)['id'], 1)
+
+        self.statements.clear()
+        user = connection_api._load_connection_api_token_user(token)
+
+        self.assertEqual(user['saldo'], 10.0)
+        queries = [s for s in self.statements if s.lstrip().upper().startswith(('SELECT', 'CREATE', 'DELETE'))]
+        self.assertEqual(len(queries), 1)
+        self.assertIn('FROM usuarios WHERE id', queries[0])
+
+        self._issue_token()
+        self.assertFalse(any('CREATE' in s for s in self.statements))
+
+    def test_expired_tokens_are_rejected_and_swept(self):
+        token = self._issue_token()
+        self.assertIsNotNone(connection_api._load_connection_api_token_user(token))
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('UPDATE connection_api_tokens SET expires_at = ?', (int(time.time()) - 1,))
+        conn.commit()
+        conn.close()
+        connection_api._token_cache[token] = (1, int(time.time()) - 1)
+
+        self.assertIsNone(connection_api._load_connection_api_token_user(token))
+        connection_api._sweep_expired_connection_api_tokens()
+
+        conn = sqlite3.connect(self.db_path)
+        remaining = conn.execute('SELECT COUNT(*) FROM connection_api_tokens').fetchone()[0]
+        conn.close()
+        self.assertEqual(remaining, 0)
+        self.assertNotIn(token, connection_api._token_cache)
+
+    def test_unknown_token_is_rejected(self):
+        connection_api.init_connection_api_tokens()
+        self.assertIsNone(connection_api._load_connection_api_token_user('desconocido'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import freefire_id_queue
+from pg_compat import SqliteConnection
+from pin_redeemer import PinRedeemResult
+
+
+class FreefireIdQueueTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        freefire_id_queue.init_freefire_id_queue_tables(conn.cursor())
+        freefire_id_queue.add_vps_job_columns(conn.cursor())
+        conn.commit()
+        conn.close()
+        self._patch = patch.object(freefire_id_queue, '_get_conn', side_effect=lambda: SqliteConnection(self.db_path))
+        self._patch.start()
+
+    def tearDown(self):
+        self._patch.stop()
+        os.remove(self.db_path)
+
+    def _enqueue(self, transaction_id):
+        conn = SqliteConnection(self.db_path)
+        freefire_id_queue.enqueue_redeem_job(
+            conn, transaction_id, source='web', usuario_id=1, player_id='123456789',
+            paquete_id=2, pin_codigo='PINCODE123456', precio=1.5, saldo_cobrado=True, request_id='req-1',
+        )
+        conn.commit()
+        conn.close()
+
+    def test_claim_is_exclusive_until_lease_expires(self):
+        self._enqueue(10)
+
+        job = freefire_id_queue.claim_next_job('w1', now=1000.0)
+        self.assertEqual(job['transaction_id'], 10)
+        self.assertEqual(job['estado'], 'procesando')
+        self.assertEqual(job['intentos'], 1)
+
+        self.assertIsNone(freefire_id_queue.claim_next_job('w2', now=1001.0))
+
+        expired = 1000.0 + freefire_id_queue.FFID_REDEEM_LEASE_SECONDS + 1
+        resumed = freefire_id_queue.claim_next_job('w2', now=expired)
+        self.assertEqual(resumed['id'], job['id'])
+        self.assertEqual(resumed['worker_id'], 'w2')
+        self.assertEqual(resumed['intentos'], 2)
+
+    def test_active_jobs_across_processes_are_capped(self):
+        for tx in (20, 21, 22):
+            self._enqueue(tx)
+
+        with patch.object(freefire_id_queue, 'FFID_REDEEM_MAX_ACTIVE', 2):
+            first = freefire_id_queue.claim_next_job('proc1:0', now=1000.0)
+            second = freefire_id_queue.claim_next_job('proc2:0', now=1000.0)
+            self.assertIsNone(freefire_id_queue.claim_next_job('proc3:0', now=1000.0))
+
+            # Estacionado en el VPS sigue ocupando capacidad
+            freefire_id_queue.park_job_on_vps(first['id'], 'vps-1', now=1000.0)
+            self.assertIsNone(freefire_id_queue.claim_next_job('proc3:0', now=1001.0))
+
+            freefire_id_queue.finish_job(second['id'], 'aprobado')
+            third = freefire_id_queue.claim_next_job('proc3:0', now=1002.0)
+            self.assertEqual(third['transaction_id'], 22)
+
+            # Un envío viejo sin cierre deja de contar tras un lease
+            self._enqueue(23)
+            self.assertIsNone(freefire_id_queue.claim_next_job('proc3:0', now=1003.0))
+            late = 1000.0 + freefire_id_queue.FFID_REDEEM_LEASE_SECONDS + 1
+            self.assertEqual(freefire_id_queue.claim_next_job('proc3:0', now=late)['transaction_id'], 23)
+
+    def test_finished_jobs_are_not_claimed_and_can_be_requeued(self):
+        self._enqueue(11)
+        job = freefire_id_queue.claim_next_job('w1', now=1000.0)
+        freefire_id_queue.finish_job(job['id'], 'rechazado', error_msg='fallo')
+
+        self.assertIsNone(freefire_id_queue.claim_next_job('w1', now=99999.0))
+        self.assertEqual(freefire_id_queue.get_queue_stats(), {'rechazado': 1})
+
+        self._enqueue(11)
+        self.assertEqual(freefire_id_queue.get_queue_stats(), {'pendiente': 1})
+
+    def test_finish_job_rejects_non_final_state(self):
+        with self.assertRaises(ValueError):
+            freefire_id_queue.finish_job(1, 'procesando')
+
+    def test_parked_job_frees_worker_and_is_closed_only_once(self):
+        self._enqueue(12)
+        job = freefire_id_queue.claim_next_job('w1', now=1000.0)
+        freefire_id_queue.park_job_on_vps(job['id'], 'vps-1', now=1000.0)
+
+        # Estacionado no cuenta como trabajo pendiente para los workers
+        self.assertIsNone(freefire_id_queue.claim_next_job('w2', now=99999.0))
+        self.assertIsNone(freefire_id_queue.claim_due_vps_check('p1', now=1001.0))
+        due = freefire_id_queue.claim_due_vps_check('p1', now=1000.0 + freefire_id_queue.FFID_VPS_CHECK_SECONDS + 1)
+        self.assertEqual((due['id'], due['vps_job_id'], due['vps_enviado_at']), (job['id'], 'vps-1', 1000.0))
+        self.assertEqual(freefire_id_queue.find_vps_job('vps-1')['id'], job['id'])
+
+        self.assertTrue(freefire_id_queue.take_vps_job(job['id'], 'callback'))
+        self.assertFalse(freefire_id_queue.take_vps_job(job['id'], 'p1'))
+        self.assertIsNone(freefire_id_queue.find_vps_job('vps-1'))
+        self.assertEqual(freefire_id_queue.get_queue_stats(), {'procesando': 1})
+
+
+class FreefireIdQueueHandlerTests(unittest.TestCase):
+    def setUp(self):
+        import app
+        self.app = app
+        self.job = {
+            'id': 5, 'transaction_id': 7, 'source': 'web', 'usuario_id': 1, 'player_id': '123456789',
+            'paquete_id': 2, 'pin_codigo': 'PINCODE123456', 'precio': 1.5, 'saldo_cobrado': True,
+            'request_id': 'req-1', 'intentos': 1,
+        }
+        self.conn = MagicMock()
+        self.conn.execute.return_value.fetchone.return_value = {
+            'id': 7, 'usuario_id': 1, 'estado': 'procesando', 'transaccion_id': 'FFID-TEST', 'numero_control': '123',
+        }
+
+    def test_resumed_job_skips_redeem_when_pin_already_used(self):
+        job = dict(self.job, intentos=2)
+        app = self.app
+        with patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'verify_pin_already_redeemed', return_value=True), \
+             patch.object(app, 'submit_redeem_job') as submit_mock, \
+             patch.object(app, '_finalize_queued_freefire_id_success') as success_mock, \
+             patch.object(app, 'finish_ffid_redeem_job') as finish_mock:
+            app._process_freefire_id_redeem_job(job)
+
+        submit_mock.assert_not_called()
+        success_mock.assert_called_once()
+        self.assertEqual(finish_mock.call_args[0][:2], (5, 'aprobado'))
+
+    def test_accepted_job_is_parked_without_waiting(self):
+        app = self.app
+        with patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'submit_redeem_job', return_value={'job_id': 'vps-9', 'status': 'queued'}), \
+             patch.object(app, 'wait_for_redeem_job') as wait_mock, \
+             patch.object(app, 'park_ffid_job_on_vps') as park_mock, \
+             patch.object(app, 'finish_ffid_redeem_job') as finish_mock:
+            app._process_freefire_id_redeem_job(self.job)
+
+        wait_mock.assert_not_called()
+        park_mock.assert_called_once_with(5, 'vps-9')
+        finish_mock.assert_not_called()
+
+    def test_resumed_job_with_remote_job_is_not_resubmitted(self):
+        job = dict(self.job, intentos=2, vps_job_id='vps-9')
+        app = self.app
+        with patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'verify_pin_already_redeemed', return_value=False), \
+             patch.object(app, 'submit_redeem_job') as submit_mock, \
+             patch.object(app, 'park_ffid_job_on_vps') as park_mock:
+            app._process_freefire_id_redeem_job(job)
+
+        submit_mock.assert_not_called()
+        park_mock.assert_called_once_with(5, 'vps-9')
+
+    def test_failed_redeem_restores_pin_and_rejects(self):
+        app = self.app
+        failed = PinRedeemResult(False, 'PIN inválido', 'PINCODE123456', '123456789')
+        with patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'submit_redeem_job', return_value=failed), \
+             patch.object(app, 'restore_freefire_id_pin_if_unverified', return_value={'restored': True, 'verified_used': False}) as restore_mock, \
+             patch.object(app, '_finalize_queued_freefire_id_failure') as failure_mock, \
+             patch.object(app, 'finish_ffid_redeem_job') as finish_mock:
+            app._process_freefire_id_redeem_job(self.job)
+
+        restore_mock.assert_called_once()
+        failure_mock.assert_called_once()
+        self.assertEqual(finish_mock.call_args[0][:2], (5, 'rechazado'))
+        self.assertEqual(finish_mock.call_args[1]['error_msg'], 'PIN inválido')
+
+    def test_poller_closes_finished_remote_job(self):
+        app = self.app
+        parked = dict(self.job, vps_job_id='vps-9', vps_enviado_at=1.0, worker_id='p1')
+        done = {'status': 'done', 'result': {'success': True, 'player_name': 'Jugador'}}
+        with patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'get_redeem_job', side_effect=[{'status': 'running'}, done]), \
+             patch.object(app, 'take_ffid_vps_job', return_value=True) as take_mock, \
+             patch.object(app.time_module, 'time', return_value=10.0), \
+             patch.object(app, '_finalize_queued_freefire_id_success') as success_mock, \
+             patch.object(app, 'finish_ffid_redeem_job') as finish_mock:
+            app._check_freefire_id_vps_job(parked)
+            take_mock.assert_not_called()
+            app._check_freefire_id_vps_job(parked)
+
+        take_mock.assert_called_once_with(5, 'p1')
+        self.assertEqual(success_mock.call_args[0][2], 'Jugador')
+        self.assertEqual(finish_mock.call_args[0][:2], (5, 'aprobado'))
+        self.assertEqual(finish_mock.call_args[1]['duracion_segundos'], 9.0)
+
+    def test_callback_uses_vps_result_not_the_request_body(self):
+        app = self.app
+        parked = dict(self.job, vps_job_id='vps-9', vps_enviado_at=1.0)
+        client = app.app.test_client()
+        failed = {'status': 'failed', 'result': {'success': False, 'message': 'PIN ya usado'}}
+        with patch.dict(os.environ, {'VPS_CALLBACK_TOKEN': 'secreto'}), \
+             patch.object(app, 'get_db_connection', return_value=self.conn), \
+             patch.object(app, 'get_redeemer_config_from_db', return_value={}), \
+             patch.object(app, 'get_redeem_job', return_value=failed) as get_mock, \
+             patch.object(app, 'find_ffid_vps_job', return_value=parked), \
+             patch.object(app, 'take_ffid_vps_job', return_value=True), \
+             patch.object(app, 'restore_freefire_id_pin_if_unverified', return_value={'restored': True, 'verified_used': False}), \
+             patch.object(app, '_finalize_queued_freefire_id_failure'), \
+             patch.object(app, 'finish_ffid_redeem_job') as finish_mock:
+            denied = client.post('/api/vps/callback', json={'job_id': 'vps-9'}, headers={'X-Callback-Token': 'otro'})
+            resp = client.post('/api/vps/callback', headers={'X-Callback-Token': 'secreto'},
+                               json={'job_id': 'vps-9', 'status': 'done', 'result': {'success': True}})
+
+        self.assertEqual(denied.status_code, 401)
+        self.assertEqual(resp.get_json(), {'ok': True, 'closed': True})
+        get_mock.assert_called_once_with('vps-9', {})
+        self.assertEqual(finish_mock.call_args[0][:2], (5, 'rechazado'))
+        self.assertEqual(finish_mock.call_args[1]['error_msg'], 'PIN ya usado')
+
+if __name__ == '__main__':
+    unittest.main()
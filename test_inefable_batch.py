@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from inefable_api_client import InefableAPIClient
+
+
+class InefableBatchRequestTests(unittest.TestCase):
+    def setUp(self):
+        self.client = InefableAPIClient()
+
+    def test_pins_are_requested_concurrently(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_request_pin(monto_id, numero_destino=0, timeout=None):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            return {'status': 'success', 'pin_code': f'PIN{monto_id}'}
+
+        with patch('inefable_api_client.INEFABLE_MAX_IN_FLIGHT', 4), \
+             patch.object(self.client, 'request_pin', side_effect=fake_request_pin):
+            started = time.monotonic()
+            batch = self.client.request_pins(1, 4)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(len(batch['pins']), 4)
+        self.assertEqual(batch['errores'], [])
+        self.assertGreater(max(peak), 1)
+        self.assertLess(elapsed, 0.18)
+
+    def test_queued_requests_are_skipped_after_an_error(self):
+        calls = []
+
+        def fake_request_pin(monto_id, numero_destino=0, timeout=None):
+            calls.append(1)
+            return {'status': 'error', 'message': 'Sin stock'}
+
+        with patch('inefable_api_client.INEFABLE_MAX_IN_FLIGHT', 1), \
+             patch.object(self.client, 'request_pin', side_effect=fake_request_pin):
+            batch = self.client.request_pins(1, 3)
+
+        self.assertEqual(batch['pins'], [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(batch['errores'][0], 'Pin 1: Sin stock')
+        self.assertIn('Cancelado', batch['errores'][1])
+
+    def test_request_timeout_is_capped_by_batch_deadline(self):
+        timeouts = []
+
+        def fake_request_pin(monto_id, numero_destino=0, timeout=None):
+            timeouts.append(timeout)
+            return {'status': 'success', 'pin_code': 'PIN'}
+
+        with patch.object(self.client, 'request_pin', side_effect=fake_request_pin):
+            self.client.request_pins(1, 2, deadline_seconds=2)
+
+        self.assertTrue(all(t <= 2 for t in timeouts))
+
+
+if __name__ == '__main__':
+    unittest.main()
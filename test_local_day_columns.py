@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import app
+from pg_compat import SqliteConnection
+
+
+class LocalDayColumnTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        conn = SqliteConnection(self.db_path)
+        for table in app._LOCAL_DAY_INDEXES:
+            conn.execute(f'''
+                CREATE TABLE {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, tipo_evento TEXT DEFAULT 'compra',
+                    estado TEXT, monto REAL, fecha DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        # 02:00 UTC todavía es el día anterior en Caracas
+        conn.execute("INSERT INTO historial_compras (usuario_id, monto, fecha) VALUES (1, 2.0, '2026-03-02 02:00:00')")
+        conn.commit()
+        conn.close()
+
+    def test_existing_and_new_rows_get_local_day(self):
+        conn = SqliteConnection(self.db_path)
+        app._migration_local_day_columns(conn.cursor())
+        app._migration_local_day_columns(conn.cursor())  # idempotente
+        conn.execute("INSERT INTO historial_compras (usuario_id, monto, fecha) VALUES (1, 3.0, '2026-03-02 05:00:00')")
+        rows = conn.execute('SELECT monto, local_day FROM historial_compras ORDER BY id').fetchall()
+        self.assertEqual([(r['monto'], r['local_day']) for r in rows], [(2.0, '2026-03-01'), (3.0, '2026-03-02')])
+        conn.close()
+
+    def test_day_filters_use_the_composite_indexes(self):
+        conn = SqliteConnection(self.db_path)
+        app._migration_local_day_columns(conn.cursor())
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM historial_compras "
+            "WHERE tipo_evento = 'compra' AND local_day BETWEEN ? AND ?", ('2026-03-01', '2026-03-02')
+        ).fetchall()
+        self.assertIn('idx_historial_compras_tipo_evento_local_day', ' '.join(r['detail'] for r in plan))
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM creditos_billetera WHERE usuario_id = ? AND local_day = ?",
+            (1, '2026-03-01')
+        ).fetchall()
+        self.assertIn('idx_creditos_billetera_usuario_id_local_day', ' '.join(r['detail'] for r in plan))
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Blueprint, Flask
+
+import circuit_breaker
+import metrics
+import pg_compat
+from pg_compat import SqliteConnection
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        self.addCleanup(pg_compat.remove_query_listener, metrics._on_query)
+        self.addCleanup(circuit_breaker.remove_call_listener, metrics._on_outbound_call)
+        patcher = patch.object(metrics, 'registry', metrics.MetricsRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _app(self):
+        app = Flask(__name__)
+        app.secret_key = 'test'
+        bp = Blueprint('dynamic_games', __name__)
+
+        @bp.route('/juego')
+        def juego():
+            conn = SqliteConnection(self.db_path)
+            conn.execute('SELECT 1').fetchone()
+            conn.execute('SELECT 2').fetchone()
+            conn.close()
+            return 'ok'
+
+        @app.route('/lento')
+        def lento():
+            circuit_breaker.CircuitBreaker('gameclub').call(lambda: None)
+            return 'ok'
+
+        @app.route('/falla')
+        def falla():
+            raise RuntimeError('boom')
+
+        app.register_blueprint(bp)
+        with patch.object(metrics, 'atexit'):
+            metrics.init_app(app)
+        return app
+
+    def test_records_requests_db_and_outbound_with_blueprint_labels(self):
+        app = self._app()
+        client = app.test_client()
+        client.get('/juego')
+        client.get('/juego')
+        client.get('/lento')
+        client.get('/no-existe')
+        counters, histograms = metrics.collect()
+
+        def counter(name, **labels):
+            return counters.get((name, tuple(sorted(labels.items()))))
+
+        self.assertEqual(counter('http_requests_total', blueprint='dynamic_games', endpoint='dynamic_games.juego',
+                                 method='GET', status='200'), 2)
+        self.assertEqual(counter('http_requests_total', blueprint='app', endpoint='<sin_ruta>',
+                                 method='GET', status='404'), 1)
+        self.assertEqual(counter('http_request_db_queries_total', blueprint='dynamic_games',
+                                 endpoint='dynamic_games.juego'), 4)
+        latency = histograms[('http_request_duration_seconds',
+                              (('blueprint', 'dynamic_games'), ('endpoint', 'dynamic_games.juego'), ('method', 'GET')))]
+        self.assertEqual(sum(latency[:-1]), 2)
+        outbound = histograms[('outbound_request_duration_seconds', (('outcome', 'ok'), ('service', 'gameclub')))]
+        self.assertEqual(sum(outbound[:-1]), 1)
+
+    def test_unhandled_exception_counts_as_500(self):
+        app = self._app()
+        client = app.test_client()
+        client.get('/falla')
+        counters, _ = metrics.collect()
+        key = ('http_requests_total', (('blueprint', 'app'), ('endpoint', 'falla'), ('method', 'GET'), ('status', '500')))
+        self.assertEqual(counters.get(key), 1)
+
+    def test_endpoint_requires_admin_or_token(self):
+        app = self._app()
+        client = app.test_client()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        with patch.object(metrics, 'METRICS_TOKEN', 'secreto'):
+            self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer otro'}).status_code, 403)
+            resp = client.get('/metrics', headers={'Authorization': 'Bearer secreto'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', resp.get_data(as_text=True))
+        with client.session_transaction() as sess:
+            sess['is_admin'] = True
+        self.assertEqual(client.get('/metrics').status_code, 200)
+
+    def test_multiprocess_dir_sums_every_worker(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(metrics, 'METRICS_MULTIPROC_DIR', tmp), \
+                patch.dict(metrics._flush_state, {'pid': None, 'path': None, 'flushed_at': 0.0}):
+            metrics.registry.inc('http_requests_total', {'endpoint': 'index'}, 3)
+            metrics.flush(force=True)
+            # Otro worker (ya terminado) dejó su volcado
+            other = metrics.MetricsRegistry()
+            other.inc('http_requests_total', {'endpoint': 'index'}, 2)
+            other.observe('outbound_request_duration_seconds', {'service': 'inefable'}, 0.3)
+            with patch.object(metrics, 'registry', other), \
+                    patch.dict(metrics._flush_state, {'pid': None, 'path': None, 'flushed_at': 0.0}):
+                metrics.flush(force=True)
+
+            counters, histograms = metrics.collect()
+            self.assertEqual(counters[('http_requests_total', (('endpoint', 'index'),))], 5)
+            text = metrics.render_text(counters, histograms)
+            self.assertIn('outbound_request_duration_seconds_bucket{service="inefable",le="0.5"} 1', text)
+            self.assertIn('outbound_request_duration_seconds_count{service="inefable"} 1', text)
+
+            metrics.reset_multiprocess_dir()
+            self.assertEqual(os.listdir(tmp), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import sqlite3
+import unittest
+from datetime import date, datetime
+
+import migrate_sqlite_to_pg as migrate
+
+
+class CopyDependencyLevelsTests(unittest.TestCase):
+    def test_children_wait_for_their_parents(self):
+        tables = ['usuarios', 'transacciones', 'noticias', 'noticias_vistas', 'precios_paquetes']
+        edges = [
+            ('transacciones', 'usuarios'),
+            ('noticias_vistas', 'usuarios'),
+            ('noticias_vistas', 'noticias'),
+            ('otra_tabla', 'usuarios'),
+        ]
+
+        levels = migrate._toposort_levels(tables, edges)
+
+        self.assertEqual(levels[0], ['usuarios', 'noticias', 'precios_paquetes'])
+        self.assertEqual(levels[1], ['transacciones', 'noticias_vistas'])
+
+    def test_self_reference_and_cycles_do_not_block(self):
+        levels = migrate._toposort_levels(['a', 'b', 'c'], [('a', 'a'), ('b', 'c'), ('c', 'b')])
+
+        self.assertEqual(levels[0], ['a'])
+        self.assertEqual(sorted(t for level in levels for t in level), ['a', 'b', 'c'])
+
+
+class RowChecksumTests(unittest.TestCase):
+    META = {'id': 'integer', 'activo': 'boolean', 'saldo': 'real', 'monto': 'numeric',
+            'fecha': 'timestamp without time zone', 'dia': 'date', 'nota': 'text'}
+    COLS = ['id', 'activo', 'saldo', 'monto', 'fecha', 'dia', 'nota']
+
+    def _sqlite_rows(self):
+        conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, activo INTEGER, saldo REAL, monto REAL, '
+                     'fecha DATETIME, dia TEXT, nota TEXT)')
+        conn.executemany('INSERT INTO t VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (1, 1, 0.1, 12.5, '2026-01-02 03:04:05', '2026-01-02', 'hola'),
+            (2, 0, '', None, '2026-01-02T03:04:05.250000', '', None),
+        ])
+        return conn.execute('SELECT * FROM t ORDER BY id').fetchall()
+
+    def test_sqlite_and_postgres_representations_hash_the_same(self):
+        # Lo que devolvería psycopg tras el COPY (real = float4 redondeado)
+        pg_rows = [
+            {'id': 1, 'activo': True, 'saldo': 0.10000000149011612, 'monto': 12.5,
+             'fecha': datetime(2026, 1, 2, 3, 4, 5), 'dia': date(2026, 1, 2), 'nota': 'hola'},
+            {'id': 2, 'activo': False, 'saldo': None, 'monto': None,
+             'fecha': datetime(2026, 1, 2, 3, 4, 5, 250000), 'dia': None, 'nota': None},
+        ]
+        sq = migrate._rows_checksum(self._sqlite_rows(), self.COLS, self.META, True)
+        pg = migrate._rows_checksum(pg_rows, self.COLS, self.META, True)
+        self.assertEqual(sq, pg)
+        self.assertEqual(sq[0], 2)
+
+    def test_changed_value_with_same_ids_is_detected(self):
+        rows = [dict(row) for row in self._sqlite_rows()]
+        tampered = [dict(rows[0], nota='adios'), rows[1]]
+        self.assertNotEqual(migrate._rows_checksum(rows, self.COLS, self.META, True),
+                            migrate._rows_checksum(tampered, self.COLS, self.META, True))
+
+    def test_unordered_tables_hash_independent_of_row_order(self):
+        rows = [{'k': 'a', 'v': 1}, {'k': 'b', 'v': 2}]
+        meta = {'k': 'text', 'v': 'integer'}
+        self.assertEqual(migrate._rows_checksum(rows, ['k', 'v'], meta, False),
+                         migrate._rows_checksum(rows[::-1], ['k', 'v'], meta, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
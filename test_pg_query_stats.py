@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pg_compat
+from pg_compat import SqliteConnection, fingerprint_sql, get_query_stats
+
+
+class FingerprintTests(unittest.TestCase):
+    def test_literals_and_lists_collapse(self):
+        self.assertEqual(
+            fingerprint_sql("SELECT * FROM usuarios WHERE id IN (%s, %s, %s) AND correo = 'a@b.com' AND saldo > 2.5"),
+            'SELECT * FROM usuarios WHERE id IN (...) AND correo = ? AND saldo > ?',
+        )
+        self.assertEqual(
+            fingerprint_sql('INSERT INTO t1 (a, b)\n   VALUES (?, ?), (?, ?)'),
+            fingerprint_sql('INSERT INTO t1 (a, b) VALUES (%s, %s)'),
+        )
+
+
+class QueryStatsTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        for patcher in (patch.object(pg_compat, 'QUERY_STATS_ENABLED', True),
+                        patch.object(pg_compat, '_query_stats', {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_accumulates_per_fingerprint_and_sorts_top_n(self):
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, saldo REAL)')
+        conn.executemany('INSERT INTO usuarios (id, saldo) VALUES (?, ?)', [(i, 1.0) for i in range(1, 6)])
+        for user_id in range(1, 6):
+            conn.execute(f'UPDATE usuarios SET saldo = saldo + 1 WHERE id = {user_id}')
+        conn.close()
+
+        stats = {item['fingerprint']: item for item in get_query_stats(limit=10, order_by='calls')}
+        update = stats['UPDATE usuarios SET saldo = saldo + ? WHERE id = ?']
+        self.assertEqual((update['calls'], update['rows']), (5, 5))
+        self.assertGreaterEqual(update['p95_ms'], 0.0)
+        self.assertEqual(get_query_stats(limit=1, order_by='calls')[0]['fingerprint'], update['fingerprint'])
+        self.assertEqual(stats['INSERT INTO usuarios (id, saldo) VALUES (...)']['rows'], 5)
+
+    def test_slow_queries_are_logged_with_caller(self):
+        conn = SqliteConnection(self.db_path)
+        with patch.object(pg_compat, 'SLOW_QUERY_MS', 0.0), self.assertLogs('pg_compat', 'WARNING') as logs:
+            conn.execute("SELECT 'lento'")
+        conn.close()
+        self.assertIn('test_pg_query_stats.py:', logs.output[0])
+        self.assertIn('SELECT ?', logs.output[0])
+
+    def test_fingerprint_count_is_bounded(self):
+        with patch.object(pg_compat, 'QUERY_STATS_MAX_FINGERPRINTS', 2):
+            for table in ('a', 'b', 'c', 'd'):
+                pg_compat.record_query_stats(f'SELECT * FROM {table}', 0.001)
+        stats = {item['fingerprint']: item['calls'] for item in get_query_stats(limit=10)}
+        self.assertEqual(stats, {'SELECT * FROM a': 1, 'SELECT * FROM b': 1, '<otras huellas>': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
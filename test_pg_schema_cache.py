@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pg_compat
+import schema_migrations
+from pg_compat import SqliteConnection
+
+
+class SchemaCacheTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.conn = SqliteConnection(self.db_path)
+        self.conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, correo TEXT)')
+        self.conn.commit()
+        pg_compat.invalidate_schema_cache(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        pg_compat.invalidate_schema_cache(self.conn)
+        os.remove(self.db_path)
+
+    def test_repeated_checks_cost_one_query(self):
+        with patch.object(pg_compat, '_load_schema_columns', wraps=pg_compat._load_schema_columns) as loader:
+            for _ in range(20):
+                self.assertTrue(pg_compat.table_exists(self.conn, 'usuarios'))
+                self.assertFalse(pg_compat.table_exists(self.conn, 'spent_ledger'))
+                self.assertTrue(pg_compat.column_exists(self.conn, 'usuarios', 'correo'))
+                self.assertFalse(pg_compat.column_exists(self.conn, 'usuarios', 'saldo'))
+        self.assertEqual(loader.call_count, 1)
+
+    def test_ddl_through_the_wrappers_invalidates(self):
+        self.assertFalse(pg_compat.table_exists(self.conn, 'noticias'))
+        self.conn.cursor().execute('CREATE TABLE noticias (id INTEGER PRIMARY KEY)')
+        self.assertTrue(pg_compat.table_exists(self.conn, 'noticias'))
+
+        self.conn.execute('ALTER TABLE usuarios ADD COLUMN saldo REAL')
+        self.assertTrue(pg_compat.column_exists(self.conn, 'usuarios', 'saldo'))
+
+    def test_external_ddl_is_seen_after_ttl_or_migrations(self):
+        self.assertFalse(pg_compat.table_exists(self.conn, 'externa'))
+        raw = sqlite3.connect(self.db_path)
+        raw.execute('CREATE TABLE externa (id INTEGER)')
+        raw.commit()
+        raw.close()
+        self.assertFalse(pg_compat.table_exists(self.conn, 'externa'))  # todavía cacheado
+
+        schema_migrations.run_migrations(self.conn, [(1, 'noop', lambda cursor: None)])
+        self.assertTrue(pg_compat.table_exists(self.conn, 'externa'))
+
+    def test_connections_without_cache_key_query_directly(self):
+        class _Conn:
+            def execute(self, sql, params=None):
+                raise RuntimeError('sin base')
+
+        self.assertFalse(pg_compat.table_exists(_Conn(), 'usuarios'))
+
+
+if __name__ == '__main__':
+    unittest.main()
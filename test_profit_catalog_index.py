@@ -0,0 +1,116 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import admin_stats
+from pg_compat import SqliteConnection
+
+
+def _linear_profit_unit(catalog, item_name, package_name, sale_unit):
+    """Resolución original (recorrido lineal), como referencia."""
+    candidates = catalog.get((item_name, package_name), [])
+    nearest, nearest_delta = None, None
+    for candidate in candidates:
+        delta = abs(candidate['sale_price'] - sale_unit)
+        if delta <= 0.011:
+            return candidate['profit_unit']
+        if nearest_delta is None or delta < nearest_delta:
+            nearest, nearest_delta = candidate, delta
+    return nearest['profit_unit'] if nearest else None
+
+
+class ProfitCatalogIndexTests(unittest.TestCase):
+    def test_bisection_matches_linear_scan(self):
+        rng = random.Random(7)
+        catalog = {}
+        for package in range(20):
+            catalog[('Free Fire', str(package))] = [
+                {'sale_price': round(rng.choice([1.0, 1.005, 2.5, 2.5, 3.0]) + rng.randint(0, 3), 3),
+                 'profit_unit': round(rng.uniform(-1, 1), 4)}
+                for _ in range(rng.randint(1, 6))
+            ]
+        index = admin_stats.ProfitCatalogIndex(catalog, [])
+
+        for _ in range(2000):
+            key = ('Free Fire', str(rng.randint(0, 21)))
+            sale_unit = round(rng.uniform(0, 7), rng.choice([0, 2, 3]))
+            self.assertEqual(index.profit_unit(*key, sale_unit), _linear_profit_unit(catalog, *key, sale_unit),
+                             (key, sale_unit))
+
+    def test_repeated_sales_are_memoized(self):
+        index = admin_stats.ProfitCatalogIndex({('Blood Striker', '100'): [{'sale_price': 2.0, 'profit_unit': 0.5}]}, [])
+        with patch.object(admin_stats, '_infer_dashboard_item_name', wraps=admin_stats._infer_dashboard_item_name) as infer, \
+                patch.object(index, '_bisect', wraps=index._bisect) as bisect:
+            for _ in range(50):
+                item, package = index.classify('Blood Striker - 100 🪙')
+                self.assertEqual(index.profit_amount(item, package, 4.0, 2), (0.5, 1.0))
+        self.assertEqual(infer.call_count, 1)
+        self.assertEqual(bisect.call_count, 1)
+
+
+class ProfitCatalogVersionTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE historial_compras (id INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE precios_compra (juego TEXT, paquete_id INTEGER, precio_compra REAL, activo INTEGER DEFAULT 1)')
+        conn.execute('CREATE TABLE precios_bloodstriker (id INTEGER PRIMARY KEY, nombre TEXT, precio REAL)')
+        conn.execute("INSERT INTO precios_bloodstriker (id, nombre, precio) VALUES (1, '100 🪙', 2.0)")
+        conn.execute("INSERT INTO precios_compra (juego, paquete_id, precio_compra) VALUES ('bloodstriker', 1, 1.5)")
+        admin_stats.init_profit_rollup_tables(conn.cursor())
+        conn.commit()
+        self.conn = conn
+        for patcher in (
+            patch.dict(admin_stats._profit_catalog_cache, {'index': None, 'checked_at': 0.0, 'stale': True}),
+            patch.object(admin_stats, 'PROFIT_CATALOG_CHECK_SECONDS', 0),
+            patch.object(admin_stats, 'get_conn', side_effect=lambda: SqliteConnection(self.db_path)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.db_path)
+
+    def _unit(self):
+        return admin_stats.get_profit_catalog_index(self.conn).profit_unit('Blood Striker', '100', 2.0)
+
+    def test_index_is_rebuilt_only_when_version_changes(self):
+        with patch.object(admin_stats, '_load_dashboard_profit_catalog', wraps=admin_stats._load_dashboard_profit_catalog) as loader:
+            self.assertEqual(self._unit(), 0.5)
+            first = admin_stats.get_profit_catalog_index(self.conn)
+            self.assertIs(admin_stats.get_profit_catalog_index(self.conn), first)
+            self.assertEqual(loader.call_count, 1)
+
+            # Otro worker cambia un precio sin alterar ninguna suma: el contador lo detecta
+            self.conn.execute("UPDATE precios_compra SET precio_compra = 1.2")
+            self.conn.commit()
+            admin_stats.invalidate_profit_catalog()
+            with patch.dict(admin_stats._profit_catalog_cache, {'stale': False}):
+                self.assertAlmostEqual(self._unit(), 0.8)
+            self.assertEqual(loader.call_count, 2)
+
+    def test_version_check_is_one_query_without_table_probes(self):
+        admin_stats.get_profit_catalog_index(self.conn)
+        with patch.object(admin_stats, 'table_exists') as probe, \
+                patch.object(admin_stats, '_load_dashboard_profit_catalog') as loader:
+            admin_stats.get_profit_catalog_index(self.conn)
+        probe.assert_not_called()
+        loader.assert_not_called()
+
+    def test_version_is_not_rechecked_within_interval(self):
+        admin_stats.get_profit_catalog_index(self.conn)
+        with patch.object(admin_stats, 'PROFIT_CATALOG_CHECK_SECONDS', 60), \
+                patch.object(admin_stats, '_profit_catalog_version', return_value=0) as version:
+            admin_stats.get_profit_catalog_index(self.conn)
+            version.assert_not_called()
+            admin_stats.invalidate_profit_catalog()
+            admin_stats.get_profit_catalog_index(self.conn)
+            version.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
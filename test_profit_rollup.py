@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+import admin_stats
+from pg_compat import SqliteConnection
+
+
+def _local_day(days_ago=0):
+    return (datetime.now(pytz.timezone('America/Caracas')).date() - timedelta(days=days_ago)).isoformat()
+
+
+def _utc_noon(days_ago=0):
+    # 12:00 en Caracas = 16:00 UTC, lejos del borde del día
+    return f'{_local_day(days_ago)} 16:00:00'
+
+
+class ProfitRollupTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, correo TEXT, sin_ganancia BOOLEAN DEFAULT FALSE)')
+        conn.execute('''
+            CREATE TABLE historial_compras (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, monto REAL, paquete_nombre TEXT,
+                pin TEXT, tipo_evento TEXT DEFAULT 'compra', duracion_segundos REAL,
+                saldo_antes REAL DEFAULT 0, saldo_despues REAL DEFAULT 0, fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+                local_day TEXT GENERATED ALWAYS AS (DATE(fecha, '-4 hours')) VIRTUAL
+            )
+        ''')
+        conn.execute('CREATE TABLE precios_compra (juego TEXT, paquete_id INTEGER, precio_compra REAL, activo INTEGER DEFAULT 1)')
+        conn.execute('CREATE TABLE precios_bloodstriker (id INTEGER PRIMARY KEY, nombre TEXT, precio REAL)')
+        conn.execute("INSERT INTO usuarios (id, correo) VALUES (1, 'cliente@x.com')")
+        conn.execute("INSERT INTO usuarios (id, correo, sin_ganancia) VALUES (2, 'interno@x.com', TRUE)")
+        conn.execute("INSERT INTO precios_bloodstriker (id, nombre, precio) VALUES (1, '100 🪙', 2.0)")
+        conn.execute("INSERT INTO precios_compra (juego, paquete_id, precio_compra) VALUES ('bloodstriker', 1, 1.5)")
+        admin_stats.init_profit_rollup_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        patcher = patch.dict(admin_stats._profit_catalog_cache, {'index': None, 'checked_at': 0.0, 'stale': True})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _conn(self):
+        return SqliteConnection(self.db_path)
+
+    def _insert_sale(self, conn, usuario_id, days_ago, attributed=True):
+        if attributed:
+            admin_stats.insert_historial_compra(conn, usuario_id, 2.0, 'Blood Striker - 100 🪙', 'PIN1')
+            conn.execute('UPDATE historial_compras SET fecha = ? WHERE id = (SELECT MAX(id) FROM historial_compras)',
+                         (_utc_noon(days_ago),))
+        else:
+            conn.execute('''
+                INSERT INTO historial_compras (usuario_id, monto, paquete_nombre, pin, fecha)
+                VALUES (?, 2.0, 'Blood Striker - 100 🪙', 'PIN1', ?)
+            ''', (usuario_id, _utc_noon(days_ago)))
+        conn.commit()
+
+    def _range(self, days_back):
+        tz = pytz.timezone('America/Caracas')
+        start = tz.localize(datetime.combine(datetime.fromisoformat(_local_day(days_back)), datetime.min.time()))
+        end = tz.localize(datetime.combine(datetime.fromisoformat(_local_day(-1)), datetime.min.time()))
+        return start.astimezone(pytz.utc).isoformat(), end.astimezone(pytz.utc).isoformat()
+
+    def test_sale_is_attributed_when_written(self):
+        conn = self._conn()
+        attribution = admin_stats.insert_historial_compra(conn, 1, 2.0, 'Blood Striker - 100 🪙', 'PIN1')
+        excluded = admin_stats.insert_historial_compra(conn, 2, 2.0, 'Blood Striker - 100 🪙', 'PIN2')
+        refund = admin_stats.insert_historial_compra(conn, 1, 2.0, 'Blood Striker - 100 🪙', 'PIN1', tipo_evento='reembolso')
+        conn.commit()
+        rows = conn.execute('SELECT ganancia, ganancia_item, ganancia_paquete FROM historial_compras ORDER BY id').fetchall()
+        conn.close()
+
+        self.assertEqual(attribution, {'item': 'Blood Striker', 'package': '100', 'quantity': 1, 'profit': 0.5})
+        self.assertIsNone(excluded['profit'])
+        self.assertIsNone(refund)
+        self.assertEqual(
+            [(r['ganancia'], r['ganancia_item'], r['ganancia_paquete']) for r in rows],
+            [(0.5, 'Blood Striker', '100'), (None, 'Blood Striker', '100'), (None, None, None)],
+        )
+
+    def test_connection_api_purchases_are_attributed_on_plain_sqlite3(self):
+        import connection_api
+        import simple_connection_api
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        for module in (connection_api, simple_connection_api):
+            module.persist_purchase_metrics(conn, 1, 1, 1, 'Blood Striker - 100 🪙', 'PIN1', 2.0, 10.0, 8.0, 'API-1')
+        conn.commit()
+        rows = conn.execute('SELECT ganancia, ganancia_item FROM historial_compras').fetchall()
+        conn.close()
+        self.assertEqual([(r['ganancia'], r['ganancia_item']) for r in rows], [(0.5, 'Blood Striker')] * 2)
+
+    def test_insert_without_profit_columns_keeps_the_sale(self):
+        conn = self._conn()
+        conn.execute('ALTER TABLE historial_compras RENAME TO historial_nuevo')
+        conn.execute('CREATE TABLE historial_compras AS SELECT usuario_id, monto, paquete_nombre, pin, tipo_evento, '
+                     'duracion_segundos, saldo_antes, saldo_despues FROM historial_nuevo')
+        with patch.object(admin_stats, 'column_exists', return_value=False):
+            self.assertIsNone(admin_stats.insert_historial_compra(conn, 1, 2.0, 'Blood Striker - 100 🪙', 'PIN1'))
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM historial_compras').fetchone()[0], 1)
+        conn.close()
+
+    def test_closed_days_are_folded_once_and_today_stays_live(self):
+        conn = self._conn()
+        self._insert_sale(conn, 1, days_ago=2)
+        self._insert_sale(conn, 1, days_ago=1, attributed=False)  # fila antigua sin atribución
+        self._insert_sale(conn, 1, days_ago=0)
+        start_utc, end_utc = self._range(2)
+
+        series = admin_stats.compute_dashboard_profit_by_day(conn, start_utc, end_utc)
+        self.assertEqual(series, [
+            {'day': _local_day(2), 'profit': 0.5},
+            {'day': _local_day(1), 'profit': 0.5},
+            {'day': _local_day(0), 'profit': 0.5},
+        ])
+        # La lectura del dashboard no escribe: solo la limpieza diaria consolida
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM profit_rollup_dias').fetchone()[0], 0)
+
+        admin_stats.fold_closed_profit_days(conn, _local_day(2), _local_day(0))
+        folded = conn.execute('SELECT day FROM profit_rollup_dias ORDER BY day').fetchall()
+        self.assertEqual([r['day'] for r in folded], [_local_day(2), _local_day(1)])
+
+        # Los días cerrados ya no dependen de historial_compras (purgado) ni del catálogo actual
+        conn.execute('DELETE FROM historial_compras WHERE fecha < ?', (_utc_noon(0),))
+        conn.execute("UPDATE precios_bloodstriker SET precio = 3.0")
+        conn.commit()
+        admin_stats.invalidate_profit_catalog(conn)
+        self._insert_sale(conn, 1, days_ago=0)
+        with patch.object(admin_stats, '_load_sales_rows_for_days', wraps=admin_stats._load_sales_rows_for_days) as loader:
+            series = admin_stats.compute_dashboard_profit_by_day(conn, start_utc, end_utc)
+        conn.close()
+
+        # Hoy: la venta previa conserva su ganancia guardada (0.5); la nueva usa el precio nuevo (3.0 - 1.5)
+        self.assertEqual([item['profit'] for item in series], [0.5, 0.5, 2.0])
+        self.assertEqual(loader.call_args_list[0].args[1:], (_local_day(0), _local_day(-1)))
+
+    def test_rows_without_attribution_columns_use_text_resolution(self):
+        conn = self._conn()
+        conn.execute('ALTER TABLE historial_compras RENAME TO historial_nuevo')
+        conn.execute('''
+            CREATE TABLE historial_compras (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, monto REAL, paquete_nombre TEXT,
+                pin TEXT, tipo_evento TEXT DEFAULT 'compra', saldo_antes REAL DEFAULT 0, saldo_despues REAL DEFAULT 0,
+                fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+                local_day TEXT GENERATED ALWAYS AS (DATE(fecha, '-4 hours')) VIRTUAL
+            )
+        ''')
+        self._insert_sale(conn, 1, days_ago=1, attributed=False)
+        conn.execute("INSERT INTO usuarios (id, correo) VALUES (3, 'pendiente@x.com')")  # sin commit
+
+        rows = admin_stats._load_sales_rows_for_days(conn, _local_day(1), _local_day(0))
+        conn.commit()
+        pending = conn.execute('SELECT COUNT(*) FROM usuarios WHERE id = 3').fetchone()[0]
+        conn.close()
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(pending, 1)  # no se descartó el trabajo pendiente del llamador
+
+    def test_fold_skips_today(self):
+        conn = self._conn()
+        self._insert_sale(conn, 1, days_ago=0)
+        folded = admin_stats.fold_closed_profit_days(conn, _local_day(1), _local_day(-1))
+        conn.close()
+        self.assertEqual(folded, [_local_day(1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
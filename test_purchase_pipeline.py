@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import app
+from pg_compat import SqliteConnection
+
+
+class PurchasePipelineTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, self.db_path)
+        conn = SqliteConnection(self.db_path)
+        conn.execute('CREATE TABLE usuarios (id INTEGER PRIMARY KEY, correo TEXT, saldo REAL, sin_ganancia BOOLEAN DEFAULT FALSE)')
+        conn.execute('''
+            CREATE TABLE profit_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, juego TEXT, paquete_id INTEGER, cantidad INTEGER,
+                precio_venta_unit REAL, costo_unit REAL, profit_unit REAL, profit_total REAL, transaccion_id TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE profit_daily_aggregate (
+                day TEXT PRIMARY KEY, profit_total REAL NOT NULL, updated_at TEXT DEFAULT (datetime('now'))
+            )
+        ''')
+        conn.execute("INSERT INTO usuarios (id, correo, saldo) VALUES (1, 'cliente@x.com', 10.0)")
+        conn.commit()
+        conn.close()
+
+    def _conn(self):
+        return SqliteConnection(self.db_path)
+
+    def test_pipeline_commits_on_exit_and_rolls_back_on_error(self):
+        conn = self._conn()
+        with conn.pipeline():
+            self.assertTrue(app.debit_user_balance_atomic(conn, 1, 2.5)['ok'])
+        with self.assertRaises(RuntimeError):
+            with conn.pipeline():
+                app.debit_user_balance_atomic(conn, 1, 1.0)
+                raise RuntimeError('fallo a mitad de la compra')
+        conn.close()
+
+        other = self._conn()
+        self.assertEqual(other.execute('SELECT saldo FROM usuarios WHERE id = 1').fetchone()['saldo'], 7.5)
+        other.close()
+
+    def test_debit_reports_balances_in_one_statement(self):
+        conn = self._conn()
+        before = conn.query_count
+        result = app.debit_user_balance_atomic(conn, 1, 4.0)
+        self.assertEqual(conn.query_count - before, 1)
+        self.assertEqual(result, {'ok': True, 'saldo_antes': 10.0, 'saldo_despues': 6.0})
+
+        rejected = app.debit_user_balance_atomic(conn, 1, 50.0)
+        self.assertEqual(rejected, {'ok': False, 'saldo_actual': 6.0})
+        conn.close()
+
+    def test_profit_bookkeeping_with_preloaded_values_only_writes(self):
+        conn = self._conn()
+        before = conn.query_count
+        app.record_profit_for_transaction(conn, 1, False, 'freefire_latam', 1, 2, 0.66, 'API-X',
+                                          sin_ganancia=False, costo_unit=0.59)
+        conn.commit()
+        self.assertEqual(conn.query_count - before, 2)  # INSERT ledger + upsert del agregado
+        row = conn.execute('SELECT cantidad, costo_unit, profit_total FROM profit_ledger').fetchone()
+        self.assertEqual((row['cantidad'], row['costo_unit'], row['profit_total']), (2, 0.59, 0.14))
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
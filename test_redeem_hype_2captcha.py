@@ -0,0 +1,109 @@
+import itertools
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import redeem_hype_2captcha as captcha
+
+
+def _resp(body):
+    resp = MagicMock()
+    resp.json.return_value = body
+    return resp
+
+
+class AdaptivePollingTests(unittest.TestCase):
+    def test_first_poll_near_expected_time_then_tightens_and_backs_off(self):
+        with patch.object(captcha, 'CAPTCHA_POLL_MIN_S', 1.0), patch.object(captcha, 'CAPTCHA_POLL_MAX_S', 5.0):
+            delays = list(itertools.islice(captcha._poll_delays(10.0), 12))
+
+        self.assertEqual(delays[0], 8.0)
+        self.assertEqual(delays[1:8], [1.0] * 7)
+        self.assertGreater(delays[8], 1.0)
+        self.assertEqual(delays[-1], 5.0)
+
+    def test_solve_uses_persistent_client_and_learns_solve_time(self):
+        client = MagicMock()
+        client.post.return_value = _resp({'status': 1, 'request': 'task-1'})
+        client.get.side_effect = [
+            _resp({'status': 0, 'request': 'CAPCHA_NOT_READY'}),
+            _resp({'status': 1, 'request': 'x' * 40}),
+        ]
+        sleeps = []
+        with patch.object(captcha, '_client', client), \
+                patch.dict(captcha._solve_ewma, {}, clear=True), \
+                patch.object(captcha.time, 'sleep', side_effect=sleeps.append):
+            token = captcha._solve_recaptcha_v3('key', captcha.BASE_URL, 'site', action='validate')
+            learned = captcha._solve_ewma['validate']
+
+        self.assertEqual(token, 'x' * 40)
+        self.assertEqual(len(sleeps), 2)
+        self.assertEqual(sleeps[0], captcha.CAPTCHA_EXPECTED_SOLVE_S * 0.8)
+        self.assertLess(learned, captcha.CAPTCHA_EXPECTED_SOLVE_S)
+
+    def test_provider_error_is_raised(self):
+        client = MagicMock()
+        client.post.return_value = _resp({'status': 1, 'request': 'task-1'})
+        client.get.return_value = _resp({'status': 0, 'request': 'ERROR_CAPTCHA_UNSOLVABLE'})
+        with patch.object(captcha, '_client', client), patch.object(captcha.time, 'sleep'):
+            with self.assertRaises(RuntimeError):
+                captcha._solve_recaptcha_v3('key', captcha.BASE_URL, 'site')
+
+
+class CaptchaTokenPoolTests(unittest.TestCase):
+    def _wait_ready(self, pool, n):
+        deadline = time.monotonic() + 2
+        while pool.stats()['ready'] < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_keeps_tokens_ahead_of_demand(self):
+        counter = itertools.count(1)
+        lock = threading.Lock()
+
+        def _solver():
+            with lock:
+                return f'tok-{next(counter)}'
+
+        pool = captcha.CaptchaTokenPool(_solver, size=2, ttl_s=60, idle_s=0)
+        self.assertIsNone(pool.take())  # primera demanda: pool vacío, arranca a llenarse
+        self._wait_ready(pool, 2)
+
+        self.assertTrue(pool.take().startswith('tok-'))
+        self._wait_ready(pool, 2)
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['ready']), (1, 1, 2))
+
+    def test_expired_tokens_are_discarded(self):
+        pool = captcha.CaptchaTokenPool(lambda: 'tok', size=1, ttl_s=10, idle_s=0)
+        pool._tokens.append((time.monotonic() - 1, 'viejo'))
+        with patch.object(pool, '_refill_locked'):
+            self.assertIsNone(pool.take())
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_tokens_are_replaced_before_expiry_without_demand(self):
+        counter = itertools.count(1)
+        pool = captcha.CaptchaTokenPool(lambda: f'tok-{next(counter)}', size=1, ttl_s=0.3, idle_s=0,
+                                        refresh_lead_s=0.1)
+        pool.warm()
+        self._wait_ready(pool, 1)
+
+        time.sleep(0.45)  # el primer token ya venció y nadie llamó a take()
+        token = pool.take()
+        self.assertNotIn(token, (None, 'tok-1'))
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 0))
+        self.assertGreaterEqual(stats['expired'], 1)
+
+    def test_stops_refilling_when_idle(self):
+        solver = MagicMock(return_value='tok')
+        pool = captcha.CaptchaTokenPool(solver, size=1, ttl_s=60, idle_s=5)
+        pool._last_demand -= 10
+        with pool._lock:
+            pool._refill_locked(time.monotonic())
+        self.assertEqual(pool.stats()['in_flight'], 0)
+        solver.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import redeem_hype_vps
+from mock_vps_server import start_mock_vps
+from pin_redeemer import PinRedeemResult
+
+
+class VpsJobProtocolTests(unittest.TestCase):
+    def _start(self, **kwargs):
+        self.server, url = start_mock_vps(**kwargs)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.config = {'vps_url': url, 'vps_timeout_s': 5}
+
+    def setUp(self):
+        patcher = patch.object(redeem_hype_vps, 'VPS_POLL_INTERVAL_S', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submit_returns_job_immediately_and_poll_resolves_it(self):
+        self._start(job_seconds=0.3)
+
+        started = time.monotonic()
+        job = redeem_hype_vps.submit_redeem_job('PINCODE123456', '123456789', self.config, request_id='T1')
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertIn(job['status'], ('queued', 'running'))
+
+        result = redeem_hype_vps.wait_for_redeem_job(job, self.config)
+        self.assertTrue(result.success)
+        self.assertEqual(result.player_name, 'Jugador 123456789')
+        self.assertGreaterEqual(self.server.state.polls, 1)
+
+    def test_failed_job_is_reported(self):
+        self._start(job_seconds=0.05)
+        result = redeem_hype_vps.redeem_pin_vps('FAILCODE123456', '123456789', self.config)
+        self.assertFalse(result.success)
+        self.assertIn('ya usado', result.message)
+
+    def test_batch_submission_creates_one_job_per_pin(self):
+        self._start(job_seconds=0.05)
+        items = [('PINCODE000001', '111', 'A'), ('FAILCODE00002', '222', 'B'), ('corto', '333', 'C')]
+
+        jobs = redeem_hype_vps.submit_redeem_batch(items, self.config)
+
+        self.assertEqual(self.server.state.submitted, 2)
+        self.assertIsInstance(jobs[2], PinRedeemResult)
+        results = [redeem_hype_vps.wait_for_redeem_job(j, self.config).success for j in jobs]
+        self.assertEqual(results, [True, False, False])
+
+    def test_legacy_synchronous_vps_still_works(self):
+        self._start(legacy=True)
+        result = redeem_hype_vps.redeem_pin_vps('PINCODE123456', '123456789', self.config)
+        self.assertTrue(result.success)
+
+        jobs = redeem_hype_vps.submit_redeem_batch([('PINCODE654321', '1', 'X')], self.config)
+        self.assertTrue(redeem_hype_vps.wait_for_redeem_job(jobs[0], self.config).success)
+
+    def test_callback_wakes_the_waiting_thread(self):
+        self._start(job_seconds=0.05)
+        job = redeem_hype_vps.submit_redeem_job('PINCODE123456', '123456789', self.config)
+
+        def _deliver():
+            time.sleep(0.1)
+            redeem_hype_vps.notify_job_result(job['job_id'], {
+                'status': 'done', 'result': {'success': True, 'player_name': 'Callback'}
+            })
+
+        threading.Thread(target=_deliver).start()
+        with patch.object(redeem_hype_vps, 'VPS_POLL_INTERVAL_S', 10):
+            started = time.monotonic()
+            result = redeem_hype_vps.wait_for_redeem_job(job, self.config)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(result.player_name, 'Callback')
+        self.assertEqual(self.server.state.polls, 0)
+
+    def test_connections_are_reused(self):
+        self.assertIs(redeem_hype_vps.vps_session(), redeem_hype_vps.vps_session())
+
+
+if __name__ == '__main__':
+    unittest.main()
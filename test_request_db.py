@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import pg_compat
+import request_db
+from pg_compat import SqliteConnection
+
+
+class RequestConnectionTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.opened = []
+
+        def _connect():
+            conn = SqliteConnection(self.db_path)
+            self.opened.append(conn)
+            return conn
+
+        patcher = patch.object(request_db, 'get_db_connection', side_effect=_connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pg_compat.remove_connection_listener, request_db._track_connection)
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _app(self, debug=False):
+        app = Flask(__name__)
+        with patch.object(request_db, 'DB_REQUEST_DEBUG', debug):
+            request_db.init_app(app)
+
+        @app.route('/page')
+        def page():
+            # Tres "helpers" que antes abrían una conexión cada uno
+            for _ in range(3):
+                conn = request_db.get_request_connection()
+                conn.execute('SELECT 1').fetchone()
+                conn.close()
+            return 'ok'
+
+        @app.route('/leak')
+        def leak():
+            SqliteConnection(self.db_path).execute('SELECT 1')
+            return 'ok'
+
+        return app
+
+    def test_one_connection_per_request_closed_on_teardown(self):
+        client = self._app().test_client()
+        self.assertEqual(client.get('/page').status_code, 200)
+        self.assertEqual(len(self.opened), 1)
+        self.assertTrue(self.opened[0].closed)
+
+        client.get('/page')
+        self.assertEqual(len(self.opened), 2)
+
+    def test_outside_request_returns_plain_connection(self):
+        conn = request_db.get_request_connection()
+        conn.close()
+        self.assertTrue(conn.closed)
+
+    def test_debug_mode_reports_counts_and_leaks(self):
+        client = self._app(debug=True).test_client()
+        response = client.get('/page')
+        self.assertEqual(response.headers['X-DB-Connections'], '1')
+        self.assertEqual(response.headers['X-DB-Queries'], '3')
+
+        with self.assertLogs(request_db.logger, level='WARNING') as logs:
+            client.get('/leak')
+        self.assertIn('siguen abiertas', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import gzip
+import marshal
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask, session
+
+import request_profiler
+
+
+class RequestProfilerTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for patcher in (patch.object(request_profiler, 'REQUEST_PROFILE_DIR', self.dir),
+                        patch.object(request_profiler, 'REQUEST_PROFILE_CHECK_SECONDS', 0.0),
+                        patch.dict(request_profiler._state, {'config': request_profiler._DISABLED,
+                                                             'mtime': None, 'checked_at': 0.0})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        request_profiler.init_app(self.app)
+
+        @self.app.route('/dashboard')
+        def dashboard():
+            return str(sum(range(1000)))
+
+        @self.app.route('/otra')
+        def otra():
+            return 'ok'
+
+        @self.app.route('/login/<int:user_id>')
+        def login(user_id):
+            session['user_db_id'] = user_id
+            return 'ok'
+
+    def test_disabled_writes_nothing(self):
+        client = self.app.test_client()
+        for _ in range(5):
+            client.get('/dashboard')
+        self.assertEqual(request_profiler.list_profiles(), [])
+
+    def test_endpoint_filter_profiles_only_matching_requests(self):
+        request_profiler.set_config(True, endpoint='dashboard')
+        client = self.app.test_client()
+        client.get('/dashboard')
+        client.get('/otra')
+
+        profiles = request_profiler.list_profiles()
+        self.assertEqual([p['endpoint'] for p in profiles], ['dashboard'])
+        with gzip.open(request_profiler.profile_path(profiles[0]['name']), 'rb') as fh:
+            stats = marshal.loads(fh.read())
+        self.assertTrue(any(func[2] == 'dashboard' for func in stats))
+
+    def test_user_filter_and_sampling(self):
+        client = self.app.test_client()
+        request_profiler.set_config(True, user_id=7)
+        client.get('/otra')
+        client.get('/login/7')
+        client.get('/otra')
+        self.assertEqual(len(request_profiler.list_profiles()), 1)
+
+        request_profiler.set_config(True, sample_rate=0.0)
+        client.get('/otra')
+        self.assertEqual(len(request_profiler.list_profiles()), 1)
+        request_profiler.set_config(True, sample_rate=1.0)
+        client.get('/otra')
+        self.assertEqual(len(request_profiler.list_profiles()), 2)
+
+    def test_expired_config_stops_profiling(self):
+        request_profiler.set_config(True, sample_rate=1.0)
+        with patch.object(request_profiler.time, 'time', return_value=10 ** 12):
+            self.app.test_client().get('/otra')
+        self.assertEqual(request_profiler.list_profiles(), [])
+
+    def test_ring_buffer_keeps_newest_files(self):
+        request_profiler.set_config(True, sample_rate=1.0)
+        client = self.app.test_client()
+        with patch.object(request_profiler, 'REQUEST_PROFILE_MAX_FILES', 3):
+            for _ in range(5):
+                client.get('/otra')
+        self.assertEqual(len(request_profiler.list_profiles()), 3)
+        self.assertEqual(len([n for n in os.listdir(self.dir) if n.endswith('.prof.gz')]), 3)
+
+    def test_profile_path_rejects_traversal(self):
+        self.assertIsNone(request_profiler.profile_path('../config.json'))
+        self.assertIsNone(request_profiler.profile_path('20260101T000000000000_1_x_1ms.prof.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import schema_migrations
+from pg_compat import SqliteConnection
+
+
+class SchemaMigrationsTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.calls = []
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _step(self, name, sql=None):
+        def step(cursor):
+            self.calls.append(name)
+            if sql:
+                cursor.execute(sql)
+        return step
+
+    def _migrations(self):
+        return [
+            (1, 'tabla_a', self._step('a', 'CREATE TABLE IF NOT EXISTS a (id INTEGER PRIMARY KEY)')),
+            (2, 'tabla_b', self._step('b', 'CREATE TABLE IF NOT EXISTS b (id INTEGER PRIMARY KEY)')),
+        ]
+
+    def test_applies_pending_steps_once_and_in_order(self):
+        conn = SqliteConnection(self.db_path)
+        try:
+            self.assertEqual(schema_migrations.run_migrations(conn, self._migrations()), [1, 2])
+            self.assertEqual(schema_migrations.run_migrations(conn, self._migrations()), [])
+            self.assertEqual(schema_migrations.get_schema_version(conn), 2)
+        finally:
+            conn.close()
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_only_new_versions_run_after_upgrade(self):
+        conn = SqliteConnection(self.db_path)
+        try:
+            schema_migrations.run_migrations(conn, self._migrations()[:1])
+            applied = schema_migrations.run_migrations(conn, self._migrations())
+        finally:
+            conn.close()
+        self.assertEqual(applied, [2])
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_failed_step_is_not_recorded(self):
+        def broken(cursor):
+            raise RuntimeError('boom')
+
+        conn = SqliteConnection(self.db_path)
+        try:
+            with self.assertRaises(RuntimeError):
+                schema_migrations.run_migrations(conn, self._migrations()[:1] + [(2, 'rota', broken)])
+            self.assertEqual(schema_migrations.get_schema_version(conn), 1)
+            self.assertEqual(schema_migrations.run_migrations(conn, self._migrations()), [2])
+        finally:
+            conn.close()
+
+    def test_rejects_unordered_versions(self):
+        conn = SqliteConnection(self.db_path)
+        try:
+            with self.assertRaises(ValueError):
+                schema_migrations.run_migrations(conn, list(reversed(self._migrations())))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()